@@ -31,6 +31,11 @@ try:
 
     import config_manager
     import processing_workflows
+    import worker_pool
+    import run_control
+    import archive_input
+    import threading
+    from contextlib import contextmanager
     print("Модули успешно загружены.")
 except ImportError as e: print(f"\n[!!! КРИТИЧЕСКАЯ ОШИБКА] Import Error: {e}"); sys.exit(1)
 except Exception as e: print(f"\n[!!! КРИТИЧЕСКАЯ ОШИБКА] App Import Error: {e}"); import traceback; traceback.print_exc(); sys.exit(1)
@@ -41,38 +46,54 @@ st.set_page_config(layout="wide", page_title="Обработчик Изобра
 
 # --- Настройка логирования ---
 LOG_FILENAME = "app.log" # Имя файла для логов
-log_stream = StringIO() # Буфер для UI
 log_level = logging.INFO # logging.DEBUG для более подробных логов
 log_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(name)s - %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
 
-# --- Настройка корневого логгера --- 
-# Удаляем стандартные обработчики, если они есть (на всякий случай)
-root_logger = logging.getLogger()
-for handler in root_logger.handlers[:]:
-    root_logger.removeHandler(handler)
-root_logger.setLevel(log_level)
-
-# 1. Обработчик для вывода в UI (через StringIO)
-stream_handler = logging.StreamHandler(log_stream)
-stream_handler.setFormatter(log_formatter)
-stream_handler.setLevel(log_level) # Уровень для UI
-root_logger.addHandler(stream_handler)
-
-# 2. Обработчик для записи в файл
-try:
-    file_handler = logging.FileHandler(LOG_FILENAME, mode='a', encoding='utf-8') 
-    file_handler.setFormatter(log_formatter)
-    file_handler.setLevel(logging.DEBUG) # В файл пишем ВСЕ сообщения от DEBUG и выше
-    root_logger.addHandler(file_handler)
-    print(f"Logging to file: {os.path.abspath(LOG_FILENAME)} (Level: DEBUG, Mode: Append)")
-except Exception as e_fh:
-    print(f"[!!! ОШИБКА] Не удалось настроить логирование в файл {LOG_FILENAME}: {e_fh}")
-
-# Получаем логгер для текущего модуля
+# --- Настройка корневого логгера ---
+# Корневой логгер общий для процесса: настраивается один раз, а не при каждом перезапуске скрипта
+@st.cache_resource
+def setup_root_logging() -> logging.Logger:
+    root_logger = logging.getLogger()
+    # Удаляем стандартные обработчики, если они есть (на всякий случай)
+    for handler in root_logger.handlers[:]:
+        root_logger.removeHandler(handler)
+    root_logger.setLevel(log_level)
+    # Обработчик для записи в файл (лог для UI подключается на время запуска, см. capture_ui_log)
+    try:
+        file_handler = logging.FileHandler(LOG_FILENAME, mode='a', encoding='utf-8')
+        file_handler.setFormatter(log_formatter)
+        file_handler.setLevel(logging.DEBUG) # В файл пишем ВСЕ сообщения от DEBUG и выше
+        root_logger.addHandler(file_handler)
+        print(f"Logging to file: {os.path.abspath(LOG_FILENAME)} (Level: DEBUG, Mode: Append)")
+    except Exception as e_fh:
+        print(f"[!!! ОШИБКА] Не удалось настроить логирование в файл {LOG_FILENAME}: {e_fh}")
+    logging.getLogger(__name__).info(f"--- Logger configured (File: DEBUG, UI: {logging.getLevelName(log_level)}) ---")
+    return root_logger
+
+setup_root_logging()
 log = logging.getLogger(__name__)
-log.info("--- App script started, logger configured (Stream + File) ---")
-log.info(f"UI Log Level: {logging.getLevelName(log_level)}")
-log.info(f"File Log Level: DEBUG")
+
+# Буфер для UI хранится в session_state: фоновая обработка пишет в него между перезапусками скрипта
+if 'log_stream' not in st.session_state: st.session_state.log_stream = StringIO()
+log_stream = st.session_state.log_stream
+
+@contextmanager
+def capture_ui_log(stream: StringIO):
+    """
+    Пишет в stream (лог UI сессии) записи текущего потока - и потоков-обработчиков
+    пула, если обработка идет в потоках, - пока открыт блок with.
+    Обработчик висит на корневом логгере только на время блока: перезапуски
+    скрипта и другие сессии в этот лог не попадают.
+    """
+    thread_ident = threading.get_ident()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(log_formatter)
+    handler.setLevel(log_level)
+    handler.addFilter(lambda record: record.thread == thread_ident or record.threadName.startswith(worker_pool.THREAD_NAME_PREFIX))
+    root_logger = logging.getLogger()
+    root_logger.addHandler(handler)
+    try: yield handler
+    finally: root_logger.removeHandler(handler); handler.close()
 
 # === Основной код приложения Streamlit ===
 
@@ -118,6 +139,40 @@ def get_downloads_folder():
 
 config_manager.create_default_preset() # Проверка дефолтного пресета нужна
 
+# --- Теплый пул обработчиков (общий для всех перезапусков скрипта и сессий) ---
+@st.cache_resource
+def get_worker_pool() -> worker_pool.WorkerPool:
+    log.info("Creating shared worker pool owner (cache_resource).")
+    return worker_pool.WorkerPool()
+
+# --- Фоновый запуск обработки (интерфейс остается отзывчивым, есть кнопка остановки) ---
+def run_workflow_in_background(mode: str, run_settings: Dict[str, Any], executor, control, outcome: Dict[str, Any],
+                               ui_log: StringIO):
+    """Выполняется в отдельном потоке. Результат пишет в outcome, лог запуска - в ui_log (st.* здесь недоступен)."""
+    with capture_ui_log(ui_log): _run_workflow(mode, run_settings, executor, control, outcome)
+
+def _run_workflow(mode: str, run_settings: Dict[str, Any], executor, control, outcome: Dict[str, Any]):
+    """(Helper) Тело run_workflow_in_background."""
+    try:
+        if mode == "Обработка отдельных файлов":
+            log.info("Condition matched: 'Обработка отдельных файлов'")
+            multi_presets = run_settings.get('individual_mode', {}).get('multi_presets') or []
+            if multi_presets:
+                outcome['summary'] = processing_workflows.run_multi_preset_processing(multi_presets, executor=executor, control=control, **run_settings)
+            else:
+                outcome['summary'] = processing_workflows.run_individual_processing(executor=executor, control=control, **run_settings)
+            outcome['success'] = outcome['summary'] is not None
+            log.info(f"Finished {'run_multi_preset_processing' if multi_presets else 'run_individual_processing'} call. Result: {outcome['success']}")
+        elif mode == "Создание коллажей":
+            log.info("Condition matched: 'Создание коллажей'")
+            outcome['success'] = processing_workflows.run_collage_processing(executor=executor, control=control, **run_settings)
+            log.info(f"Finished run_collage_processing call. Result: {outcome['success']}")
+        else:
+            log.error(f"!!! Unknown mode encountered in background run: '{mode}'")
+    except Exception as e:
+        log.critical(f"!!! WORKFLOW EXECUTION FAILED with EXCEPTION: {e}", exc_info=True)
+        outcome['error'] = str(e)
+
 # Инициализация session_state (Единственный блок)
 if 'initialized' not in st.session_state:
     log.info("--- Initializing Streamlit Session State ---")
@@ -443,7 +498,7 @@ with st.sidebar:
         "Папка с исходными файлами:", 
         value=input_path_default_value,
         key='path_input_sidebar',
-        help="Укажите папку, где лежат изображения для обработки."
+        help="Укажите папку, где лежат изображения для обработки, или архив ZIP/TAR (читается без распаковки)."
     )
     # Сохраняем новое значение, только если оно отличается от того, что было (или было пустым)
     if input_path_val != current_input_path:
@@ -451,6 +506,7 @@ with st.sidebar:
     
     # Отображение статуса папки
     if input_path_val and os.path.isdir(input_path_val): st.caption(f"✅ Папка найдена: {os.path.abspath(input_path_val)}")
+    elif input_path_val and archive_input.archive_kind(input_path_val): st.caption(f"✅ Архив найден: {os.path.abspath(input_path_val)}")
     elif input_path_val: st.caption(f"❌ Папка не найдена: {os.path.abspath(input_path_val)}")
     else: st.caption("ℹ️ Путь не указан.")
 
@@ -491,6 +547,28 @@ with st.sidebar:
             # Проверяем, отличается ли от стандартного умолчания, чтобы не писать лишнее
             is_default_shown = not current_backup_path and backup_path_val == os.path.join(user_downloads_folder, "Backups")
             st.caption(f"Бэкап в: {os.path.abspath(backup_path_val)}" + (" (по умолчанию)" if is_default_shown else ""))
+            fast_backup = st.checkbox("Быстрое копирование (ссылки, reflink)",
+                                      value=get_setting('backup.fast_backup', False),
+                                      key='backup_fast',
+                                      help="Бэкап всегда выполняется в фоне, не задерживая обработку, а оригиналы удаляются только после завершения всех бэкапов. С этой опцией на том же диске создаются жесткие ссылки (или reflink) вместо копий.")
+            set_setting('backup.fast_backup', fast_backup)
+            backup_modes = {"copy": "Копии файлов", "content": "Хранилище по содержимому"}
+            current_backup_mode = get_setting('backup.mode', 'copy')
+            backup_mode = st.selectbox("Формат бэкапа", list(backup_modes), format_func=backup_modes.get,
+                                       index=list(backup_modes).index(current_backup_mode) if current_backup_mode in backup_modes else 0,
+                                       key='backup_mode',
+                                       help="Хранилище по содержимому сохраняет каждый уникальный файл один раз, а для каждого запуска - список имен. Повторная обработка той же папки не занимает места. Очистка: python file_backup.py prune <папка>.")
+            set_setting('backup.mode', backup_mode)
+            if backup_mode == 'content':
+                col_keep1, col_keep2 = st.columns(2)
+                with col_keep1:
+                    keep_runs = st.number_input("Хранить запусков", 0, 100_000, value=int(get_setting('backup.keep_runs', 0)),
+                                                key='backup_keep_runs', help="Последние запуски каждой входной папки. 0 - все.")
+                    set_setting('backup.keep_runs', keep_runs)
+                with col_keep2:
+                    keep_days = st.number_input("Хранить дней", 0, 36_500, value=int(get_setting('backup.keep_days', 0)),
+                                                key='backup_keep_days', help="0 - без ограничения.")
+                    set_setting('backup.keep_days', keep_days)
         else: 
             st.caption(f"Бэкап отключен.")
         
@@ -656,6 +734,129 @@ with st.sidebar:
             set_setting('brightness_contrast.contrast_factor', contrast_factor)
     # ========================
 
+    with st.expander("6. Производительность", expanded=False):
+        perf_workers = st.number_input("Процессов-обработчиков", 0, 64,
+                                       value=get_setting('performance.max_workers', 1),
+                                       step=1, key='perf_workers',
+                                       help="1 - последовательная обработка, 0 - по числу ядер процессора.")
+        set_setting('performance.max_workers', perf_workers)
+        if perf_workers != 1:
+            perf_lpt = st.checkbox("Сначала самые большие файлы (LPT)",
+                                   value=get_setting('performance.lpt_scheduling', True),
+                                   key='perf_lpt',
+                                   help="Большие файлы отправляются обработчикам первыми, чтобы в конце пакета не оставался один долгий файл. Имена и переименование - по-прежнему в естественном порядке.")
+            set_setting('performance.lpt_scheduling', perf_lpt)
+            kind_options = {"process": "Процессы", "thread": "Потоки"}
+            current_kind = get_setting('performance.worker_kind', 'process')
+            perf_kind = st.radio("Тип обработчиков", options=list(kind_options.keys()),
+                                 format_func=kind_options.get,
+                                 index=list(kind_options.keys()).index(current_kind) if current_kind in kind_options else 0,
+                                 key='perf_kind', horizontal=True,
+                                 help="Процессы - полная параллельность на всех ядрах. Потоки - без копирования данных между процессами, но Python-часть обработки выполняется по очереди.")
+            set_setting('performance.worker_kind', perf_kind)
+        perf_deadline = st.number_input("Ограничение времени, мин", 0, 1440,
+                                        value=int(get_setting('performance.deadline_minutes', 0)),
+                                        step=1, key='perf_deadline',
+                                        help="0 - без ограничения. По истечении времени новые файлы не запускаются, начатые дорабатываются.")
+        set_setting('performance.deadline_minutes', perf_deadline)
+        if perf_deadline > 0:
+            perf_fast = st.checkbox("Быстрый режим при нехватке времени",
+                                    value=get_setting('performance.fast_on_deadline', True),
+                                    key='perf_fast_on_deadline',
+                                    help="Если по скорости обработки видно, что срок не будет соблюден, оставшиеся файлы обрабатываются быстрее (ресайз BILINEAR, сохранение без оптимизации).")
+            set_setting('performance.fast_on_deadline', perf_fast)
+        durability_options = {"none": "Без сброса (быстрее)", "batch": "Пачками", "fsync": "Каждый файл"}
+        current_durability = get_setting('performance.write_durability', 'none')
+        perf_durability = st.radio("Сброс результатов на диск", options=list(durability_options.keys()),
+                                   format_func=durability_options.get,
+                                   index=list(durability_options.keys()).index(current_durability) if current_durability in durability_options else 0,
+                                   key='perf_durability', horizontal=True,
+                                   help="Файлы результатов всегда записываются атомарно (временный файл + переименование). Сброс на диск гарантирует, что после отключения питания готовые файлы не окажутся пустыми или обрезанными.")
+        set_setting('performance.write_durability', perf_durability)
+        if perf_durability == 'batch':
+            perf_batch = st.number_input("Файлов в пачке", 1, 10_000,
+                                         value=int(get_setting('performance.durability_batch_size', 32)),
+                                         key='perf_durability_batch')
+            set_setting('performance.durability_batch_size', perf_batch)
+        perf_mmap = st.checkbox("Чтение файлов через отображение в память (mmap)",
+                                value=get_setting('performance.mmap_input', False),
+                                key='perf_mmap_input',
+                                help="Исходник читается прямо из страничного кеша системы, хеш для кешей и декодирование используют одни и те же данные. Не меняйте входные файлы во время обработки.")
+        set_setting('performance.mmap_input', perf_mmap)
+        perf_readahead = st.number_input("Читать заранее, файлов", 0, 256,
+                                         value=int(get_setting('performance.readahead_files', 0)),
+                                         step=1, key='perf_readahead_files',
+                                         help="Пока обрабатываются текущие файлы, система заранее читает следующие N (полезно на HDD и сетевых дисках). 0 - выключено. Только Linux и другие системы с posix_fadvise.")
+        set_setting('performance.readahead_files', perf_readahead)
+        pool_status = get_worker_pool().status()
+        if pool_status['running']:
+            st.caption(f"Пул активен: {pool_status['kind']} x{pool_status['max_workers']} (перезапусков: {pool_status['restarts']})")
+        else:
+            st.caption("Пул не запущен (будет создан при первой обработке).")
+        if st.button("🔄 Перезапустить обработчики", key="restart_workers_button", disabled=not pool_status['running']):
+            get_worker_pool().restart()
+            st.toast("Обработчики будут запущены заново при следующей обработке.")
+
+    with st.expander("7. Кеширование", expanded=False):
+        cache_enable = st.checkbox("Кеш готовых результатов",
+                                   value=get_setting('cache.enable_result_cache', False),
+                                   key='cache_enable_results',
+                                   help="Одинаковые по содержимому исходники с теми же настройками обработки не обрабатываются повторно (в любых папках и запусках).")
+        set_setting('cache.enable_result_cache', cache_enable)
+        if cache_enable:
+            cache_dir = st.text_input("Папка кеша",
+                                      value=get_setting('cache.result_cache_dir', ''),
+                                      key='cache_results_dir',
+                                      placeholder="~/.cache/image_processor/results")
+            set_setting('cache.result_cache_dir', cache_dir)
+            cache_max_mb = st.number_input("Максимальный размер, МБ", 0, 1_000_000,
+                                           value=int(get_setting('cache.result_cache_max_mb', 2048)),
+                                           step=256, key='cache_results_max_mb',
+                                           help="0 - без ограничения. При превышении удаляются давно не использованные результаты.")
+            set_setting('cache.result_cache_max_mb', cache_max_mb)
+        stage_enable = st.checkbox("Кеш промежуточных изображений",
+                                   value=get_setting('cache.enable_stage_cache', False),
+                                   key='cache_enable_stages',
+                                   help="Сохраняет изображение после удаления фона и обрезки. При изменении только полей, размеров, холста или формата декодирование, отбеливание и обрезка не повторяются. В режиме коллажа кешируются обработанные ячейки: при изменении только сетки, отступов и размеров коллаж собирается из кеша.")
+        set_setting('cache.enable_stage_cache', stage_enable)
+        if stage_enable:
+            stage_dir = st.text_input("Папка промежуточного кеша",
+                                      value=get_setting('cache.stage_cache_dir', ''),
+                                      key='cache_stages_dir',
+                                      placeholder="~/.cache/image_processor/stages")
+            set_setting('cache.stage_cache_dir', stage_dir)
+            stage_max_mb = st.number_input("Максимальный размер промежуточного кеша, МБ", 0, 1_000_000,
+                                           value=int(get_setting('cache.stage_cache_max_mb', 4096)),
+                                           step=256, key='cache_stages_max_mb',
+                                           help="0 - без ограничения. Несжатые изображения занимают много места.")
+            set_setting('cache.stage_cache_max_mb', stage_max_mb)
+
+    with st.expander("8. Поиск файлов", expanded=False):
+        discovery_recursive = st.checkbox("Искать в подпапках",
+                                          value=get_setting('discovery.recursive', False),
+                                          key='discovery_recursive',
+                                          help="Изображения из подпапок обрабатываются вместе с остальными. В отдельном режиме результаты сохраняются в одну папку с именами вида 'подпапка__файл'.")
+        set_setting('discovery.recursive', discovery_recursive)
+        include_str = st.text_input("Только файлы по маскам",
+                                    value=", ".join(get_setting('discovery.include_patterns', [])),
+                                    key='discovery_include', placeholder="*.jpg, Артикул1/*",
+                                    help="Через запятую, без учета регистра. Маска без '/' сравнивается с именем файла.")
+        set_setting('discovery.include_patterns', [p.strip() for p in include_str.split(',') if p.strip()])
+        exclude_str = st.text_input("Исключить файлы по маскам",
+                                    value=", ".join(get_setting('discovery.exclude_patterns', [])),
+                                    key='discovery_exclude', placeholder="*_raw.*, черновики/*")
+        set_setting('discovery.exclude_patterns', [p.strip() for p in exclude_str.split(',') if p.strip()])
+        discovery_sniff = st.checkbox("Проверять содержимое файлов",
+                                      value=get_setting('discovery.sniff_content', False),
+                                      key='discovery_sniff',
+                                      help="Читает первые байты каждого файла: файлы с расширением изображения, но другим содержимым, пропускаются при поиске.")
+        set_setting('discovery.sniff_content', discovery_sniff)
+        discovery_streaming = st.checkbox("Потоковый поиск (очень большие папки)",
+                                          value=get_setting('discovery.streaming', False),
+                                          key='discovery_streaming',
+                                          help="Обработка отдельных файлов начинается сразу, не дожидаясь полного списка папки. Сортировка выполняется только при переименовании и в отчете. Планирование по размеру (LPT) и поиск дубликатов в этом режиме не выполняются.")
+        set_setting('discovery.streaming', discovery_streaming)
+
     # Настройки, зависящие от режима
     st.divider()
     current_mode_local_for_settings = st.session_state.selected_processing_mode
@@ -740,6 +941,11 @@ with st.sidebar:
                          else: st.caption("❌ R,G,B 0-255")
                      except ValueError: st.caption("❌ R,G,B 0-255")
                  else: st.caption("-")
+            output_archive_ind = st.checkbox("Сохранять результаты в ZIP-архив",
+                                             value=get_setting('individual_mode.output_archive', False),
+                                             key='ind_output_archive',
+                                             help="Каждый готовый файл сразу дописывается в архив в папке результатов (имя - артикул или имя папки); отдельные файлы не создаются. JPEG хранится без сжатия, PNG сжимается.")
+            set_setting('individual_mode.output_archive', output_archive_ind)
         # === КОНЕЦ ЭКСПАНДЕРА 1 ===
         
         # === ЭКСПАНДЕР 2 (теперь не вложенный) ===
@@ -757,6 +963,11 @@ with st.sidebar:
                 set_setting('individual_mode.article_name', article_ind)
                 if article_ind: st.caption("Файлы будут вида: [Артикул]_1.jpg, ...")
                 else: st.warning("Введите артикул для переименования.") # Валидация
+                allocate_names_ind = st.checkbox("Сразу сохранять под итоговыми именами",
+                                                 value=get_setting('individual_mode.allocate_names_upfront', False),
+                                                 key='ind_allocate_names',
+                                                 help="Имена распределяются до обработки, и файлы не переименовываются после нее (быстрее на больших папках). Если файл не удалось обработать, его номер остается пропущенным.")
+                set_setting('individual_mode.allocate_names_upfront', allocate_names_ind)
             
             # --- Удаление (без изменений) ---
             delete_orig_ind = st.checkbox("Удалять оригиналы после обработки?",
@@ -764,7 +975,49 @@ with st.sidebar:
                                           key='ind_delete_orig')
             set_setting('individual_mode.delete_originals', delete_orig_ind)
             if delete_orig_ind: st.warning("ВНИМАНИЕ: Удаление необратимо!", icon="⚠️")
+
+            # --- Инкрементальная обработка ---
+            skip_unchanged_ind = st.checkbox("Пропускать неизмененные файлы",
+                                             value=get_setting('individual_mode.skip_unchanged', False),
+                                             key='ind_skip_unchanged',
+                                             help="В папке результатов хранится манифест. Файлы, не изменившиеся с прошлого запуска (при тех же настройках обработки), не обрабатываются повторно.")
+            set_setting('individual_mode.skip_unchanged', skip_unchanged_ind)
+            if skip_unchanged_ind:
+                manifest_hash_ind = st.checkbox("Сверять содержимое (хеш)",
+                                                value=get_setting('individual_mode.manifest_hash', False),
+                                                key='ind_manifest_hash',
+                                                help="Если у файла изменилась только дата (копирование), содержимое сверяется по хешу.")
+                set_setting('individual_mode.manifest_hash', manifest_hash_ind)
+
+            dedup_ind = st.checkbox("Обрабатывать дубликаты один раз",
+                                    value=get_setting('individual_mode.detect_duplicates', False),
+                                    key='ind_detect_duplicates',
+                                    help="Файлы с одинаковым содержимым (например, 'IMG_001.jpg' и 'IMG_001 (1).jpg') обрабатываются один раз, результат копируется для остальных. Сравниваются размеры, затем хеши.")
+            set_setting('individual_mode.detect_duplicates', dedup_ind)
+
+            # --- Журнал запуска ---
+            journal_ind = st.checkbox("Вести журнал запуска",
+                                      value=get_setting('individual_mode.enable_journal', False),
+                                      key='ind_enable_journal',
+                                      help="В папке результатов ведется журнал обработанных файлов, удалений и переименований. После сбоя незавершенное переименование (файлы __temp_) откатывается. После успешного завершения журнал удаляется.")
+            set_setting('individual_mode.enable_journal', journal_ind)
+            if journal_ind:
+                resume_ind = st.checkbox("Продолжать прерванный запуск",
+                                         value=get_setting('individual_mode.resume_interrupted', False),
+                                         key='ind_resume_interrupted',
+                                         help="Если прошлый запуск (с теми же настройками и папками) прервался или был остановлен, уже обработанные файлы не обрабатываются заново.")
+                set_setting('individual_mode.resume_interrupted', resume_ind)
         # === КОНЕЦ ЭКСПАНДЕРА 2 ===
+
+        with st.expander("Несколько наборов за один проход", expanded=False):
+            preset_options = config_manager.get_available_presets()
+            multi_presets_ind = st.multiselect("Наборы для обработки",
+                                               options=preset_options,
+                                               default=[p for p in get_setting('individual_mode.multi_presets', []) if p in preset_options],
+                                               key='ind_multi_presets',
+                                               help="Если выбраны наборы, входная папка обрабатывается каждым из них (настройки обработки и формата - из набора), результаты - в подпапки с именами наборов. Каждый файл читается один раз, общие начальные шаги выполняются один раз.")
+            set_setting('individual_mode.multi_presets', multi_presets_ind)
+            if multi_presets_ind: st.caption("Удаление оригиналов в этом режиме отключено.")
         # === КОНЕЦ УДАЛЕННОГО ОБЩЕГО ЭКСПАНДЕРА ===
 
     elif current_mode_local_for_settings == "Создание коллажей":
@@ -869,6 +1122,13 @@ with st.sidebar:
                     st.caption("❌ Неверный формат чисел")
         # ====================================================
 
+        with st.expander("Повторная сборка коллажа", expanded=False):
+            incr_coll = st.checkbox("Перерисовывать только изменившиеся ячейки",
+                                    value=get_setting('collage_mode.incremental_update', False),
+                                    key='coll_incremental',
+                                    help="Холст прошлой сборки сохраняется рядом с коллажем. Если сетка не изменилась, заново обрабатываются только измененные исходники. Не действует при пропорциональном размещении.")
+            set_setting('collage_mode.incremental_update', incr_coll)
+
     # === ЗАКОММЕНТИРОВАН ДУБЛИРУЮЩИЙ БЛОК УПРАВЛЕНИЯ НАСТРОЙКАМИ ===
     # st.subheader("💾 Управление настройками") 
     # settings_save_col_dup, settings_reset_col_dup = st.columns(2)
@@ -913,114 +1173,132 @@ st.divider()
 # --- Кнопка Запуска ---
 col_run_main, col_spacer_main = st.columns([3, 1])
 start_button_pressed_this_run = False
+active_run = st.session_state.get('active_run')
+run_in_progress = bool(active_run and active_run['thread'].is_alive())
 
 with col_run_main:
-    if st.button(f"🚀 Запустить: {st.session_state.selected_processing_mode}", type="primary", key="run_processing_button", use_container_width=True):
+    if st.button(f"🚀 Запустить: {st.session_state.selected_processing_mode}", type="primary", key="run_processing_button",
+                 use_container_width=True, disabled=run_in_progress):
         start_button_pressed_this_run = True
         log.info(f"--- Button '{st.session_state.selected_processing_mode}' CLICKED! Processing will start below. ---")
         log_stream.seek(0); log_stream.truncate(0) # Очищаем лог для нового запуска
         log.info(f"--- Log cleared. Validating paths for mode '{st.session_state.selected_processing_mode}' ---")
+with col_spacer_main:
+    if run_in_progress:
+        if st.button("⏹️ Остановить", key="stop_processing_button", use_container_width=True,
+                     disabled=active_run['control'].token.is_cancelled,
+                     help="Уже начатые файлы будут доработаны, новые не запускаются. Удаление и переименование - только для готовых файлов."):
+            active_run['control'].cancel("stopped from UI")
+            st.toast("⏹️ Остановка: дорабатываются уже начатые файлы...")
 
 # --- Логика Запуска ---
 if start_button_pressed_this_run:
-    log.info(f"--- Start button was pressed this run. Starting validation... ---")
-    paths_ok = True
-    validation_errors = []
-    input_path = get_setting('paths.input_folder_path', '')
-    abs_input_path = os.path.abspath(input_path) if input_path else ''
-    if not input_path or not os.path.isdir(abs_input_path):
-        validation_errors.append(f"Папка с исходными файлами не найдена или не указана: '{input_path}'")
-        paths_ok = False
-
-    current_mode = st.session_state.selected_processing_mode # Используем из state
-    if current_mode == "Обработка отдельных файлов":
-        output_path_ind = get_setting('paths.output_folder_path', '')
-        if not output_path_ind: validation_errors.append("Не указана папка для результатов!"); paths_ok = False
-        if paths_ok and get_setting('individual_mode.delete_originals') and input_path and output_path_ind:
-             if os.path.normcase(os.path.abspath(input_path)) == os.path.normcase(os.path.abspath(output_path_ind)):
-                 st.warning("Удаление оригиналов не будет выполнено (папка ввода и вывода совпадают).", icon="⚠️")
-                 log.warning("Original deletion will be skipped (paths are same).")
-    elif current_mode == "Создание коллажей":
-        output_filename_coll = get_setting('paths.output_filename', '')
-        if not output_filename_coll: validation_errors.append("Не указано имя файла для сохранения коллажа!"); paths_ok = False
-        elif input_path and paths_ok:
-             # Проверяем ПОЛНОЕ имя файла с расширением
-             output_format_coll = get_setting('collage_mode.output_format', 'jpg').lower()
-             base_name, _ = os.path.splitext(output_filename_coll)
-             coll_filename_with_ext = f"{base_name}.{output_format_coll}"
-             full_coll_path_with_ext = os.path.abspath(os.path.join(abs_input_path, coll_filename_with_ext))
-             if os.path.isdir(full_coll_path_with_ext): validation_errors.append(f"Имя файла коллажа '{coll_filename_with_ext}' указывает на папку!"); paths_ok = False
-
-    if not paths_ok:
-        log.warning("--- Path validation FAILED. Processing aborted. ---")
-        for error_msg in validation_errors: st.error(error_msg, icon="❌"); log.error(f"Validation Error: {error_msg}")
-        st.warning("Обработка не запущена из-за ошибок в настройках путей.", icon="⚠️")
-        st.subheader("Логи выполнения (Ошибки валидации):")
-        st.text_area("Лог:", value=log_stream.getvalue(), height=200, key='log_output_validation_error', disabled=True, label_visibility="collapsed")
-    else:
-        log.info(f"--- Path validation successful. Starting processing workflow '{current_mode}'... ---")
+    with capture_ui_log(log_stream): # Проверка путей пишется в лог UI этой сессии
+        log.info(f"--- Start button was pressed this run. Starting validation... ---")
+        paths_ok = True
+        validation_errors = []
+        input_path = get_setting('paths.input_folder_path', '')
+        abs_input_path = os.path.abspath(input_path) if input_path else ''
+        input_is_archive = bool(input_path) and not os.path.isdir(abs_input_path) and archive_input.archive_kind(abs_input_path) is not None
+        if not input_path or not (os.path.isdir(abs_input_path) or input_is_archive):
+            validation_errors.append(f"Папка (или архив) с исходными файлами не найдена или не указана: '{input_path}'")
+            paths_ok = False
+
+        current_mode = st.session_state.selected_processing_mode # Используем из state
+        if current_mode == "Обработка отдельных файлов":
+            output_path_ind = get_setting('paths.output_folder_path', '')
+            if not output_path_ind: validation_errors.append("Не указана папка для результатов!"); paths_ok = False
+            if paths_ok and get_setting('individual_mode.delete_originals') and input_path and output_path_ind:
+                 if os.path.normcase(os.path.abspath(input_path)) == os.path.normcase(os.path.abspath(output_path_ind)):
+                     st.warning("Удаление оригиналов не будет выполнено (папка ввода и вывода совпадают).", icon="⚠️")
+                     log.warning("Original deletion will be skipped (paths are same).")
+        elif current_mode == "Создание коллажей":
+            output_filename_coll = get_setting('paths.output_filename', '')
+            if not output_filename_coll: validation_errors.append("Не указано имя файла для сохранения коллажа!"); paths_ok = False
+            elif input_path and paths_ok:
+                 # Проверяем ПОЛНОЕ имя файла с расширением
+                 output_format_coll = get_setting('collage_mode.output_format', 'jpg').lower()
+                 base_name, _ = os.path.splitext(output_filename_coll)
+                 coll_filename_with_ext = f"{base_name}.{output_format_coll}"
+                 coll_output_dir = os.path.dirname(abs_input_path) if input_is_archive else abs_input_path # Коллаж из архива - рядом с архивом
+                 full_coll_path_with_ext = os.path.abspath(os.path.join(coll_output_dir, coll_filename_with_ext))
+                 if os.path.isdir(full_coll_path_with_ext): validation_errors.append(f"Имя файла коллажа '{coll_filename_with_ext}' указывает на папку!"); paths_ok = False
+
+        if not paths_ok:
+            log.warning("--- Path validation FAILED. Processing aborted. ---")
+            for error_msg in validation_errors: st.error(error_msg, icon="❌"); log.error(f"Validation Error: {error_msg}")
+            st.warning("Обработка не запущена из-за ошибок в настройках путей.", icon="⚠️")
+            st.subheader("Логи выполнения (Ошибки валидации):")
+            st.text_area("Лог:", value=log_stream.getvalue(), height=200, key='log_output_validation_error', disabled=True, label_visibility="collapsed")
+        else: log.info(f"--- Path validation successful. Starting processing workflow '{current_mode}'... ---")
+    if paths_ok:
         st.info(f"Запускаем обработку в режиме '{current_mode}'...")
-        progress_placeholder = st.empty()
-        workflow_success = False # Инициализируем флаг успеха
-        with st.spinner(f"Выполняется обработка... Пожалуйста, подождите."):
-             try:
-                 current_run_settings = st.session_state.current_settings.copy()
-                 log.debug(f"Passing settings to workflow: {current_run_settings}")
-                 # Используем значение из session_state напрямую для сравнения
-                 mode_from_state = st.session_state.selected_processing_mode
-                 log.debug(f"---> Checking workflow for mode (from state): '{mode_from_state}'")
-                 
-                 # === ИСПРАВЛЕНО СРАВНЕНИЕ ===
-                 if mode_from_state == "Обработка отдельных файлов": 
-                     log.info("Condition matched: 'Обработка отдельных файлов'")
-                     # TODO: Позже можно доработать run_individual_processing по аналогии.
-                     processing_workflows.run_individual_processing(**current_run_settings)
-                     workflow_success = True 
-                     log.info("Finished run_individual_processing call (assumed success).")
-                 elif mode_from_state == "Создание коллажей": 
-                     log.info("Condition matched: 'Создание коллажей'")
-                     collage_created_ok = processing_workflows.run_collage_processing(**current_run_settings)
-                     workflow_success = collage_created_ok 
-                     log.info(f"Finished run_collage_processing call. Result: {workflow_success}")
-                 else:
-                     # Этот блок теперь не должен выполняться, но оставим на всякий случай
-                     log.error(f"!!! Unknown mode_from_state encountered in processing block: '{mode_from_state}'")
-                     workflow_success = False 
-             except Exception as e:
-                 log.critical(f"!!! WORKFLOW EXECUTION FAILED with EXCEPTION: {e}", exc_info=True)
-                 st.error(f"Произошла критическая ошибка во время обработки: {e}", icon="🔥")
-                 workflow_success = False
-                 # progress_placeholder.empty() # Убрали, сообщение ниже
-                 # st.text_area("Детали ошибки:", value=traceback.format_exc(), height=200, key="error_traceback_area")
-
-        progress_placeholder.empty() # Очищаем спиннер
-        # --- Вывод сообщения по результату --- 
-        if workflow_success:
-            # Используем mode_from_state для сообщения
-            st.success(f"Обработка ('{mode_from_state}') успешно завершена!", icon="✅")
-            log.info(f"--- Workflow '{mode_from_state}' completed successfully. --- ")
-            
-            # === АВТОСОХРАНЕНИЕ ПОСЛЕ УСПЕХА ===
-            log.debug("Workflow successful, attempting to auto-save main settings...")
-            try:
-                settings_to_save_after_success = st.session_state.current_settings.copy()
-                settings_to_save_after_success["active_preset"] = st.session_state.active_preset
-                settings_to_save_after_success["processing_mode_selector"] = st.session_state.selected_processing_mode
-                save_after_success_ok = config_manager.save_settings(settings_to_save_after_success, CONFIG_FILE)
-                if save_after_success_ok:
-                    log.info(f"Main settings auto-saved successfully to {CONFIG_FILE} after workflow completion.")
-                    st.session_state.settings_changed = False # Сбрасываем флаг, если он был
-                else:
-                    log.error(f"Failed to auto-save main settings after workflow completion.")
-                    st.toast("❌ Не удалось авто-сохранить настройки после обработки.")
-            except Exception as save_ex:
-                 log.error(f"Exception during auto-save after workflow completion: {save_ex}", exc_info=True)
-                 st.toast("❌ Ошибка при авто-сохранении настроек после обработки.")
-            # ====================================
-            
-        else:
-            st.warning(f"Обработка ('{mode_from_state}') завершена, но результат НЕ достигнут (см. лог).", icon="⚠️")
-            log.warning(f"--- Workflow '{mode_from_state}' finished, but reported failure or encountered an exception. --- ")
+        current_run_settings = st.session_state.current_settings.copy()
+        log.debug(f"Passing settings to workflow: {current_run_settings}")
+        # Теплый пул: процессы и импорты переиспользуются между запусками
+        run_executor = None
+        perf_run_settings = current_run_settings.get('performance', {})
+        max_workers_setting = int(perf_run_settings.get('max_workers', 1))
+        if max_workers_setting != 1:
+            pool_size = max_workers_setting if max_workers_setting > 0 else (os.cpu_count() or 1)
+            run_executor = get_worker_pool().ensure_healthy(pool_size, perf_run_settings.get('worker_kind', 'process'))
+        run_ctrl = run_control.RunControl.from_settings(perf_run_settings)
+        run_outcome = {'success': False, 'summary': None, 'error': None}
+        run_thread = threading.Thread(target=run_workflow_in_background, name="processing_run", daemon=True,
+                                      args=(current_mode, current_run_settings, run_executor, run_ctrl, run_outcome, log_stream))
+        st.session_state.active_run = {'thread': run_thread, 'control': run_ctrl, 'mode': current_mode,
+                                       'outcome': run_outcome, 'started_at': time.time(), 'reported': False}
+        run_thread.start()
+        st.rerun()
+
+# --- Ход и результат фоновой обработки ---
+active_run = st.session_state.get('active_run')
+run_in_progress = bool(active_run and active_run['thread'].is_alive())
+if run_in_progress:
+    elapsed_run = time.time() - active_run['started_at']
+    if active_run['control'].token.is_cancelled:
+        st.warning(f"Остановка ('{active_run['mode']}'): дорабатываются уже начатые файлы... ({elapsed_run:.0f} с)", icon="⏹️")
+    else:
+        st.info(f"Выполняется обработка ('{active_run['mode']}')... {elapsed_run:.0f} с", icon="⏳")
+elif active_run and not active_run['reported']:
+    active_run['reported'] = True
+    mode_from_state = active_run['mode']
+    run_outcome = active_run['outcome']
+    workflow_success = run_outcome['success']
+    stop_reason = active_run['control'].stop_reason
+    if run_outcome['error']:
+        st.error(f"Произошла критическая ошибка во время обработки: {run_outcome['error']}", icon="🔥")
+    # --- Вывод сообщения по результату ---
+    if stop_reason:
+        cancelled_count = (run_outcome['summary'] or {}).get('cancelled', 0)
+        st.warning(f"Обработка ('{mode_from_state}') остановлена: {stop_reason}. Не запущено файлов: {cancelled_count}.", icon="⏹️")
+        log.warning(f"--- Workflow '{mode_from_state}' stopped: {stop_reason}. ---")
+    elif workflow_success:
+        # Используем mode_from_state для сообщения
+        st.success(f"Обработка ('{mode_from_state}') успешно завершена!", icon="✅")
+        log.info(f"--- Workflow '{mode_from_state}' completed successfully. --- ")
+
+        # === АВТОСОХРАНЕНИЕ ПОСЛЕ УСПЕХА ===
+        log.debug("Workflow successful, attempting to auto-save main settings...")
+        try:
+            settings_to_save_after_success = st.session_state.current_settings.copy()
+            settings_to_save_after_success["active_preset"] = st.session_state.active_preset
+            settings_to_save_after_success["processing_mode_selector"] = st.session_state.selected_processing_mode
+            save_after_success_ok = config_manager.save_settings(settings_to_save_after_success, CONFIG_FILE)
+            if save_after_success_ok:
+                log.info(f"Main settings auto-saved successfully to {CONFIG_FILE} after workflow completion.")
+                st.session_state.settings_changed = False # Сбрасываем флаг, если он был
+            else:
+                log.error(f"Failed to auto-save main settings after workflow completion.")
+                st.toast("❌ Не удалось авто-сохранить настройки после обработки.")
+        except Exception as save_ex:
+             log.error(f"Exception during auto-save after workflow completion: {save_ex}", exc_info=True)
+             st.toast("❌ Ошибка при авто-сохранении настроек после обработки.")
+        # ====================================
+
+    else:
+        st.warning(f"Обработка ('{mode_from_state}') завершена, но результат НЕ достигнут (см. лог).", icon="⚠️")
+        log.warning(f"--- Workflow '{mode_from_state}' finished, but reported failure or encountered an exception. --- ")
 
 # --- Область для Логов ---
 # Этот блок должен быть ПОСЛЕ блока if start_button_pressed_this_run
@@ -1037,14 +1315,15 @@ if st.session_state.selected_processing_mode == "Создание коллаже
     coll_input_path = get_setting('paths.input_folder_path','')
     # Получаем БАЗОВОЕ имя файла из настроек
     coll_filename_base = get_setting('paths.output_filename','')
-    if coll_input_path and coll_filename_base and os.path.isdir(coll_input_path):
+    coll_input_is_archive = bool(coll_input_path) and os.path.isfile(coll_input_path) and archive_input.archive_kind(coll_input_path) is not None
+    if coll_input_path and coll_filename_base and (os.path.isdir(coll_input_path) or coll_input_is_archive):
         # Получаем ФОРМАТ из настроек коллажа
         coll_format = get_setting('collage_mode.output_format', 'jpg').lower()
         # Формируем ПОЛНОЕ имя файла с расширением
         base_name, _ = os.path.splitext(coll_filename_base)
         coll_filename_with_ext = f"{base_name}.{coll_format}"
         # Используем ПОЛНОЕ имя для проверки и отображения
-        coll_full_path = os.path.abspath(os.path.join(coll_input_path, coll_filename_with_ext))
+        coll_full_path = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(coll_input_path)) if coll_input_is_archive else coll_input_path, coll_filename_with_ext))
         log.debug(f"Checking for collage preview at: {coll_full_path}") # Добавим лог
         if os.path.isfile(coll_full_path):
             st.divider(); st.subheader("Предпросмотр коллажа:")
@@ -1059,4 +1338,9 @@ if st.session_state.selected_processing_mode == "Создание коллаже
         else: log.debug(f"Collage file for preview not found: {coll_full_path}")
     else: log.debug("Input path or collage filename not set for preview.")
 
-log.info("--- End of app script render cycle ---")
\ No newline at end of file
+log.debug("--- End of app script render cycle ---")
+
+# --- Пока обработка идет в фоне, периодически перерисовываем страницу (лог, статус, кнопка остановки) ---
+if run_in_progress:
+    time.sleep(1.0)
+    st.rerun()
\ No newline at end of file
@@ -0,0 +1,174 @@
+# archive_input.py
+# Чтение входных изображений прямо из архива (ZIP, TAR, сжатый TAR) без
+# распаковки на диск. Член архива читается в память и передается в
+# Image.open через BytesIO.
+#
+# ZIP и несжатый TAR читаются вразнобой: обработчик (в том числе в другом
+# процессе) сам открывает архив и читает свой член - по центральному каталогу
+# ZIP или по смещению данных в TAR, поэтому члены обрабатываются параллельно.
+# Сжатый TAR (.tar.gz, .tar.bz2, .tar.xz) читается только подряд: содержимое
+# членов читается при перечислении и передается обработчикам вместе с заданием.
+#
+# Маски включения/исключения из настроек discovery применяются к путям
+# членов; члены в скрытых папках (в т.ч. __MACOSX/._*) пропускаются.
+# Подпапки архива просматриваются всегда.
+
+import os
+import time
+import zlib
+import tarfile
+import zipfile
+import logging
+import threading
+from typing import Any, Optional, List, Iterator, Iterable, NamedTuple
+
+try:
+    from natsort import natsorted
+except ImportError:
+    natsorted = sorted
+
+import file_discovery
+
+log = logging.getLogger(__name__)
+
+# Виды архивов: 'zip' и 'tar' - чтение членов вразнобой, 'tar-stream' - только подряд
+ARCHIVE_KINDS = ('zip', 'tar', 'tar-stream')
+
+
+class ArchiveMember(NamedTuple):
+    archive: str                 # Полный путь к архиву
+    name: str                    # Имя члена в архиве (через '/')
+    rel_path: str                # Путь для отчетов и имен результатов (через os.sep)
+    size: int                    # Размер содержимого
+    mtime_ns: int                # Время изменения члена
+    offset: int = -1             # Начало данных в несжатом TAR (-1 - не TAR)
+    data: Optional[bytes] = None # Содержимое, прочитанное при перечислении (сжатый TAR)
+
+    @property
+    def path(self) -> str:
+        """Условный путь члена (архив/путь внутри) - для отчетов, на диске не существует."""
+        return os.path.join(self.archive, self.rel_path)
+
+
+def archive_kind(path: str) -> Optional[str]:
+    """Вид архива по содержимому файла ('zip', 'tar', 'tar-stream') или None, если это не архив."""
+    if not os.path.isfile(path): return None
+    try:
+        if zipfile.is_zipfile(path): return 'zip'
+        try:
+            with tarfile.open(path, 'r:'): return 'tar'
+        except tarfile.TarError: pass
+        if tarfile.is_tarfile(path): return 'tar-stream'
+    except OSError as e:
+        log.debug(f"  Cannot check archive {path}: {e}")
+    return None
+
+
+def _safe_rel_path(name: str) -> Optional[str]:
+    """(Helper) Путь члена без '.', '..' и ведущего '/' (через os.sep) или None для пустого."""
+    parts = [p for p in name.replace('\\', '/').split('/') if p not in ('', '.', '..')]
+    return os.sep.join(parts) if parts else None
+
+
+def _accepts(rel_path: str, path_filter) -> bool:
+    """(Helper) Изображение с поддерживаемым расширением вне скрытых папок, прошедшее маски."""
+    parts = rel_path.split(os.sep)
+    if any(p.startswith(file_discovery.SKIPPED_PREFIXES) for p in parts): return False
+    if not parts[-1].lower().endswith(file_discovery.SUPPORTED_EXTENSIONS): return False
+    return path_filter is None or path_filter('/'.join(parts))
+
+
+def _zip_mtime_ns(info: zipfile.ZipInfo) -> int:
+    """(Helper) Время члена ZIP (локальное, с точностью до 2 с) в наносекундах."""
+    try: return int(time.mktime(info.date_time + (0, 0, -1)) * 1_000_000_000)
+    except (OverflowError, ValueError): return 0
+
+
+def _iter_raw_members(archive_path: str, kind: str, path_filter) -> Iterator[ArchiveMember]:
+    """(Helper) Члены-изображения в порядке архива (см. iter_members)."""
+    if kind == 'zip':
+        with zipfile.ZipFile(archive_path) as zf:
+            for info in zf.infolist():
+                rel_path = _safe_rel_path(info.filename)
+                if info.is_dir() or not rel_path or not _accepts(rel_path, path_filter): continue
+                yield ArchiveMember(archive_path, info.filename, rel_path, info.file_size, _zip_mtime_ns(info))
+    elif kind == 'tar':
+        with tarfile.open(archive_path, 'r:') as tf:
+            for info in tf:
+                rel_path = _safe_rel_path(info.name)
+                if not info.isfile() or not rel_path or not _accepts(rel_path, path_filter): continue
+                yield ArchiveMember(archive_path, info.name, rel_path, info.size, int(info.mtime * 1_000_000_000), info.offset_data)
+    else:
+        with tarfile.open(archive_path, 'r|*') as tf:
+            for info in tf:
+                rel_path = _safe_rel_path(info.name)
+                if not info.isfile() or not rel_path or not _accepts(rel_path, path_filter): continue
+                member_file = tf.extractfile(info)
+                data = member_file.read() if member_file else b''
+                yield ArchiveMember(archive_path, info.name, rel_path, info.size, int(info.mtime * 1_000_000_000), data=data)
+
+
+def iter_members(archive_path: str, kind: Optional[str] = None, include: Optional[Iterable[str]] = None,
+                 exclude: Optional[Iterable[str]] = None) -> Iterator[ArchiveMember]:
+    """
+    Перебирает члены-изображения архива в порядке архива, без сортировки.
+    Для сжатого TAR содержимое членов читается сразу (member.data).
+    Повторные члены с тем же путем (дописанные в архив позже) пропускаются.
+    Ошибка чтения архива - OSError.
+    """
+    kind = kind or archive_kind(archive_path)
+    if kind not in ARCHIVE_KINDS: raise OSError(f"Not a supported archive: {archive_path}")
+    path_filter = file_discovery.make_path_filter(include, exclude)
+    seen = set()
+    try:
+        for member in _iter_raw_members(archive_path, kind, path_filter):
+            key = os.path.normcase(member.rel_path)
+            if key in seen: log.warning(f"  Duplicate archive member skipped: {member.name}"); continue
+            seen.add(key)
+            yield member
+    except (tarfile.TarError, zipfile.BadZipFile, EOFError) as e:
+        raise OSError(f"Cannot read archive {archive_path}: {e}") from e
+
+
+def list_members(archive_path: str, kind: Optional[str] = None, **options: Any) -> List[ArchiveMember]:
+    """Все члены-изображения архива (параметры - как у iter_members) в естественном порядке путей."""
+    return natsorted(iter_members(archive_path, kind, **options), key=lambda m: m.rel_path)
+
+
+# Открытый ZIP на поток: центральный каталог читается один раз на архив, а не на каждый член.
+# В процессе-обработчике, созданном через fork, унаследованный ZipFile не используется:
+# его дескриптор (и позиция чтения) общий с родительским процессом.
+_local = threading.local()
+
+
+def _open_zip(archive_path: str) -> zipfile.ZipFile:
+    """(Helper) ZipFile текущего потока (переоткрывается, если архив заменили)."""
+    st = os.stat(archive_path)
+    signature = (os.getpid(), archive_path, st.st_size, st.st_mtime_ns)
+    cached = getattr(_local, 'zip', None)
+    if cached is not None and cached[0] == signature: return cached[1]
+    if cached is not None: cached[1].close()
+    _local.zip = None
+    zf = zipfile.ZipFile(archive_path)
+    _local.zip = (signature, zf)
+    return zf
+
+
+def read_member(member: ArchiveMember) -> Optional[bytes]:
+    """Содержимое члена архива или None при ошибке чтения (ошибка логируется)."""
+    if member.data is not None: return member.data
+    try:
+        if member.offset >= 0:
+            with open(member.archive, 'rb') as f:
+                f.seek(member.offset); data = f.read(member.size)
+            if len(data) != member.size: raise OSError(f"unexpected end of archive ({len(data)} of {member.size} bytes)")
+            return data
+        return _open_zip(member.archive).read(member.name)
+    except (OSError, KeyError, RuntimeError, zipfile.BadZipFile, EOFError, zlib.error) as e:
+        log.error(f"  ! Cannot read {member.name} from archive {os.path.basename(member.archive)}: {e}")
+        return None
+
+
+def source_name(source) -> str:
+    """Имя источника для логов: имя файла или путь члена внутри архива."""
+    return source.rel_path if isinstance(source, ArchiveMember) else os.path.basename(source)
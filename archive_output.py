@@ -0,0 +1,96 @@
+# archive_output.py
+# Запись результатов прямо в ZIP-архив по мере готовности файлов, без
+# промежуточных файлов в папке результатов.
+#
+# Архив пишет только основной процесс: обработчики возвращают закодированные
+# байты, ArchiveWriter добавляет их членом архива. JPEG уже сжат и
+# сохраняется без сжатия (STORED), PNG и прочее - со сжатием DEFLATE.
+# Архив пишется во временный файл рядом с итоговым и переименовывается при
+# закрытии: по итоговому пути всегда лежит только целый архив.
+
+import os
+import time
+import zipfile
+import logging
+from typing import Dict, Any, Set
+
+import durable_io
+
+log = logging.getLogger(__name__)
+
+# Уже сжатые форматы: повторное сжатие почти ничего не дает
+STORED_EXTENSIONS = ('.jpg', '.jpeg')
+DEFLATE_LEVEL = 6
+
+
+def compression_for(member_name: str) -> int:
+    """Метод сжатия члена архива по расширению: ZIP_STORED для JPEG, иначе ZIP_DEFLATED."""
+    return zipfile.ZIP_STORED if member_name.lower().endswith(STORED_EXTENSIONS) else zipfile.ZIP_DEFLATED
+
+
+class ArchiveWriter:
+    """
+    ZIP-архив результатов: add() дописывает член, close() завершает архив и
+    ставит его на место, abort() удаляет недописанный архив.
+    fsync=True - архив и запись папки сбрасываются на диск при закрытии.
+    """
+
+    def __init__(self, archive_path: str, fsync: bool = False):
+        self.archive_path = archive_path
+        self.fsync = fsync
+        self.tmp_path = durable_io.temp_path_for(archive_path)
+        self._zip = zipfile.ZipFile(self.tmp_path, 'w', allowZip64=True)
+        self._names: Set[str] = set()
+        self.members = 0
+        self.data_bytes = 0 # Сумма размеров результатов до сжатия архива
+        self.archive_bytes = 0 # Размер готового архива (после close)
+
+    def add(self, member_name: str, data: bytes) -> bool:
+        """Дописывает результат членом архива. False - ошибка записи или имя уже занято."""
+        if self._zip is None: log.error(f"  ! Output archive already closed: cannot add {member_name}"); return False
+        if member_name in self._names:
+            log.error(f"  ! Output name '{member_name}' already used in the archive: result skipped.")
+            return False
+        info = zipfile.ZipInfo(member_name, date_time=time.localtime()[:6])
+        info.external_attr = 0o644 << 16
+        try:
+            self._zip.writestr(info, data, compress_type=compression_for(member_name), compresslevel=DEFLATE_LEVEL)
+        except (OSError, ValueError) as e:
+            log.error(f"  ! Cannot write {member_name} to archive {os.path.basename(self.archive_path)}: {e}")
+            return False
+        self._names.add(member_name); self.members += 1; self.data_bytes += len(data)
+        log.debug(f"  > Added to archive: {member_name} ({len(data) / 1024:.0f} KB)")
+        return True
+
+    def close(self) -> bool:
+        """Завершает архив и переименовывает его в итоговый. Пустой архив не создается."""
+        if self._zip is None: return False
+        zf = self._zip; self._zip = None
+        try:
+            zf.close()
+            if not self.members:
+                os.remove(self.tmp_path); log.info("Output archive not created: no processed files.")
+                return False
+            if self.fsync: durable_io.fsync_file(self.tmp_path)
+            self.archive_bytes = os.path.getsize(self.tmp_path)
+            os.replace(self.tmp_path, self.archive_path)
+            if self.fsync: durable_io.fsync_dir(os.path.dirname(self.archive_path) or '.')
+        except OSError as e:
+            log.error(f"! Cannot finish output archive {self.archive_path}: {e}")
+            try: os.remove(self.tmp_path)
+            except OSError: pass
+            return False
+        return True
+
+    def abort(self):
+        """Прерывает запись: недописанный архив удаляется, прежний архив по итоговому пути не трогается."""
+        if self._zip is None: return
+        zf = self._zip; self._zip = None
+        try: zf.close()
+        except (OSError, ValueError): pass
+        try: os.remove(self.tmp_path)
+        except OSError: pass
+
+    def stats(self) -> Dict[str, Any]:
+        """{'path', 'members', 'data_bytes', 'archive_bytes'} (размер архива - после close)."""
+        return {'path': self.archive_path, 'members': self.members, 'data_bytes': self.data_bytes, 'archive_bytes': self.archive_bytes}
@@ -0,0 +1,155 @@
+# async_workflows.py
+# Асинхронные (asyncio) варианты сценариев обработки для встраивания в сервисы.
+# Файловые операции (поиск, журнал, удаление, переименование) выполняются в потоке
+# через asyncio.to_thread, обработка изображений - в executor, поэтому цикл
+# событий не блокируется. Несколько запусков могут делить один executor.
+
+import time
+import asyncio
+import logging
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, Any, Optional, AsyncIterator, AsyncGenerator, List, Tuple
+
+import processing_workflows
+import run_control
+
+log = logging.getLogger(__name__)
+
+
+class IndividualRun:
+    """
+    Асинхронный запуск обработки отдельных файлов.
+
+        run = IndividualRun(executor=pool, **settings)
+        async for result in run:      # результаты по мере готовности файлов
+            ...
+        summary = run.summary         # итог (как у run_individual_processing)
+
+    Итерация запускает обработку; после последнего результата выполняются
+    барьер бекапа, удаление оригиналов и переименование. Прерванная итерация
+    (run.aclose(), aclose() итератора, отмена задачи) завершается как
+    остановка через control (run_control.RunControl): задания, еще не
+    начатые в пуле, отменяются, начатые дорабатывают, затем запуск
+    завершается с уже готовыми файлами. После break без aclose() это
+    происходит, только когда цикл событий закроет брошенный итератор, поэтому
+    итерацию с возможным прерыванием оборачивайте в contextlib.aclosing(run).
+    """
+
+    def __init__(self, executor: Optional[Executor] = None, control: Optional[run_control.RunControl] = None,
+                 **all_settings: Dict[str, Any]):
+        self.executor = executor
+        self.all_settings = all_settings
+        self.control = control or run_control.RunControl.from_settings(all_settings.get('performance', {}))
+        self.summary: Optional[Dict[str, Any]] = None
+        self._iterator: Optional[AsyncGenerator[Dict[str, Any], None]] = None
+
+    def __aiter__(self) -> AsyncIterator[Dict[str, Any]]:
+        if self._iterator is not None: raise RuntimeError("IndividualRun can only be iterated once.")
+        self._iterator = self._iterate()
+        return self._iterator
+
+    async def wait(self) -> Optional[Dict[str, Any]]:
+        """Выполняет запуск целиком (или дочитывает оставшиеся результаты) и возвращает итог."""
+        if self._iterator is None: self.__aiter__()
+        async for _ in self._iterator: pass
+        return self.summary
+
+    async def aclose(self) -> Optional[Dict[str, Any]]:
+        """Прерывает итерацию (как остановка через control) и возвращает итог."""
+        if self._iterator is not None: await self._iterator.aclose()
+        return self.summary
+
+    async def _iterate(self) -> AsyncGenerator[Dict[str, Any], None]:
+        log.info("--- Starting Individual File Processing (async) ---")
+        start_time = time.time()
+        self.control.start()
+        run = await asyncio.to_thread(processing_workflows.prepare_individual_run, self.all_settings)
+        if not run: return
+
+        execution_start = time.perf_counter()
+        params = run['params']
+        # Бекап и выдача заданий - как у синхронного варианта (LPT читает заголовки файлов - вне цикла событий)
+        dispatcher, schedule, parallel = await asyncio.to_thread(processing_workflows.plan_individual_execution,
+                                                                 run, self.executor, self.control)
+        executor = self.executor if parallel else None
+        own_executor = None
+        if executor is None: # Последовательно - в отдельном потоке, вне цикла событий
+            executor = own_executor = ProcessPoolExecutor(max_workers=run['num_workers']) if parallel else ThreadPoolExecutor(max_workers=1)
+
+        async def take_jobs() -> List[Dict[str, Any]]:
+            # При потоковом поиске выдача заданий читает папку - вне цикла событий
+            if run.get('streaming'): return await asyncio.to_thread(dispatcher.take)
+            return dispatcher.take()
+
+        results: List[Dict[str, Any]] = []
+        pending: Dict[asyncio.Future, Tuple[Dict[str, Any], Future]] = {} # {ожидание: (задание, future пула)}
+
+        def submit(job: Dict[str, Any]):
+            future = executor.submit(processing_workflows.process_individual_job, job, params)
+            pending[asyncio.wrap_future(future)] = (job, future)
+
+        finished = False; stopped = False
+        try:
+            for job in await take_jobs(): submit(job)
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for waiter in done:
+                    job, future = pending.pop(waiter); dispatcher.complete()
+                    # Журнал, архив результатов и сброс на диск - вне цикла событий
+                    result = await asyncio.to_thread(processing_workflows.complete_individual_job, run, job, future, results)
+                    yield result
+                for job in await take_jobs(): submit(job)
+            finished = True
+        except (GeneratorExit, asyncio.CancelledError):
+            stopped = True
+            raise
+        finally:
+            try:
+                if stopped: results.extend(await self._stop_jobs(run, dispatcher, pending, results))
+                elif not finished:
+                    # Ошибка: удаление оригиналов и переименование не выполняются, запуск остается прерванным
+                    for job, future in pending.values(): future.cancel()
+                    await asyncio.to_thread(processing_workflows.abort_individual_run, run)
+            finally:
+                if own_executor is not None: own_executor.shutdown(wait=False, cancel_futures=True)
+            if finished or stopped:
+                execution_time = time.perf_counter() - execution_start
+                results.extend(dispatcher.cancel_remaining())
+                run['stop_reason'] = self.control.stop_reason
+                results.sort(key=lambda r: r['index']) # Переименование - в natsort-порядке исходных файлов (потоковый режим сортируется при завершении)
+                self.summary = await asyncio.to_thread(processing_workflows.finalize_individual_run,
+                                                       run, results, schedule, start_time, execution_time)
+
+    async def _stop_jobs(self, run: Dict[str, Any], dispatcher: processing_workflows.JobDispatcher,
+                         pending: Dict[asyncio.Future, Tuple[Dict[str, Any], Future]],
+                         results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        (Helper) Итерацию прервали (break с aclose, отмена задачи): как остановка
+        через control - не начатые в пуле задания отменяются, начатые
+        дорабатывают и фиксируются. Возвращает результаты отмененных заданий.
+        """
+        self.control.cancel("iteration stopped")
+        not_started = [job for job, future in pending.values() if future.cancel()]
+        running = {waiter: job_future for waiter, job_future in pending.items() if not job_future[1].cancelled()}
+        if running: await asyncio.wait(running)
+        for job, future in running.values():
+            dispatcher.complete()
+            await asyncio.to_thread(processing_workflows.complete_individual_job, run, job, future, results)
+        pending.clear()
+        return dispatcher.cancel_remaining(not_started)
+
+
+async def run_individual_processing_async(executor: Optional[Executor] = None, control: Optional[run_control.RunControl] = None,
+                                          **all_settings: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Асинхронный аналог run_individual_processing: возвращает итоговую статистику или None."""
+    return await IndividualRun(executor=executor, control=control, **all_settings).wait()
+
+
+async def run_collage_processing_async(executor: Optional[Executor] = None, control: Optional[run_control.RunControl] = None,
+                                       **all_settings: Dict[str, Any]) -> bool:
+    """
+    Асинхронный аналог run_collage_processing.
+    Сборка коллажа выполняется в отдельном потоке, обработка ячеек -
+    в executor (или во временном пуле по настройкам performance).
+    """
+    return await asyncio.to_thread(processing_workflows.run_collage_processing, executor=executor, control=control, **all_settings)
@@ -0,0 +1,90 @@
+# batch_scheduler.py
+# Планирование пакетной обработки: оценка "веса" файлов по заголовку
+# и порядок выдачи заданий обработчикам (LPT - longest processing time first).
+
+import os
+import logging
+from typing import Dict, Any, List, Optional
+
+from PIL import Image, ImageFile
+ImageFile.LOAD_TRUNCATED_IMAGES = True
+
+log = logging.getLogger(__name__)
+
+
+def probe_megapixels(path: str) -> float:
+    """
+    Возвращает размер изображения в мегапикселях, читая только заголовок файла.
+    Image.open() не декодирует пиксели до вызова load(), поэтому проба дешевая.
+    При ошибке возвращает 0.0 (такие файлы окажутся в конце расписания).
+    """
+    try:
+        with Image.open(path) as img_probe:
+            width, height = img_probe.size
+        return (width * height) / 1_000_000.0
+    except Exception as e:
+        log.debug(f"  Header probe failed for {os.path.basename(path)}: {e}")
+        return 0.0
+
+
+def build_lpt_schedule(costs: List[float], num_workers: int) -> Dict[str, Any]:
+    """
+    Строит расписание LPT для списка стоимостей заданий.
+
+    Задания сортируются по убыванию стоимости и по очереди назначаются
+    наименее загруженному обработчику. Пул процессов выдает задания в порядке
+    отправки, поэтому отправка в 'order' воспроизводит это расписание.
+
+    Returns:
+        dict: {
+            'order': индексы заданий в порядке отправки,
+            'assignments': список индексов заданий для каждого обработчика,
+            'loads': суммарная стоимость каждого обработчика,
+            'predicted_makespan': max(loads) в единицах стоимости (Мп),
+        }
+    """
+    num_workers = max(1, int(num_workers))
+    order = sorted(range(len(costs)), key=lambda i: (-costs[i], i))
+    loads = [0.0] * num_workers
+    assignments: List[List[int]] = [[] for _ in range(num_workers)]
+    for job_index in order:
+        worker = min(range(num_workers), key=lambda w: loads[w])
+        assignments[worker].append(job_index)
+        loads[worker] += costs[job_index]
+    return {
+        'order': order,
+        'assignments': assignments,
+        'loads': loads,
+        'predicted_makespan': max(loads) if loads else 0.0,
+    }
+
+
+def log_schedule(schedule: Dict[str, Any], file_names: List[str], max_listed: int = 5):
+    """Логирует выбранное расписание (первые задания и загрузку обработчиков)."""
+    order = schedule['order']
+    head = ", ".join(file_names[i] for i in order[:max_listed])
+    more = f" ... (+{len(order) - max_listed})" if len(order) > max_listed else ""
+    log.info(f"Schedule: LPT over {len(schedule['loads'])} workers. Dispatch order: {head}{more}")
+    for worker, (jobs, load) in enumerate(zip(schedule['assignments'], schedule['loads'])):
+        log.debug(f"  Worker {worker + 1}: {len(jobs)} files, predicted load {load:.1f} MP")
+
+
+def log_makespan_report(schedule: Optional[Dict[str, Any]], results: List[Dict[str, Any]], actual_makespan: float):
+    """
+    Логирует предсказанное и фактическое время выполнения пакета (makespan).
+
+    Предсказание переводится из мегапикселей в секунды по средней скорости,
+    измеренной в этом же запуске (сумма времени обработки / сумма Мп).
+    """
+    if not schedule:
+        return
+    total_mp = sum(r.get('megapixels', 0.0) for r in results)
+    total_busy = sum(r.get('elapsed', 0.0) for r in results)
+    if total_mp <= 0 or total_busy <= 0:
+        log.info(f"Makespan: actual {actual_makespan:.2f}s (no cost data for prediction)")
+        return
+    sec_per_mp = total_busy / total_mp
+    predicted = schedule['predicted_makespan'] * sec_per_mp
+    lower_bound = total_busy / len(schedule['loads'])
+    log.info(f"Makespan: predicted {predicted:.2f}s, actual {actual_makespan:.2f}s "
+             f"(ideal {lower_bound:.2f}s, {sec_per_mp:.3f} s/MP)")
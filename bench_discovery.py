@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Замер скорости поиска входных файлов: прежний способ (os.listdir +
+os.path.isfile на каждую запись) против file_discovery (os.scandir) на
+временной папке с большим числом записей. Файлы пустые, кроме заголовков
+для проверки сигнатуры; часть записей - не изображения и подпапки.
+
+    python bench_discovery.py [--entries 100000] [--repeat 3]
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+try:
+    from natsort import natsorted
+except ImportError:
+    natsorted = sorted
+
+import file_discovery
+
+PNG_HEADER = b'\x89PNG\r\n\x1a\n' + b'\0' * 8
+
+
+def create_tree(root, entries):
+    """Создает entries записей: ~90% .png, ~9% .txt, ~1% подпапок (с одним файлом внутри)."""
+    for i in range(entries):
+        if i % 100 == 99:
+            sub = os.path.join(root, f"dir_{i}"); os.mkdir(sub)
+            with open(os.path.join(sub, "inner.png"), 'wb') as f: f.write(PNG_HEADER)
+        elif i % 10 == 9:
+            open(os.path.join(root, f"notes_{i}.txt"), 'wb').close()
+        else:
+            with open(os.path.join(root, f"img_{i}.png"), 'wb') as f: f.write(PNG_HEADER)
+
+
+def legacy_discovery(root):
+    """Поиск в прежнем виде (до file_discovery)."""
+    files = [f for f in os.listdir(root) if os.path.isfile(os.path.join(root, f))
+             and not f.startswith(file_discovery.SKIPPED_PREFIXES) and f.lower().endswith(file_discovery.SUPPORTED_EXTENSIONS)]
+    return natsorted(files)
+
+
+def best_time(func, repeat):
+    best = None; count = 0
+    for _ in range(repeat):
+        start = time.perf_counter(); count = len(func())
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark input file discovery.")
+    parser.add_argument('--entries', type=int, default=100_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix="bench_discovery_")
+    try:
+        print(f"Creating {args.entries} entries in {root} ...")
+        create_tree(root, args.entries)
+        cases = [
+            ("listdir + isfile (legacy)", lambda: legacy_discovery(root)),
+            ("scandir", lambda: file_discovery.discover_image_files(root)),
+            ("scandir, recursive", lambda: file_discovery.discover_image_files(root, recursive=True)),
+            ("scandir + sniff", lambda: file_discovery.discover_image_files(root, sniff=True)),
+        ]
+        baseline = None
+        for name, func in cases:
+            elapsed, count = best_time(func, args.repeat)
+            baseline = baseline or elapsed
+            print(f"{name:<28} {elapsed * 1000:9.1f} ms  {count:7d} files  x{baseline / elapsed:.2f}")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Замер скорости чтения исходников: прежний способ (Image.open по пути,
+буферизованное чтение) против mapped_input (отображение в память) и
+mapped_input с упреждающим чтением следующих файлов, с хешированием для
+кешей и без. Каждый случай замеряется на холодном кеше ОС (страницы файлов
+сбрасываются через posix_fadvise DONTNEED перед каждым проходом) и на теплом
+(файлы заранее прочитаны). Холодный кеш доступен только с posix_fadvise;
+на быстром SSD разница меньше, чем на HDD и сетевых дисках.
+
+    python bench_input_reading.py [--files 200] [--size 2000] [--repeat 3] [--readahead 8]
+"""
+
+import io
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+from PIL import Image, ImageDraw
+
+import file_hashing
+import mapped_input
+
+COLD_CACHE_SUPPORTED = hasattr(os, 'posix_fadvise') and hasattr(os, 'POSIX_FADV_DONTNEED')
+
+
+def create_files(root, count, size):
+    """Создает count JPEG size x size с разным содержимым (плохо сжимаемый шум + фигуры)."""
+    paths = []
+    noise = Image.effect_noise((size, size), 64).convert('RGB')
+    for i in range(count):
+        img = noise.copy()
+        ImageDraw.Draw(img).rectangle([i % size // 4, size // 4, size // 2, 3 * size // 4], fill=(i * 37 % 255, 80, 160))
+        path = os.path.join(root, f"img_{i}.jpg"); img.save(path, quality=90)
+        paths.append(path)
+    return paths
+
+
+def drop_cache(paths):
+    """Просит ОС выбросить страницы файлов из кеша (холодный кеш)."""
+    for path in paths:
+        fd = os.open(path, os.O_RDONLY)
+        try: os.fdatasync(fd); os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally: os.close(fd)
+
+
+def warm_cache(paths):
+    """Читает файлы целиком, чтобы они оказались в кеше ОС (теплый кеш)."""
+    for path in paths:
+        with open(path, 'rb') as f:
+            while f.read(1 << 20): pass
+
+
+def read_buffered(path, with_hash):
+    """Прежний способ: хеш отдельным чтением файла, затем Image.open по пути."""
+    if with_hash: file_hashing.hash_file(path)
+    with Image.open(path) as img: img.load(); return img.size
+
+
+def read_mapped(path, with_hash):
+    """mapped_input: хеш и декодирование по одному отображению."""
+    mapped = mapped_input.map_file(path)
+    try:
+        if with_hash: file_hashing.hash_bytes(mapped)
+        with Image.open(mapped) as img: img.load(); return img.size
+    finally:
+        mapped_input.release(mapped)
+
+
+def run_pass(paths, reader, with_hash, readahead_depth):
+    """Один проход по всем файлам по порядку; с readahead_depth > 0 - подсказки для следующих файлов."""
+    readahead = mapped_input.ReadAhead(readahead_depth) if readahead_depth else None
+    start = time.perf_counter()
+    for i, path in enumerate(paths):
+        if readahead is not None: readahead.hint(paths[i + 1:i + 1 + readahead_depth])
+        reader(path, with_hash)
+    return time.perf_counter() - start
+
+
+def best_time(paths, reader, with_hash, readahead_depth, cold, repeat):
+    best = None
+    for _ in range(repeat):
+        if cold: drop_cache(paths)
+        else: warm_cache(paths)
+        elapsed = run_pass(paths, reader, with_hash, readahead_depth)
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark input reading (buffered vs memory-mapped).")
+    parser.add_argument('--files', type=int, default=200)
+    parser.add_argument('--size', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--readahead', type=int, default=8)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix="bench_input_reading_")
+    try:
+        print(f"Creating {args.files} JPEG files {args.size}x{args.size} in {root} ...")
+        paths = create_files(root, args.files, args.size)
+        total_mb = sum(os.path.getsize(p) for p in paths) / (1024 * 1024)
+        print(f"Total: {total_mb:.1f} MB. Read-ahead: {'supported' if mapped_input.READAHEAD_SUPPORTED else 'not supported'}")
+        cases = [
+            ("buffered (legacy)", read_buffered, 0),
+            ("mmap", read_mapped, 0),
+            (f"mmap + read-ahead {args.readahead}", read_mapped, args.readahead),
+        ]
+        caches = (("cold", True), ("warm", False)) if COLD_CACHE_SUPPORTED else (("warm", False),)
+        if not COLD_CACHE_SUPPORTED: print("Cold cache: not supported on this platform (no posix_fadvise)")
+        for cache_name, cold in caches:
+            for with_hash in (False, True):
+                print(f"\n[{cache_name} cache, {'hash + decode' if with_hash else 'decode'}]")
+                baseline = None
+                for name, reader, depth in cases:
+                    elapsed = best_time(paths, reader, with_hash, depth, cold, args.repeat)
+                    baseline = baseline or elapsed
+                    print(f"{name:<28} {elapsed * 1000:9.1f} ms  {total_mb / elapsed:7.1f} MB/s  x{baseline / elapsed:.2f}")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
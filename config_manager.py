@@ -2,6 +2,7 @@
 
 import json
 import os
+import hashlib
 import logging
 from typing import Dict, Any, Optional, Tuple, List # Для type hints
 import shutil # Добавим для rename
@@ -68,7 +69,15 @@ DEFAULT_SETTINGS = {
         "jpg_background_color": [255, 255, 255],
         "enable_rename": False,
         "article_name": "",
-        "delete_originals": False
+        "delete_originals": False,
+        "skip_unchanged": False, # Пропускать файлы, не изменившиеся с прошлого запуска (манифест в папке результатов)
+        "manifest_hash": False, # Дополнительно сверять хеш содержимого, если изменился только mtime
+        "enable_journal": False, # Журнал запуска в папке результатов (восстановление после сбоя; удаляется после завершения)
+        "resume_interrupted": False, # Продолжать прерванный запуск по журналу
+        "multi_presets": [], # Обработка сразу несколькими наборами (каждый - в свою подпапку)
+        "detect_duplicates": False, # Одинаковые по содержимому входные файлы обрабатываются один раз
+        "allocate_names_upfront": False, # Имена по артикулу выделяются до обработки (без переименований; ошибки оставляют пропуски в номерах)
+        "output_archive": False # Результаты пишутся сразу в ZIP-архив в папке результатов (без отдельных файлов)
     },
     "collage_mode": {
         "enable_force_aspect_ratio": False,
@@ -86,7 +95,40 @@ DEFAULT_SETTINGS = {
         "forced_cols": 3,
         "spacing_percent": 2.0,
         "proportional_placement": False,
-        "placement_ratios": [1.0]
+        "placement_ratios": [1.0],
+        "incremental_update": False # Перерисовывать на холсте прошлой сборки только изменившиеся ячейки
+    },
+    "performance": {
+        "max_workers": 1, # 1 = последовательно, 0 = по числу ядер
+        "lpt_scheduling": True, # Сначала самые большие файлы (по заголовку)
+        "worker_kind": "process", # "process" или "thread" (теплый пул в интерфейсе)
+        "deadline_minutes": 0, # 0 = без ограничения времени запуска
+        "fast_on_deadline": True, # При нехватке времени - быстрый ресайз/сохранение для оставшихся файлов
+        "write_durability": "none", # Сброс результатов на диск: "none", "fsync" (каждый файл), "batch" (пачками)
+        "durability_batch_size": 32, # Размер пачки для "batch"
+        "mmap_input": False, # Читать исходники через отображение в память (mmap)
+        "readahead_files": 0 # Сколько следующих файлов заранее читать в кеш ОС (0 = выкл.)
+    },
+    "cache": {
+        "enable_result_cache": False, # Кеш готовых результатов по содержимому исходника и настройкам
+        "result_cache_dir": "", # Пусто = ~/.cache/image_processor/results
+        "result_cache_max_mb": 2048, # 0 = без ограничения
+        "enable_stage_cache": False, # Кеш промежуточного изображения после удаления фона/обрезки
+        "stage_cache_dir": "", # Пусто = ~/.cache/image_processor/stages
+        "stage_cache_max_mb": 4096 # 0 = без ограничения
+    },
+    "discovery": {
+        "recursive": False, # Искать изображения и в подпапках входной папки
+        "include_patterns": [], # Маски файлов ("*.jpg", "Артикул1/*"); пусто = все изображения
+        "exclude_patterns": [], # Маски исключаемых файлов
+        "sniff_content": False, # Проверять сигнатуру содержимого (файлы-не-изображения пропускаются до обработки)
+        "streaming": False # Отдельные файлы: начинать обработку до окончания поиска (без LPT и поиска дубликатов)
+    },
+    "backup": {
+        "fast_backup": False, # Способ копирования: жесткие ссылки / reflink / копирование в ядре (иначе обычная копия); бекап всегда в фоновом потоке
+        "mode": "copy", # "copy" - копии под исходными именами, "content" - хранилище по содержимому с индексом запусков
+        "keep_runs": 0, # Хранилище: сколько последних запусков каждой входной папки хранить (0 = все)
+        "keep_days": 0 # Хранилище: сколько дней хранить запуски (0 = без ограничения)
     }
 }
 
@@ -97,6 +139,118 @@ def get_default_settings() -> Dict[str, Any]:
     # Используем копию, чтобы избежать случайных изменений оригинала
     return DEFAULT_SETTINGS.copy()
 
+# Ключи individual_mode, управляющие сценарием (переименование, удаление,
+# инкрементальный режим, журнал), а не пикселями и форматом результата
+WORKFLOW_ONLY_KEYS = {
+    'individual_mode': {'enable_rename', 'article_name', 'delete_originals', 'skip_unchanged', 'manifest_hash',
+                        'enable_journal', 'resume_interrupted', 'multi_presets',
+                        'detect_duplicates', 'allocate_names_upfront', 'output_archive'},
+}
+
+# =================================================
+# === ОТПЕЧАТКИ НАСТРОЕК ПО ШАГАМ КОНВЕЙЕРА ===
+# =================================================
+# Для каждого шага - канонический словарь только тех настроек, что меняют его
+# результат: выключенный шаг или шаг без эффекта (коэффициенты 1.0, нулевые
+# поля и размеры) дает {'enabled': False} независимо от остальных значений,
+# числа приводятся к int/float. Отпечаток шага накопительный: включает
+# отпечаток предыдущего, поэтому изменение настройки шага меняет отпечатки
+# этого шага и всех следующих, а предыдущие (и их кеши) остаются в силе.
+# Пути, режим интерфейса, производительность и кеши не учитываются.
+
+# Увеличивать при изменении правил канонизации
+STAGE_FINGERPRINT_VERSION = 1
+PIPELINE_STAGES = ('preresize', 'whitening', 'bg_crop', 'padding', 'brightness_contrast', 'geometry', 'encode')
+# Последний шаг промежуточного результата (stage_cache) и готовой ячейки коллажа
+STAGE_PREFIX_END = 'bg_crop'
+COLLAGE_CELL_END = 'brightness_contrast'
+
+_DISABLED = {'enabled': False}
+
+def _padding_is_conditional(pad_settings: Dict[str, Any]) -> bool:
+    """(Helper) Поля отдельных файлов работают только при проценте и маржине периметра > 0."""
+    return (bool(pad_settings.get('enable_padding', False)) and float(pad_settings.get('padding_percent', 0.0)) > 0
+            and int(pad_settings.get('perimeter_margin', 0)) > 0)
+
+def _canonical_geometry(mode_settings: Dict[str, Any], keys: Tuple[str, ...]) -> Dict[str, Any]:
+    """(Helper) Соотношение сторон, макс. размер и точный холст; keys - имена ключей секции режима."""
+    ratio_key, max_w_key, max_h_key, exact_w_key, exact_h_key = keys
+    geometry = {}
+    ratio = mode_settings.get(ratio_key)
+    if mode_settings.get('enable_force_aspect_ratio') and ratio: geometry['aspect_ratio'] = [float(v) for v in ratio]
+    max_w, max_h = int(mode_settings.get(max_w_key, 0)), int(mode_settings.get(max_h_key, 0))
+    if mode_settings.get('enable_max_dimensions') and (max_w > 0 or max_h > 0): geometry['max_size'] = [max_w, max_h]
+    exact_w, exact_h = int(mode_settings.get(exact_w_key, 0)), int(mode_settings.get(exact_h_key, 0))
+    if mode_settings.get('enable_exact_canvas') and exact_w > 0 and exact_h > 0: geometry['exact_canvas'] = [exact_w, exact_h]
+    return geometry
+
+def _canonical_encode(mode_settings: Dict[str, Any]) -> Dict[str, Any]:
+    """(Helper) Формат; качество и фон - только для JPG."""
+    output_format = str(mode_settings.get('output_format', 'jpg')).lower()
+    if output_format != 'jpg': return {'format': output_format}
+    return {'format': output_format, 'quality': int(mode_settings.get('jpeg_quality', 95)),
+            'background': [int(v) for v in mode_settings.get('jpg_background_color', [255, 255, 255])]}
+
+def get_stage_settings(settings: Dict[str, Any], mode: str = 'individual') -> Dict[str, Dict[str, Any]]:
+    """
+    Канонические настройки каждого шага конвейера (в порядке PIPELINE_STAGES)
+    для режима 'individual' или 'collage' (geometry/encode - собранного коллажа).
+    """
+    if mode not in ('individual', 'collage'): raise ValueError(f"Unknown pipeline mode: {mode}")
+    prep = settings.get('preprocessing', {}); white = settings.get('whitening', {})
+    bgc = settings.get('background_crop', {}); pad = settings.get('padding', {})
+    bc = settings.get('brightness_contrast', {})
+    stages = {}
+
+    preresize = [int(prep.get('preresize_width', 0)), int(prep.get('preresize_height', 0))]
+    stages['preresize'] = {'size': preresize} if prep.get('enable_preresize') and max(preresize) > 0 else _DISABLED
+    stages['whitening'] = ({'cancel_threshold': int(white.get('whitening_cancel_threshold', 550))}
+                           if white.get('enable_whitening') else _DISABLED)
+    bg_crop = ({'tolerance': int(bgc.get('white_tolerance', 0)), 'symmetric_axes': bool(bgc.get('crop_symmetric_axes', False)),
+                'symmetric_absolute': bool(bgc.get('crop_symmetric_absolute', False))} if bgc.get('enable_bg_crop') else dict(_DISABLED))
+    if mode == 'individual' and _padding_is_conditional(pad):
+        bg_crop['perimeter_margin'] = int(pad.get('perimeter_margin', 0)) # Проверка периметра - до обрезки
+    stages['bg_crop'] = bg_crop
+
+    padding_percent = float(pad.get('padding_percent', 0.0)) if pad.get('enable_padding') else 0.0
+    if mode == 'individual':
+        stages['padding'] = ({'percent': padding_percent, 'allow_expansion': bool(pad.get('allow_expansion', True))}
+                             if _padding_is_conditional(pad) else _DISABLED)
+    else:
+        stages['padding'] = {'percent': padding_percent} if padding_percent > 0 else _DISABLED
+    factors = [float(bc.get('brightness_factor', 1.0)), float(bc.get('contrast_factor', 1.0))]
+    stages['brightness_contrast'] = {'factors': factors} if bc.get('enable_bc') and factors != [1.0, 1.0] else _DISABLED
+
+    if mode == 'individual':
+        ind = settings.get('individual_mode', {})
+        stages['geometry'] = _canonical_geometry(ind, ('force_aspect_ratio', 'max_output_width', 'max_output_height',
+                                                       'final_exact_width', 'final_exact_height'))
+        stages['encode'] = _canonical_encode(ind)
+    else:
+        coll = settings.get('collage_mode', {})
+        geometry = {'forced_cols': int(coll.get('forced_cols', 0)), 'spacing_percent': float(coll.get('spacing_percent', 2.0))}
+        if coll.get('proportional_placement'): geometry['placement_ratios'] = [float(v) for v in coll.get('placement_ratios', [1.0])]
+        geometry.update(_canonical_geometry(coll, ('force_collage_aspect_ratio', 'max_collage_width', 'max_collage_height',
+                                                   'final_collage_exact_width', 'final_collage_exact_height')))
+        stages['geometry'] = geometry
+        stages['encode'] = _canonical_encode(coll)
+    return stages
+
+def get_stage_fingerprints(settings: Dict[str, Any], mode: str = 'individual') -> Dict[str, str]:
+    """Накопительные отпечатки (hex) шагов конвейера: {шаг: отпечаток} в порядке PIPELINE_STAGES."""
+    fingerprints = {}
+    previous = f"v{STAGE_FINGERPRINT_VERSION}|{mode}"
+    for stage, values in get_stage_settings(settings, mode).items():
+        payload = json.dumps({'previous': previous, 'stage': stage, 'settings': values}, sort_keys=True, ensure_ascii=False)
+        previous = fingerprints[stage] = hashlib.blake2b(payload.encode('utf-8'), digest_size=16).hexdigest()
+    return fingerprints
+
+def first_changed_stage(old_fingerprints: Optional[Dict[str, str]], new_fingerprints: Dict[str, str]) -> Optional[str]:
+    """Первый шаг, отпечаток которого изменился (с него результаты нужно пересчитать), или None."""
+    for stage, fingerprint in new_fingerprints.items():
+        if not old_fingerprints or old_fingerprints.get(stage) != fingerprint: return stage
+    return None
+
 def _ensure_presets_dir_exists():
     """Убеждается, что директория для пресетов существует."""
     if not os.path.isdir(PRESETS_DIR):
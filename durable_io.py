@@ -0,0 +1,137 @@
+# durable_io.py
+# Атомарная запись файлов результата и политика сброса на диск.
+#
+# Файл пишется во временный файл в той же папке и переименовывается
+# (os.replace): при сбое на месте результата остается либо прежний файл,
+# либо новый целиком, но не обрезанный. Политика durability определяет,
+# когда данные гарантированно попадают на диск:
+#   'none'  - как решит ОС (быстрее всего);
+#   'fsync' - каждый файл сбрасывается до переименования, папка - после;
+#   'batch' - файлы сбрасываются пачками по N (и один раз их папки) в
+#             основном процессе, по мере завершения файлов и в конце запуска.
+# Временные файлы, оставшиеся после сбоя, удаляет remove_stale_temp_files()
+# при следующем запуске по той же папке.
+
+import os
+import re
+import uuid
+import shutil
+import logging
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, List, Iterator, BinaryIO
+
+log = logging.getLogger(__name__)
+
+DURABILITY_MODES = ('none', 'fsync', 'batch')
+DEFAULT_BATCH_SIZE = 32
+# Имена временных файлов temp_path_for: .<имя>.<pid>_<8 hex>.tmp
+_TEMP_NAME_RE = re.compile(r'^\..+\.\d+_[0-9a-f]{8}\.tmp$')
+
+
+def temp_path_for(path: str) -> str:
+    """Имя временного файла рядом с path (скрытое: поиск входных файлов его пропускает)."""
+    directory, name = os.path.split(path)
+    return os.path.join(directory, f".{name}.{os.getpid()}_{uuid.uuid4().hex[:8]}.tmp")
+
+
+def fsync_dir(path: str):
+    """Сбрасывает на диск запись каталога (новые и переименованные файлы). Не везде поддерживается."""
+    if not hasattr(os, 'O_DIRECTORY'): return
+    try:
+        fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+        try: os.fsync(fd)
+        finally: os.close(fd)
+    except OSError: pass
+
+
+def fsync_file(path: str) -> bool:
+    """Сбрасывает на диск содержимое уже записанного файла (в т.ч. записанного другим процессом)."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+        try: os.fsync(fd)
+        finally: os.close(fd)
+        return True
+    except OSError as e:
+        log.warning(f"  Could not fsync {path}: {e}")
+        return False
+
+
+@contextmanager
+def atomic_write(path: str, fsync: bool = False) -> Iterator[BinaryIO]:
+    """
+    Контекст записи файла целиком: with atomic_write(path) as f: f.write(...).
+    При исключении временный файл удаляется, а path остается прежним.
+    fsync=True - данные и запись каталога сбрасываются на диск.
+    """
+    tmp_path = temp_path_for(path)
+    try:
+        with open(tmp_path, 'wb') as f:
+            yield f
+            if fsync: f.flush(); os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try: os.remove(tmp_path)
+        except OSError: pass
+        raise
+    if fsync: fsync_dir(os.path.dirname(path) or '.')
+
+
+def copy_file(src: str, dst: str, fsync: bool = False):
+    """Атомарно копирует src в dst (как atomic_write). OSError - копия не создана, dst прежний."""
+    with open(src, 'rb') as fsrc, atomic_write(dst, fsync) as fdst:
+        shutil.copyfileobj(fsrc, fdst)
+
+
+def remove_stale_temp_files(directory: str) -> int:
+    """
+    Удаляет из папки временные файлы atomic_write, оставшиеся после сбоя
+    (вызывается при старте запуска, до записи результатов; одновременные запуски
+    в одну папку результатов не поддерживаются). Возвращает число удаленных.
+    """
+    removed = 0
+    try: entries = list(os.scandir(directory))
+    except OSError: return 0
+    for entry in entries:
+        if not _TEMP_NAME_RE.match(entry.name) or not entry.is_file(follow_symlinks=False): continue
+        try: os.remove(entry.path); removed += 1
+        except OSError as e: log.warning(f"  Could not remove stale temp file {entry.name}: {e}")
+    if removed: log.info(f"Removed {removed} stale temp file(s) left by an interrupted run in {directory}")
+    return removed
+
+
+def resolve_durability(perf_settings: Dict[str, Any]) -> Dict[str, Any]:
+    """Политика из секции performance: {'mode', 'batch_size'} (неизвестный режим - 'none')."""
+    mode = str(perf_settings.get('write_durability', 'none')).lower()
+    if mode not in DURABILITY_MODES:
+        log.warning(f"Unknown write durability '{mode}'. Using 'none'."); mode = 'none'
+    try: batch_size = max(1, int(perf_settings.get('durability_batch_size', DEFAULT_BATCH_SIZE)))
+    except (TypeError, ValueError): batch_size = DEFAULT_BATCH_SIZE
+    return {'mode': mode, 'batch_size': batch_size}
+
+
+class DurabilityBatch:
+    """
+    Пачечный сброс на диск (режим 'batch'): add() копит пути готовых файлов,
+    каждые batch_size файлов они сбрасываются вместе с их папками; flush() -
+    сброс остатка (перед удалением оригиналов и в конце запуска).
+    """
+
+    def __init__(self, batch_size: int = DEFAULT_BATCH_SIZE):
+        self.batch_size = max(1, batch_size)
+        self._pending: List[str] = []
+        self.synced = 0
+
+    def add(self, path: Optional[str]):
+        if not path: return
+        self._pending.append(path)
+        if len(self._pending) >= self.batch_size: self.flush()
+
+    def flush(self):
+        if not self._pending: return
+        directories = set()
+        for path in self._pending:
+            if fsync_file(path): self.synced += 1
+            directories.add(os.path.dirname(path) or '.')
+        for directory in directories: fsync_dir(directory)
+        log.debug(f"  Durability batch: {len(self._pending)} file(s) synced.")
+        self._pending = []
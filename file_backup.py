@@ -0,0 +1,349 @@
+# file_backup.py
+# Бекап исходников без лишнего чтения на пути обработки. Копия делается
+# самым дешевым доступным способом:
+#   1. жесткая ссылка (та же файловая система; данные не копируются);
+#   2. reflink (FICLONE: копирование при записи - Btrfs, XFS, APFS-подобные ФС);
+#   3. os.copy_file_range / os.sendfile (копирование в ядре, без буферов Python);
+#   4. shutil.copy2.
+# Копии пишутся во временный файл и переименовываются (os.replace), поэтому
+# прерванный бекап не оставляет обрезанных файлов. BackupWriter выполняет
+# бекапы в фоновом потоке основного процесса (с fast=False - только способом 4);
+# перед удалением оригиналов вызывается wait() (барьер).
+#
+# BackupStore - хранилище по содержимому (режим backup.mode = "content"):
+#   <папка бекапа>/objects/ab/<хеш><расширение>   содержимое (один раз на хеш)
+#   <папка бекапа>/runs/<время>_<id>.json          индекс запуска {имя: хеш}
+# Повторные запуски по той же папке не копируют уже сохраненное содержимое
+# (файл с тем же именем, размером и временем изменения, что в прошлом индексе
+# той же папки, даже не читается), одинаковые имена разных запусков не
+# перезаписывают друг друга. Старые индексы (keep_runs - отдельно для каждой
+# входной папки) и неиспользуемое содержимое удаляет prune():
+#   python file_backup.py prune <папка бекапа> [--keep-runs N] [--keep-days D] [--dry-run]
+
+import os
+import sys
+import json
+import time
+import uuid
+import queue
+import shutil
+import logging
+import argparse
+import threading
+from typing import Dict, Any, Optional, List, Tuple
+
+import file_hashing
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+FICLONE = 0x40049409 # ioctl Linux: клонирование содержимого файла (reflink)
+COPY_CHUNK = 64 * 1024 * 1024
+BACKUP_METHODS = ('hardlink', 'reflink', 'copy_file_range', 'sendfile', 'copy2')
+# Содержимое хранилища не должно меняться вместе с исходником: без жестких ссылок
+STORE_METHODS = BACKUP_METHODS[1:]
+BACKUP_MODES = ('copy', 'content')
+
+STORE_INDEX_VERSION = 1
+OBJECTS_DIR = "objects"
+RUNS_DIR = "runs"
+# Содержимое моложе этого срока не удаляется при очистке: его индекс может еще записываться
+PRUNE_GRACE_SECONDS = 3600
+
+
+def _hardlink(src: str, dst: str):
+    os.link(src, dst)
+
+
+def _reflink(src: str, dst: str):
+    if fcntl is None: raise OSError("reflink is not supported on this platform")
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    shutil.copystat(src, dst)
+
+
+def _kernel_copy(src: str, dst: str, copy_func):
+    """(Helper) Копирование в ядре порциями (copy_file_range или sendfile)."""
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        remaining = os.fstat(fsrc.fileno()).st_size; offset = 0
+        while remaining > 0:
+            sent = copy_func(fsrc.fileno(), fdst.fileno(), offset, min(remaining, COPY_CHUNK))
+            if sent <= 0: raise OSError(f"kernel copy stopped at {offset} bytes")
+            offset += sent; remaining -= sent
+    shutil.copystat(src, dst)
+
+
+def _copy_file_range(src: str, dst: str):
+    if not hasattr(os, 'copy_file_range'): raise OSError("copy_file_range is not available")
+    _kernel_copy(src, dst, lambda fin, fout, offset, count: os.copy_file_range(fin, fout, count, offset, None))
+
+
+def _sendfile(src: str, dst: str):
+    if not hasattr(os, 'sendfile'): raise OSError("sendfile is not available")
+    _kernel_copy(src, dst, lambda fin, fout, offset, count: os.sendfile(fout, fin, offset, count))
+
+
+def _copy2(src: str, dst: str):
+    shutil.copy2(src, dst)
+
+
+_METHOD_FUNCS = {'hardlink': _hardlink, 'reflink': _reflink, 'copy_file_range': _copy_file_range,
+                 'sendfile': _sendfile, 'copy2': _copy2}
+
+
+def fast_copy(src: str, dst: str, methods: Tuple[str, ...] = BACKUP_METHODS) -> str:
+    """
+    Копирует src в dst (с заменой) первым сработавшим способом из methods.
+    Возвращает название способа; OSError - если не сработал ни один.
+    """
+    last_error: Optional[OSError] = None
+    for method in methods:
+        tmp_path = f"{dst}.{os.getpid()}_{uuid.uuid4().hex}.tmp"
+        try:
+            _METHOD_FUNCS[method](src, tmp_path)
+            os.replace(tmp_path, dst)
+            # rename() между ссылками на один и тот же файл ничего не делает - временная ссылка остается
+            if os.path.lexists(tmp_path): os.remove(tmp_path)
+            return method
+        except OSError as e:
+            last_error = e
+            try: os.remove(tmp_path)
+            except OSError: pass
+            if isinstance(e, FileNotFoundError) and not os.path.exists(src): break # Исходника нет - пробовать дальше незачем
+    raise last_error or OSError(f"No backup method available for {src}")
+
+
+class BackupWriter:
+    """
+    Фоновый бекап: submit() ставит файл в очередь, wait() дожидается
+    выполнения всех поставленных и возвращает статистику. Поток запускается
+    при первой постановке. Способ, не сработавший для папки бекапа (другая ФС,
+    нет поддержки), больше не пробуется. fast=False - только обычная копия
+    (shutil.copy2), без ссылок и копирования в ядре.
+    """
+
+    def __init__(self, backup_dir: str, store: Optional['BackupStore'] = None, fast: bool = True):
+        self.backup_dir = backup_dir
+        self.store = store # Хранилище по содержимому вместо копий под исходными именами
+        methods = STORE_METHODS if store is not None else BACKUP_METHODS
+        self._methods = list(methods if fast else ('copy2',))
+        self._queue: "queue.Queue[Optional[Tuple[str, str]]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._submitted = set()
+        self.failed: Dict[str, str] = {} # {исходный путь: ошибка}
+        self.method_counts: Dict[str, int] = {}
+
+    def submit(self, source_path: str, backup_name: str):
+        """Ставит исходник в очередь бекапа под именем backup_name (повтор того же файла игнорируется)."""
+        if source_path in self._submitted: return
+        self._submitted.add(source_path)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="backup-writer", daemon=True)
+            self._thread.start()
+        self._queue.put((source_path, os.path.join(self.backup_dir, backup_name)))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None: return
+            source_path, backup_path = item
+            try:
+                if self.store is not None: method = self.store.put(source_path, os.path.basename(backup_path), tuple(self._methods))
+                else: method = fast_copy(source_path, backup_path, tuple(self._methods))
+                self.method_counts[method] = self.method_counts.get(method, 0) + 1
+                # Способы до сработавшего не подходят этой паре папок - не пробуем их снова
+                if method in self._methods: del self._methods[:self._methods.index(method)]
+                log.debug(f"  > Backup created ({method}): {os.path.basename(backup_path)}")
+            except Exception as e:
+                self.failed[source_path] = str(e)
+                log.error(f"  ! Backup failed for {os.path.basename(source_path)}: {e}")
+
+    def wait(self) -> Dict[str, Any]:
+        """Барьер: дожидается всех бекапов. Возвращает {'done', 'failed', 'methods'}."""
+        if self._thread is not None:
+            self._queue.put(None); self._thread.join(); self._thread = None
+        return {'done': sum(self.method_counts.values()), 'failed': len(self.failed), 'methods': dict(self.method_counts)}
+
+    def failed_sources(self) -> List[str]:
+        return list(self.failed)
+
+
+class BackupStore:
+    """
+    Хранилище бекапов по содержимому. put() вызывается из одного потока
+    (BackupWriter), write_index() - после барьера, один раз за запуск.
+    input_path - входная папка запуска: по индексам ее прошлых запусков
+    неизмененные файлы сохраняются без чтения.
+    """
+
+    def __init__(self, backup_dir: str, input_path: Optional[str] = None):
+        self.backup_dir = os.path.abspath(backup_dir)
+        self.input_path = input_path
+        self._known: Optional[Dict[Tuple[str, int, float], str]] = None # {(имя, размер, время): blob} прошлых запусков
+        self.objects_dir = os.path.join(self.backup_dir, OBJECTS_DIR)
+        self.runs_dir = os.path.join(self.backup_dir, RUNS_DIR)
+        self.run_id = uuid.uuid4().hex[:12]
+        self.created = time.time()
+        self.entries: Dict[str, Dict[str, Any]] = {} # {имя: {'blob', 'size', 'mtime'}}
+        self.stored_bytes = 0; self.reused = 0
+        self.index_path: Optional[str] = None
+
+    def _blob_path(self, digest: str, ext: str) -> str:
+        return os.path.join(self.objects_dir, digest[:2], f"{digest}{ext.lower()}")
+
+    def _known_blob(self, name: str, st: os.stat_result) -> Optional[str]:
+        """(Helper) Содержимое, сохраненное прошлым запуском той же папки для неизмененного файла, или None."""
+        if self._known is None:
+            self._known = {}
+            if self.input_path:
+                input_key = os.path.normcase(os.path.abspath(self.input_path))
+                for _, index in read_store_indexes(self.backup_dir): # От старых к новым: новые перекрывают
+                    if os.path.normcase(os.path.abspath(index.get('input') or '')) != input_key: continue
+                    for entry_name, entry in index.get('files', {}).items():
+                        self._known[(entry_name, entry.get('size'), entry.get('mtime'))] = os.path.join(self.backup_dir, entry['blob'])
+        blob_path = self._known.get((name, st.st_size, st.st_mtime))
+        return blob_path if blob_path and os.path.isfile(blob_path) else None
+
+    def put(self, source_path: str, name: str, methods: Tuple[str, ...] = STORE_METHODS) -> str:
+        """
+        Сохраняет исходник под именем name в индексе запуска. Уже сохраненное
+        содержимое не копируется ('reused'); иначе возвращает способ копирования.
+        Хешируется только готовая копия (один проход чтения), поэтому изменение
+        исходника во время копирования не портит хранилище. Файл, не изменившийся
+        с прошлого запуска той же папки, не читается вовсе.
+        """
+        st = os.stat(source_path)
+        ext = os.path.splitext(name)[1]
+        blob_path = self._known_blob(name, st)
+        if blob_path is not None:
+            method = 'reused'; self.reused += 1
+        else:
+            os.makedirs(self.objects_dir, exist_ok=True)
+            tmp_path = os.path.join(self.objects_dir, f".{uuid.uuid4().hex}.tmp")
+            try:
+                method = fast_copy(source_path, tmp_path, methods)
+                digest = file_hashing.hash_file(tmp_path)
+                if digest is None: raise OSError(f"cannot read back {tmp_path}")
+                blob_path = self._blob_path(digest, ext)
+                if os.path.isfile(blob_path):
+                    method = 'reused'; self.reused += 1 # Копия не нужна: такое содержимое уже есть
+                else:
+                    os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                    os.replace(tmp_path, blob_path)
+                    self.stored_bytes += os.path.getsize(blob_path)
+            finally:
+                if os.path.exists(tmp_path): os.remove(tmp_path)
+        try: os.utime(blob_path, None) # Отметка использования (очистка не трогает свежее содержимое)
+        except OSError: pass
+        self.entries[name] = {'blob': os.path.relpath(blob_path, self.backup_dir).replace(os.sep, '/'),
+                              'size': st.st_size, 'mtime': st.st_mtime}
+        return method
+
+    def write_index(self, input_path: Optional[str] = None) -> Optional[str]:
+        """Атомарно записывает индекс запуска (если что-то сохранено, один раз). Возвращает путь индекса."""
+        if not self.entries or self.index_path: return self.index_path
+        input_path = input_path or self.input_path
+        stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(self.created))
+        index_path = os.path.join(self.runs_dir, f"{stamp}_{self.run_id}.json")
+        index = {'version': STORE_INDEX_VERSION, 'run_id': self.run_id, 'created': self.created,
+                 'input': input_path, 'files': self.entries}
+        tmp_path = f"{index_path}.tmp"
+        try:
+            os.makedirs(self.runs_dir, exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8') as f: json.dump(index, f, ensure_ascii=False, indent=1)
+            os.replace(tmp_path, index_path)
+            self.index_path = index_path
+            return index_path
+        except OSError as e:
+            log.error(f"Could not write backup index {index_path}: {e}")
+            try: os.remove(tmp_path)
+            except OSError: pass
+            return None
+
+
+def read_store_indexes(backup_dir: str) -> List[Tuple[str, Dict[str, Any]]]:
+    """Индексы запусков хранилища [(путь, индекс), ...] от старых к новым; нечитаемые пропускаются."""
+    runs_dir = os.path.join(backup_dir, RUNS_DIR)
+    indexes = []
+    try: names = sorted(n for n in os.listdir(runs_dir) if n.endswith('.json'))
+    except FileNotFoundError: return []
+    for name in names:
+        path = os.path.join(runs_dir, name)
+        try:
+            with open(path, 'r', encoding='utf-8') as f: index = json.load(f)
+        except (OSError, ValueError) as e: log.warning(f"Skipping unreadable backup index {name}: {e}"); continue
+        if index.get('version') != STORE_INDEX_VERSION: log.warning(f"Skipping backup index {name}: unsupported version."); continue
+        indexes.append((path, index))
+    indexes.sort(key=lambda item: item[1].get('created', 0))
+    return indexes
+
+
+def prune(backup_dir: str, keep_runs: int = 0, keep_days: float = 0, dry_run: bool = False) -> Dict[str, int]:
+    """
+    Удаляет индексы запусков сверх keep_runs последних для каждой входной
+    папки (index['input']) и старше keep_days дней (0 - без ограничения),
+    затем содержимое, на которое не ссылается ни один оставшийся индекс.
+    Возвращает {'runs_removed', 'runs_kept', 'blobs_removed', 'freed_bytes'}.
+    """
+    stats = {'runs_removed': 0, 'runs_kept': 0, 'blobs_removed': 0, 'freed_bytes': 0}
+    backup_dir = os.path.abspath(backup_dir)
+    indexes = read_store_indexes(backup_dir)
+    now = time.time()
+    # Сколько более новых запусков той же входной папки у каждого индекса
+    newer_counts: List[int] = []; runs_per_input: Dict[str, int] = {}
+    for _, index in reversed(indexes):
+        input_key = os.path.normcase(str(index.get('input') or ''))
+        newer_counts.append(runs_per_input.get(input_key, 0)); runs_per_input[input_key] = newer_counts[-1] + 1
+    newer_counts.reverse()
+    kept = []
+    for (path, index), newer_count in zip(indexes, newer_counts):
+        too_many = keep_runs > 0 and newer_count >= keep_runs
+        too_old = keep_days > 0 and now - index.get('created', 0) > keep_days * 86400
+        if too_many or too_old:
+            stats['runs_removed'] += 1
+            log.info(f"  Removing backup run {os.path.basename(path)} ({len(index.get('files', {}))} file(s))")
+            if not dry_run:
+                try: os.remove(path)
+                except OSError as e: log.warning(f"  Could not remove {path}: {e}"); kept.append(index)
+        else: kept.append(index)
+    stats['runs_kept'] = len(kept)
+    referenced = {os.path.normcase(os.path.join(backup_dir, entry['blob']))
+                  for index in kept for entry in index.get('files', {}).values()}
+    objects_dir = os.path.join(backup_dir, OBJECTS_DIR)
+    if not os.path.isdir(objects_dir): return stats
+    for shard in os.scandir(objects_dir):
+        if not shard.is_dir(): continue
+        for entry in os.scandir(shard.path):
+            if not entry.is_file() or os.path.normcase(entry.path) in referenced: continue
+            try: st = entry.stat()
+            except OSError: continue
+            if now - st.st_mtime < PRUNE_GRACE_SECONDS: continue
+            stats['blobs_removed'] += 1; stats['freed_bytes'] += st.st_size
+            if not dry_run:
+                try: os.remove(entry.path)
+                except OSError as e: log.warning(f"  Could not remove {entry.path}: {e}")
+    return stats
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Content-addressed backup store maintenance.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    prune_parser = commands.add_parser('prune', help="Remove old backup runs and unreferenced content.")
+    prune_parser.add_argument('backup_dir')
+    prune_parser.add_argument('--keep-runs', type=int, default=0, help="Keep the N most recent runs of each input folder (0 = all).")
+    prune_parser.add_argument('--keep-days', type=float, default=0, help="Keep runs younger than D days (0 = all).")
+    prune_parser.add_argument('--dry-run', action='store_true', help="Only report what would be removed.")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    stats = prune(args.backup_dir, args.keep_runs, args.keep_days, args.dry_run)
+    print(f"{'Would remove' if args.dry_run else 'Removed'}: {stats['runs_removed']} run(s), {stats['blobs_removed']} blob(s), "
+          f"{stats['freed_bytes'] / (1024 * 1024):.1f} MB. Runs kept: {stats['runs_kept']}.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
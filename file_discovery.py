@@ -0,0 +1,148 @@
+# file_discovery.py
+# Поиск входных изображений для обоих режимов. Используется os.scandir: тип
+# записи берется из DirEntry (без отдельного stat на каждый файл, как у
+# os.path.isfile). Дополнительно: обход подпапок, маски включения/исключения и
+# проверка сигнатуры (первых байтов) содержимого - файлы с расширением
+# изображения, но другим содержимым, отсеиваются до обработки.
+#
+# Маски (fnmatch, без учета регистра) сравниваются с относительным путем через
+# '/' ("Артикул1/*.jpg"); маска без '/' - также с именем файла ("*_raw.*").
+
+import os
+import fnmatch
+import logging
+from typing import Dict, Any, Optional, List, Iterator, Iterable, NamedTuple, Callable
+
+try:
+    from natsort import natsorted
+except ImportError:
+    natsorted = sorted
+
+log = logging.getLogger(__name__)
+
+SUPPORTED_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tiff', '.webp', '.tif')
+# Временные файлы переименования и скрытые файлы/папки не являются входными
+SKIPPED_PREFIXES = ("__temp_", ".")
+SNIFF_BYTES = 16
+
+# Сигнатуры форматов, которые читает конвейер (WEBP проверяется отдельно: RIFF....WEBP)
+_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8\xff', 'jpeg'),
+    (b'GIF87a', 'gif'), (b'GIF89a', 'gif'),
+    (b'II*\x00', 'tiff'), (b'MM\x00*', 'tiff'),
+    (b'BM', 'bmp'),
+)
+
+
+class DiscoveredFile(NamedTuple):
+    rel_path: str # Путь относительно корня поиска (для файлов корня - имя файла)
+    path: str     # Полный путь
+
+
+def sniff_image_format(path: str) -> Optional[str]:
+    """Формат по первым байтам файла ('png', 'jpeg', ...) или None, если это не поддерживаемое изображение."""
+    try:
+        with open(path, 'rb') as f: head = f.read(SNIFF_BYTES)
+    except OSError as e:
+        log.debug(f"  Cannot read {path} for sniffing: {e}")
+        return None
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP': return 'webp'
+    for signature, image_format in _SIGNATURES:
+        if head.startswith(signature): return image_format
+    return None
+
+
+def _normalize_patterns(patterns: Optional[Iterable[str]]) -> List[str]:
+    """(Helper) Маски из настроек: список или строка через запятую; пустые убираются."""
+    if not patterns: return []
+    if isinstance(patterns, str): patterns = patterns.split(',')
+    return [p.strip().replace('\\', '/').lower() for p in patterns if p and p.strip()]
+
+
+def _matches_any(rel_posix: str, name: str, patterns: List[str]) -> bool:
+    """(Helper) rel_posix и name - в нижнем регистре."""
+    return any(fnmatch.fnmatchcase(rel_posix, p) or ('/' not in p and fnmatch.fnmatchcase(name, p)) for p in patterns)
+
+
+def make_path_filter(include: Optional[Iterable[str]] = None,
+                     exclude: Optional[Iterable[str]] = None) -> Optional[Callable[[str], bool]]:
+    """
+    Проверка относительного пути (через '/') масками включения/исключения:
+    функция(rel_posix) -> True, если путь проходит. None - масок нет.
+    """
+    include_patterns = _normalize_patterns(include); exclude_patterns = _normalize_patterns(exclude)
+    if not include_patterns and not exclude_patterns: return None
+
+    def accepts(rel_posix: str) -> bool:
+        rel_lower = rel_posix.lower(); name_lower = rel_lower.rsplit('/', 1)[-1]
+        if include_patterns and not _matches_any(rel_lower, name_lower, include_patterns): return False
+        return not (exclude_patterns and _matches_any(rel_lower, name_lower, exclude_patterns))
+    return accepts
+
+
+def iter_image_files(root: str, recursive: bool = False, include: Optional[Iterable[str]] = None,
+                     exclude: Optional[Iterable[str]] = None, sniff: bool = False,
+                     exclude_paths: Iterable[Optional[str]] = (),
+                     stats: Optional[Dict[str, int]] = None) -> Iterator[DiscoveredFile]:
+    """
+    Перебирает изображения в root (и в подпапках при recursive) в порядке
+    файловой системы, без сортировки. exclude_paths - файлы и папки, которые
+    не просматриваются (папка результатов внутри входной, файл коллажа).
+    stats (если передан) накапливает {'found', 'rejected_content', 'unreadable_dirs'}.
+    Ошибка чтения root - OSError; нечитаемые подпапки пропускаются с предупреждением.
+    """
+    path_filter = make_path_filter(include, exclude)
+    excluded = {os.path.normcase(os.path.abspath(p)) for p in exclude_paths if p}
+    if stats is None: stats = {}
+    for key in ('found', 'rejected_content', 'unreadable_dirs'): stats.setdefault(key, 0)
+    pending = [(root, '')] # (папка, относительный префикс)
+    while pending:
+        dir_path, rel_prefix = pending.pop()
+        try:
+            scanner = os.scandir(dir_path)
+        except OSError as e:
+            if not rel_prefix: raise
+            log.warning(f"Cannot read folder {dir_path}: {e}. Skipping it.")
+            stats['unreadable_dirs'] += 1
+            continue
+        subdirs = []
+        with scanner:
+            for entry in scanner:
+                name = entry.name
+                if name.startswith(SKIPPED_PREFIXES): continue
+                try:
+                    if recursive and entry.is_dir(follow_symlinks=False): # Ссылки на папки не обходятся (нет циклов)
+                        if os.path.normcase(entry.path) not in excluded: subdirs.append((entry.path, f"{rel_prefix}{name}/"))
+                        continue
+                    if not name.lower().endswith(SUPPORTED_EXTENSIONS) or not entry.is_file(): continue
+                except OSError:
+                    continue
+                rel_posix = f"{rel_prefix}{name}"
+                if path_filter is not None and not path_filter(rel_posix): continue
+                if excluded and os.path.normcase(entry.path) in excluded: continue
+                if sniff and sniff_image_format(entry.path) is None:
+                    log.info(f"  Skipping {rel_posix}: content is not a supported image.")
+                    stats['rejected_content'] += 1
+                    continue
+                stats['found'] += 1
+                yield DiscoveredFile(rel_posix.replace('/', os.sep), entry.path)
+        # Подпапки - в обратном порядке, чтобы стек обходил их в порядке чтения
+        pending.extend(reversed(subdirs))
+
+
+def discover_image_files(root: str, **options: Any) -> List[DiscoveredFile]:
+    """Все изображения (параметры - как у iter_image_files) в естественном порядке относительных путей."""
+    stats: Dict[str, int] = {}
+    found = natsorted(iter_image_files(root, stats=stats, **options), key=lambda f: f.rel_path)
+    if stats['rejected_content']: log.warning(f"Files with unsupported content skipped: {stats['rejected_content']}")
+    if stats['unreadable_dirs']: log.warning(f"Unreadable folders skipped: {stats['unreadable_dirs']}")
+    return found
+
+
+def options_from_settings(discovery_settings: Dict[str, Any]) -> Dict[str, Any]:
+    """Параметры iter_image_files из секции настроек discovery."""
+    return {'recursive': bool(discovery_settings.get('recursive', False)),
+            'include': discovery_settings.get('include_patterns') or None,
+            'exclude': discovery_settings.get('exclude_patterns') or None,
+            'sniff': bool(discovery_settings.get('sniff_content', False))}
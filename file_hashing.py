@@ -0,0 +1,52 @@
+# file_hashing.py
+# Хеширование содержимого файлов (BLAKE2b) для манифестов и кешей.
+
+import os
+import hashlib
+import logging
+from typing import Optional, List, Dict
+
+log = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 1024 * 1024 # 1 МБ
+HASH_DIGEST_SIZE = 20 # 160 бит - достаточно для идентификации содержимого
+
+
+def hash_bytes(data: bytes) -> str:
+    """Возвращает hex-хеш BLAKE2b для данных в памяти."""
+    return hashlib.blake2b(data, digest_size=HASH_DIGEST_SIZE).hexdigest()
+
+
+def hash_file(path: str) -> Optional[str]:
+    """Возвращает hex-хеш BLAKE2b содержимого файла или None при ошибке чтения."""
+    hasher = hashlib.blake2b(digest_size=HASH_DIGEST_SIZE)
+    try:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                hasher.update(chunk)
+    except OSError as e:
+        log.error(f"  ! Cannot hash file {path}: {e}")
+        return None
+    return hasher.hexdigest()
+
+
+def find_duplicates(paths: List[str]) -> Dict[str, List[str]]:
+    """
+    Находит файлы с одинаковым содержимым. Хешируются только файлы, размер
+    которых совпадает с размером другого файла. Возвращает {первый путь
+    группы (в порядке paths): [остальные пути с тем же содержимым]}.
+    """
+    by_size: Dict[int, List[str]] = {}
+    for path in paths:
+        try: by_size.setdefault(os.path.getsize(path), []).append(path)
+        except OSError as e: log.warning(f"  Cannot stat {path}: {e}")
+    duplicates: Dict[str, List[str]] = {}
+    for same_size in by_size.values():
+        if len(same_size) < 2: continue
+        by_hash: Dict[str, List[str]] = {}
+        for path in same_size:
+            digest = hash_file(path)
+            if digest: by_hash.setdefault(digest, []).append(path)
+        for group in by_hash.values():
+            if len(group) > 1: duplicates[group[0]] = group[1:]
+    return duplicates
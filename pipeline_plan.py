@@ -0,0 +1,457 @@
+# pipeline_plan.py
+# Скомпилированный план конвейера. Настройки (вложенные словари) один раз за
+# запуск превращаются в неизменяемую последовательность объектов-шагов, поэтому
+# обработчикам не нужно разбирать настройки для каждого файла. Шаги, которые
+# ничего не меняют (выключенные, коэффициенты яркости/контраста 1.0, нулевые
+# поля, нулевые размеры), в план не попадают.
+#
+# План состоит из трех участков:
+#   prefix - дорогие начальные шаги (их результат кешируется, см. stage_cache);
+#   tail   - поля и яркость/контраст (для коллажа - шаги каждой ячейки);
+#   finish - соотношение сторон, макс. размер, холст/подготовка к сохранению
+#            (для коллажа - трансформации собранного коллажа).
+# План сериализуется (pickle) и передается процессам-обработчикам.
+
+import logging
+from typing import Dict, Any, Optional, Tuple
+
+from PIL import Image
+
+import image_utils
+
+log = logging.getLogger(__name__)
+
+# Профили ресайза: быстрый включается RunControl при нехватке времени до срока
+RESAMPLE_QUALITY = Image.Resampling.LANCZOS
+RESAMPLE_FAST = Image.Resampling.BILINEAR
+
+PLAN_MODES = ('individual', 'collage')
+
+# ==============================================================================
+# === ФУНКЦИИ ШАГОВ КОНВЕЙЕРА =================================================
+# ==============================================================================
+
+def apply_preresize(img, preresize_width, preresize_height, resample=RESAMPLE_QUALITY):
+    """(Helper) Применяет предварительное уменьшение размера, сохраняя пропорции."""
+    if not img or (preresize_width <= 0 and preresize_height <= 0):
+        return img
+    # ... (код функции apply_preresize из предыдущего ответа, с log.*) ...
+    prw = preresize_width if preresize_width > 0 else float('inf')
+    prh = preresize_height if preresize_height > 0 else float('inf')
+    ow, oh = img.size
+    if ow <= 0 or oh <= 0 or (ow <= prw and oh <= prh):
+        return img
+    ratio = 1.0
+    if ow > prw: ratio = min(ratio, prw / ow)
+    if oh > prh: ratio = min(ratio, prh / oh)
+    if ratio >= 1.0: return img
+    nw = max(1, int(round(ow * ratio)))
+    nh = max(1, int(round(oh * ratio)))
+    log.info(f"  > Pre-resizing image from {ow}x{oh} to {nw}x{nh}")
+    resized_img = None
+    try:
+        resized_img = img.resize((nw, nh), resample)
+        if resized_img is not img: image_utils.safe_close(img)
+        return resized_img
+    except Exception as e:
+        log.error(f"  ! Error during pre-resize to {nw}x{nh}: {e}")
+        image_utils.safe_close(resized_img)
+        return img
+
+def apply_force_aspect_ratio(img, aspect_ratio_tuple):
+    """(Helper) Вписывает изображение в холст с заданным соотношением сторон."""
+    if not img or not aspect_ratio_tuple: return img
+    # ... (код функции apply_force_aspect_ratio из предыдущего ответа, с log.*) ...
+    if not (isinstance(aspect_ratio_tuple, (tuple, list)) and len(aspect_ratio_tuple) == 2): return img
+    try:
+        target_w_ratio, target_h_ratio = map(float, aspect_ratio_tuple)
+        if target_w_ratio <= 0 or target_h_ratio <= 0: return img
+    except (ValueError, TypeError): return img
+    current_w, current_h = img.size
+    if current_w <= 0 or current_h <= 0: return img
+    target_aspect = target_w_ratio / target_h_ratio
+    current_aspect = current_w / current_h
+    if abs(current_aspect - target_aspect) < 0.001: return img
+    log.info(f"  > Applying force aspect ratio {target_w_ratio}:{target_h_ratio}")
+    if current_aspect > target_aspect: canvas_w, canvas_h = current_w, max(1, int(round(current_w / target_aspect)))
+    else: canvas_w, canvas_h = max(1, int(round(current_h * target_aspect))), current_h
+    canvas = None; img_rgba = None
+    try:
+        canvas = Image.new('RGBA', (canvas_w, canvas_h), (0, 0, 0, 0))
+        paste_x, paste_y = (canvas_w - current_w) // 2, (canvas_h - current_h) // 2
+        img_rgba = img if img.mode == 'RGBA' else img.convert('RGBA')
+        canvas.paste(img_rgba, (paste_x, paste_y), mask=img_rgba)
+        if img_rgba is not img: image_utils.safe_close(img_rgba)
+        image_utils.safe_close(img)
+        log.debug(f"    New size after aspect ratio: {canvas.size}")
+        return canvas
+    except Exception as e:
+        log.error(f"  ! Error applying force aspect ratio: {e}")
+        image_utils.safe_close(canvas)
+        if img_rgba is not img: image_utils.safe_close(img_rgba)
+        return img
+
+def apply_max_dimensions(img, max_width, max_height, resample=RESAMPLE_QUALITY):
+    """(Helper) Уменьшает изображение, если оно больше максимальных размеров."""
+    if not img or (max_width <= 0 and max_height <= 0): return img
+    # ... (код функции apply_max_dimensions из предыдущего ответа, с log.*) ...
+    max_w = max_width if max_width > 0 else float('inf')
+    max_h = max_height if max_height > 0 else float('inf')
+    ow, oh = img.size
+    if ow <= 0 or oh <= 0 or (ow <= max_w and oh <= max_h): return img
+    ratio = 1.0
+    if ow > max_w: ratio = min(ratio, max_w / ow)
+    if oh > max_h: ratio = min(ratio, max_h / oh)
+    if ratio >= 1.0: return img
+    nw, nh = max(1, int(round(ow * ratio))), max(1, int(round(oh * ratio)))
+    log.info(f"  > Resizing to fit max dimensions: {ow}x{oh} -> {nw}x{nh}")
+    resized_img = None
+    try:
+        resized_img = img.resize((nw, nh), resample)
+        if resized_img is not img: image_utils.safe_close(img)
+        return resized_img
+    except Exception as e:
+        log.error(f"  ! Error during max dimensions resize to {nw}x{nh}: {e}")
+        image_utils.safe_close(resized_img)
+        return img
+
+def apply_final_canvas_or_prepare(img, exact_width, exact_height, output_format, jpg_background_color, resample=RESAMPLE_QUALITY):
+    """(Helper) Применяет холст точного размера ИЛИ подготавливает режим для сохранения."""
+    if not img: return None
+    # ... (код функции apply_final_canvas_or_prepare из предыдущего ответа, с log.*) ...
+    ow, oh = img.size
+    if ow <= 0 or oh <= 0: log.error("! Cannot process zero-size image for final step."); return None
+    perform_final_canvas = exact_width > 0 and exact_height > 0
+    if perform_final_canvas:
+        log.info(f"  > Applying final canvas {exact_width}x{exact_height}")
+        target_w, target_h = exact_width, exact_height
+        final_canvas = None; resized_content = None; img_rgba_content = None; content_to_paste = None
+        try:
+            ratio = min(target_w / ow, target_h / oh) if ow > 0 and oh > 0 else 1.0
+            content_nw, content_nh = max(1, int(round(ow * ratio))), max(1, int(round(oh * ratio)))
+            resized_content = img.resize((content_nw, content_nh), resample)
+            target_mode = 'RGBA' if output_format == 'png' else 'RGB'
+            bg_color = (0, 0, 0, 0) if target_mode == 'RGBA' else tuple(jpg_background_color)
+            final_canvas = Image.new(target_mode, (target_w, target_h), bg_color)
+            paste_x, paste_y = (target_w - content_nw) // 2, (target_h - content_nh) // 2
+            paste_mask = None; content_to_paste = resized_content
+            if resized_content.mode in ('RGBA', 'LA', 'PA'):
+                 img_rgba_content = resized_content.convert('RGBA')
+                 paste_mask = img_rgba_content
+                 content_to_paste = img_rgba_content.convert('RGB') if target_mode == 'RGB' else img_rgba_content
+            elif target_mode == 'RGB' and resized_content.mode != 'RGB': content_to_paste = resized_content.convert('RGB')
+            elif target_mode == 'RGBA' and resized_content.mode != 'RGBA': content_to_paste = resized_content.convert('RGBA')
+            final_canvas.paste(content_to_paste, (paste_x, paste_y), mask=paste_mask)
+            log.debug(f"    Final canvas created. Size: {final_canvas.size}, Mode: {final_canvas.mode}")
+            image_utils.safe_close(img); image_utils.safe_close(resized_content)
+            if img_rgba_content and img_rgba_content is not content_to_paste: image_utils.safe_close(img_rgba_content)
+            if content_to_paste is not resized_content: image_utils.safe_close(content_to_paste)
+            return final_canvas
+        except Exception as e:
+            log.error(f"  ! Error applying final canvas: {e}")
+            image_utils.safe_close(final_canvas); image_utils.safe_close(resized_content)
+            if img_rgba_content and img_rgba_content is not content_to_paste: image_utils.safe_close(img_rgba_content)
+            if content_to_paste is not resized_content: image_utils.safe_close(content_to_paste)
+            return img
+    else: # Prepare mode for saving without final canvas
+        log.debug("  > Final canvas disabled. Preparing mode for saving.")
+        target_mode = 'RGBA' if output_format == 'png' else 'RGB'
+        if img.mode == target_mode: log.debug(f"    Image already in target mode {target_mode}."); return img
+        elif target_mode == 'RGBA':
+            converted_img = None
+            try: log.debug(f"    Converting {img.mode} -> RGBA"); converted_img = img.convert('RGBA'); image_utils.safe_close(img); return converted_img
+            except Exception as e: log.error(f"    ! Failed to convert to RGBA: {e}"); image_utils.safe_close(converted_img); return img
+        else: # target_mode == 'RGB'
+            rgb_image = None; temp_rgba = None; image_to_paste = img; paste_mask = None
+            try:
+                log.info(f"    Preparing {img.mode} -> RGB with background {jpg_background_color}.")
+                rgb_image = Image.new("RGB", img.size, tuple(jpg_background_color))
+                if img.mode in ('RGBA', 'LA'): paste_mask = img
+                elif img.mode == 'PA': temp_rgba = img.convert('RGBA'); paste_mask = temp_rgba; image_to_paste = temp_rgba
+                rgb_image.paste(image_to_paste, (0, 0), mask=paste_mask)
+                if temp_rgba is not img: image_utils.safe_close(temp_rgba)
+                image_utils.safe_close(img)
+                log.debug(f"    Prepared RGB image. Size: {rgb_image.size}")
+                return rgb_image
+            except Exception as e:
+                log.error(f"    ! Failed preparing RGB background: {e}. Trying simple convert.")
+                image_utils.safe_close(rgb_image); image_utils.safe_close(temp_rgba)
+                converted_img = None
+                try: log.debug("    Attempting simple RGB conversion as fallback."); converted_img = img.convert('RGB'); image_utils.safe_close(img); return converted_img
+                except Exception as e_conv: log.error(f"    ! Simple RGB conversion failed: {e_conv}"); image_utils.safe_close(converted_img); return img
+
+# ==============================================================================
+# === ОБЪЕКТЫ ШАГОВ ============================================================
+# ==============================================================================
+
+class _Frozen:
+    """Неизменяемый объект с __slots__: значения задаются только конструктором."""
+    __slots__ = ()
+
+    def __init__(self, *values):
+        if len(values) != len(self.__slots__):
+            raise TypeError(f"{type(self).__name__} expects {len(self.__slots__)} values, got {len(values)}")
+        for slot, value in zip(self.__slots__, values): object.__setattr__(self, slot, value)
+
+    def __setattr__(self, name, value): raise AttributeError(f"{type(self).__name__} is immutable")
+    def __delattr__(self, name): raise AttributeError(f"{type(self).__name__} is immutable")
+    def _values(self) -> tuple: return tuple(getattr(self, slot) for slot in self.__slots__)
+    def __reduce__(self): return (type(self), self._values()) # pickle для процессов-обработчиков
+    def __eq__(self, other): return type(self) is type(other) and self._values() == other._values()
+    def __hash__(self): return hash((type(self), self._values()))
+
+    def __repr__(self):
+        return f"{type(self).__name__}({', '.join(f'{slot}={getattr(self, slot)!r}' for slot in self.__slots__)})"
+
+
+class StageState:
+    """Данные, которые шаги передают друг другу при обработке одного изображения."""
+    __slots__ = ('resample', 'perimeter_is_white', 'pre_crop_size')
+
+    def __init__(self, resample=RESAMPLE_QUALITY, perimeter_is_white: bool = False,
+                 pre_crop_size: Optional[Tuple[int, int]] = None):
+        self.resample = resample
+        self.perimeter_is_white = perimeter_is_white
+        self.pre_crop_size = pre_crop_size
+
+
+class Stage(_Frozen):
+    """Шаг конвейера: apply(img, state) возвращает новое изображение или бросает ValueError."""
+    __slots__ = ()
+
+    def apply(self, img: Image.Image, state: StageState) -> Image.Image:
+        raise NotImplementedError
+
+
+def _checked(img: Optional[Image.Image], step: str) -> Image.Image:
+    """(Helper) Ошибка шага: функции шагов возвращают None, если продолжать нельзя."""
+    if not img: raise ValueError(f"Image became None after {step}.")
+    return img
+
+
+class PreResize(Stage):
+    __slots__ = ('width', 'height')
+
+    def apply(self, img, state):
+        return _checked(apply_preresize(img, self.width, self.height, state.resample), "pre-resize")
+
+
+class Whiten(Stage):
+    __slots__ = ('cancel_threshold',)
+
+    def apply(self, img, state):
+        img_whitened = _checked(image_utils.whiten_image_by_darkest_perimeter(img, self.cancel_threshold), "whitening")
+        if img_whitened is not img: log.debug("    Whitening applied.")
+        return img_whitened
+
+
+class PerimeterCheck(Stage):
+    """Проверка белого периметра перед обрезкой (для условных полей PadIfNotWhite)."""
+    __slots__ = ('tolerance', 'margin')
+
+    def apply(self, img, state):
+        log.debug(f"  Perimeter check (Margin: {self.margin}px)")
+        state.perimeter_is_white = image_utils.check_perimeter_is_white(img, self.tolerance, self.margin)
+        return img
+
+
+class BackgroundCrop(Stage):
+    __slots__ = ('tolerance', 'symmetric_axes', 'symmetric_absolute')
+
+    def apply(self, img, state):
+        state.pre_crop_size = img.size
+        img_removed = _checked(image_utils.remove_white_background(img, self.tolerance), "background removal")
+        if img_removed is not img: log.debug("    Background removed/converted.")
+        img_cropped = _checked(image_utils.crop_image(img_removed, self.symmetric_axes, self.symmetric_absolute), "cropping")
+        if img_cropped is not img_removed: log.debug("    Cropping applied.")
+        return img_cropped
+
+
+class PadIfNotWhite(Stage):
+    """Поля отдельных файлов: только если периметр не белый и (при запрете расширения) хватает исходного размера."""
+    __slots__ = ('percent', 'allow_expansion')
+
+    def apply(self, img, state):
+        if state.perimeter_is_white:
+            log.info("    Padding skipped: Perimeter margin is set, and perimeter is already white.")
+            return img
+        current_w, current_h = img.size
+        if current_w <= 0 or current_h <= 0:
+            log.info("    Padding skipped: Cropped image has zero size.")
+            return img
+        padding_pixels = int(round(max(current_w, current_h) * (self.percent / 100.0)))
+        if padding_pixels <= 0:
+            log.info("    Padding skipped: Calculated padding is zero pixels.")
+            return img
+        pre_crop_width, pre_crop_height = state.pre_crop_size or img.size
+        size_check_passed = (current_w + 2 * padding_pixels <= pre_crop_width and current_h + 2 * padding_pixels <= pre_crop_height)
+        if not (self.allow_expansion or size_check_passed):
+            log.info("    Padding skipped: Size check failed & expansion disabled.")
+            return img
+        log.info("    Padding will be applied (mode condition met, size conditions met).")
+        img_padded = _checked(image_utils.add_padding(img, self.percent), "padding")
+        if img_padded is not img: log.info(f"    Padding applied successfully. New size: {img_padded.size}")
+        return img_padded
+
+
+class Pad(Stage):
+    """Поля ячеек коллажа (без условий)."""
+    __slots__ = ('percent',)
+
+    def apply(self, img, state):
+        img_padded = _checked(image_utils.add_padding(img, self.percent), "padding")
+        log.debug(f"    Padding applied. New size: {img_padded.size}")
+        return img_padded
+
+
+class BrightnessContrast(Stage):
+    __slots__ = ('brightness', 'contrast')
+
+    def apply(self, img, state):
+        return _checked(image_utils.apply_brightness_contrast(img, brightness_factor=self.brightness, contrast_factor=self.contrast),
+                        "brightness/contrast")
+
+
+class ForceAspectRatio(Stage):
+    __slots__ = ('ratio',)
+
+    def apply(self, img, state):
+        img_fitted = _checked(apply_force_aspect_ratio(img, self.ratio), "force aspect ratio")
+        log.info(f"    Force Aspect Ratio applied. New size: {img_fitted.size}")
+        return img_fitted
+
+
+class MaxDimensions(Stage):
+    __slots__ = ('width', 'height')
+
+    def apply(self, img, state):
+        return _checked(apply_max_dimensions(img, self.width, self.height, state.resample), "max dimensions")
+
+
+class FinalCanvas(Stage):
+    """Холст точного размера (width, height > 0) или только подготовка режима к сохранению."""
+    __slots__ = ('width', 'height', 'output_format', 'background')
+
+    def apply(self, img, state):
+        if self.width > 0 and self.height > 0:
+            img_final = _checked(apply_final_canvas_or_prepare(img, self.width, self.height, self.output_format, self.background, state.resample), "exact canvas")
+            log.info(f"    Exact Canvas applied. New size: {img_final.size}")
+            return img_final
+        log.debug("  Applying prepare mode (no exact canvas applied).")
+        return _checked(apply_final_canvas_or_prepare(img, 0, 0, self.output_format, self.background), "prepare mode")
+
+
+class PipelinePlan(_Frozen):
+    """Скомпилированный план: кортежи шагов prefix, tail, finish (см. начало модуля)."""
+    __slots__ = ('mode', 'prefix', 'tail', 'finish')
+
+    @staticmethod
+    def run_stages(stages: Tuple[Stage, ...], img: Image.Image, state: StageState) -> Image.Image:
+        for stage in stages:
+            log.debug(f"  Step: {type(stage).__name__}")
+            img = stage.apply(img, state)
+        return img
+
+    def run_prefix(self, img: Image.Image, state: StageState) -> Image.Image:
+        """Начальные шаги; без обрезки размер до обрезки - итоговый размер участка."""
+        img = self.run_stages(self.prefix, img, state)
+        if state.pre_crop_size is None: state.pre_crop_size = img.size
+        return img
+
+    def run_tail(self, img: Image.Image, state: StageState) -> Image.Image:
+        return self.run_stages(self.tail, img, state)
+
+    def run_finish(self, img: Image.Image, state: StageState) -> Image.Image:
+        return self.run_stages(self.finish, img, state)
+
+    def describe(self) -> str:
+        return " -> ".join(type(stage).__name__ for stage in self.prefix + self.tail + self.finish) or "(empty)"
+
+
+# ==============================================================================
+# === КОМПИЛЯЦИЯ ===============================================================
+# ==============================================================================
+
+def _compile_prefix(all_settings: Dict[str, Any], perimeter_check: bool) -> Tuple[Stage, ...]:
+    """(Helper) Пре-ресайз, отбеливание, проверка периметра (опц.), удаление фона и обрезка."""
+    prep_settings = all_settings.get('preprocessing', {}); white_settings = all_settings.get('whitening', {})
+    bgc_settings = all_settings.get('background_crop', {})
+    stages = []
+    if prep_settings.get('enable_preresize', False):
+        preresize_width = int(prep_settings.get('preresize_width', 0)); preresize_height = int(prep_settings.get('preresize_height', 0))
+        if preresize_width > 0 or preresize_height > 0: stages.append(PreResize(preresize_width, preresize_height))
+    if white_settings.get('enable_whitening', False):
+        stages.append(Whiten(int(white_settings.get('whitening_cancel_threshold', 550))))
+    enable_bg_crop = bgc_settings.get('enable_bg_crop', False)
+    white_tolerance = int(bgc_settings.get('white_tolerance', 0)) if enable_bg_crop else 0
+    if perimeter_check:
+        pad_settings = all_settings.get('padding', {})
+        stages.append(PerimeterCheck(white_tolerance, int(pad_settings.get('perimeter_margin', 0))))
+    if enable_bg_crop:
+        stages.append(BackgroundCrop(white_tolerance, bool(bgc_settings.get('crop_symmetric_axes', False)),
+                                     bool(bgc_settings.get('crop_symmetric_absolute', False))))
+    return tuple(stages)
+
+
+def _compile_brightness_contrast(all_settings: Dict[str, Any]) -> Tuple[Stage, ...]:
+    """(Helper) Яркость/контраст; при коэффициентах 1.0 шага нет."""
+    bc_settings = all_settings.get('brightness_contrast', {})
+    if not bc_settings.get('enable_bc'): return ()
+    brightness = float(bc_settings.get('brightness_factor', 1.0)); contrast = float(bc_settings.get('contrast_factor', 1.0))
+    if brightness == 1.0 and contrast == 1.0: return ()
+    return (BrightnessContrast(brightness, contrast),)
+
+
+def _compile_finish(mode_settings: Dict[str, Any], keys: Dict[str, str], label: str) -> Tuple[Stage, ...]:
+    """(Helper) Соотношение сторон, макс. размер и холст по секции режима (keys - имена ключей секции)."""
+    stages = []
+    if mode_settings.get('enable_force_aspect_ratio'):
+        ratio = mode_settings.get(keys['ratio'])
+        if ratio: stages.append(ForceAspectRatio(tuple(ratio)))
+        else: log.warning(f"{label} force aspect ratio enabled but ratio value is missing/invalid.")
+    if mode_settings.get('enable_max_dimensions'):
+        max_width = int(mode_settings.get(keys['max_width'], 0)); max_height = int(mode_settings.get(keys['max_height'], 0))
+        if max_width > 0 or max_height > 0: stages.append(MaxDimensions(max_width, max_height))
+        else: log.warning(f"{label} max dimensions enabled but width/height are zero.")
+    exact_width = exact_height = 0
+    if mode_settings.get('enable_exact_canvas'):
+        exact_width = int(mode_settings.get(keys['exact_width'], 0)); exact_height = int(mode_settings.get(keys['exact_height'], 0))
+        if exact_width <= 0 or exact_height <= 0:
+            log.warning(f"{label} exact canvas enabled but width/height are zero."); exact_width = exact_height = 0
+    output_format = str(mode_settings.get('output_format', 'jpg')).lower()
+    jpg_background_color = mode_settings.get('jpg_background_color', [255, 255, 255])
+    background = tuple(jpg_background_color) if isinstance(jpg_background_color, (list, tuple)) and len(jpg_background_color) == 3 else (255, 255, 255)
+    stages.append(FinalCanvas(exact_width, exact_height, output_format, background))
+    return tuple(stages)
+
+
+def compile_plan(all_settings: Dict[str, Any], mode: str = 'individual') -> PipelinePlan:
+    """
+    Компилирует план конвейера для режима 'individual' (отдельные файлы) или
+    'collage' (tail - шаги ячейки, finish - трансформации собранного коллажа).
+    """
+    if mode not in PLAN_MODES: raise ValueError(f"Unknown pipeline plan mode: {mode}")
+    pad_settings = all_settings.get('padding', {})
+    enable_padding = pad_settings.get('enable_padding', False)
+    padding_percent = float(pad_settings.get('padding_percent', 0.0)) if enable_padding else 0.0
+    if mode == 'individual':
+        ind_settings = all_settings.get('individual_mode', {})
+        # Поля отдельных файлов зависят от проверки периметра: без маржина или с нулевым процентом их нет
+        conditional_padding = padding_percent > 0 and int(pad_settings.get('perimeter_margin', 0)) > 0
+        if enable_padding and not conditional_padding:
+            log.info("Padding skipped: perimeter margin and padding percent must both be set (> 0).")
+        prefix = _compile_prefix(all_settings, perimeter_check=conditional_padding)
+        tail = ((PadIfNotWhite(padding_percent, bool(pad_settings.get('allow_expansion', True))),) if conditional_padding else ()) \
+               + _compile_brightness_contrast(all_settings)
+        finish = _compile_finish(ind_settings, {'ratio': 'force_aspect_ratio', 'max_width': 'max_output_width', 'max_height': 'max_output_height',
+                                                'exact_width': 'final_exact_width', 'exact_height': 'final_exact_height'}, "Individual")
+    else:
+        coll_settings = all_settings.get('collage_mode', {})
+        prefix = _compile_prefix(all_settings, perimeter_check=False)
+        tail = ((Pad(padding_percent),) if padding_percent > 0 else ()) + _compile_brightness_contrast(all_settings)
+        finish = _compile_brightness_contrast(all_settings) + _compile_finish(
+            coll_settings, {'ratio': 'force_collage_aspect_ratio', 'max_width': 'max_collage_width', 'max_height': 'max_collage_height',
+                            'exact_width': 'final_collage_exact_width', 'exact_height': 'final_collage_exact_height'}, "Collage")
+    plan = PipelinePlan(mode, prefix, tail, finish)
+    log.debug(f"Pipeline plan ({mode}): {plan.describe()}")
+    return plan
@@ -1,17 +1,41 @@
 # processing_workflows.py
 import time
 import os
+import re
+import copy
 import shutil
 import math
 import logging
 import traceback
 import gc # Для сборки мусора при MemoryError
-from typing import Dict, Any, Optional, Tuple, List
+import io
+import threading
+from typing import Dict, Any, Optional, Tuple, List, Iterable
 import uuid
+import tempfile
+from collections import deque
+from itertools import islice
+from concurrent.futures import Executor, ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 # Используем абсолютный импорт (если все файлы в одной папке)
 import image_utils
 import config_manager # Может понадобиться для дефолтных значений в редких случаях
+import batch_scheduler
+import shared_buffers
+import worker_pool
+import run_control
+import run_manifest
+import result_cache
+import stage_cache
+import file_hashing
+import run_journal
+import pipeline_plan
+import file_discovery
+import file_backup
+import durable_io
+import archive_input
+import archive_output
+import mapped_input
 
 try:
     from natsort import natsorted
@@ -24,215 +48,313 @@ ImageFile.LOAD_TRUNCATED_IMAGES = True
 
 log = logging.getLogger(__name__) # Используем логгер, настроенный в app.py
 
+# Версия формата раскладки коллажа (холст + положение ячеек) для инкрементального обновления
+COLLAGE_LAYOUT_VERSION = 1
+
+# Расширение в ключе кеша ячеек коллажа (отделяет их от промежуточных результатов отдельных файлов)
+COLLAGE_CELL_KEY_EXT = '.collage_cell'
+
 # ==============================================================================
-# === ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ДЛЯ ОБРАБОТКИ ИЗОБРАЖЕНИЙ (ШАГИ КОНВЕЙЕРА) ===
+# === СОХРАНЕНИЕ РЕЗУЛЬТАТА ====================================================
 # ==============================================================================
-# Эти функции инкапсулируют отдельные шаги обработки, вызываемые из
-# run_individual_processing или _process_image_for_collage.
-
-def _apply_preresize(img, preresize_width, preresize_height):
-    """(Helper) Применяет предварительное уменьшение размера, сохраняя пропорции."""
-    if not img or (preresize_width <= 0 and preresize_height <= 0):
-        return img
-    # ... (код функции _apply_preresize из предыдущего ответа, с log.*) ...
-    prw = preresize_width if preresize_width > 0 else float('inf')
-    prh = preresize_height if preresize_height > 0 else float('inf')
-    ow, oh = img.size
-    if ow <= 0 or oh <= 0 or (ow <= prw and oh <= prh):
-        return img
-    ratio = 1.0
-    if ow > prw: ratio = min(ratio, prw / ow)
-    if oh > prh: ratio = min(ratio, prh / oh)
-    if ratio >= 1.0: return img
-    nw = max(1, int(round(ow * ratio)))
-    nh = max(1, int(round(oh * ratio)))
-    log.info(f"  > Pre-resizing image from {ow}x{oh} to {nw}x{nh}")
-    resized_img = None
-    try:
-        resized_img = img.resize((nw, nh), Image.Resampling.LANCZOS)
-        if resized_img is not img: image_utils.safe_close(img)
-        return resized_img
-    except Exception as e:
-        log.error(f"  ! Error during pre-resize to {nw}x{nh}: {e}")
-        image_utils.safe_close(resized_img)
-        return img
-
-def _apply_force_aspect_ratio(img, aspect_ratio_tuple):
-    """(Helper) Вписывает изображение в холст с заданным соотношением сторон."""
-    if not img or not aspect_ratio_tuple: return img
-    # ... (код функции _apply_force_aspect_ratio из предыдущего ответа, с log.*) ...
-    if not (isinstance(aspect_ratio_tuple, (tuple, list)) and len(aspect_ratio_tuple) == 2): return img
-    try:
-        target_w_ratio, target_h_ratio = map(float, aspect_ratio_tuple)
-        if target_w_ratio <= 0 or target_h_ratio <= 0: return img
-    except (ValueError, TypeError): return img
-    current_w, current_h = img.size
-    if current_w <= 0 or current_h <= 0: return img
-    target_aspect = target_w_ratio / target_h_ratio
-    current_aspect = current_w / current_h
-    if abs(current_aspect - target_aspect) < 0.001: return img
-    log.info(f"  > Applying force aspect ratio {target_w_ratio}:{target_h_ratio}")
-    if current_aspect > target_aspect: canvas_w, canvas_h = current_w, max(1, int(round(current_w / target_aspect)))
-    else: canvas_w, canvas_h = max(1, int(round(current_h * target_aspect))), current_h
-    canvas = None; img_rgba = None
-    try:
-        canvas = Image.new('RGBA', (canvas_w, canvas_h), (0, 0, 0, 0))
-        paste_x, paste_y = (canvas_w - current_w) // 2, (canvas_h - current_h) // 2
-        img_rgba = img if img.mode == 'RGBA' else img.convert('RGBA')
-        canvas.paste(img_rgba, (paste_x, paste_y), mask=img_rgba)
-        if img_rgba is not img: image_utils.safe_close(img_rgba)
-        image_utils.safe_close(img)
-        log.debug(f"    New size after aspect ratio: {canvas.size}")
-        return canvas
-    except Exception as e:
-        log.error(f"  ! Error applying force aspect ratio: {e}")
-        image_utils.safe_close(canvas)
-        if img_rgba is not img: image_utils.safe_close(img_rgba)
-        return img
-
-def _apply_max_dimensions(img, max_width, max_height):
-    """(Helper) Уменьшает изображение, если оно больше максимальных размеров."""
-    if not img or (max_width <= 0 and max_height <= 0): return img
-    # ... (код функции _apply_max_dimensions из предыдущего ответа, с log.*) ...
-    max_w = max_width if max_width > 0 else float('inf')
-    max_h = max_height if max_height > 0 else float('inf')
-    ow, oh = img.size
-    if ow <= 0 or oh <= 0 or (ow <= max_w and oh <= max_h): return img
-    ratio = 1.0
-    if ow > max_w: ratio = min(ratio, max_w / ow)
-    if oh > max_h: ratio = min(ratio, max_h / oh)
-    if ratio >= 1.0: return img
-    nw, nh = max(1, int(round(ow * ratio))), max(1, int(round(oh * ratio)))
-    log.info(f"  > Resizing to fit max dimensions: {ow}x{oh} -> {nw}x{nh}")
-    resized_img = None
+# Шаги конвейера (ресайз, фон, поля, холст) - в pipeline_plan.
+
+# Буфер кодирования переиспользуется между файлами (свой у каждого потока);
+# буферы больше этого размера после сохранения не удерживаются
+MAX_POOLED_ENCODE_BUFFER = 64 * 1024 * 1024
+_encode_buffers = threading.local()
+
+
+def _take_encode_buffer() -> io.BytesIO:
+    """(Helper) Буфер кодирования текущего потока, перемотанный в начало (старое содержимое дальше tell() не используется)."""
+    buffer = getattr(_encode_buffers, 'buffer', None)
+    if buffer is None: buffer = _encode_buffers.buffer = io.BytesIO()
+    buffer.seek(0)
+    return buffer
+
+
+def _encode_image(img, output_format, jpeg_quality, fast=False) -> int:
+    """
+    (Helper) Кодирует изображение в буфер текущего потока (_take_encode_buffer)
+    с опциями формата. Возвращает размер закодированных данных в начале
+    буфера; ошибка кодирования или неподдерживаемый формат - исключение.
+    fast=True - быстрый профиль: без optimize/progressive, PNG с минимальным сжатием.
+    """
+    save_options = {"optimize": not fast}
+    img_to_save = img
+    must_close_img_to_save = False
+    if output_format == 'jpg':
+        format_name = "JPEG"
+        save_options["quality"] = int(jpeg_quality) # Убедимся что int
+        save_options["subsampling"] = 0
+        save_options["progressive"] = not fast
+        if img.mode != 'RGB':
+            log.warning(f"    Mode is {img.mode}, converting to RGB for JPEG save.")
+            img_to_save = img.convert('RGB')
+            must_close_img_to_save = True
+    elif output_format == 'png':
+        format_name = "PNG"
+        save_options["compress_level"] = 1 if fast else 6
+        if img.mode != 'RGBA':
+            log.warning(f"    Mode is {img.mode}, converting to RGBA for PNG save.")
+            img_to_save = img.convert('RGBA')
+            must_close_img_to_save = True
+    else: raise ValueError(f"Unsupported output format for saving: {output_format}")
+
+    buffer = _take_encode_buffer()
     try:
-        resized_img = img.resize((nw, nh), Image.Resampling.LANCZOS)
-        if resized_img is not img: image_utils.safe_close(img)
-        return resized_img
-    except Exception as e:
-        log.error(f"  ! Error during max dimensions resize to {nw}x{nh}: {e}")
-        image_utils.safe_close(resized_img)
-        return img
-
-def _apply_final_canvas_or_prepare(img, exact_width, exact_height, output_format, jpg_background_color):
-    """(Helper) Применяет холст точного размера ИЛИ подготавливает режим для сохранения."""
-    if not img: return None
-    # ... (код функции _apply_final_canvas_or_prepare из предыдущего ответа, с log.*) ...
-    ow, oh = img.size
-    if ow <= 0 or oh <= 0: log.error("! Cannot process zero-size image for final step."); return None
-    perform_final_canvas = exact_width > 0 and exact_height > 0
-    if perform_final_canvas:
-        log.info(f"  > Applying final canvas {exact_width}x{exact_height}")
-        target_w, target_h = exact_width, exact_height
-        final_canvas = None; resized_content = None; img_rgba_content = None; content_to_paste = None
-        try:
-            ratio = min(target_w / ow, target_h / oh) if ow > 0 and oh > 0 else 1.0
-            content_nw, content_nh = max(1, int(round(ow * ratio))), max(1, int(round(oh * ratio)))
-            resized_content = img.resize((content_nw, content_nh), Image.Resampling.LANCZOS)
-            target_mode = 'RGBA' if output_format == 'png' else 'RGB'
-            bg_color = (0, 0, 0, 0) if target_mode == 'RGBA' else tuple(jpg_background_color)
-            final_canvas = Image.new(target_mode, (target_w, target_h), bg_color)
-            paste_x, paste_y = (target_w - content_nw) // 2, (target_h - content_nh) // 2
-            paste_mask = None; content_to_paste = resized_content
-            if resized_content.mode in ('RGBA', 'LA', 'PA'):
-                 img_rgba_content = resized_content.convert('RGBA')
-                 paste_mask = img_rgba_content
-                 content_to_paste = img_rgba_content.convert('RGB') if target_mode == 'RGB' else img_rgba_content
-            elif target_mode == 'RGB' and resized_content.mode != 'RGB': content_to_paste = resized_content.convert('RGB')
-            elif target_mode == 'RGBA' and resized_content.mode != 'RGBA': content_to_paste = resized_content.convert('RGBA')
-            final_canvas.paste(content_to_paste, (paste_x, paste_y), mask=paste_mask)
-            log.debug(f"    Final canvas created. Size: {final_canvas.size}, Mode: {final_canvas.mode}")
-            image_utils.safe_close(img); image_utils.safe_close(resized_content)
-            if img_rgba_content and img_rgba_content is not content_to_paste: image_utils.safe_close(img_rgba_content)
-            if content_to_paste is not resized_content: image_utils.safe_close(content_to_paste)
-            return final_canvas
-        except Exception as e:
-            log.error(f"  ! Error applying final canvas: {e}")
-            image_utils.safe_close(final_canvas); image_utils.safe_close(resized_content)
-            if img_rgba_content and img_rgba_content is not content_to_paste: image_utils.safe_close(img_rgba_content)
-            if content_to_paste is not resized_content: image_utils.safe_close(content_to_paste)
-            return img
-    else: # Prepare mode for saving without final canvas
-        log.debug("  > Final canvas disabled. Preparing mode for saving.")
-        target_mode = 'RGBA' if output_format == 'png' else 'RGB'
-        if img.mode == target_mode: log.debug(f"    Image already in target mode {target_mode}."); return img
-        elif target_mode == 'RGBA':
-            converted_img = None
-            try: log.debug(f"    Converting {img.mode} -> RGBA"); converted_img = img.convert('RGBA'); image_utils.safe_close(img); return converted_img
-            except Exception as e: log.error(f"    ! Failed to convert to RGBA: {e}"); image_utils.safe_close(converted_img); return img
-        else: # target_mode == 'RGB'
-            rgb_image = None; temp_rgba = None; image_to_paste = img; paste_mask = None
-            try:
-                log.info(f"    Preparing {img.mode} -> RGB with background {jpg_background_color}.")
-                rgb_image = Image.new("RGB", img.size, tuple(jpg_background_color))
-                if img.mode in ('RGBA', 'LA'): paste_mask = img
-                elif img.mode == 'PA': temp_rgba = img.convert('RGBA'); paste_mask = temp_rgba; image_to_paste = temp_rgba
-                rgb_image.paste(image_to_paste, (0, 0), mask=paste_mask)
-                if temp_rgba is not img: image_utils.safe_close(temp_rgba)
-                image_utils.safe_close(img)
-                log.debug(f"    Prepared RGB image. Size: {rgb_image.size}")
-                return rgb_image
-            except Exception as e:
-                log.error(f"    ! Failed preparing RGB background: {e}. Trying simple convert.")
-                image_utils.safe_close(rgb_image); image_utils.safe_close(temp_rgba)
-                converted_img = None
-                try: log.debug("    Attempting simple RGB conversion as fallback."); converted_img = img.convert('RGB'); image_utils.safe_close(img); return converted_img
-                except Exception as e_conv: log.error(f"    ! Simple RGB conversion failed: {e_conv}"); image_utils.safe_close(converted_img); return img
-
-
-def _save_image(img, output_path, output_format, jpeg_quality):
-    """(Helper) Сохраняет изображение в указанном формате с опциями."""
-    if not img: log.error("! Cannot save None image."); return False
+        img_to_save.save(buffer, format_name, **save_options)
+    finally:
+        if must_close_img_to_save: image_utils.safe_close(img_to_save)
+    return buffer.tell()
+
+
+def _save_image(img, output_path, output_format, jpeg_quality, fast=False, fsync=False) -> int:
+    """
+    (Helper) Сохраняет изображение в указанном формате с опциями.
+    Изображение кодируется в буфер в памяти и записывается одним вызовом;
+    запись атомарна (временный файл + os.replace): при ошибке или сбое
+    прежний файл по output_path не портится.
+    fast=True - быстрый профиль: без optimize/progressive, PNG с минимальным сжатием.
+    fsync=True - файл и запись папки сбрасываются на диск до возврата.
+    Возвращает размер записанного файла в байтах (0 - ошибка).
+    """
+    if not img: log.error("! Cannot save None image."); return 0
     # ... (код функции _save_image из предыдущего ответа, с log.*) ...
-    if img.size[0] <= 0 or img.size[1] <= 0: log.error(f"! Cannot save zero-size image {img.size} to {output_path}"); return False
+    if img.size[0] <= 0 or img.size[1] <= 0: log.error(f"! Cannot save zero-size image {img.size} to {output_path}"); return 0
     log.info(f"  > Saving image to {output_path} (Format: {output_format.upper()})")
     log.debug(f"    Image details before save: Mode={img.mode}, Size={img.size}")
     try:
-        save_options = {"optimize": True}
-        img_to_save = img
-        must_close_img_to_save = False
-        if output_format == 'jpg':
-            format_name = "JPEG"
-            save_options["quality"] = int(jpeg_quality) # Убедимся что int
-            save_options["subsampling"] = 0
-            save_options["progressive"] = True
-            if img.mode != 'RGB':
-                log.warning(f"    Mode is {img.mode}, converting to RGB for JPEG save.")
-                img_to_save = img.convert('RGB')
-                must_close_img_to_save = True
-        elif output_format == 'png':
-            format_name = "PNG"
-            save_options["compress_level"] = 6
-            if img.mode != 'RGBA':
-                log.warning(f"    Mode is {img.mode}, converting to RGBA for PNG save.")
-                img_to_save = img.convert('RGBA')
-                must_close_img_to_save = True
-        else: log.error(f"! Unsupported output format for saving: {output_format}"); return False
-
-        img_to_save.save(output_path, format_name, **save_options)
-        if must_close_img_to_save: image_utils.safe_close(img_to_save)
-        log.info(f"    Successfully saved: {os.path.basename(output_path)}")
-        return True
+        encoded_size = _encode_image(img, output_format, jpeg_quality, fast)
+        try:
+            with _encode_buffers.buffer.getbuffer() as view, view[:encoded_size] as payload:
+                with durable_io.atomic_write(output_path, fsync) as f: f.write(payload)
+        finally:
+            if encoded_size > MAX_POOLED_ENCODE_BUFFER: _encode_buffers.buffer = None
+        log.info(f"    Successfully saved: {os.path.basename(output_path)} ({encoded_size / 1024:.0f} KB)")
+        return encoded_size
     except Exception as e:
+        # Частично записанный временный файл уже удален atomic_write
         log.error(f"  ! Failed to save image {os.path.basename(output_path)}: {e}", exc_info=True)
-        if os.path.exists(output_path):
-            try: os.remove(output_path); log.warning(f"    Removed partially saved file: {os.path.basename(output_path)}")
-            except Exception as del_err: log.error(f"    ! Failed to remove partially saved file: {del_err}")
-        return False
+        _encode_buffers.buffer = None # Буфер мог остаться в неопределенном состоянии
+        return 0
+
+
+def _encode_image_bytes(img, output_name, output_format, jpeg_quality, fast=False) -> Optional[bytes]:
+    """
+    (Helper) Кодирует изображение в байты (для записи в архив результатов
+    основным процессом) с теми же опциями, что и _save_image.
+    Возвращает закодированные данные или None при ошибке.
+    """
+    if not img or img.size[0] <= 0 or img.size[1] <= 0: log.error(f"! Cannot encode empty image for {output_name}"); return None
+    log.info(f"  > Encoding {output_name} for the output archive (Format: {output_format.upper()})")
+    try:
+        encoded_size = _encode_image(img, output_format, jpeg_quality, fast)
+        with _encode_buffers.buffer.getbuffer() as view: data = bytes(view[:encoded_size])
+        if encoded_size > MAX_POOLED_ENCODE_BUFFER: _encode_buffers.buffer = None
+        return data
+    except Exception as e:
+        log.error(f"  ! Failed to encode image {output_name}: {e}", exc_info=True)
+        _encode_buffers.buffer = None
+        return None
 
 # ==============================================================================
 # === ОСНОВНАЯ ФУНКЦИЯ: ОБРАБОТКА ОТДЕЛЬНЫХ ФАЙЛОВ =============================
 # ==============================================================================
 
-def run_individual_processing(**all_settings: Dict[str, Any]):
+def _resolve_worker_count(perf_settings: Dict[str, Any]) -> int:
+    """(Helper) Число процессов-обработчиков: 0 = по числу ядер, 1 = без параллелизма."""
+    try: requested = int(perf_settings.get('max_workers', 1))
+    except (TypeError, ValueError): requested = 1
+    if requested <= 0: requested = os.cpu_count() or 1
+    return max(1, requested)
+
+
+def _flat_name(file: str) -> str:
+    """(Helper) Имя в папке результатов/бекапа для файла из подпапки входной: 'a/b.jpg' -> 'a__b.jpg'."""
+    return file.replace(os.sep, '__') if os.sep in file else file
+
+
+def _process_individual_file(job: Dict[str, Any], params: Dict[str, Any], shared: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
     """
-    Оркестрирует обработку отдельных файлов: поиск, цикл, вызов image_utils,
-    сохранение, переименование, удаление.
-    Принимает все настройки как один словарь.
+    (Worker) Обрабатывает один файл: открытие, конвейер шагов, сохранение.
+    Бекап исходника здесь не делается - его пишет основной процесс (см.
+    _start_backups) до удаления оригиналов.
+    Вызывается и в основном процессе, и в процессах-обработчиках, поэтому
+    принимает только сериализуемые словари и возвращает словарь-результат:
+    {'index', 'file', 'source_path', 'status', 'output_path', 'elapsed', 'megapixels', 'fast', 'cache', 'stage_cache',
+    'output_bytes'} (output_bytes - размер закодированного результата, 0 - не кодировался),
+    где status - 'processed', 'skipped' (нечитаемый файл) или 'error',
+    cache / stage_cache - 'hit'/'miss' при включенном кеше результатов /
+    промежуточного результата, иначе None.
+    При записи в архив результатов (params['output_archive']) - еще 'output_data'
+    (закодированные байты; output_path - условный путь члена архива).
+    params['mmap_input'] - исходник читается через отображение в память (mapped_input).
+    job['fast'] включает быстрый профиль ресайза и сохранения (см. run_control).
+    job['member'] (archive_input.ArchiveMember) - исходник внутри архива:
+    читается в память, source_path для него условный.
+    shared - общее для нескольких пресетов состояние файла (см.
+    _process_multi_preset_file): декодированный исходник и результаты
+    начальных шагов по отпечатку их настроек.
     """
-    log.info("--- Starting Individual File Processing ---")
-    start_time = time.time()
+    file = job['file']
+    source_file_path = job['source_path']
+    fast = bool(job.get('fast', False))
+    resample = pipeline_plan.RESAMPLE_FAST if fast else pipeline_plan.RESAMPLE_QUALITY
+    result = {'index': job['index'], 'file': file, 'source_path': source_file_path,
+              'status': 'error', 'output_path': None, 'elapsed': 0.0,
+              'megapixels': job.get('megapixels', 0.0), 'fast': fast, 'cache': None, 'stage_cache': None, 'output_bytes': 0}
+    file_start_time = time.perf_counter()
+
+    abs_output_path = params['abs_output_path']
+    output_format = params['output_format']
+    plan: pipeline_plan.PipelinePlan = params['plan']
+
+    log.info(f"--- [{job['index'] + 1}/{job['total'] or '?'}] Processing: {file} ---")
+    img_current = None
+    original_basename = os.path.splitext(_flat_name(file))[0]
+    # Имя по артикулу, выделенное до обработки, или исходное (переименование после обработки)
+    temp_output_filename = job.get('output_name') or f"{original_basename}{params['output_ext']}"
+    output_archive = params.get('output_archive') # Результат пишет в архив основной процесс
+    final_output_path = os.path.join(output_archive or abs_output_path, temp_output_filename)
+    cache = None; cache_key = None; stage_handle = None; mapped = None
+
+    try:
+        # 6.1.0. Член архива - читается в память целиком (без распаковки на диск), файл - при mmap_input отображается
+        source_data = None
+        if job.get('member') is not None:
+            # При нескольких пресетах - один раз на файл
+            source_data = shared.get('source_data') if shared is not None else None
+            if source_data is None: source_data = archive_input.read_member(job['member'])
+            if source_data is None: result['status'] = 'skipped'; return result
+            if shared is not None: shared['source_data'] = source_data
+        elif params.get('mmap_input') and not (shared is not None and shared['decoded'] is not None):
+            # Файл на диске - через отображение в память: хеш и декодирование читают одни и те же страницы
+            mapped = mapped_input.map_file(source_file_path)
+
+        # 6.1.1. Кеш готовых результатов (по содержимому исходника и настройкам)
+        cache_params = params.get('result_cache'); stage_params = params.get('stage_cache')
+        if not (cache_params or stage_params): source_hash = None
+        elif source_data is not None: source_hash = file_hashing.hash_bytes(source_data)
+        elif mapped is not None: source_hash = file_hashing.hash_bytes(mapped)
+        else: source_hash = file_hashing.hash_file(source_file_path)
+        if cache_params and source_hash:
+            cache = result_cache.ResultCache(cache_params['cache_dir'], cache_params['max_bytes'])
+            cache_key = cache.make_key(source_hash, cache_params['fingerprint'], params['output_ext'])
+            cached_data = cache.fetch_bytes(cache_key, params['output_ext']) if output_archive else None
+            if cached_data is not None: result['output_data'] = cached_data
+            if cached_data is not None or (not output_archive and cache.fetch(cache_key, params['output_ext'], final_output_path,
+                                                                              params.get('durability') == 'fsync')):
+                log.info(f"  > Result cache hit: {os.path.basename(final_output_path)}")
+                result.update(status='processed', output_path=final_output_path, cache='hit')
+                return result
+            result['cache'] = 'miss'
+
+        # 6.1.2. Кеш промежуточного результата (после обрезки фона)
+        stage = None; stage_key = None; stage_hit = None
+        if stage_params and source_hash:
+            stage = stage_cache.StageCache(stage_params['cache_dir'], stage_params['max_bytes'])
+            stage_key = stage.make_key(source_hash, stage_params['fingerprint'], stage_cache.STAGE_EXT)
+            stage_hit = stage.load_image(stage_key)
+            result['stage_cache'] = 'hit' if stage_hit else 'miss'
+
+        if stage_hit:
+            img_current, stage_meta, stage_handle = stage_hit
+            state = pipeline_plan.StageState(resample, bool(stage_meta.get('perimeter_is_white', False)), tuple(stage_meta['pre_crop_size']))
+            result['megapixels'] = stage_meta.get('source_megapixels', 0.0)
+            log.info(f"  > Stage cache hit: skipping decode/pre-resize/whitening/crop ({img_current.size[0]}x{img_current.size[1]})")
+        elif shared is not None and params['prefix_fingerprint'] in shared['prefixes']:
+            # Тот же начальный участок уже выполнен для другого пресета
+            shared_img, perimeter_is_white, pre_crop_size, result['megapixels'] = shared['prefixes'][params['prefix_fingerprint']]
+            state = pipeline_plan.StageState(resample, perimeter_is_white, pre_crop_size)
+            img_current = shared_img.copy()
+            log.info(f"  > Shared prefix reused ({img_current.size[0]}x{img_current.size[1]})")
+        else:
+            # 6.2. Открытие (при нескольких пресетах - один раз на файл)
+            if shared is not None and shared['decoded'] is not None:
+                img_current = shared['decoded'].copy()
+            else:
+                try:
+                    if source_data is not None: source_fp = io.BytesIO(source_data)
+                    elif mapped is not None: mapped.seek(0); source_fp = mapped
+                    else: source_fp = source_file_path
+                    with Image.open(source_fp) as img_opened:
+                        img_opened.load()
+                        img_current = img_opened.copy()
+                        log.debug(f"  > Opened. Orig size: {img_current.size}, Mode: {img_current.mode}")
+                except UnidentifiedImageError: log.error(f"  ! Cannot identify image: {file}"); result['status'] = 'skipped'; return result
+                except FileNotFoundError: log.error(f"  ! File not found during open: {file}"); result['status'] = 'skipped'; return result
+                except Exception as open_err: log.error(f"  ! Error opening {file}: {open_err}", exc_info=True); return result
+                mapped_input.release(mapped); mapped = None # Пиксели уже скопированы
+                if not img_current or img_current.size[0] <= 0 or img_current.size[1] <= 0:
+                    log.error(f"  ! Image empty/zero size after open: {file}"); return result
+                if shared is not None: shared['decoded'] = img_current.copy()
+            result['megapixels'] = (img_current.size[0] * img_current.size[1]) / 1_000_000.0
+
+            # --- Конвейер Обработки: начальные шаги (пре-ресайз, отбеливание, периметр, фон/обрезка) ---
+            state = pipeline_plan.StageState(resample)
+            img_current = plan.run_prefix(img_current, state)
+            if shared is not None:
+                shared['prefixes'][params['prefix_fingerprint']] = (img_current.copy(), state.perimeter_is_white,
+                                                                    state.pre_crop_size, result['megapixels'])
+            # Быстрый профиль (другой ресайз) в кеш не попадает
+            if stage and not fast:
+                stage.store_image(stage_key, img_current, {'perimeter_is_white': state.perimeter_is_white,
+                                                           'pre_crop_size': list(state.pre_crop_size),
+                                                           'source_megapixels': result['megapixels']})
+        # --- Конвейер Обработки: поля, яркость/контраст, соотношение сторон, размер, холст ---
+        img_current = plan.run_tail(img_current, state)
+        img_current = plan.run_finish(img_current, state)
+        log.debug(f"    Image after final step: {repr(img_current)}")
+
+        # 6.3. Сохранение
+        output_data = None
+        if output_archive:
+            output_data = _encode_image_bytes(img_current, temp_output_filename, output_format, params['jpeg_quality'], fast)
+            saved_bytes = len(output_data) if output_data else 0
+        else:
+            saved_bytes = _save_image(img_current, final_output_path, output_format, params['jpeg_quality'], fast,
+                                      params.get('durability') == 'fsync')
+        image_utils.safe_close(img_current); img_current = None
+
+        if saved_bytes:
+            result['status'] = 'processed'
+            result['output_path'] = final_output_path
+            result['output_bytes'] = saved_bytes
+            if output_data: result['output_data'] = output_data
+            # Быстрый профиль (нехватка времени) в кеш не попадает
+            if cache_key and not fast:
+                if output_data: cache.store_bytes(cache_key, params['output_ext'], output_data)
+                else: cache.store(cache_key, params['output_ext'], final_output_path)
+        else:
+            log.error(f"Failed to save processed file: {file}")
+
+    # --- Обработка Ошибок для Файла ---
+    except MemoryError as e:
+         log.critical(f"!!! MEMORY ERROR processing {file}: {e}. Attempting GC.", exc_info=True)
+         gc.collect()
+    except ValueError as e: # Ловим наши ошибки None
+         log.error(f"!!! PROCESSING error for {file}: {e}", exc_info=False) # Не нужен полный трейсбек
+    except Exception as e:
+         log.critical(f"!!! UNEXPECTED error processing {file}: {e}", exc_info=True)
+    finally:
+        image_utils.safe_close(img_current) # Закрываем в любом случае
+        img_current = None
+        stage_cache.release(stage_handle)
+        mapped_input.release(mapped)
+        result['elapsed'] = time.perf_counter() - file_start_time
+        log.info(f"--- Finished processing: {file} {'(Success)' if result['status'] == 'processed' else '(Failed)'} ---")
+    return result
 
+
+def prepare_individual_run(all_settings: Dict[str, Any],
+                           backup_writer: Optional[file_backup.BackupWriter] = None) -> Optional[Dict[str, Any]]:
+    """
+    Первый шаг запуска (см. run_individual_processing): извлекает и проверяет
+    настройки, готовит папки, логирует параметры и находит файлы.
+    Возвращает словарь запуска или None, если обрабатывать нечего.
+    backup_writer - общий бекап нескольких запусков по одной папке (вместо своего).
+    """
     # --- 1. Извлечение и Валидация Параметров ---
     log.debug("Extracting settings for individual mode...")
     try:
@@ -243,6 +365,8 @@ def run_individual_processing(**all_settings: Dict[str, Any]):
         pad_settings = all_settings.get('padding', {})
         bc_settings = all_settings.get('brightness_contrast', {})
         ind_settings = all_settings.get('individual_mode', {})
+        perf_settings = all_settings.get('performance', {})
+        cache_settings = all_settings.get('cache', {})
 
         input_path = paths_settings.get('input_folder_path')
         output_path = paths_settings.get('output_folder_path')
@@ -276,9 +400,31 @@ def run_individual_processing(**all_settings: Dict[str, Any]):
         perimeter_margin = int(pad_settings.get('perimeter_margin', 0)) if enable_padding else 0
         allow_expansion = bool(pad_settings.get('allow_expansion', True)) if enable_padding else False
 
+        num_workers = _resolve_worker_count(perf_settings)
+        lpt_scheduling = bool(perf_settings.get('lpt_scheduling', True))
+        durability = durable_io.resolve_durability(perf_settings)
+        mmap_input = bool(perf_settings.get('mmap_input', False))
+        readahead_files = max(0, int(perf_settings.get('readahead_files', 0) or 0))
+        skip_unchanged = bool(ind_settings.get('skip_unchanged', False))
+        manifest_hash = bool(ind_settings.get('manifest_hash', False))
+        enable_result_cache = bool(cache_settings.get('enable_result_cache', False))
+        enable_stage_cache = bool(cache_settings.get('enable_stage_cache', False))
+        enable_journal = bool(ind_settings.get('enable_journal', False))
+        resume_interrupted = bool(ind_settings.get('resume_interrupted', False))
+        detect_duplicates = bool(ind_settings.get('detect_duplicates', False))
+        allocate_names = bool(ind_settings.get('allocate_names_upfront', False))
+        output_to_archive = bool(ind_settings.get('output_archive', False))
+        discovery_options = file_discovery.options_from_settings(all_settings.get('discovery', {}))
+        streaming = bool(all_settings.get('discovery', {}).get('streaming', False))
+        backup_settings = all_settings.get('backup', {})
+        fast_backup = bool(backup_settings.get('fast_backup', False))
+        backup_mode = str(backup_settings.get('mode', 'copy')).lower()
+
         # Дополнительная валидация
         if output_format not in ['jpg', 'png']:
             raise ValueError(f"Unsupported output format: {output_format}")
+        if backup_mode not in file_backup.BACKUP_MODES:
+            raise ValueError(f"Unsupported backup mode: {backup_mode}")
         if not input_path or not output_path:
             raise ValueError("Input or Output path is missing.")
 
@@ -286,19 +432,31 @@ def run_individual_processing(**all_settings: Dict[str, Any]):
         valid_jpg_bg = tuple(jpg_background_color) if isinstance(jpg_background_color, list) else (255, 255, 255)
         valid_aspect_ratio = tuple(force_aspect_ratio) if force_aspect_ratio else None
 
+        # План шагов компилируется один раз на запуск и передается обработчикам
+        plan = pipeline_plan.compile_plan(all_settings, 'individual')
+
         log.debug("Settings extracted successfully.")
 
     except (KeyError, ValueError, TypeError) as e:
         log.critical(f"Error processing settings: {e}. Aborting.", exc_info=True)
-        return
+        return None
 
     # --- 2. Подготовка Путей и Папок ---
     abs_input_path = os.path.abspath(input_path)
     abs_output_path = os.path.abspath(output_path)
     abs_backup_path = os.path.abspath(backup_folder_path) if backup_folder_path and str(backup_folder_path).strip() else None
 
-    if not os.path.isdir(abs_input_path):
-        log.error(f"Input path is not a valid directory: {abs_input_path}"); return
+    # Входной путь - папка или архив (ZIP/TAR): члены архива читаются без распаковки
+    input_archive = None if os.path.isdir(abs_input_path) else archive_input.archive_kind(abs_input_path)
+    if not input_archive and not os.path.isdir(abs_input_path):
+        log.error(f"Input path is not a valid directory or archive: {abs_input_path}"); return None
+    if input_archive:
+        # Исходники остаются в архиве нетронутыми: бекап, удаление, манифест и поиск дубликатов (по файлам) не нужны
+        if abs_backup_path: log.info("Backup disabled: the input archive itself is kept unchanged."); abs_backup_path = None
+        if skip_unchanged: log.warning("Skip unchanged is not available for archive input: all members will be processed."); skip_unchanged = False
+        if detect_duplicates: log.warning("Duplicate detection is not available for archive input: disabled."); detect_duplicates = False
+        # Сжатый TAR читается только подряд: потоково или целиком в память при перечислении
+        if input_archive != 'tar-stream': streaming = False
 
     backup_enabled = False
     if abs_backup_path:
@@ -310,280 +468,609 @@ def run_individual_processing(**all_settings: Dict[str, Any]):
                  elif not os.path.isdir(abs_backup_path): log.error(f"Backup path not a directory: {abs_backup_path}");
                  else: backup_enabled = True # Папка существует и это директория
              except Exception as e: log.error(f"Error creating backup dir {abs_backup_path}: {e}")
-
-    safe_to_delete = abs_input_path != abs_output_path
+    # Бекап - в фоновом потоке основного процесса, а не в обработчиках; fast_backup выбирает только способ копирования
+    if not backup_enabled: backup_writer = None
+    elif backup_writer is None:
+        backup_store = file_backup.BackupStore(abs_backup_path, abs_input_path) if backup_mode == 'content' else None
+        backup_writer = file_backup.BackupWriter(abs_backup_path, backup_store, fast=fast_backup)
+
+    enable_renaming = bool(article_name and str(article_name).strip())
+    if output_to_archive:
+        # Результаты существуют только членами архива: манифест и копии результатов дубликатов (файлы) недоступны
+        if skip_unchanged: log.warning("Skip unchanged is not available with archive output: all files will be processed."); skip_unchanged = False
+        if detect_duplicates: log.warning("Duplicate detection is not available with archive output: disabled."); detect_duplicates = False
+        if resume_interrupted: log.info("Resume is not available with archive output: the archive is written anew."); resume_interrupted = False
+        if streaming and enable_renaming:
+            # Член архива не переименовать: имена по артикулу выделяются до обработки, по полному списку
+            log.warning("Streaming discovery disabled: archive output with renaming needs the full file list."); streaming = False
+
+    safe_to_delete = abs_input_path != abs_output_path and not input_archive
     effective_delete_originals = delete_originals and safe_to_delete
-    if delete_originals and not safe_to_delete: log.warning("Deletion disabled: input/output paths are same.")
+    if delete_originals and input_archive: log.warning("Deletion disabled: members of the input archive are not deleted.")
+    elif delete_originals and not safe_to_delete: log.warning("Deletion disabled: input/output paths are same.")
+    if streaming and abs_input_path == abs_output_path:
+        # Результаты появлялись бы в еще не просмотренной части папки и попадали в обработку
+        log.warning("Streaming discovery disabled: input/output paths are same."); streaming = False
 
     try: # Создание папки результатов
         if not os.path.exists(abs_output_path): os.makedirs(abs_output_path); log.info(f"Created output dir: {abs_output_path}")
-        elif not os.path.isdir(abs_output_path): log.error(f"Output path not a directory: {abs_output_path}"); return
-    except Exception as e: log.error(f"Error creating output dir {abs_output_path}: {e}"); return
+        elif not os.path.isdir(abs_output_path): log.error(f"Output path not a directory: {abs_output_path}"); return None
+    except Exception as e: log.error(f"Error creating output dir {abs_output_path}: {e}"); return None
+    durable_io.remove_stale_temp_files(abs_output_path) # Недописанные результаты прерванного запуска
+    # Архив результатов - в папке результатов, по артикулу или по имени папки
+    output_archive_path = None
+    if output_to_archive:
+        archive_base = str(article_name).strip() if enable_renaming else (os.path.basename(abs_output_path) or "results")
+        output_archive_path = os.path.join(abs_output_path, f"{archive_base}.zip")
 
     # --- 3. Логирование параметров ---
     log.info("--- Processing Parameters (Individual Mode) ---")
-    log.info(f"Input Path: {abs_input_path}")
+    log.info(f"Input Path: {abs_input_path}" + (f" (archive: {input_archive})" if input_archive else ""))
     log.info(f"Output Path: {abs_output_path}")
-    log.info(f"Backup Path: {abs_backup_path if backup_enabled else 'Disabled'}")
+    if output_archive_path: log.info(f"Output Archive: {output_archive_path} (JPEG stored, PNG deflated)")
+    log.info(f"Backup Path: {abs_backup_path if backup_enabled else 'Disabled'}" +
+             ((" (content-addressed store" if backup_writer.store else " (") + (", fast copy" if fast_backup else ", copy") + ", background)" if backup_writer else ""))
     log.info(f"Article (Renaming): {article_name or 'Disabled'}")
     log.info(f"Delete Originals: {effective_delete_originals}")
     log.info(f"Output Format: {output_format.upper()}")
     if output_format == 'jpg': log.info(f"  JPG Bg: {valid_jpg_bg}, Quality: {jpeg_quality}")
+    log.info(f"Skip Unchanged: {'Enabled' if skip_unchanged else 'Disabled'}" + (" (hash check)" if skip_unchanged and manifest_hash else ""))
+    if streaming: log.info("Streaming Discovery: Enabled (processing starts before the folder is fully listed)")
+    if mmap_input or readahead_files:
+        log.info(f"Input Reading: {'memory-mapped' if mmap_input else 'buffered'}" +
+                 (f", read-ahead {readahead_files} file(s)" + ("" if mapped_input.READAHEAD_SUPPORTED else " (not supported on this platform)") if readahead_files else ""))
+    if durability['mode'] != 'none':
+        log.info(f"Write Durability: {durability['mode']}" + (f" (every {durability['batch_size']} files)" if durability['mode'] == 'batch' else ""))
+    log.info(f"Duplicate Detection: {'Enabled' if detect_duplicates else 'Disabled'}")
+    log.info(f"Run Journal: {'Enabled' if enable_journal else 'Disabled'}" + (" (resume interrupted run)" if enable_journal and resume_interrupted else ""))
+    results_cache = result_cache.ResultCache.from_settings(cache_settings) if enable_result_cache else None
+    log.info(f"Result Cache: {results_cache.cache_dir if results_cache else 'Disabled'}" +
+             (f" (limit: {results_cache.max_bytes / (1024 * 1024):.0f} MB)" if results_cache and results_cache.max_bytes else ""))
+    stages_cache = stage_cache.StageCache.from_settings(cache_settings) if enable_stage_cache else None
+    log.info(f"Stage Cache: {stages_cache.cache_dir if stages_cache else 'Disabled'}" +
+             (f" (limit: {stages_cache.max_bytes / (1024 * 1024):.0f} MB)" if stages_cache and stages_cache.max_bytes else ""))
+    log.info(f"Workers: {num_workers}" + (f" (LPT scheduling: {'Enabled' if lpt_scheduling else 'Disabled'})" if num_workers > 1 else ""))
     log.info("---------- Steps ----------")
     log.info(f"1. Preresize: {'Enabled' if enable_preresize else 'Disabled'} (W:{preresize_width}, H:{preresize_height})")
     log.info(f"2. Whitening: {'Enabled' if enable_whitening else 'Disabled'} (Thresh:{whitening_cancel_threshold})")
     log.info(f"3. BG Removal/Crop: {'Enabled' if enable_bg_crop else 'Disabled'} (Tol:{white_tolerance})")
     if enable_bg_crop: log.info(f"  Crop Symmetry: Abs={crop_symmetric_absolute}, Axes={crop_symmetric_axes}")
-    log.info(f"4. Padding: {'Enabled' if enable_padding else 'Disabled'}" + 
+    log.info(f"4. Padding: {'Enabled' if enable_padding else 'Disabled'}" +
              (f" (%:{padding_percent:.1f}, Margin:{perimeter_margin}, Expand:{allow_expansion})" if pad_settings.get('enable_padding') else ""))
-    
+
     # === ВОССТАНОВЛЕН ВЫЗОВ ЯРКОСТИ И КОНТРАСТА ===
     enable_bc = bc_settings.get('enable_bc', False)
-    log.info(f"5. Brightness/Contrast: {'Enabled' if enable_bc else 'Disabled'}" + 
+    log.info(f"5. Brightness/Contrast: {'Enabled' if enable_bc else 'Disabled'}" +
              (f" (B:{bc_settings.get('brightness_factor', 1.0):.2f}, C:{bc_settings.get('contrast_factor', 1.0):.2f})" if enable_bc else ""))
     # ===================================
-    
+
     # === УЛУЧШЕНО ЛОГИРОВАНИЕ ФЛАГА ===
     enable_ratio_log = ind_settings.get('enable_force_aspect_ratio', False)
     ratio_value_log = ind_settings.get('force_aspect_ratio')
-    log.info(f"6. Force Aspect Ratio: {'Enabled' if enable_ratio_log else 'Disabled'} " + 
+    log.info(f"6. Force Aspect Ratio: {'Enabled' if enable_ratio_log else 'Disabled'} " +
              (f"(Value: {ratio_value_log})" if enable_ratio_log and ratio_value_log else ""))
     # ==================================
-    
+
     log.info(f"7. Max Dimensions: W:{max_output_width or 'N/A'}, H:{max_output_height or 'N/A'}")
     log.info(f"8. Final Exact Canvas: W:{final_exact_width or 'N/A'}, H:{final_exact_height or 'N/A'}")
+    log.info(f"Compiled steps: {plan.describe()}")
     log.info("-------------------------")
 
     # --- 4. Поиск Файлов ---
+    # Папки результатов и бекапа внутри входной (при обходе подпапок) не просматриваются
+    discovery_options['exclude_paths'] = (abs_output_path, abs_backup_path)
+    members: Dict[str, archive_input.ArchiveMember] = {}
+    if input_archive:
+        archive_options = {'include': discovery_options['include'], 'exclude': discovery_options['exclude']}
+        if streaming:
+            discovered = archive_input.iter_members(abs_input_path, input_archive, **archive_options); files = []
+        else:
+            try:
+                members = {m.rel_path: m for m in archive_input.list_members(abs_input_path, input_archive, **archive_options)}
+                files = list(members)
+                log.info(f"Found {len(files)} images in the archive.")
+                if input_archive == 'tar-stream' and files:
+                    log.info(f"  Compressed TAR members read into memory: {sum(m.size for m in members.values()) / (1024 * 1024):.1f} MB "
+                             "(streaming discovery reads them as processing goes).")
+            except Exception as e: log.error(f"Error reading input archive {abs_input_path}: {e}"); return None
+    elif streaming:
+        # Файлы перебираются по мере чтения папки, фильтры шагов 4.1-4.2 применяются к каждому (см. _stream_individual_jobs)
+        discovered = file_discovery.iter_image_files(abs_input_path, **discovery_options); files = []
+    else:
+        try:
+            files = [f.rel_path for f in file_discovery.discover_image_files(abs_input_path, **discovery_options)]
+            log.info(f"Found {len(files)} files to process.")
+        except Exception as e: log.error(f"Error reading input directory {abs_input_path}: {e}"); return None
+
+    # --- 4.1. Инкрементальный режим: пропуск файлов, не изменившихся с прошлого запуска ---
+    # Отпечатки по шагам конвейера: последний - для готового результата, STAGE_PREFIX_END - для промежуточного
+    stage_fingerprints = config_manager.get_stage_fingerprints(all_settings)
+    settings_fingerprint = stage_fingerprints[config_manager.PIPELINE_STAGES[-1]]
+    prefix_fingerprint = stage_fingerprints[config_manager.STAGE_PREFIX_END]
+    manifest = None; unchanged_files: List[str] = []; check_unchanged = False
+    if skip_unchanged:
+        manifest = run_manifest.load_manifest(abs_output_path)
+        if manifest.get('settings_fingerprint') != settings_fingerprint:
+            # Старые записи остаются: по ним удаляются устаревшие результаты после обработки
+            if manifest['entries']:
+                changed_stage = config_manager.first_changed_stage(manifest.get('stage_fingerprints'), stage_fingerprints)
+                prefix_reusable = stages_cache and changed_stage and \
+                    config_manager.PIPELINE_STAGES.index(changed_stage) > config_manager.PIPELINE_STAGES.index(config_manager.STAGE_PREFIX_END)
+                log.info(f"Settings changed since the last run (from step '{changed_stage}'): all files will be processed." +
+                         (" Steps up to background crop are reused from the stage cache." if prefix_reusable else ""))
+        elif streaming: check_unchanged = True
+        else:
+            unchanged_files = [f for f in files if run_manifest.is_unchanged(manifest['entries'].get(f), os.path.join(abs_input_path, f), abs_output_path, manifest_hash)]
+            unchanged_set = set(unchanged_files)
+            files = [f for f in files if f not in unchanged_set]
+        if not streaming: log.info(f"Unchanged since the last run (skipped): {len(unchanged_files)}. To process: {len(files)}.")
+
+    # --- 4.2. Журнал запуска: откат незавершенного переименования и продолжение ---
+    journal = None; resumed_results: List[Dict[str, Any]] = []; resumed_set = set()
+    if enable_journal:
+        journal_header = {'input': abs_input_path, 'output_ext': f".{output_format}",
+                          'settings_fingerprint': settings_fingerprint}
+        previous = run_journal.read_journal(abs_output_path)
+        carried_records = []
+        if run_journal.is_interrupted(previous):
+            log.warning("The previous run in this output folder did not finish.")
+            if previous['renames']:
+                restored, rollback_errors = run_journal.rollback_renames(abs_output_path, previous['renames'])
+                log.info(f"  Pending renames rolled back: {restored}. Errors: {rollback_errors}.")
+            same_run = all(previous['header'].get(k) == v for k, v in journal_header.items())
+            if resume_interrupted and same_run:
+                for f, record in previous['files'].items():
+                    if record['status'] != 'processed' or not record.get('output'): continue
+                    # Результат мог быть переименован завершенным проходом (остановленный запуск)
+                    if record['output'] in previous['renamed']: record = dict(record, output=previous['renamed'][record['output']])
+                    output_file_path = os.path.join(abs_output_path, record['output'])
+                    if not os.path.isfile(output_file_path): continue
+                    carried_records.append(record)
+                    resumed_results.append({'index': -1, 'file': f, 'source_path': os.path.join(abs_input_path, f),
+                                            'status': 'processed', 'output_path': output_file_path, 'elapsed': 0.0,
+                                            'megapixels': 0.0, 'fast': False, 'resumed': True})
+                resumed_set = {r['file'] for r in resumed_results}
+                files = [f for f in files if f not in resumed_set]
+                log.info(f"Resuming: {len(resumed_results)} file(s) already processed" + ("." if streaming else f", {len(files)} left."))
+            elif resume_interrupted: log.warning("Cannot resume: settings or input folder changed. All files will be processed.")
+            else: log.info("Resume disabled: all files will be processed again.")
+    if not streaming and not files and not unchanged_files and not resumed_results: return None
+
+    # --- 4.3. Дубликаты: одинаковые по содержимому файлы обрабатываются один раз ---
+    duplicates: Dict[str, List[str]] = {}
+    if detect_duplicates and streaming:
+        log.warning("Duplicate detection needs the full file list: disabled in streaming discovery mode.")
+    elif detect_duplicates and len(files) > 1:
+        found = file_hashing.find_duplicates([os.path.join(abs_input_path, f) for f in files])
+        duplicates = {os.path.relpath(first, abs_input_path): [os.path.relpath(p, abs_input_path) for p in others] for first, others in found.items()}
+        duplicate_set = {f for others in duplicates.values() for f in others}
+        files = [f for f in files if f not in duplicate_set]
+        log.info(f"Duplicate inputs (processed once): {len(duplicate_set)} in {len(duplicates)} group(s). To process: {len(files)}.")
+    if enable_journal:
+        journal = run_journal.RunJournal(abs_output_path)
+        if not journal.start(journal_header, carried_records): journal = None
+
+    # --- 4.4. Итоговые имена по артикулу - до обработки (результаты сразу пишутся под ними) ---
+    output_names: Dict[str, str] = {}
+    if output_archive_path and enable_renaming:
+        # Архив пишется заново: имена по артикулу не пересекаются с прежними результатами
+        output_names = allocate_output_names({f: os.path.splitext(_flat_name(f))[0] for f in files}, article_name, f".{output_format}", set())
+        log.info(f"Archive member names allocated up front: {len(output_names)}.")
+    elif allocate_names and article_name and str(article_name).strip():
+        if streaming: log.info("Output names cannot be allocated up front in streaming discovery mode: renaming after processing.")
+        else:
+            output_names = _allocate_run_output_names(files + [d for others in duplicates.values() for d in others], article_name,
+                                                      f".{output_format}", abs_output_path, manifest)
+            if output_names is None: output_names = {}
+            else: log.info(f"Output names allocated up front: {len(output_names)}.")
+
+    # Параметры конвейера, передаваемые обработчикам (только сериализуемые значения и план шагов)
+    params = {
+        'abs_output_path': abs_output_path,
+        'output_format': output_format, 'output_ext': f".{output_format}",
+        'jpeg_quality': jpeg_quality,
+        'plan': plan,
+        'result_cache': {'cache_dir': results_cache.cache_dir, 'max_bytes': results_cache.max_bytes,
+                         'fingerprint': settings_fingerprint} if results_cache else None,
+        'stage_cache': {'cache_dir': stages_cache.cache_dir, 'max_bytes': stages_cache.max_bytes,
+                        'fingerprint': prefix_fingerprint} if stages_cache else None,
+        'prefix_fingerprint': prefix_fingerprint,
+        'durability': durability['mode'],
+        'output_archive': output_archive_path,
+        'mmap_input': mmap_input,
+    }
+    if streaming:
+        file_filter = {'manifest': manifest if check_unchanged else None, 'manifest_hash': manifest_hash,
+                       'unchanged_files': unchanged_files, 'resumed': resumed_set, 'backup': backup_writer}
+        jobs = _stream_individual_jobs(discovered, abs_input_path, abs_output_path, file_filter)
+    else:
+        total_files = len(files)
+        jobs = [{'index': i, 'total': total_files, 'file': f, 'source_path': os.path.join(abs_input_path, f),
+                 'output_name': output_names.get(f)} for i, f in enumerate(files)]
+        for job in jobs:
+            if job['file'] in members: job['member'] = members[job['file']]
+
+    return {
+        'params': params, 'jobs': jobs,
+        'abs_input_path': abs_input_path, 'abs_output_path': abs_output_path,
+        'article_name': article_name, 'delete_originals': delete_originals,
+        'effective_delete_originals': effective_delete_originals,
+        'num_workers': num_workers, 'lpt_scheduling': lpt_scheduling,
+        'manifest': manifest, 'settings_fingerprint': settings_fingerprint, 'stage_fingerprints': stage_fingerprints,
+        'manifest_hash': manifest_hash, 'unchanged_files': unchanged_files,
+        'journal': journal, 'resumed_results': resumed_results, 'duplicates': duplicates,
+        'streaming': streaming, 'backup': backup_writer, 'output_names': output_names, 'input_archive': input_archive,
+        # С архивом результатов сбрасывается на диск только сам архив (при закрытии)
+        'durability': durable_io.DurabilityBatch(durability['batch_size']) if durability['mode'] == 'batch' and not output_archive_path else None,
+        'archive_writer': archive_output.ArchiveWriter(output_archive_path, durability['mode'] != 'none') if output_archive_path else None,
+        'readahead': mapped_input.ReadAhead(readahead_files) if readahead_files else None,
+        'backup_retention': (int(backup_settings.get('keep_runs', 0) or 0), float(backup_settings.get('keep_days', 0) or 0)),
+    }
+
+
+def allocate_output_names(basenames: Dict[str, str], article_name: str, output_ext: str,
+                          occupied: Optional[set] = None) -> Dict[str, str]:
+    """
+    Распределяет итоговые имена по артикулу. basenames - {ключ: исходное имя
+    без расширения}, результат - {ключ: имя файла}. Порядок - естественный
+    (natsort) по исходным именам. Имя '<артикул><ext>' получает файл, исходное
+    имя которого совпадает с артикулом (без учета регистра), а если такого
+    нет - первый файл; остальные - '<артикул>_N<ext>' по возрастанию N.
+    Имена из occupied (os.path.normcase) пропускаются.
+    """
+    occupied = set(occupied or ())
+    ordered = natsorted(basenames, key=lambda k: (basenames[k], k))
+    exact = next((k for k in ordered if basenames[k].lower() == str(article_name).lower()), None)
+    base_owner = exact if exact is not None else (ordered[0] if ordered else None)
+    names = {}; counter = 1
+    for key in ordered:
+        target = f"{article_name}{output_ext}"
+        if key != base_owner or os.path.normcase(target) in occupied:
+            if key == base_owner: log.warning(f"    ! Conflict: Base name '{target}' exists/occupied. Numbering.")
+            while os.path.normcase(f"{article_name}_{counter}{output_ext}") in occupied: counter += 1
+            target = f"{article_name}_{counter}{output_ext}"; counter += 1
+        occupied.add(os.path.normcase(target)); names[key] = target
+    return names
+
+
+def _allocate_run_output_names(files: List[str], article_name: str, output_ext: str, abs_output_path: str,
+                               manifest: Optional[Dict[str, Any]]) -> Optional[Dict[str, str]]:
+    """
+    (Helper) Итоговые имена для файлов запуска {файл: имя результата} по одному
+    списку папки результатов. Имена прошлых результатов этих же файлов (по
+    манифесту) считаются свободными: они заменяются новыми результатами.
+    None - папку прочитать не удалось (переименование после обработки).
+    """
+    try: occupied = {os.path.normcase(name) for name in os.listdir(abs_output_path)}
+    except OSError as e: log.error(f"Could not list output folder for name allocation: {e}"); return None
+    if manifest:
+        for f in files:
+            previous_output = (manifest['entries'].get(f) or {}).get('output')
+            if previous_output: occupied.discard(os.path.normcase(previous_output))
+    return allocate_output_names({f: os.path.splitext(_flat_name(f))[0] for f in files}, article_name, output_ext, occupied)
+
+
+def _stream_individual_jobs(discovered, abs_input_path: str, abs_output_path: str,
+                            file_filter: Dict[str, Any]):
+    """
+    (Helper) Задания потокового режима: по одному на найденный файл, сразу по
+    мере чтения папки (без полного списка и сортировки). Неизмененные с
+    прошлого запуска файлы дописываются в file_filter['unchanged_files'],
+    готовые до сбоя (file_filter['resumed']) пропускаются, остальные сразу
+    ставятся в очередь фонового бекапа (file_filter['backup']). Число файлов
+    заранее неизвестно: job['total'] = None, index - порядок обнаружения.
+    """
+    manifest = file_filter['manifest']; resumed = file_filter['resumed']
+    index = 0
     try:
-        all_entries = os.listdir(abs_input_path)
-        SUPPORTED_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tiff', '.webp', '.tif')
-        files_unsorted = [f for f in all_entries if os.path.isfile(os.path.join(abs_input_path, f)) and not f.startswith(("__temp_", ".")) and f.lower().endswith(SUPPORTED_EXTENSIONS)]
-        files = natsorted(files_unsorted)
-        log.info(f"Found {len(files)} files to process.")
-        if not files: return
-    except Exception as e: log.error(f"Error reading input directory {abs_input_path}: {e}"); return
-
-    # --- 5. Инициализация для Цикла ---
-    processed_files_count = 0; skipped_files_count = 0; error_files_count = 0
-    source_files_to_potentially_delete = []
-    processed_output_file_map = {} # {final_output_path: original_basename}
-    output_ext = f".{output_format}"
-
-    # --- 6. Основной Цикл Обработки ---
-    total_files = len(files)
-    for file_index, file in enumerate(files):
-        source_file_path = os.path.join(abs_input_path, file)
-        log.info(f"--- [{file_index + 1}/{total_files}] Processing: {file} ---")
-        img_current = None
-        original_basename = os.path.splitext(file)[0]
-        success_flag = False # Успех для текущего файла
+        for found in discovered:
+            f = found.rel_path
+            if f in resumed: continue
+            if manifest is not None and run_manifest.is_unchanged(manifest['entries'].get(f), found.path, abs_output_path, file_filter['manifest_hash']):
+                file_filter['unchanged_files'].append(f); continue
+            if file_filter['backup'] is not None: file_filter['backup'].submit(found.path, _flat_name(f))
+            job = {'index': index, 'total': None, 'file': f, 'source_path': found.path}
+            if isinstance(found, archive_input.ArchiveMember): job['member'] = found
+            yield job
+            index += 1
+    except OSError as e:
+        log.error(f"Error reading input directory {abs_input_path}: {e}. Discovery stopped.")
+
+
+def _effective_worker_count(run: Dict[str, Any], executor: Optional[Executor]) -> int:
+    """(Helper) Число обработчиков запуска: размер переданного пула или из настроек."""
+    if executor is not None: return worker_pool.get_executor_workers(executor, run['num_workers'])
+    return run['num_workers']
+
+
+def _plan_individual_dispatch(run: Dict[str, Any], num_workers: int) -> Tuple[List[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """(Helper) Порядок отправки заданий в пул: по расписанию LPT или исходный."""
+    jobs = run['jobs']
+    if not run['lpt_scheduling']: return jobs, None
+    if run.get('streaming'): log.info("LPT scheduling needs the full file list: skipped in streaming discovery mode."); return jobs, None
+    if run.get('input_archive'): log.info("LPT scheduling skipped for archive input: member headers are not probed."); return jobs, None
+    for job in jobs: job['megapixels'] = batch_scheduler.probe_megapixels(job['source_path'])
+    schedule = batch_scheduler.build_lpt_schedule([job['megapixels'] for job in jobs], num_workers)
+    batch_scheduler.log_schedule(schedule, [job['file'] for job in jobs])
+    return [jobs[i] for i in schedule['order']], schedule
+
+
+def _failed_job_result(job: Dict[str, Any], error: BaseException) -> Dict[str, Any]:
+    """(Helper) Результат задания, обработчик которого завершился исключением."""
+    log.critical(f"!!! Worker failed for {job['file']}: {error}", exc_info=error)
+    return {'index': job['index'], 'file': job['file'], 'source_path': job['source_path'],
+            'status': 'error', 'output_path': None, 'elapsed': 0.0, 'megapixels': job.get('megapixels', 0.0),
+            'fast': bool(job.get('fast', False))}
+
+
+class JobDispatcher:
+    """
+    Выдает задания в пул окном ограниченного размера.
+    Перед выдачей каждого задания проверяет RunControl: после отмены или
+    истечения срока новые задания не выдаются (начатые дорабатывают), а при
+    нехватке времени задание помечается быстрым профилем (job['fast']).
+    jobs - список или итератор (потоковый поиск): из итератора задания
+    берутся по одному по мере освобождения окна.
+    readahead (mapped_input.ReadAhead) - после каждой выдачи ядру
+    подсказываются файлы следующих readahead.depth заданий очереди.
+    """
 
-        try:
-            # 6.1. Бекап
-            if backup_enabled:
-                try: shutil.copy2(source_file_path, os.path.join(abs_backup_path, file)); log.debug("  > Backup created.")
-                except Exception as backup_err: log.error(f"  ! Backup failed for {file}: {backup_err}")
+    def __init__(self, jobs, window: int, control: Optional[run_control.RunControl] = None,
+                 readahead: Optional[mapped_input.ReadAhead] = None):
+        self._queue = deque(jobs) if isinstance(jobs, list) else deque()
+        self._stream = None if isinstance(jobs, list) else iter(jobs)
+        self.window = max(1, window)
+        self.control = control
+        self.readahead = readahead
+        self.in_flight = 0
+        self.done = 0
+
+    def take(self) -> List[Dict[str, Any]]:
+        """Задания, которые можно отправить сейчас (пусто - больше отправлять нечего)."""
+        batch = []
+        while self.in_flight < self.window:
+            if not self._queue and self._stream is not None:
+                job = next(self._stream, None)
+                if job is None: self._stream = None
+                else: self._queue.append(job)
+            if not self._queue: break
+            if self.control is not None and self.control.should_stop(): break
+            job = self._queue.popleft()
+            # При потоковом поиске остаток неизвестен: прогноз по уже найденным файлам
+            if self.control is not None and self.control.use_fast_profile(self.done, len(self._queue) + self.in_flight + 1):
+                job['fast'] = True
+            self.in_flight += 1
+            batch.append(job)
+        if batch and self.readahead is not None:
+            # Члены архива читаются из архива, а не по source_path
+            self.readahead.hint(job['source_path'] for job in islice(self._queue, self.readahead.depth) if job.get('member') is None)
+        return batch
+
+    def complete(self):
+        self.in_flight -= 1; self.done += 1
+
+    def cancel_remaining(self, started: Iterable[Dict[str, Any]] = ()) -> List[Dict[str, Any]]:
+        """
+        Результаты со статусом 'cancelled' для заданий, которые так и не были
+        отправлены, и для выданных, но не начатых в пуле (started - их отмена
+        удалась). Потоковый поиск при остановке не продолжается: ненайденные
+        файлы в итог не попадают.
+        """
+        started = list(started)
+        self.in_flight -= len(started)
+        cancelled = [{'index': job['index'], 'file': job['file'], 'source_path': job['source_path'],
+                      'status': 'cancelled', 'output_path': None, 'elapsed': 0.0,
+                      'megapixels': job.get('megapixels', 0.0), 'fast': False} for job in [*started, *self._queue]]
+        self._queue.clear(); self._stream = None
+        if cancelled:
+            reason = self.control.stop_reason if self.control is not None else None
+            log.warning(f"Run stopped ({reason or 'cancelled'}): {len(cancelled)} file(s) not started.")
+        return cancelled
+
+
+def _start_backups(run: Dict[str, Any]):
+    """(Helper) Ставит исходники заданий в очередь фонового бекапа (в потоковом режиме - по мере поиска)."""
+    writer = run.get('backup')
+    if writer is None or run.get('streaming'): return
+    for job in run['jobs']: writer.submit(job['source_path'], _flat_name(job['file']))
+
+
+def _journal_result(run: Dict[str, Any], result: Dict[str, Any]):
+    """
+    (Helper) Фиксирует завершенный файл в журнале запуска (если он ведется)
+    и в пачке сброса на диск (режим durability 'batch'). При записи в архив
+    результатов байты результата (result['output_data']) дописываются в архив;
+    если записать не удалось, файл считается ошибочным.
+    """
+    if run.get('archive_writer') is not None:
+        output_data = result.pop('output_data', None)
+        if result['status'] == 'processed' and not (output_data and run['archive_writer'].add(os.path.basename(result['output_path']), output_data)):
+            result.update(status='error', output_path=None)
+    if run.get('durability') is not None and result['status'] == 'processed': run['durability'].add(result.get('output_path'))
+    if run.get('journal'): run['journal'].record_file(result)
 
-            # 6.2. Открытие
-            try:
-                with Image.open(source_file_path) as img_opened:
-                    img_opened.load()
-                    img_current = img_opened.copy()
-                    log.debug(f"  > Opened. Orig size: {img_current.size}, Mode: {img_current.mode}")
-            except UnidentifiedImageError: log.error(f"  ! Cannot identify image: {file}"); skipped_files_count += 1; continue
-            except FileNotFoundError: log.error(f"  ! File not found during open: {file}"); skipped_files_count += 1; continue
-            except Exception as open_err: log.error(f"  ! Error opening {file}: {open_err}", exc_info=True); error_files_count += 1; continue
-            if not img_current or img_current.size[0] <= 0 or img_current.size[1] <= 0:
-                log.error(f"  ! Image empty/zero size after open: {file}"); error_files_count += 1; image_utils.safe_close(img_current); continue
-
-            # --- Конвейер Обработки ---
-            step_counter = 1
-            log.debug(f"  Step {step_counter}: Pre-resize")
-            if enable_preresize: img_current = _apply_preresize(img_current, preresize_width, preresize_height)
-            if not img_current: raise ValueError("Image became None after pre-resize.")
-            step_counter += 1
-
-            log.debug(f"  Step {step_counter}: Whitening")
-            if enable_whitening:
-                 img_original = img_current
-                 img_current = image_utils.whiten_image_by_darkest_perimeter(img_current, whitening_cancel_threshold)
-                 if img_current is not img_original: log.debug("    Whitening applied.")
-            if not img_current: raise ValueError("Image became None after whitening.")
-            step_counter += 1
-
-            # Периметр (проверяем, только если включены поля и задан маржин)
-            perimeter_is_white = False # Важно инициализировать
-            if enable_padding and perimeter_margin > 0:
-                 log.debug(f"  Step {step_counter}.{1}: Perimeter check (Margin: {perimeter_margin}px)")
-                 current_perimeter_tolerance = white_tolerance if enable_bg_crop and white_tolerance is not None else 0
-                 perimeter_is_white = image_utils.check_perimeter_is_white(img_current, current_perimeter_tolerance, perimeter_margin)
-            # Если padding выключен или margin=0, проверка периметра не выполняется и perimeter_is_white остается False
-            step_counter += 1 
-
-            pre_crop_width, pre_crop_height = img_current.size
-
-            log.debug(f"  Step {step_counter}: BG Removal / Crop (Enabled: {enable_bg_crop})")
-            cropped_image_dimensions = img_current.size # Запомним размер ДО
-            if enable_bg_crop:
-                img_original = img_current
-                img_current = image_utils.remove_white_background(img_current, white_tolerance)
-                if not img_current: raise ValueError("Image became None after background removal.")
-                if img_current is not img_original: log.debug("    Background removed/converted.")
-
-                img_original = img_current # Обновляем для сравнения после обрезки
-                img_current = image_utils.crop_image(img_current, crop_symmetric_axes, crop_symmetric_absolute)
-                if not img_current: raise ValueError("Image became None after cropping.")
-                if img_current is not img_original: log.debug("    Cropping applied.")
-                cropped_image_dimensions = img_current.size # Обновляем размер ПОСЛЕ обрезки
-            step_counter += 1
-
-            log.debug(f"  Step {step_counter}: Padding (Mode: {enable_padding})")
-            apply_padding = False # По умолчанию не добавляем
-            
-            if enable_padding:
-                if perimeter_margin > 0:
-                    if not perimeter_is_white:
-                        current_w, current_h = cropped_image_dimensions
-                        if current_w > 0 and current_h > 0 and padding_percent > 0:
-                            padding_pixels = int(round(max(current_w, current_h) * (padding_percent / 100.0)))
-                            if padding_pixels > 0:
-                                potential_padded_w = current_w + 2 * padding_pixels
-                                potential_padded_h = current_h + 2 * padding_pixels
-                                size_check_passed = (potential_padded_w <= pre_crop_width and potential_padded_h <= pre_crop_height)
-                                
-                                if allow_expansion or size_check_passed:
-                                    apply_padding = True # Все проверки пройдены
-                                    log.info("    Padding will be applied (mode condition met, size conditions met).")
-                                else:
-                                    log.info("    Padding skipped: Size check failed & expansion disabled.")
-                            else:
-                                log.info("    Padding skipped: Calculated padding is zero pixels.")
-                        else:
-                            log.info("    Padding skipped: Cropped image has zero size.")
-                    else: # perimeter_margin > 0 AND perimeter_is_white is True
-                        log.info("    Padding skipped: Perimeter margin is set, and perimeter is already white.")
-                else: # perimeter_margin <= 0
-                    log.info("    Padding skipped: Perimeter margin is not set (> 0), padding only applied if perimeter is NOT white.")
-            else: # enable_padding is False
-                log.debug("    Padding step skipped: 'enable_padding' is False.")
-
-            # Вызываем функцию добавления полей, только если флаг установлен
-            if apply_padding:
-                img_original = img_current
-                img_current = image_utils.add_padding(img_current, padding_percent)
-                if not img_current: raise ValueError("Image became None after padding.")
-                if img_current is not img_original: log.info(f"    Padding applied successfully. New size: {img_current.size}")
-            step_counter += 1
-
-            log.debug(f"  Step {step_counter}: Brightness/Contrast")
-            if enable_bc:
-                log.debug("  Calling apply_brightness_contrast...") # Доп. лог
-                img_current = image_utils.apply_brightness_contrast(
-                    img_current, 
-                    brightness_factor=bc_settings.get('brightness_factor', 1.0),
-                    contrast_factor=bc_settings.get('contrast_factor', 1.0)
-                )
-                if not img_current: 
-                    log.warning(f"  Skipping file after brightness/contrast failed (returned None).")
-                    continue
-                log.info(f"    Brightness/Contrast applied. New size: {img_current.size}") # Доп. лог
-
-            log.debug(f"  Step {step_counter}: Force Aspect Ratio")
-            if ind_settings.get('enable_force_aspect_ratio'): # Проверяем флаг
-                aspect_ratio_ind = ind_settings.get('force_aspect_ratio')
-                if aspect_ratio_ind:
-                    # Вызов ТОЛЬКО если флаг True и значение есть
-                    img_current = _apply_force_aspect_ratio(img_current, aspect_ratio_ind)
-                    if not img_current: log.warning(f"  Skipping file after force aspect ratio failed."); continue
-                    log.info(f"    Force Aspect Ratio applied. New size: {img_current.size}")
-                else:
-                    log.warning("  Force aspect ratio enabled but ratio value is missing/invalid.")
-            step_counter += 1
-
-            log.debug(f"  Step {step_counter}: Max Dimensions")
-            if ind_settings.get('enable_max_dimensions'): # Проверяем флаг
-                img_current = _apply_max_dimensions(img_current, max_output_width, max_output_height)
-                if not img_current: raise ValueError("Image became None after max dimensions.")
-            step_counter += 1
-
-            log.debug(f"  Step {step_counter}: Final Canvas / Prepare")
-            # --- Логика точного холста / подготовки --- 
-            canvas_applied = False
-            img_before_prepare = img_current # Сохраняем ссылку для лога
-            log.debug(f"    Image before final step: {repr(img_before_prepare)}") 
-            
-            if ind_settings.get('enable_exact_canvas'): # Проверяем флаг точного холста
-                exact_w = ind_settings.get('final_exact_width', 0)
-                exact_h = ind_settings.get('final_exact_height', 0)
-                if exact_w > 0 and exact_h > 0:
-                    img_processed = _apply_final_canvas_or_prepare(
-                        img_current, exact_w, exact_h, output_format, valid_jpg_bg
-                    )
-                    if not img_processed: log.warning(f"  Skipping file after exact canvas failed."); continue
-                    log.info(f"    Exact Canvas applied. New size: {img_processed.size}")
-                    img_current = None 
-                    canvas_applied = True
-                else:
-                    log.warning("  Exact canvas enabled but width/height are zero.")
-            
-            if not canvas_applied:
-                log.debug("  Applying prepare mode (no exact canvas applied).")
-                img_processed = _apply_final_canvas_or_prepare(
-                    img_current, 0, 0, output_format, valid_jpg_bg
-                )
-                if not img_processed: log.warning(f"  Skipping file after prepare mode failed."); continue
-                img_current = None
-                
-            log.debug(f"    Image after final step: {repr(img_processed)}") # Логируем результат
-            step_counter += 1
-            # ----------------------------------------
-
-            # 6.3. Сохранение
-            log.debug(f"  Step {step_counter}: Saving")
-            temp_output_filename = f"{original_basename}{output_ext}"
-            final_output_path = os.path.join(abs_output_path, temp_output_filename)
-            # === ПЕРЕДАЕМ img_processed В СОХРАНЕНИЕ ===
-            save_successful = _save_image(img_processed, final_output_path, output_format, jpeg_quality)
-            
-            # Закрываем img_processed после сохранения
-            image_utils.safe_close(img_processed)
-
-            if save_successful:
-                processed_files_count += 1
-                success_flag = True
-                processed_output_file_map[final_output_path] = original_basename
-                if os.path.exists(source_file_path) and source_file_path not in source_files_to_potentially_delete:
-                     source_files_to_potentially_delete.append(source_file_path)
-            else:
-                error_files_count += 1
-                log.error(f"Failed to save processed file: {file}")
-
-        # --- Обработка Ошибок для Файла ---
-        except MemoryError as e:
-             log.critical(f"!!! MEMORY ERROR processing {file}: {e}. Attempting GC.", exc_info=True)
-             error_files_count += 1; gc.collect(); success_flag = False
-        except ValueError as e: # Ловим наши ошибки None
-             log.error(f"!!! PROCESSING error for {file}: {e}", exc_info=False) # Не нужен полный трейсбек
-             error_files_count += 1; success_flag = False
-        except Exception as e:
-             log.critical(f"!!! UNEXPECTED error processing {file}: {e}", exc_info=True)
-             error_files_count += 1; success_flag = False
-        finally:
-            image_utils.safe_close(img_current) # Закрываем в любом случае
-            if not success_flag and source_file_path in source_files_to_potentially_delete:
-                 try: source_files_to_potentially_delete.remove(source_file_path); log.warning(f"  Removed {os.path.basename(source_file_path)} from deletion list due to error.")
-                 except ValueError: pass
-            log.info(f"--- Finished processing: {file} {'(Success)' if success_flag else '(Failed)'} ---")
+
+def plan_individual_execution(run: Dict[str, Any], executor: Optional[Executor] = None,
+                              control: Optional[run_control.RunControl] = None) -> Tuple[JobDispatcher, Optional[Dict[str, Any]], bool]:
+    """
+    Второй шаг запуска: ставит исходники в очередь фонового бекапа и решает,
+    как выполнять задания (общее для синхронного и асинхронного вариантов):
+    (выдача заданий, расписание LPT или None, нужен ли пул). Один файл или
+    один обработчик без переданного пула - последовательно. Задания
+    выполняются через process_individual_job, результаты фиксируются
+    complete_individual_job, итог - finalize_individual_run.
+    """
+    _start_backups(run)
+    num_workers = _effective_worker_count(run, executor)
+    if (not run.get('streaming') and len(run['jobs']) <= 1) or (executor is None and num_workers <= 1):
+        return JobDispatcher(run['jobs'], 1, control, run.get('readahead')), None, False
+    dispatch_jobs, schedule = _plan_individual_dispatch(run, num_workers)
+    # Окно в 2 задания на обработчик: пул не простаивает, а отмена срабатывает быстро
+    return JobDispatcher(dispatch_jobs, num_workers * 2, control, run.get('readahead')), schedule, True
+
+
+def process_individual_job(job: Dict[str, Any], params: Dict[str, Any]) -> Dict[str, Any]:
+    """(Worker) Обрабатывает одно задание запуска (job из run['jobs'] или выдачи, params - run['params'])."""
+    return _process_individual_file(job, params)
+
+
+def complete_individual_job(run: Dict[str, Any], job: Dict[str, Any], future, results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Результат завершенного в пуле задания (ошибка обработчика - статус
+    'error'): добавляется в results и фиксируется через _journal_result.
+    Выполняет файловый ввод-вывод (журнал, архив, сброс на диск).
+    """
+    try: result = future.result()
+    except Exception as e: result = _failed_job_result(job, e)
+    results.append(result); _journal_result(run, result)
+    log.info(f"  [{len(results)}/{'?' if run.get('streaming') else len(run['jobs'])}] Completed: {result['file']} ({result['status']})")
+    return result
+
+
+def _execute_individual_jobs(run: Dict[str, Any], executor: Optional[Executor] = None,
+                             control: Optional[run_control.RunControl] = None,
+                             worker=None) -> Tuple[List[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """
+    (Helper) Выполняет задания запуска последовательно или в пуле обработчиков
+    (переданном executor или временном пуле процессов).
+    При нескольких обработчиках задания отправляются по расписанию LPT
+    (сначала самые большие по заголовку файлы). Результаты возвращаются
+    в исходном (natsort) порядке вместе с расписанием (или None).
+    При отмене через control неотправленные задания получают статус 'cancelled'.
+    worker - функция обработки задания (по умолчанию _process_individual_file).
+    """
+    worker = worker or _process_individual_file
+    params = run['params']
+    dispatcher, schedule, parallel = plan_individual_execution(run, executor, control)
+    results = []
+    if not parallel:
+        for batch in iter(dispatcher.take, []):
+            results.append(worker(batch[0], params)); dispatcher.complete()
+            _journal_result(run, results[-1])
+        return results + dispatcher.cancel_remaining(), None
+
+    with worker_pool.borrow_executor(executor, _effective_worker_count(run, executor)) as pool:
+        future_to_job = {}
+        for job in dispatcher.take(): future_to_job[pool.submit(worker, job, params)] = job
+        while future_to_job:
+            done, _ = wait(future_to_job, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = future_to_job.pop(future); dispatcher.complete()
+                complete_individual_job(run, job, future, results)
+            for job in dispatcher.take(): future_to_job[pool.submit(worker, job, params)] = job
+    results.extend(dispatcher.cancel_remaining())
+    results.sort(key=lambda r: r['index'])
+    return results, schedule
+
+
+def abort_individual_run(run: Dict[str, Any]):
+    """
+    Завершает запуск, прерванный ошибкой, без удаления оригиналов и
+    переименования: недописанный архив результатов удаляется, фоновый бекап
+    дорабатывает, журнал закрывается (запуск остается прерванным - его можно продолжить).
+    """
+    if run.get('archive_writer') is not None: run['archive_writer'].abort()
+    if run.get('backup') is not None and not run.get('backup_shared'): run['backup'].wait() # Общий бекап ждет владелец
+    if run.get('journal'): run['journal'].close()
 
 
+def finalize_individual_run(run: Dict[str, Any], results: List[Dict[str, Any]], schedule: Optional[Dict[str, Any]],
+                            start_time: float, execution_time: float) -> Dict[str, Any]:
+    """
+    Последний шаг запуска: барьер бекапа, итоговая статистика, удаление
+    оригиналов и переименование по артикулу. results - результаты всех заданий
+    (неотправленные - со статусом 'cancelled'). Вызывается один раз за запуск.
+    """
+    abs_input_path = run['abs_input_path']; abs_output_path = run['abs_output_path']
+    article_name = run['article_name']; delete_originals = run['delete_originals']
+    effective_delete_originals = run['effective_delete_originals']
+    output_ext = run['params']['output_ext']
+    journal = run.get('journal')
+    resumed_results = run.get('resumed_results', [])
+    job_count = len(results) # Включая отмененные
+    if run.get('streaming'): results = natsorted(results, key=lambda r: r['file']) # Отчет и удаление - в natsort-порядке
+    results = resumed_results + results # Готовые до сбоя файлы участвуют в удалении и переименовании
+    duplicate_results = _materialize_duplicates(run, results)
+    results = results + duplicate_results
+    # Барьер фонового бекапа: до удаления оригиналов все копии должны быть готовы
+    backup_stats = None; backup_failed = set()
+    if run.get('backup') is not None and not run.get('backup_shared'): # Общий бекап завершает владелец
+        backup_stats = run['backup'].wait(); backup_failed = set(run['backup'].failed_sources())
+        if run['backup'].store is not None: _finish_backup_store(run, backup_stats)
+    # Результаты - на диск до удаления оригиналов
+    if run.get('durability') is not None: run['durability'].flush()
+    archive_stats = None; archive_ready = True
+    if run.get('archive_writer') is not None:
+        archive_ready = run['archive_writer'].close(); archive_stats = run['archive_writer'].stats()
+    total_files = job_count + len(resumed_results) + sum(len(d) for d in run.get('duplicates', {}).values())
+
+    processed_files_count = sum(1 for r in results if r['status'] == 'processed')
+    skipped_files_count = sum(1 for r in results if r['status'] == 'skipped')
+    error_files_count = sum(1 for r in results if r['status'] == 'error')
+    cancelled_files_count = sum(1 for r in results if r['status'] == 'cancelled')
+    fast_files_count = sum(1 for r in results if r['status'] == 'processed' and r.get('fast'))
+    unchanged_files_count = len(run.get('unchanged_files', []))
+    cache_hits = sum(1 for r in results if r.get('cache') == 'hit')
+    cache_misses = sum(1 for r in results if r.get('cache') == 'miss')
+    stage_hits = sum(1 for r in results if r.get('stage_cache') == 'hit')
+    stage_misses = sum(1 for r in results if r.get('stage_cache') == 'miss')
+    output_bytes = sum(r.get('output_bytes', 0) for r in results if r['status'] == 'processed')
+    encoded_count = sum(1 for r in results if r['status'] == 'processed' and r.get('output_bytes'))
+    # Сигнатуры исходников для манифеста снимаются до возможного удаления оригиналов
+    manifest_entries = {}
+    if run.get('manifest') is not None:
+        for r in results:
+            if r['status'] != 'processed': continue
+            entry = run_manifest.make_entry(r['source_path'], run['manifest_hash'], r.get('fast'))
+            if entry: manifest_entries[r['file']] = entry
+    final_output_names = {} # {original_basename: итоговое имя файла результата}
+    # Результаты уже в natsort-порядке исходных файлов
+    source_files_to_potentially_delete = [r['source_path'] for r in results if r['status'] == 'processed' and os.path.exists(r['source_path'])]
+    if not archive_ready and effective_delete_originals and source_files_to_potentially_delete:
+        log.warning("Output archive was not completed: originals are kept.")
+        source_files_to_potentially_delete = []
+    if backup_failed and effective_delete_originals:
+        log.warning(f"Originals without a backup are kept: {sum(1 for p in source_files_to_potentially_delete if p in backup_failed)}")
+        source_files_to_potentially_delete = [p for p in source_files_to_potentially_delete if p not in backup_failed]
+    processed_output_file_map = {r['output_path']: os.path.splitext(_flat_name(r['file']))[0] for r in results if r['status'] == 'processed'} # {final_output_path: original_basename}
+
     # --- 7. Финальные Действия (Статистика, Удаление, Переименование) ---
     log.info("\n" + "=" * 30)
     log.info("--- Final Summary ---")
     log.info(f"Successfully processed: {processed_files_count}")
     log.info(f"Skipped (unreadable/not found): {skipped_files_count}")
+    if resumed_results: log.info(f"Resumed (processed before interruption): {len(resumed_results)}")
+    if duplicate_results:
+        log.info(f"Duplicates (copied from a single result): {len(duplicate_results)}")
+        for r in duplicate_results: log.info(f"  {r['file']} = {r['duplicate_of']}")
+    if run.get('manifest') is not None: log.info(f"Skipped (unchanged since last run): {unchanged_files_count}")
+    if backup_stats:
+        log.info(f"Backups: {backup_stats['done']} ({', '.join(f'{m}: {n}' for m, n in backup_stats['methods'].items()) or 'none'}), "
+                 f"failed: {backup_stats['failed']}")
+    cache_stats = None
+    if run['params'].get('result_cache'):
+        cache_params = run['params']['result_cache']
+        cache_stats = result_cache.ResultCache(cache_params['cache_dir'], cache_params['max_bytes']).enforce_size_limit()
+        log.info(f"Result cache: {cache_hits} hit(s), {cache_misses} miss(es); "
+                 f"{cache_stats['entries']} entries, {cache_stats['total_bytes'] / (1024 * 1024):.1f} MB"
+                 + (f", evicted {cache_stats['evicted']} ({cache_stats['freed_bytes'] / (1024 * 1024):.1f} MB)" if cache_stats['evicted'] else ""))
+    stage_stats = None
+    if run['params'].get('stage_cache'):
+        stage_params = run['params']['stage_cache']
+        stage_stats = stage_cache.StageCache(stage_params['cache_dir'], stage_params['max_bytes']).enforce_size_limit()
+        log.info(f"Stage cache: {stage_hits} hit(s), {stage_misses} miss(es); "
+                 f"{stage_stats['entries']} entries, {stage_stats['total_bytes'] / (1024 * 1024):.1f} MB"
+                 + (f", evicted {stage_stats['evicted']} ({stage_stats['freed_bytes'] / (1024 * 1024):.1f} MB)" if stage_stats['evicted'] else ""))
     log.info(f"Errors during processing/saving: {error_files_count}")
     log.info(f"Total analyzed: {processed_files_count + skipped_files_count + error_files_count} / {total_files}")
+    if cancelled_files_count: log.warning(f"Not started ({run.get('stop_reason') or 'cancelled'}): {cancelled_files_count}")
+    if fast_files_count: log.info(f"Processed with fast profile (deadline pressure): {fast_files_count}")
+    if encoded_count: log.info(f"Encoded output: {output_bytes / (1024 * 1024):.1f} MB in {encoded_count} file(s)")
+    if run.get('readahead') is not None and run['readahead'].hinted: log.info(f"Read-ahead hints: {run['readahead'].hinted} file(s)")
+    if archive_stats and archive_ready:
+        log.info(f"Output archive: {archive_stats['path']} ({archive_stats['members']} file(s), "
+                 f"{archive_stats['archive_bytes'] / (1024 * 1024):.1f} MB)")
+    if not cancelled_files_count: batch_scheduler.log_makespan_report(schedule, results, execution_time)
     total_time = time.time() - start_time
     log.info(f"Total processing time: {total_time:.2f} seconds")
 
@@ -593,7 +1080,9 @@ def run_individual_processing(**all_settings: Dict[str, Any]):
         removed_count = 0; remove_errors = 0
         for file_to_remove in list(source_files_to_potentially_delete):
             try:
-                if os.path.exists(file_to_remove): os.remove(file_to_remove); removed_count += 1; log.debug(f"  Deleted: {os.path.basename(file_to_remove)}")
+                if os.path.exists(file_to_remove):
+                    os.remove(file_to_remove); removed_count += 1; log.debug(f"  Deleted: {os.path.basename(file_to_remove)}")
+                    if journal: journal.record_delete(file_to_remove)
                 else: log.warning(f"  File to delete not found: {os.path.basename(file_to_remove)}")
             except Exception as remove_error: log.error(f"  Error deleting {os.path.basename(file_to_remove)}: {remove_error}"); remove_errors += 1
         log.info(f"  -> Successfully deleted: {removed_count}. Deletion errors: {remove_errors}.")
@@ -601,9 +1090,15 @@ def run_individual_processing(**all_settings: Dict[str, Any]):
     elif delete_originals: log.info("\n--- Deletion of originals skipped (check paths or successful processing). ---")
     else: log.info("\n--- Deletion of originals disabled. ---")
 
+    if run.get('manifest') is not None: _remove_superseded_outputs(run, results)
+
     # 7.2. Переименование
     enable_renaming_actual = bool(article_name and str(article_name).strip())
-    if enable_renaming_actual and processed_output_file_map:
+    if enable_renaming_actual and run.get('output_names'):
+        # Результаты уже записаны под итоговыми именами; имена файлов с ошибкой остаются незанятыми
+        unused_names = sum(1 for r in results if r['status'] != 'processed' and r['file'] in run['output_names'])
+        log.info(f"\n--- Renaming not needed: names allocated before processing. Unused (failed/cancelled files): {unused_names}. ---")
+    elif enable_renaming_actual and processed_output_file_map:
         log.info(f"\n--- Renaming {len(processed_output_file_map)} files in '{abs_output_path}' using article '{article_name}' ---")
         files_to_rename = list(processed_output_file_map.items()) # [(path, orig_basename), ...]
         if not files_to_rename: log.info("  No files available for renaming stage.")
@@ -612,9 +1107,13 @@ def run_individual_processing(**all_settings: Dict[str, Any]):
             try: sorted_files_for_rename = natsorted(files_to_rename, key=lambda item: item[1])
             except Exception as sort_err: log.error(f"! Error sorting for renaming: {sort_err}"); sorted_files_for_rename = files_to_rename
             temp_rename_map = {}; rename_step1_errors = 0; temp_prefix = f"__temp_{os.getpid()}_"; log.info("  Step 1: Renaming to temporary names...")
+            if journal: journal.begin_renames()
             for i, (current_path, original_basename) in enumerate(sorted_files_for_rename):
                 temp_filename = f"{temp_prefix}{i}_{original_basename}{output_ext}"; temp_path = os.path.join(abs_output_path, temp_filename)
-                try: log.debug(f"    '{os.path.basename(current_path)}' -> '{temp_filename}'"); os.rename(current_path, temp_path); temp_rename_map[temp_path] = original_basename
+                try:
+                    log.debug(f"    '{os.path.basename(current_path)}' -> '{temp_filename}'")
+                    if journal: journal.record_rename(current_path, temp_path)
+                    os.rename(current_path, temp_path); temp_rename_map[temp_path] = original_basename
                 except Exception as rename_error: log.error(f"  ! Temp rename error for '{os.path.basename(current_path)}': {rename_error}"); rename_step1_errors += 1
             if rename_step1_errors > 0: log.warning(f"  ! Temp renaming errors: {rename_step1_errors}")
             log.info("  Step 2: Renaming to final names...")
@@ -645,9 +1144,13 @@ def run_individual_processing(**all_settings: Dict[str, Any]):
                             if norm_target_path not in occupied_final_names and not (os.path.exists(target_path) and os.path.normcase(temp_path) != norm_target_path): break
                             numeric_counter += 1
                         numeric_counter += 1
-                    try: log.debug(f"    '{os.path.basename(temp_path)}' -> '{target_filename}'"); os.rename(temp_path, target_path); renamed_final_count += 1; occupied_final_names.add(os.path.normcase(target_path))
+                    try:
+                        log.debug(f"    '{os.path.basename(temp_path)}' -> '{target_filename}'")
+                        if journal: journal.record_rename(temp_path, target_path)
+                        os.rename(temp_path, target_path); renamed_final_count += 1; occupied_final_names.add(os.path.normcase(target_path)); final_output_names[original_basename] = target_filename
                     except Exception as rename_error: log.error(f"    ! Final renaming error '{os.path.basename(temp_path)}' -> '{target_filename}': {rename_error}"); rename_step2_errors += 1
             log.info(f"  -> Files renamed: {renamed_final_count}. Step 2 errors: {rename_step2_errors}.")
+            if journal: journal.end_renames()
             try:
                 remaining_temp = [f for f in os.listdir(abs_output_path) if f.startswith(temp_prefix) and os.path.isfile(os.path.join(abs_output_path, f))]
                 if remaining_temp: log.warning(f"  ! Temp files might remain: {remaining_temp}")
@@ -655,98 +1158,658 @@ def run_individual_processing(**all_settings: Dict[str, Any]):
     elif enable_renaming_actual: log.info("\n--- Renaming skipped: No files successfully processed. ---")
     else: log.info("\n--- Renaming disabled. ---")
 
+    if run.get('manifest') is not None: _save_run_manifest(run, results, manifest_entries, final_output_names)
+    if run['params'].get('durability', 'none') != 'none': durable_io.fsync_dir(abs_output_path) # Переименования и удаления
+    if journal: journal.finish(complete=not cancelled_files_count, stop_reason=run.get('stop_reason'))
+
     log.info("=" * 30)
     log.info("--- Individual File Processing Function Finished ---")
+    return {
+        'total': total_files, 'processed': processed_files_count, 'skipped_unchanged': unchanged_files_count,
+        'resumed': len(resumed_results),
+        'duplicates': {r['file']: r['duplicate_of'] for r in duplicate_results},
+        'cache_hits': cache_hits, 'cache_misses': cache_misses, 'cache_stats': cache_stats,
+        'stage_hits': stage_hits, 'stage_misses': stage_misses, 'stage_stats': stage_stats,
+        'backup_stats': backup_stats, 'output_bytes': output_bytes, 'output_archive': archive_stats if archive_ready else None,
+        'skipped': skipped_files_count, 'errors': error_files_count,
+        'cancelled': cancelled_files_count, 'fast_profile': fast_files_count, 'stop_reason': run.get('stop_reason'),
+        'schedule': schedule, 'makespan': execution_time, 'total_time': total_time,
+    }
+
+
+def _finish_backup_store(run: Dict[str, Any], backup_stats: Dict[str, Any]):
+    """(Helper) Записывает индекс запуска в хранилище бекапов и применяет срок хранения."""
+    store = run['backup'].store
+    backup_stats['index'] = store.write_index(run['abs_input_path'])
+    backup_stats['stored_bytes'] = store.stored_bytes
+    log.info(f"Backup store: {len(store.entries)} file(s) in run index, {store.reused} already stored, "
+             f"{store.stored_bytes / (1024 * 1024):.1f} MB new.")
+    keep_runs, keep_days = run.get('backup_retention', (0, 0))
+    if keep_runs > 0 or keep_days > 0:
+        prune_stats = file_backup.prune(store.backup_dir, keep_runs, keep_days)
+        log.info(f"Backup retention: {prune_stats['runs_removed']} run(s) and {prune_stats['blobs_removed']} blob(s) removed "
+                 f"({prune_stats['freed_bytes'] / (1024 * 1024):.1f} MB).")
+
+
+def _materialize_duplicates(run: Dict[str, Any], results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    (Helper) Создает результаты для дубликатов копированием результата их
+    оригинала (и бекап исходников дубликатов). Дубликаты затем участвуют в
+    удалении оригиналов и переименовании, как обычные обработанные файлы.
+    """
+    duplicates = run.get('duplicates') or {}
+    if not duplicates: return []
+    params = run['params']; abs_input_path = run['abs_input_path']
+    duplicate_results = []
+    for r in results:
+        if r['status'] != 'processed' or r['file'] not in duplicates: continue
+        for duplicate_file in duplicates[r['file']]:
+            source_path = os.path.join(abs_input_path, duplicate_file)
+            output_name = run.get('output_names', {}).get(duplicate_file) or f"{os.path.splitext(_flat_name(duplicate_file))[0]}{params['output_ext']}"
+            output_path = os.path.join(run['abs_output_path'], output_name)
+            status = 'processed'
+            if run.get('backup') is not None: run['backup'].submit(source_path, _flat_name(duplicate_file))
+            try: durable_io.copy_file(r['output_path'], output_path, params.get('durability') == 'fsync')
+            except OSError as e: log.error(f"  ! Could not copy result for duplicate {duplicate_file}: {e}"); status = 'error'; output_path = None
+            duplicate_result = {'index': r['index'], 'file': duplicate_file, 'source_path': source_path,
+                                'status': status, 'output_path': output_path, 'elapsed': 0.0,
+                                'megapixels': r['megapixels'], 'fast': r.get('fast', False), 'duplicate_of': r['file']}
+            _journal_result(run, duplicate_result)
+            duplicate_results.append(duplicate_result)
+    return duplicate_results
+
+
+def _remove_superseded_outputs(run: Dict[str, Any], results: List[Dict[str, Any]]):
+    """
+    (Helper) Удаляет результаты прошлого запуска для файлов, обработанных заново
+    (изменились), чтобы после переименования не оставалось устаревших копий.
+    """
+    old_entries = run['manifest']['entries']; abs_output_path = run['abs_output_path']
+    # Имя прошлого результата может уже занимать новый результат другого файла (имена выделены до обработки)
+    current_outputs = {os.path.normcase(r['output_path']) for r in results if r['status'] == 'processed' and r.get('output_path')}
+    for r in results:
+        old_output = (old_entries.get(r['file']) or {}).get('output')
+        if r['status'] != 'processed' or not old_output: continue
+        old_path = os.path.join(abs_output_path, old_output)
+        if os.path.normcase(old_path) in current_outputs or not os.path.isfile(old_path): continue
+        try: os.remove(old_path); log.debug(f"  Removed superseded output: {old_output}")
+        except OSError as e: log.warning(f"  Could not remove superseded output {old_output}: {e}")
+
+
+def _save_run_manifest(run: Dict[str, Any], results: List[Dict[str, Any]], new_entries: Dict[str, Dict[str, Any]],
+                       final_output_names: Dict[str, str]):
+    """(Helper) Сохраняет манифест: записи неизмененных файлов + записи обработанных в этом запуске."""
+    manifest = run['manifest']; old_entries = manifest['entries']
+    entries = {f: old_entries[f] for f in run['unchanged_files'] if f in old_entries}
+    for r in results:
+        entry = new_entries.get(r['file'])
+        if not entry: continue
+        original_basename = os.path.splitext(_flat_name(r['file']))[0]
+        entry['output'] = final_output_names.get(original_basename, os.path.basename(r['output_path']))
+        entries[r['file']] = entry
+    manifest['entries'] = entries
+    manifest['settings_fingerprint'] = run['settings_fingerprint']
+    manifest['stage_fingerprints'] = run['stage_fingerprints']
+    run_manifest.save_manifest(run['abs_output_path'], manifest)
+
+
+def run_individual_processing(executor: Optional[Executor] = None, control: Optional[run_control.RunControl] = None,
+                              **all_settings: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Оркестрирует обработку отдельных файлов: поиск, цикл, вызов image_utils,
+    сохранение, переименование, удаление.
+    Принимает все настройки как один словарь.
+    executor - необязательный долгоживущий пул (см. worker_pool.WorkerPool);
+    без него при performance.max_workers > 1 создается временный пул процессов.
+    control - необязательный run_control.RunControl (отмена, срок); без него
+    срок берется из performance.deadline_minutes.
+    Удаление оригиналов и переименование затрагивают только обработанные файлы.
+    Возвращает словарь итоговой статистики или None, если запуск не состоялся.
+    """
+    log.info("--- Starting Individual File Processing ---")
+    start_time = time.time()
+    if control is None: control = run_control.RunControl.from_settings(all_settings.get('performance', {}))
+    control.start()
+
+    run = prepare_individual_run(all_settings)
+    if not run: return None
+    if control.deadline_seconds: log.info(f"Deadline: {control.deadline_seconds:.0f}s (fast profile on pressure: {control.fast_on_pressure})")
+
+    # --- 5-6. Основной Цикл Обработки ---
+    execution_start = time.perf_counter()
+    try: results, schedule = _execute_individual_jobs(run, executor, control)
+    except BaseException:
+        abort_individual_run(run) # Недописанный архив результатов не остается
+        raise
+    execution_time = time.perf_counter() - execution_start
+    run['stop_reason'] = control.stop_reason
+
+    return finalize_individual_run(run, results, schedule, start_time, execution_time)
+
+
+# ==============================================================================
+# === НЕСКОЛЬКО ПРЕСЕТОВ ЗА ОДИН ПРОХОД ========================================
+# ==============================================================================
+
+# Секции, которые в многопресетном запуске берутся из текущих настроек, а не из пресетов
+MULTI_PRESET_SHARED_SECTIONS = ('paths', 'performance', 'cache', 'discovery', 'backup')
+
+
+def _preset_folder_name(preset_name: str) -> str:
+    """(Helper) Имя подпапки результатов пресета (без недопустимых в именах файлов символов)."""
+    return re.sub(r'[<>:"/\\|?*]', '_', str(preset_name)).strip(' .') or "preset"
+
+
+def _build_preset_run_settings(preset_name: str, preset_settings: Dict[str, Any], base_settings: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    (Helper) Настройки запуска одного пресета: шаги обработки и формат - из
+    пресета; папки, производительность, кеши и переименование - из текущих
+    настроек. Результаты пишутся в подпапку с именем пресета.
+    """
+    run_settings = copy.deepcopy(preset_settings)
+    for section in MULTI_PRESET_SHARED_SECTIONS: run_settings[section] = copy.deepcopy(base_settings.get(section, {}))
+    ind_settings = dict(run_settings.get('individual_mode', {}))
+    base_ind_settings = base_settings.get('individual_mode', {})
+    for key in config_manager.WORKFLOW_ONLY_KEYS['individual_mode']: # Ключи, не влияющие на результат
+        if key in base_ind_settings: ind_settings[key] = base_ind_settings[key]
+    ind_settings['delete_originals'] = False # Исходники нужны всем пресетам
+    run_settings['discovery']['streaming'] = False # Задания пресетов объединяются по файлам: нужен полный список
+    ind_settings.pop('multi_presets', None)
+    run_settings['individual_mode'] = ind_settings
+    base_output = base_settings.get('paths', {}).get('output_folder_path')
+    if base_output: run_settings['paths']['output_folder_path'] = os.path.join(base_output, _preset_folder_name(preset_name))
+    return run_settings
+
+
+class _PresetJournals:
+    """(Helper) Раскладывает результаты многопресетных заданий по журналам запусков пресетов."""
+
+    def __init__(self, runs: List[Dict[str, Any]]):
+        self.runs = runs
+
+    def record_file(self, result: Dict[str, Any]):
+        for preset_index, part in result.get('parts', []): _journal_result(self.runs[preset_index], part)
+
+
+def _process_multi_preset_file(multi_job: Dict[str, Any], params_list: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    (Worker) Обрабатывает один исходный файл для нескольких пресетов.
+    Файл декодируется один раз; начальные шаги (пре-ресайз, отбеливание,
+    обрезка) выполняются один раз на каждый набор их настроек, остальные -
+    для каждого пресета. Возвращает сводный результат с 'parts':
+    [(номер пресета, результат как у _process_individual_file), ...].
+    """
+    shared = {'decoded': None, 'prefixes': {}}
+    fast = bool(multi_job.get('fast', False))
+    parts = []
+    try:
+        for preset_index, job in multi_job['parts']:
+            params = params_list[preset_index]
+            parts.append((preset_index, _process_individual_file(dict(job, fast=fast), params, shared)))
+    finally:
+        image_utils.safe_close(shared['decoded'])
+        for prefix in shared['prefixes'].values(): image_utils.safe_close(prefix[0])
+    statuses = sorted({r['status'] for _, r in parts})
+    return {'index': multi_job['index'], 'file': multi_job['file'], 'source_path': multi_job['source_path'],
+            'status': '/'.join(statuses), 'output_path': None, 'elapsed': sum(r['elapsed'] for _, r in parts),
+            'megapixels': max((r['megapixels'] for _, r in parts), default=0.0), 'fast': fast, 'parts': parts}
+
+
+def _split_multi_preset_results(multi_jobs: List[Dict[str, Any]], results: List[Dict[str, Any]],
+                                preset_count: int) -> List[List[Dict[str, Any]]]:
+    """(Helper) Результаты по пресетам (в natsort-порядке файлов каждого пресета)."""
+    per_preset: List[List[Dict[str, Any]]] = [[] for _ in range(preset_count)]
+    multi_jobs_by_index = {mj['index']: mj for mj in multi_jobs}
+    for r in results:
+        parts = r.get('parts')
+        if parts is None:
+            # Задание не выполнялось (отмена) или обработчик упал: статус относится ко всем пресетам файла
+            parts = [(preset_index, dict(r, index=job['index'])) for preset_index, job in multi_jobs_by_index[r['index']]['parts']]
+        for preset_index, part in parts: per_preset[preset_index].append(part)
+    for preset_results in per_preset: preset_results.sort(key=lambda r: r['index'])
+    return per_preset
+
+
+def run_multi_preset_processing(preset_names: List[str], executor: Optional[Executor] = None,
+                                control: Optional[run_control.RunControl] = None,
+                                **all_settings: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Обрабатывает входную папку сразу несколькими пресетами из settings_presets.
+    Каждый пресет пишет результаты в свою подпапку папки результатов;
+    каждый файл декодируется один раз, а одинаковые начальные шаги разных
+    пресетов выполняются один раз. Папки, производительность, кеши и
+    переименование берутся из all_settings; удаление оригиналов отключено.
+    Возвращает {'presets': {имя: итог как у run_individual_processing}, 'files',
+    'cancelled', 'backup_stats', 'stop_reason', 'total_time'} или None, если запуск не состоялся.
+    """
+    log.info(f"--- Starting Multi-Preset Processing ({len(preset_names)} preset(s)) ---")
+    start_time = time.time()
+    if control is None: control = run_control.RunControl.from_settings(all_settings.get('performance', {}))
+    control.start()
+    if all_settings.get('individual_mode', {}).get('delete_originals'):
+        log.warning("Deletion of originals is disabled in multi-preset mode.")
+
+    names: List[str] = []; runs: List[Dict[str, Any]] = []
+    backup_writer = None # Пути у пресетов общие: один бекап (и одно хранилище) на весь проход
+    for preset_name in dict.fromkeys(preset_names): # Без повторов, порядок сохраняется
+        preset_settings = config_manager.load_settings_preset(preset_name)
+        if preset_settings is None: log.error(f"Preset '{preset_name}' could not be loaded. Skipping it."); continue
+        log.info(f"=== Preset '{preset_name}' ===")
+        run = prepare_individual_run(_build_preset_run_settings(preset_name, preset_settings, all_settings), backup_writer)
+        if run: names.append(preset_name); runs.append(run); backup_writer = backup_writer or run.get('backup')
+    if not runs:
+        log.error("No presets to process.")
+        return None
+
+    # Одно задание на исходный файл со списком пресетов, которым он нужен
+    multi_jobs_by_file: Dict[str, Dict[str, Any]] = {}
+    for preset_index, run in enumerate(runs):
+        for job in run['jobs']:
+            multi_job = multi_jobs_by_file.setdefault(job['source_path'], {'file': job['file'], 'source_path': job['source_path'], 'parts': []})
+            multi_job['parts'].append((preset_index, job))
+    multi_jobs = natsorted(multi_jobs_by_file.values(), key=lambda mj: mj['file'])
+    for i, multi_job in enumerate(multi_jobs): multi_job.update(index=i, total=len(multi_jobs))
+    prefix_count = len({run['params']['prefix_fingerprint'] for run in runs})
+    log.info(f"Presets: {len(runs)} ({', '.join(names)}). Files: {len(multi_jobs)}. "
+             f"Distinct prefix pipelines per file: {prefix_count}.")
+    if control.deadline_seconds: log.info(f"Deadline: {control.deadline_seconds:.0f}s (fast profile on pressure: {control.fast_on_pressure})")
+
+    # Исходник копируется в бекап один раз; барьер, индекс хранилища и очистка - после всех пресетов
+    for run in runs: run['backup_shared'] = True
+    multi_run = {'jobs': multi_jobs, 'params': [run['params'] for run in runs], 'backup': backup_writer,
+                 'abs_input_path': runs[0]['abs_input_path'], 'backup_retention': runs[0]['backup_retention'],
+                 'num_workers': runs[0]['num_workers'], 'lpt_scheduling': runs[0]['lpt_scheduling'],
+                 'input_archive': runs[0]['input_archive'], 'readahead': runs[0]['readahead'], 'journal': _PresetJournals(runs)}
+    execution_start = time.perf_counter()
+    try: results, _ = _execute_individual_jobs(multi_run, executor, control, worker=_process_multi_preset_file)
+    except BaseException:
+        for run in runs: abort_individual_run(run)
+        if backup_writer is not None: backup_writer.wait()
+        raise
+    execution_time = time.perf_counter() - execution_start
+
+    summaries = {}
+    for preset_name, run, preset_results in zip(names, runs, _split_multi_preset_results(multi_jobs, results, len(runs))):
+        log.info(f"=== Preset '{preset_name}': {run['abs_output_path']} ===")
+        run['stop_reason'] = control.stop_reason
+        summaries[preset_name] = finalize_individual_run(run, preset_results, None, start_time, execution_time)
+    backup_stats = None
+    if backup_writer is not None: # Бекапы исходников дубликатов ставятся при завершении пресетов
+        backup_stats = backup_writer.wait()
+        if backup_writer.store is not None: _finish_backup_store(multi_run, backup_stats)
+        log.info(f"Backups: {backup_stats['done']} ({', '.join(f'{m}: {n}' for m, n in backup_stats['methods'].items()) or 'none'}), "
+                 f"failed: {backup_stats['failed']}")
+    total_time = time.time() - start_time
+    log.info(f"--- Multi-Preset Processing Finished: {len(runs)} preset(s), {len(multi_jobs)} file(s) in {total_time:.2f} seconds ---")
+    return {'presets': summaries, 'files': len(multi_jobs),
+            'cancelled': sum(1 for r in results if r['status'] == 'cancelled'),
+            'backup_stats': backup_stats, 'stop_reason': control.stop_reason, 'total_time': total_time}
 
 
 # ==============================================================================
 # === ОСНОВНАЯ ФУНКЦИЯ: СОЗДАНИЕ КОЛЛАЖА =======================================
 # ==============================================================================
 
-def _process_image_for_collage(image_path: str, prep_settings, white_settings, bgc_settings, pad_settings, bc_settings) -> Optional[Image.Image]:
+def _load_cached_collage_cell(image_path: str, cell_cache: Dict[str, Any],
+                              source_data: Optional[bytes] = None) -> Tuple[Optional[stage_cache.StageCache], Optional[str], Optional[Image.Image]]:
     """
-    Применяет базовые шаги обработки к одному изображению для коллажа.
-    (Preresize, Whitening, BG Removal, Padding, Brightness/Contrast)
+    (Helper) Ищет готовую ячейку коллажа в кеше промежуточных изображений.
+    Возвращает (кеш, ключ, копия ячейки или None). Ключ None - файл не прочитан.
+    source_data - уже прочитанное или отображенное в память содержимое исходника.
     """
-    log.debug(f"-- Starting processing for collage: {os.path.basename(image_path)}")
-    img_current = None
+    cells = stage_cache.StageCache(cell_cache['cache_dir'], cell_cache['max_bytes'])
+    source_hash = file_hashing.hash_bytes(source_data) if source_data is not None else file_hashing.hash_file(image_path)
+    if not source_hash: return cells, None, None
+    cell_key = cells.make_key(source_hash, cell_cache['fingerprint'], COLLAGE_CELL_KEY_EXT)
+    cached = cells.load_image(cell_key)
+    if not cached: return cells, cell_key, None
+    img_mapped, _, handle = cached
+    try: img_cell = img_mapped.convert('RGBA') if img_mapped.mode != 'RGBA' else img_mapped.copy()
+    finally: image_utils.safe_close(img_mapped); stage_cache.release(handle)
+    return cells, cell_key, img_cell
+
+
+def _process_image_for_collage(image_path: str, plan: pipeline_plan.PipelinePlan,
+                               fast: bool = False, cell_cache: Optional[Dict[str, Any]] = None,
+                               mmap_input: bool = False) -> Optional[Image.Image]:
+    """
+    Применяет к одному изображению для коллажа шаги ячейки из плана
+    (prefix и tail: пре-ресайз, отбеливание, фон/обрезка, поля, яркость/контраст).
+    cell_cache - {'cache_dir', 'max_bytes', 'fingerprint'}: готовые ячейки
+    берутся из кеша промежуточных изображений и сохраняются в него.
+    image_path - путь к файлу или archive_input.ArchiveMember (член архива).
+    mmap_input - файл читается через отображение в память (mapped_input).
+    """
+    source_label = archive_input.source_name(image_path)
+    log.debug(f"-- Starting processing for collage: {source_label}")
+    img_current = None; mapped = None
+    cells = None; cell_key = None
     try:
+        source_data = None
+        if isinstance(image_path, archive_input.ArchiveMember):
+            source_data = archive_input.read_member(image_path)
+            if source_data is None: return None
+        elif mmap_input: mapped = mapped_input.map_file(image_path)
+        if cell_cache:
+            cells, cell_key, img_cached = _load_cached_collage_cell(image_path, cell_cache, source_data if mapped is None else mapped)
+            if img_cached is not None:
+                log.info(f"    Cell cache hit: {source_label} ({img_cached.size[0]}x{img_cached.size[1]})")
+                return img_cached
+
         # 1. Открытие
+        if source_data is not None: source_fp = io.BytesIO(source_data)
+        elif mapped is not None: mapped.seek(0); source_fp = mapped
+        else: source_fp = image_path
         try:
-            with Image.open(image_path) as img_opened: img_opened.load(); img_current = img_opened.convert('RGBA')
+            with Image.open(source_fp) as img_opened: img_opened.load(); img_current = img_opened.convert('RGBA')
         except Exception as e: log.error(f"    ! Open/convert error: {e}"); return None
+        mapped_input.release(mapped); mapped = None
         if not img_current or img_current.size[0]<=0: log.error("    ! Zero size after open."); return None
         log.debug(f"    Opened RGBA Size: {img_current.size}")
 
-        # 2. Пре-ресайз (если вкл)
-        enable_preresize = prep_settings.get('enable_preresize', False)
-        preresize_width = int(prep_settings.get('preresize_width', 0)) if enable_preresize else 0
-        preresize_height = int(prep_settings.get('preresize_height', 0)) if enable_preresize else 0
-        if enable_preresize: img_current = _apply_preresize(img_current, preresize_width, preresize_height)
-        if not img_current: return None
-
-        # 3. Отбеливание (если вкл)
-        enable_whitening = white_settings.get('enable_whitening', False)
-        whitening_cancel_threshold = int(white_settings.get('whitening_cancel_threshold', 550))
-        if enable_whitening: img_current = image_utils.whiten_image_by_darkest_perimeter(img_current, whitening_cancel_threshold)
-        if not img_current: return None
-
-        # 4. Удаление фона/обрезка (если вкл)
-        enable_bg_crop = bgc_settings.get('enable_bg_crop', False)
-        white_tolerance = int(bgc_settings.get('white_tolerance', 0)) if enable_bg_crop else None
-        crop_symmetric_absolute = bool(bgc_settings.get('crop_symmetric_absolute', False)) if enable_bg_crop else False
-        crop_symmetric_axes = bool(bgc_settings.get('crop_symmetric_axes', False)) if enable_bg_crop else False
-        if enable_bg_crop:
-            img_current = image_utils.remove_white_background(img_current, white_tolerance)
-            if not img_current: return None
-            img_current = image_utils.crop_image(img_current, crop_symmetric_axes, crop_symmetric_absolute)
-            if not img_current: return None
+        # 2. Шаги ячейки по плану
+        state = pipeline_plan.StageState(pipeline_plan.RESAMPLE_FAST if fast else pipeline_plan.RESAMPLE_QUALITY)
+        try:
+            img_current = plan.run_prefix(img_current, state)
+            img_current = plan.run_tail(img_current, state)
+        except ValueError as e:
+            log.error(f"    ! Processing error for collage image: {e}")
+            image_utils.safe_close(img_current)
+            return None
 
-        # 5. Добавление полей (если вкл)
-        enable_padding = pad_settings.get('enable_padding', False)
-        padding_percent = float(pad_settings.get('padding_percent', 0.0)) if enable_padding else 0.0
-        perimeter_margin = int(pad_settings.get('perimeter_margin', 0)) if enable_padding else 0
-        allow_expansion = bool(pad_settings.get('allow_expansion', True)) if enable_padding else False
-        if enable_padding:
-            img_current = image_utils.add_padding(img_current, padding_percent)
-            if not img_current: return None
-            log.debug(f"    Padding applied. New size: {img_current.size}")
-
-        # === ЯРКОСТЬ И КОНТРАСТ (для отдельных фото перед коллажом) ===
-        if bc_settings.get('enable_bc'):
-            log.debug("  Applying Brightness/Contrast to individual image for collage...")
-            img_current = image_utils.apply_brightness_contrast(
-                img_current, 
-                brightness_factor=bc_settings.get('brightness_factor', 1.0),
-                contrast_factor=bc_settings.get('contrast_factor', 1.0)
-            )
-            if not img_current: 
-                log.warning(f"  Brightness/contrast failed for collage image.")
-                return None # Не можем продолжить, если Я/К вернула None
-        # =============================================================
-        
         # Проверка RGBA (для коллажа нужен RGBA)
         if img_current.mode != 'RGBA':
              try: img_tmp = img_current.convert("RGBA"); image_utils.safe_close(img_current); img_current = img_tmp
              except Exception as e: log.error(f"    ! Final RGBA conversion failed: {e}"); return None
 
-        log.debug(f"-- Finished processing for collage: {os.path.basename(image_path)}")
+        # Ячейки быстрого профиля (другой ресайз) в кеш не попадают
+        if cells and cell_key and not fast: cells.store_image(cell_key, img_current, {})
+        log.debug(f"-- Finished processing for collage: {source_label}")
         return img_current
 
     except Exception as e:
-        log.critical(f"!!! UNEXPECTED error in _process_image_for_collage for {os.path.basename(image_path)}: {e}", exc_info=True)
+        log.critical(f"!!! UNEXPECTED error in _process_image_for_collage for {source_label}: {e}", exc_info=True)
         image_utils.safe_close(img_current)
         return None
+    finally:
+        mapped_input.release(mapped)
+
+
+def _process_collage_cell_worker(image_path: str, plan: pipeline_plan.PipelinePlan,
+                                 scratch_dir: Optional[str] = None, fast: bool = False, cell_cache: Optional[Dict[str, Any]] = None,
+                                 mmap_input: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    (Worker) Обрабатывает одно изображение для коллажа в процессе-обработчике.
+    Вместо PIL-изображения (которое пришлось бы сериализовать целиком) возвращает
+    дескриптор разделяемой памяти с пикселями RGBA или None при ошибке.
+    """
+    img_cell = _process_image_for_collage(image_path, plan, fast, cell_cache, mmap_input)
+    if not img_cell: return None
+    try: return shared_buffers.export_image(img_cell, scratch_dir)
+    finally: image_utils.safe_close(img_cell)
+
+
+def _process_collage_cells_parallel(paths: List[str], num_workers: int, cell_settings: Dict[str, Any],
+                                    scratch_dir: Optional[str], executor: Optional[Executor] = None,
+                                    control: Optional[run_control.RunControl] = None) -> Tuple[List[Image.Image], List[Any]]:
+    """
+    (Helper) Обрабатывает ячейки коллажа в пуле обработчиков.
+    Возвращает (изображения в исходном порядке, handles разделяемой памяти).
+    Изображения из процессов ссылаются на разделяемую память без копирования;
+    handles нужно освободить через shared_buffers.release() после закрытия
+    изображений. Пул потоков возвращает изображения напрямую (handles пустые).
+    Ячейки выдаются окном через JobDispatcher: при нехватке времени следующие
+    ячейки получают быстрый профиль, при отмене через control новые не
+    выдаются, а результаты уже начатых отбрасываются.
+    """
+    images: List[Image.Image] = []; handles: List[Any] = []
+    total = len(paths)
+    in_threads = isinstance(executor, ThreadPoolExecutor)
+    dispatcher = JobDispatcher([{'index': idx, 'path': path} for idx, path in enumerate(paths)], num_workers * 2, control)
+    outcomes: Dict[int, Any] = {}
+    with worker_pool.borrow_executor(executor, num_workers) as pool:
+        pending = {}
+        while True:
+            for job in dispatcher.take():
+                path = job['path']; fast = job.get('fast', False)
+                log.info(f"-> Processing {job['index']+1}/{total}: {archive_input.source_name(path)}" + (" [fast]" if fast else ""))
+                if in_threads: future = pool.submit(_process_image_for_collage, path, fast=fast, **cell_settings)
+                else: future = pool.submit(_process_collage_cell_worker, path, scratch_dir=scratch_dir, fast=fast, **cell_settings)
+                pending[future] = job
+            if control is not None and control.should_stop():
+                _discard_collage_futures(list(pending), in_threads)
+                break
+            if not pending: break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = pending.pop(future); dispatcher.complete()
+                try: outcomes[job['index']] = future.result()
+                except Exception as e: log.error(f"  ! Worker failed for {archive_input.source_name(job['path'])}: {e}"); outcomes[job['index']] = None
+    for idx in sorted(outcomes):
+        path = paths[idx]; descriptor = outcomes[idx]
+        if not descriptor: log.warning(f"  Skipping {archive_input.source_name(path)} due to processing errors."); continue
+        if in_threads: images.append(descriptor); continue
+        try:
+            img_cell, handle = shared_buffers.attach_image(descriptor)
+        except Exception as e:
+            log.error(f"  ! Cannot attach shared buffer for {archive_input.source_name(path)}: {e}")
+            continue
+        images.append(img_cell); handles.append(handle)
+    return images, handles
+
+
+def _discard_collage_futures(futures: List[Any], in_threads: bool):
+    """(Helper) Отменяет не начатые ячейки и освобождает результаты уже начатых."""
+    running = [future for future in futures if not future.cancel()]
+    for future in running:
+        try: outcome = future.result()
+        except Exception: continue
+        if not outcome: continue
+        if in_threads: image_utils.safe_close(outcome)
+        else: shared_buffers.discard(outcome)
+    log.warning(f"  Collage cell processing stopped: {len(futures) - len(running)} cell(s) cancelled, {len(running)} discarded.")
+
+
+def _release_shared_cells(handles: List[Any], scratch_dir: Optional[str]):
+    """(Helper) Освобождает разделяемую память ячеек (изображения должны быть закрыты)."""
+    for handle in handles: shared_buffers.release(handle)
+    handles.clear()
+    if scratch_dir: shutil.rmtree(scratch_dir, ignore_errors=True)
+
+
+def _process_collage_cells(paths: List[str], cell_settings: Dict[str, Any], num_workers: int,
+                           executor: Optional[Executor] = None,
+                           control: Optional[run_control.RunControl] = None) -> Tuple[List[Image.Image], List[Any], Optional[str]]:
+    """
+    (Helper) Обрабатывает ячейки коллажа последовательно или в пуле обработчиков.
+    Возвращает (успешно обработанные изображения по порядку, handles
+    разделяемой памяти, временная папка или None) - см. _release_shared_cells.
+    """
+    total = len(paths)
+    if num_workers > 1 and total > 1:
+        log.info(f"Using {num_workers} worker processes (cells returned via shared memory).")
+        scratch_dir = tempfile.mkdtemp(prefix="collage_cells_") if shared_buffers.USE_SCRATCH_FILES else None
+        images, handles = _process_collage_cells_parallel(paths, num_workers, cell_settings, scratch_dir, executor, control)
+        return images, handles, scratch_dir
+    images = []
+    for idx, path in enumerate(paths):
+        if control is not None and control.should_stop(): break
+        log.info(f"-> Processing {idx+1}/{total}: {archive_input.source_name(path)}")
+        fast = control.use_fast_profile(idx, total - idx) if control is not None else False
+        processed = _process_image_for_collage(image_path=path, fast=fast, **cell_settings)
+        if processed: images.append(processed)
+        else: log.warning(f"  Skipping {archive_input.source_name(path)} due to processing errors.")
+    return images, [], None
+
+
+def _collage_grid(cell_sizes: List[Tuple[int, int]], forced_cols: int, spacing_percent: float) -> Dict[str, int]:
+    """(Helper) Геометрия сетки коллажа: число колонок/строк, размер слота и отступы."""
+    cols = forced_cols if forced_cols > 0 else max(1, int(math.ceil(math.sqrt(len(cell_sizes)))))
+    rows = max(1, int(math.ceil(len(cell_sizes) / cols)))
+    max_w = max((w for w, h in cell_sizes), default=1)
+    max_h = max((h for w, h in cell_sizes), default=1)
+    return {'cols': cols, 'rows': rows, 'max_w': max_w, 'max_h': max_h,
+            'spacing_h': int(round(max_w * (spacing_percent / 100.0))), 'spacing_v': int(round(max_h * (spacing_percent / 100.0)))}
+
+
+def _collage_slot_origin(grid: Dict[str, int], idx: int) -> Tuple[int, int]:
+    """(Helper) Левый верхний угол слота ячейки idx на холсте."""
+    r, c = divmod(idx, grid['cols'])
+    return (grid['spacing_h'] + c * (grid['max_w'] + grid['spacing_h']),
+            grid['spacing_v'] + r * (grid['max_h'] + grid['spacing_v']))
+
+
+def _paste_collage_cell(canvas: Image.Image, img: Image.Image, grid: Dict[str, int], idx: int):
+    """(Helper) Вставляет ячейку по центру ее слота."""
+    px, py = _collage_slot_origin(grid, idx)
+    paste_x = px + (grid['max_w'] - img.width) // 2; paste_y = py + (grid['max_h'] - img.height) // 2
+    canvas.paste(img, (paste_x, paste_y), mask=img)
+
+
+def _assemble_collage_canvas(images: List[Image.Image], forced_cols: int, spacing_percent: float,
+                             proportional_placement: bool, placement_ratios: List[float],
+                             collage_resample) -> Tuple[Optional[Image.Image], Optional[Dict[str, int]], List[Tuple[int, int]]]:
+    """
+    (Helper) Пропорциональное масштабирование (опц.) и раскладка ячеек по сетке.
+    Закрывает переданные изображения. Возвращает (холст RGBA, геометрия сетки,
+    размеры ячеек) или (None, None, []) при ошибке.
+    """
+    num_processed = len(images)
+    processed_images = list(images)
+    # --- 6. Пропорциональное Масштабирование (опц.) ---
+    scaled_images: List[Image.Image] = []
+    if proportional_placement and num_processed > 0:
+        # ... (логика масштабирования с логированием как в предыдущем ответе) ...
+        log.info("Applying proportional scaling...")
+        base_img = processed_images[0]; base_w, base_h = base_img.size
+        if base_w > 0 and base_h > 0:
+            log.debug(f"  Base size: {base_w}x{base_h}")
+            ratios = placement_ratios if placement_ratios else [1.0] * num_processed
+            for i, img in enumerate(processed_images):
+                 temp_img = None; current_w, current_h = img.size; target_w, target_h = base_w, base_h
+                 if i < len(ratios):
+                      try: ratio = max(0.01, float(ratios[i])); target_w, target_h = int(round(base_w*ratio)), int(round(base_h*ratio))
+                      except: pass # ignore ratio error
+                 if current_w > 0 and current_h > 0 and target_w > 0 and target_h > 0:
+                      scale = min(target_w / current_w, target_h / current_h)
+                      nw, nh = max(1, int(round(current_w * scale))), max(1, int(round(current_h * scale)))
+                      if nw != current_w or nh != current_h:
+                           try:
+                               log.debug(f"  Scaling image {i+1} ({current_w}x{current_h} -> {nw}x{nh})")
+                               temp_img = img.resize((nw, nh), collage_resample); scaled_images.append(temp_img); image_utils.safe_close(img)
+                           except Exception as e_scale: log.error(f"  ! Error scaling image {i+1}: {e_scale}"); scaled_images.append(img)
+                      else: scaled_images.append(img)
+                 else: scaled_images.append(img)
+            processed_images = []
+        else: log.error("  Base image zero size. Scaling skipped."); scaled_images = processed_images; processed_images = []
+    else: log.info("Proportional scaling disabled or no images."); scaled_images = processed_images; processed_images = []
+
+    # --- 7. Сборка Коллажа ---
+    num_final_images = len(scaled_images)
+    if num_final_images == 0:
+        log.error("No images left after scaling step (if enabled). Cannot create collage.")
+        return None, None, []
+    log.info(f"--- Assembling collage ({num_final_images} images) ---")
+    cell_sizes = [img.size if img else (0, 0) for img in scaled_images]
+    grid = _collage_grid(cell_sizes, forced_cols, spacing_percent)
+    canvas_width = (grid['cols'] * grid['max_w']) + ((grid['cols'] + 1) * grid['spacing_h'])
+    canvas_height = (grid['rows'] * grid['max_h']) + ((grid['rows'] + 1) * grid['spacing_v'])
+    log.debug(f"  Grid: {grid['rows']}x{grid['cols']}, Cell: {grid['max_w']}x{grid['max_h']}, Space H/V: {grid['spacing_h']}/{grid['spacing_v']}, Canvas: {canvas_width}x{canvas_height}")
+
+    collage_canvas = None
+    try:
+        collage_canvas = Image.new('RGBA', (canvas_width, canvas_height), (0, 0, 0, 0))
+        log.debug(f"    Canvas created: {repr(collage_canvas)}")
+        for idx, img in enumerate(scaled_images):
+            if img and img.width > 0 and img.height > 0:
+                try: _paste_collage_cell(collage_canvas, img, grid, idx)
+                except Exception as e_paste: log.error(f"  ! Error pasting image {idx+1}: {e_paste}")
+        log.info("  Images placed on collage canvas.")
+        return collage_canvas, grid, cell_sizes
+    except Exception as e:
+        log.critical(f"!!! Error during collage assembly: {e}", exc_info=True)
+        image_utils.safe_close(collage_canvas)
+        return None, None, []
+    finally:
+        for img in scaled_images: image_utils.safe_close(img) # Закрываем исходники
+
+
+def _collage_layout_path(output_file_path: str) -> str:
+    """(Helper) Файл раскладки коллажа (холст до трансформаций) рядом с коллажем."""
+    directory, filename = os.path.split(output_file_path)
+    return os.path.join(directory, f".{filename}.layout{stage_cache.STAGE_EXT}")
+
+
+def _collage_cell_signature(path: str) -> Dict[str, Any]:
+    """(Helper) Имя, размер и mtime исходника ячейки (для поиска изменившихся файлов)."""
+    if isinstance(path, archive_input.ArchiveMember): return {'file': path.rel_path, 'size': path.size, 'mtime_ns': path.mtime_ns}
+    try: st = os.stat(path); size, mtime_ns = st.st_size, st.st_mtime_ns
+    except OSError: size, mtime_ns = None, None
+    return {'file': os.path.basename(path), 'size': size, 'mtime_ns': mtime_ns}
+
+
+def _update_collage_incrementally(layout_path: str, layout_key: Dict[str, Any], paths: List[str],
+                                  cell_settings: Dict[str, Any], num_workers: int, executor: Optional[Executor],
+                                  control: run_control.RunControl) -> Tuple[Optional[Image.Image], Optional[Dict[str, Any]]]:
+    """
+    (Helper) Перерисовывает на холсте прошлого запуска только ячейки изменившихся
+    файлов. Возможно, если совпадают настройки ячеек, параметры сетки и список
+    файлов, а геометрия сетки с новыми ячейками не меняется.
+    Возвращает (холст, новая раскладка) или (None, None) - нужна полная сборка.
+    """
+    loaded = stage_cache.read_raw_image(layout_path)
+    if not loaded:
+        log.info("Incremental update: no previous collage layout. Full rebuild.")
+        return None, None
+    img_previous, meta, handle = loaded
+    new_images: List[Image.Image] = []; handles: List[Any] = []; scratch_dir = None
+    try:
+        if any(meta.get(k) != v for k, v in layout_key.items()):
+            log.info("Incremental update: cell or grid settings changed. Full rebuild."); return None, None
+        cells = meta.get('cells', [])
+        if [cell['file'] for cell in cells] != [archive_input.source_name(path) for path in paths]:
+            log.info("Incremental update: the list of source files changed. Full rebuild."); return None, None
+        signatures = [_collage_cell_signature(path) for path in paths]
+        changed = [i for i, (cell, signature) in enumerate(zip(cells, signatures))
+                   if (cell['size'], cell['mtime_ns']) != (signature['size'], signature['mtime_ns'])]
+        log.info(f"Incremental update: {len(changed)} of {len(paths)} cell(s) changed.")
+        if changed:
+            new_images, handles, scratch_dir = _process_collage_cells([paths[i] for i in changed], cell_settings, num_workers, executor, control)
+        if control.should_stop(): return None, None
+        if len(new_images) != len(changed):
+            log.warning("Incremental update: some changed cells failed. Full rebuild."); return None, None
+        cell_sizes = [tuple(cell['cell']) for cell in cells]
+        for i, img in zip(changed, new_images): cell_sizes[i] = img.size
+        grid = _collage_grid(cell_sizes, layout_key['forced_cols'], layout_key['spacing_percent'])
+        if grid != meta.get('grid'):
+            log.info("Incremental update: grid geometry changed. Full rebuild."); return None, None
+        canvas = img_previous.copy()
+        for i, img in zip(changed, new_images):
+            px, py = _collage_slot_origin(grid, i)
+            canvas.paste((0, 0, 0, 0), (px, py, px + grid['max_w'], py + grid['max_h'])) # Стираем прежнюю ячейку
+            _paste_collage_cell(canvas, img, grid, i)
+        log.info(f"  Repainted {len(changed)} cell(s) on the previous canvas.")
+        return canvas, {'grid': grid, 'cells': [dict(signature, cell=list(size)) for signature, size in zip(signatures, cell_sizes)]}
+    finally:
+        for img in new_images: image_utils.safe_close(img)
+        _release_shared_cells(handles, scratch_dir)
+        image_utils.safe_close(img_previous); stage_cache.release(handle)
 
 
-def run_collage_processing(**all_settings: Dict[str, Any]) -> bool:
+def run_collage_processing(executor: Optional[Executor] = None, control: Optional[run_control.RunControl] = None,
+                           **all_settings: Dict[str, Any]) -> bool:
     """
     Создает коллаж из обработанных изображений.
+    executor - необязательный долгоживущий пул для обработки ячеек.
+    control - необязательный run_control.RunControl: при отмене коллаж не
+    сохраняется; при нехватке времени сборка идет быстрым профилем.
     Возвращает True при успехе, False при любой ошибке или если коллаж не был создан.
     """
     log.info("====== Entered run_collage_processing function ======")
     log.info("--- Starting Collage Processing ---")
     start_time = time.time()
+    if control is None: control = run_control.RunControl.from_settings(all_settings.get('performance', {}))
+    control.start()
     success_flag = False # Флаг для финального return
 
     # --- 1. Извлечение и Валидация Параметров ---
@@ -757,8 +1820,9 @@ def run_collage_processing(**all_settings: Dict[str, Any]) -> bool:
         white_settings = all_settings.get('whitening', {})
         bgc_settings = all_settings.get('background_crop', {})
         pad_settings = all_settings.get('padding', {})
-        bc_settings = all_settings.get('brightness_contrast', {})
         coll_settings = all_settings.get('collage_mode', {})
+        perf_settings = all_settings.get('performance', {})
+        cache_settings = all_settings.get('cache', {})
 
         source_dir = paths_settings.get('input_folder_path')
         output_filename_base = paths_settings.get('output_filename') # Имя без расширения от пользователя
@@ -775,6 +1839,7 @@ def run_collage_processing(**all_settings: Dict[str, Any]) -> bool:
         output_format = str(coll_settings.get('output_format', 'jpg')).lower()
         jpg_background_color = coll_settings.get('jpg_background_color', [255, 255, 255])
         jpeg_quality = int(coll_settings.get('jpeg_quality', 95))
+        incremental_update = bool(coll_settings.get('incremental_update', False))
 
         if not source_dir or not output_filename_base:
              raise ValueError("Source directory or output filename base missing.")
@@ -788,6 +1853,9 @@ def run_collage_processing(**all_settings: Dict[str, Any]) -> bool:
         valid_jpg_bg = tuple(jpg_background_color) if isinstance(jpg_background_color, list) and len(jpg_background_color) == 3 else (255, 255, 255)
         valid_collage_aspect_ratio = tuple(force_collage_aspect_ratio) if force_collage_aspect_ratio and len(force_collage_aspect_ratio) == 2 else None
 
+        # План: шаги ячеек (передаются обработчикам) и трансформации собранного коллажа
+        plan = pipeline_plan.compile_plan(all_settings, 'collage')
+
         log.debug("Collage settings extracted.")
 
     except (KeyError, ValueError, TypeError) as e:
@@ -796,12 +1864,15 @@ def run_collage_processing(**all_settings: Dict[str, Any]) -> bool:
 
     # --- 2. Подготовка Путей ---
     abs_source_dir = os.path.abspath(source_dir)
-    if not os.path.isdir(abs_source_dir):
+    # Источник - папка или архив (ZIP/TAR); коллаж из архива сохраняется рядом с архивом
+    source_archive = None if os.path.isdir(abs_source_dir) else archive_input.archive_kind(abs_source_dir)
+    if not source_archive and not os.path.isdir(abs_source_dir):
         log.error(f"Source directory not found: {abs_source_dir}")
         log.info(">>> Exiting: Source directory not found.")
         return False # Возвращаем False
     # Используем имя файла с расширением для пути
-    output_file_path = os.path.abspath(os.path.join(abs_source_dir, output_filename_with_ext))
+    output_dir = os.path.dirname(abs_source_dir) if source_archive else abs_source_dir
+    output_file_path = os.path.abspath(os.path.join(output_dir, output_filename_with_ext))
     if os.path.isdir(output_file_path):
         log.error(f"Output filename points to a directory: {output_file_path}")
         log.info(">>> Exiting: Output filename is a directory.")
@@ -809,7 +1880,7 @@ def run_collage_processing(**all_settings: Dict[str, Any]) -> bool:
 
     # --- 3. Логирование Параметров ---
     log.info("--- Processing Parameters (Collage Mode) ---")
-    log.info(f"Source Directory: {abs_source_dir}")
+    log.info(f"Source Directory: {abs_source_dir}" + (f" (archive: {source_archive})" if source_archive else ""))
     # Логируем имя с расширением и путь
     log.info(f"Output Filename: {output_filename_with_ext} (Path: {output_file_path})")
     log.info(f"Output Format: {output_format.upper()}")
@@ -819,6 +1890,11 @@ def run_collage_processing(**all_settings: Dict[str, Any]) -> bool:
     log.info(f"Whitening: {'Enabled' if white_settings.get('enable_whitening') else 'Disabled'}")
     log.info(f"BG Removal/Crop: {'Enabled' if bgc_settings.get('enable_bg_crop') else 'Disabled'}")
     log.info(f"Padding: {'Enabled' if pad_settings.get('enable_padding') else 'Disabled'}")
+    cells_cache = stage_cache.StageCache.from_settings(cache_settings) if cache_settings.get('enable_stage_cache') else None
+    cell_fingerprint = config_manager.get_stage_fingerprints(all_settings, 'collage')[config_manager.COLLAGE_CELL_END]
+    cell_cache = {'cache_dir': cells_cache.cache_dir, 'max_bytes': cells_cache.max_bytes,
+                  'fingerprint': cell_fingerprint} if cells_cache else None
+    log.info(f"Cell Cache: {cells_cache.cache_dir if cells_cache else 'Disabled'}")
     log.info("-" * 10 + " Collage Assembly " + "-" * 10)
     log.info(f"Proportional Placement: {proportional_placement} (Ratios: {placement_ratios if proportional_placement else 'N/A'})")
     log.info(f"Columns: {forced_cols if forced_cols > 0 else 'Auto'}")
@@ -826,27 +1902,25 @@ def run_collage_processing(**all_settings: Dict[str, Any]) -> bool:
     log.info(f"Force Aspect Ratio: {str(valid_collage_aspect_ratio) or 'Disabled'}")
     log.info(f"Max Dimensions: W:{max_collage_width or 'N/A'}, H:{max_collage_height or 'N/A'}")
     log.info(f"Final Exact Canvas: W:{final_collage_exact_width or 'N/A'}, H:{final_collage_exact_height or 'N/A'}")
+    log.info(f"Incremental Update: {'Enabled' if incremental_update else 'Disabled'}")
+    log.info(f"Compiled steps: {plan.describe()}")
     log.info("-" * 25)
 
     # --- 4. Поиск Файлов ---
     log.info(f"Searching for images (excluding output file)...")
-    input_files_found = []
-    SUPPORTED_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tiff', '.webp', '.tif')
-    norm_output_path = os.path.normcase(output_file_path)
+    discovery_options = file_discovery.options_from_settings(all_settings.get('discovery', {}))
     try:
-        for entry in os.listdir(abs_source_dir):
-            entry_path = os.path.join(abs_source_dir, entry)
-            # Сравниваем с нормализованным путем выходного файла
-            if os.path.isfile(entry_path) and \
-               entry.lower().endswith(SUPPORTED_EXTENSIONS) and \
-               os.path.normcase(entry_path) != norm_output_path:
-                input_files_found.append(entry_path)
+        if source_archive:
+            input_files_found = archive_input.list_members(abs_source_dir, source_archive, include=discovery_options['include'],
+                                                           exclude=discovery_options['exclude'])
+        else:
+            input_files_found = [f.path for f in file_discovery.discover_image_files(abs_source_dir, exclude_paths=(output_file_path,), **discovery_options)]
 
         if not input_files_found:
             log.warning("No suitable image files found in the source directory.") # Меняем на warning, т.к. это не критическая ошибка
             log.info(">>> Exiting: No suitable image files found.")
             return False # Возвращаем False
-        input_files_sorted = natsorted(input_files_found)
+        input_files_sorted = input_files_found # Уже в естественном порядке
         log.info(f"Found {len(input_files_sorted)} images for collage.")
     except Exception as e:
         log.error(f"Error searching for files: {e}")
@@ -856,107 +1930,71 @@ def run_collage_processing(**all_settings: Dict[str, Any]) -> bool:
 
     # --- 5. Обработка Индивидуальных Изображений ---
     processed_images: List[Image.Image] = []
-    log.info("--- Processing individual images for collage ---")
+    scaled_images: List[Image.Image] = []
+    shared_handles: List[Any] = [] # Разделяемая память под ячейками из процессов-обработчиков
+    scratch_dir = None
+    collage_canvas = None; final_collage = None
     total_files_coll = len(input_files_sorted)
-    for idx, path in enumerate(input_files_sorted):
-        log.info(f"-> Processing {idx+1}/{total_files_coll}: {os.path.basename(path)}")
-        # Передаем настройки Я/К в _process_image_for_collage
-        processed = _process_image_for_collage(
-            image_path=path,
-            prep_settings=prep_settings,
-            white_settings=white_settings,
-            bgc_settings=bgc_settings,
-            pad_settings=pad_settings,
-            bc_settings=bc_settings 
-        )
-        if processed: processed_images.append(processed)
-        else: log.warning(f"  Skipping {os.path.basename(path)} due to processing errors.")
-
+    num_workers = worker_pool.get_executor_workers(executor) if executor is not None else _resolve_worker_count(perf_settings)
+    cell_settings = {'plan': plan, 'cell_cache': cell_cache, 'mmap_input': bool(perf_settings.get('mmap_input', False))}
+    layout_path = _collage_layout_path(output_file_path)
+    layout_key = {'version': COLLAGE_LAYOUT_VERSION, 'forced_cols': forced_cols, 'spacing_percent': spacing_percent,
+                  'cell_fingerprint': cell_fingerprint}
+    layout = None # Раскладка холста для следующего инкрементального обновления (None - не сохранять)
+
+    # 5.1. Инкрементальное обновление: перерисовка изменившихся ячеек на холсте прошлого запуска
+    if incremental_update and not proportional_placement:
+        collage_canvas, layout = _update_collage_incrementally(layout_path, layout_key, input_files_sorted, cell_settings, num_workers, executor, control)
+    elif incremental_update: log.info("Incremental update is not available with proportional placement. Full rebuild.")
+
+    if collage_canvas is None:
+        log.info("--- Processing individual images for collage ---")
+        processed_images, shared_handles, scratch_dir = _process_collage_cells(input_files_sorted, cell_settings, num_workers, executor, control)
     num_processed = len(processed_images)
-    if num_processed == 0:
+    if control.should_stop():
+        log.warning(f"Collage cancelled ({control.stop_reason}). Nothing will be saved.")
+        log.info(">>> Exiting: Collage cancelled.")
+        image_utils.safe_close(collage_canvas)
+        for img in processed_images: image_utils.safe_close(img)
+        _release_shared_cells(shared_handles, scratch_dir)
+        return False
+    if collage_canvas is None and num_processed == 0:
         log.error("No images successfully processed for collage.")
         log.info(">>> Exiting: No images were successfully processed.")
         # Важно: Нужно очистить память от непроцессированных файлов, если они остались
         for img in processed_images: image_utils.safe_close(img)
+        _release_shared_cells(shared_handles, scratch_dir)
         return False # Возвращаем False
-    log.info(f"--- Successfully processed {num_processed} images. Starting assembly... ---")
-
+    if collage_canvas is None: log.info(f"--- Successfully processed {num_processed} images. Starting assembly... ---")
+    if cells_cache:
+        cell_stats = cells_cache.enforce_size_limit()
+        log.info(f"Cell cache: {cell_stats['entries']} entries, {cell_stats['total_bytes'] / (1024 * 1024):.1f} MB"
+                 + (f", evicted {cell_stats['evicted']}" if cell_stats['evicted'] else ""))
+    # Сборка оценивается как еще одна "ячейка": при нехватке времени - быстрый профиль
+    fast_assembly = control.use_fast_profile(total_files_coll, 1)
+    collage_resample = pipeline_plan.RESAMPLE_FAST if fast_assembly else pipeline_plan.RESAMPLE_QUALITY
+
+    # --- 6-7. Масштабирование и Сборка Коллажа ---
+    if collage_canvas is None:
+        collage_canvas, grid, cell_sizes = _assemble_collage_canvas(processed_images, forced_cols, spacing_percent,
+                                                                    proportional_placement, placement_ratios, collage_resample)
+        processed_images = []
+        _release_shared_cells(shared_handles, scratch_dir)
+        if collage_canvas is None:
+            log.info(">>> Exiting: Collage could not be assembled.")
+            return False
+        # Раскладка верна, только если на холсте все файлы по порядку и без масштабирования
+        if incremental_update and not proportional_placement and num_processed == total_files_coll:
+            layout = {'grid': grid, 'cells': [dict(_collage_cell_signature(path), cell=list(size))
+                                              for path, size in zip(input_files_sorted, cell_sizes)]}
+
+    # Холст до трансформаций сохраняется рядом с коллажем (вступает в силу после успешного сохранения)
+    pending_layout_path = None
+    if layout is not None and not control.fast_mode:
+        pending_layout_path = f"{layout_path}.pending"
+        if not stage_cache.write_raw_image(pending_layout_path, collage_canvas, dict(layout_key, **layout)): pending_layout_path = None
 
-    # --- 6. Пропорциональное Масштабирование (опц.) ---
-    scaled_images: List[Image.Image] = []
-    if proportional_placement and num_processed > 0:
-        # ... (логика масштабирования с логированием как в предыдущем ответе) ...
-        log.info("Applying proportional scaling...")
-        base_img = processed_images[0]; base_w, base_h = base_img.size
-        if base_w > 0 and base_h > 0:
-            log.debug(f"  Base size: {base_w}x{base_h}")
-            ratios = placement_ratios if placement_ratios else [1.0] * num_processed
-            for i, img in enumerate(processed_images):
-                 temp_img = None; current_w, current_h = img.size; target_w, target_h = base_w, base_h
-                 if i < len(ratios):
-                      try: ratio = max(0.01, float(ratios[i])); target_w, target_h = int(round(base_w*ratio)), int(round(base_h*ratio))
-                      except: pass # ignore ratio error
-                 if current_w > 0 and current_h > 0 and target_w > 0 and target_h > 0:
-                      scale = min(target_w / current_w, target_h / current_h)
-                      nw, nh = max(1, int(round(current_w * scale))), max(1, int(round(current_h * scale)))
-                      if nw != current_w or nh != current_h:
-                           try:
-                               log.debug(f"  Scaling image {i+1} ({current_w}x{current_h} -> {nw}x{nh})")
-                               temp_img = img.resize((nw, nh), Image.Resampling.LANCZOS); scaled_images.append(temp_img); image_utils.safe_close(img)
-                           except Exception as e_scale: log.error(f"  ! Error scaling image {i+1}: {e_scale}"); scaled_images.append(img)
-                      else: scaled_images.append(img)
-                 else: scaled_images.append(img)
-            processed_images = []
-        else: log.error("  Base image zero size. Scaling skipped."); scaled_images = processed_images; processed_images = []
-    else: log.info("Proportional scaling disabled or no images."); scaled_images = processed_images; processed_images = []
-
-
-    # --- 7. Сборка Коллажа ---
-    num_final_images = len(scaled_images)
-    if num_final_images == 0:
-        log.error("No images left after scaling step (if enabled). Cannot create collage.")
-        log.info(">>> Exiting: No images left after scaling.")
-        # Очистка, если что-то осталось в scaled_images (хотя не должно)
-        for img in scaled_images: image_utils.safe_close(img)
-        return False # Возвращаем False
-    log.info(f"--- Assembling collage ({num_final_images} images) ---")
-    
-    # === Убедимся, что расчет grid_cols и grid_rows на месте ===
-    grid_cols = forced_cols if forced_cols > 0 else max(1, int(math.ceil(math.sqrt(num_final_images))))
-    grid_rows = max(1, int(math.ceil(num_final_images / grid_cols))) 
-    # ==========================================================
-
-    max_w = max((img.width for img in scaled_images if img), default=1)
-    max_h = max((img.height for img in scaled_images if img), default=1)
-    spacing_px_h = int(round(max_w * (spacing_percent / 100.0)))
-    spacing_px_v = int(round(max_h * (spacing_percent / 100.0)))
-    canvas_width = (grid_cols * max_w) + ((grid_cols + 1) * spacing_px_h)
-    canvas_height = (grid_rows * max_h) + ((grid_rows + 1) * spacing_px_v)
-    log.debug(f"  Grid: {grid_rows}x{grid_cols}, Cell: {max_w}x{max_h}, Space H/V: {spacing_px_h}/{spacing_px_v}, Canvas: {canvas_width}x{canvas_height}")
-
-    collage_canvas = None; final_collage = None
     try:
-        collage_canvas = Image.new('RGBA', (canvas_width, canvas_height), (0, 0, 0, 0))
-        # === ЛОГ 1 ===
-        log.debug(f"    Canvas created: {repr(collage_canvas)}") 
-        # ============
-        current_idx = 0
-        for r in range(grid_rows):
-            for c in range(grid_cols):
-                if current_idx >= num_final_images: break # Этот break внутри цикла
-                img = scaled_images[current_idx]
-                if img and img.width > 0 and img.height > 0:
-                     px = spacing_px_h + c * (max_w + spacing_px_h); py = spacing_px_v + r * (max_h + spacing_px_v)
-                     paste_x = px + (max_w - img.width) // 2; paste_y = py + (max_h - img.height) // 2
-                     try: collage_canvas.paste(img, (paste_x, paste_y), mask=img)
-                     except Exception as e_paste: log.error(f"  ! Error pasting image {current_idx+1}: {e_paste}")
-                current_idx += 1
-            if current_idx >= num_final_images: break # Этот break внутри цикла
-        
-        log.info("  Images placed on collage canvas.")
-        for img in scaled_images: image_utils.safe_close(img) # Закрываем исходники
-        scaled_images = []
-        
         final_collage = collage_canvas # Передаем владение
         # === ЛОГ 2 ===
         log.debug(f"    final_collage assigned: {repr(final_collage)}") 
@@ -965,66 +2003,20 @@ def run_collage_processing(**all_settings: Dict[str, Any]) -> bool:
 
         # --- 8. Трансформации Коллажу ---
         log.info("--- Applying transformations to collage ---")
-        # Яркость/Контраст
-        if bc_settings.get('enable_bc'):
-            final_collage = image_utils.apply_brightness_contrast(
-                final_collage,
-                brightness_factor=bc_settings.get('brightness_factor', 1.0),
-                contrast_factor=bc_settings.get('contrast_factor', 1.0)
-            )
-            if not final_collage: raise ValueError("Collage became None after brightness/contrast.")
-        
-        # Соотношение сторон
-        # === ИСПРАВЛЕНА ПРОВЕРКА ФЛАГА ===
-        if coll_settings.get('enable_force_aspect_ratio'): # Проверяем флаг
-            aspect_ratio_coll = coll_settings.get('force_collage_aspect_ratio')
-            if aspect_ratio_coll:
-                # Вызов ТОЛЬКО если флаг True и значение есть
-                final_collage = _apply_force_aspect_ratio(final_collage, aspect_ratio_coll)
-                if not final_collage: raise ValueError("Collage became None after aspect ratio.")
-                log.info(f"    Collage Force Aspect Ratio applied. New size: {final_collage.size}")
-            else:
-                log.warning("Collage force aspect ratio enabled but ratio value is missing/invalid.")
-        
-        # Макс. размер
-        if coll_settings.get('enable_max_dimensions'): # Проверяем флаг
-            max_w_coll = coll_settings.get('max_collage_width', 0)
-            max_h_coll = coll_settings.get('max_collage_height', 0)
-            if max_w_coll > 0 or max_h_coll > 0:
-                 final_collage = _apply_max_dimensions(final_collage, max_w_coll, max_h_coll)
-                 if not final_collage: raise ValueError("Collage became None after max dimensions.")
-            else:
-                 log.warning("Collage max dimensions enabled but width/height are zero.")
-
-        # Точный холст
-        # --- Логика точного холста --- 
-        canvas_applied_coll = False
-        if coll_settings.get('enable_exact_canvas'): # Проверяем флаг
-            exact_w_coll = coll_settings.get('final_collage_exact_width', 0)
-            exact_h_coll = coll_settings.get('final_collage_exact_height', 0)
-            if exact_w_coll > 0 and exact_h_coll > 0:
-                # Вызов ТОЛЬКО если флаг True и значения корректны
-                final_collage = _apply_final_canvas_or_prepare(final_collage, exact_w_coll, exact_h_coll, output_format, valid_jpg_bg)
-                if not final_collage: raise ValueError("Collage became None after exact canvas.")
-                log.info(f"    Collage Exact Canvas applied. New size: {final_collage.size}")
-                canvas_applied_coll = True
-            else:
-                log.warning("Collage exact canvas enabled but width/height are zero.")
-        
-        # Вызываем _apply_final_canvas_or_prepare в режиме подготовки,
-        # только если точный холст не был применен выше.
-        if not canvas_applied_coll:
-            log.debug("  Applying prepare mode to collage (no exact canvas applied).")
-            final_collage = _apply_final_canvas_or_prepare(final_collage, 0, 0, output_format, valid_jpg_bg)
-            if not final_collage: raise ValueError("Collage became None after prepare mode.")
-        # ----------------------------- 
+        # Яркость/контраст, соотношение сторон, макс. размер, точный холст или подготовка к сохранению
+        final_collage = plan.run_finish(final_collage, pipeline_plan.StageState(collage_resample))
 
         # --- 9. Сохранение Коллажа ---
         log.info("--- Saving final collage ---")
-        save_successful = _save_image(final_collage, output_file_path, output_format, jpeg_quality)
+        # Один файл: при любой политике, кроме 'none', он сбрасывается на диск сразу
+        collage_fsync = durable_io.resolve_durability(perf_settings)['mode'] != 'none'
+        save_successful = _save_image(final_collage, output_file_path, output_format, jpeg_quality, fast_assembly, collage_fsync)
         if save_successful:
             log.info(f"--- Collage processing finished successfully! Saved to {output_file_path} ---")
             success_flag = True # Устанавливаем флаг успеха
+            if pending_layout_path:
+                try: os.replace(pending_layout_path, layout_path); pending_layout_path = None; log.debug(f"  Collage layout saved: {layout_path}")
+                except OSError as e: log.warning(f"  Could not save collage layout {layout_path}: {e}")
         else:
             log.error("--- Collage processing failed during final save. ---")
             success_flag = False # Флаг неудачи
@@ -1038,6 +2030,10 @@ def run_collage_processing(**all_settings: Dict[str, Any]) -> bool:
         # Очищаем оставшиеся списки на всякий случай
         for img in processed_images: image_utils.safe_close(img)
         for img in scaled_images: image_utils.safe_close(img)
+        _release_shared_cells(shared_handles, scratch_dir)
+        if pending_layout_path:
+            try: os.remove(pending_layout_path)
+            except OSError: pass
         gc.collect() # Принудительная сборка мусора
 
     total_time = time.time() - start_time
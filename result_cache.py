@@ -0,0 +1,175 @@
+# result_cache.py
+# Кеш готовых результатов по содержимому: ключ = хеш исходного файла +
+# отпечаток настроек + версия конвейера. Одинаковые исходники с одинаковыми
+# настройками (в разных папках, пресетах, запусках) обрабатываются один раз.
+#
+# Запись атомарна (временный файл + os.replace), поэтому кешем могут
+# одновременно пользоваться несколько процессов-обработчиков и запусков.
+# Размер ограничивается вытеснением давно не использованных записей (LRU по
+# mtime, который обновляется при каждом попадании).
+
+import os
+import time
+import uuid
+import shutil
+import hashlib
+import logging
+from typing import Dict, Any, Optional
+
+import file_hashing
+import durable_io
+
+log = logging.getLogger(__name__)
+
+# Увеличивать при любом изменении кода обработки, меняющем результат:
+# записи с прежней версией перестают совпадать и со временем вытесняются.
+PIPELINE_VERSION = "1"
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'image_processor', 'results')
+LOCK_FILENAME = ".evict.lock"
+STALE_LOCK_SECONDS = 600
+
+
+class ResultCache:
+    """Дисковый кеш готовых файлов результата с ограничением размера."""
+
+    def __init__(self, cache_dir: Optional[str] = None, max_bytes: int = 0):
+        self.cache_dir = os.path.abspath(cache_dir or DEFAULT_CACHE_DIR)
+        self.max_bytes = max(0, int(max_bytes))
+
+    @classmethod
+    def from_settings(cls, cache_settings: Dict[str, Any]) -> 'ResultCache':
+        """Создает кеш по секции настроек cache (result_cache_dir, result_cache_max_mb)."""
+        try: max_mb = float(cache_settings.get('result_cache_max_mb', 0) or 0)
+        except (TypeError, ValueError): max_mb = 0.0
+        return cls(cache_settings.get('result_cache_dir') or None, int(max_mb * 1024 * 1024))
+
+    @staticmethod
+    def make_key(source_hash: str, settings_fingerprint: str, output_ext: str) -> str:
+        payload = f"{source_hash}|{settings_fingerprint}|{PIPELINE_VERSION}|{output_ext.lower()}"
+        return hashlib.blake2b(payload.encode('utf-8'), digest_size=20).hexdigest()
+
+    def key_for_file(self, source_path: str, settings_fingerprint: str, output_ext: str) -> Optional[str]:
+        """Ключ для исходного файла или None, если файл не удалось прочитать."""
+        source_hash = file_hashing.hash_file(source_path)
+        return self.make_key(source_hash, settings_fingerprint, output_ext) if source_hash else None
+
+    def _entry_path(self, key: str, output_ext: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}{output_ext.lower()}")
+
+    def fetch(self, key: str, output_ext: str, dest_path: str, fsync: bool = False) -> bool:
+        """
+        Копирует результат из кеша в dest_path атомарно (durable_io.copy_file;
+        fsync=True - со сбросом на диск). False - промах, dest_path не тронут.
+        """
+        entry_path = self._entry_path(key, output_ext)
+        try:
+            durable_io.copy_file(entry_path, dest_path, fsync)
+        except FileNotFoundError:
+            return False # Нет записи (или ее только что вытеснили)
+        except OSError as e:
+            log.warning(f"  ! Result cache read failed for {key}: {e}")
+            return False
+        try: os.utime(entry_path, None) # Отметка использования для LRU
+        except OSError: pass
+        return True
+
+    def store(self, key: str, output_ext: str, src_path: str) -> bool:
+        """Атомарно помещает готовый файл в кеш."""
+        entry_path = self._entry_path(key, output_ext)
+        tmp_path = f"{entry_path}.{os.getpid()}_{uuid.uuid4().hex}.tmp"
+        try:
+            os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+            shutil.copyfile(src_path, tmp_path)
+            os.replace(tmp_path, entry_path)
+            return True
+        except OSError as e:
+            log.warning(f"  ! Result cache write failed for {key}: {e}")
+            try: os.remove(tmp_path)
+            except OSError: pass
+            return False
+
+    def fetch_bytes(self, key: str, output_ext: str) -> Optional[bytes]:
+        """Содержимое результата из кеша (для записи в архив результатов). None - промах."""
+        entry_path = self._entry_path(key, output_ext)
+        try:
+            with open(entry_path, 'rb') as f: data = f.read()
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            log.warning(f"  ! Result cache read failed for {key}: {e}")
+            return None
+        try: os.utime(entry_path, None)
+        except OSError: pass
+        return data
+
+    def store_bytes(self, key: str, output_ext: str, data: bytes) -> bool:
+        """Атомарно помещает в кеш результат, закодированный в памяти."""
+        entry_path = self._entry_path(key, output_ext)
+        tmp_path = f"{entry_path}.{os.getpid()}_{uuid.uuid4().hex}.tmp"
+        try:
+            os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+            with open(tmp_path, 'wb') as f: f.write(data)
+            os.replace(tmp_path, entry_path)
+            return True
+        except OSError as e:
+            log.warning(f"  ! Result cache write failed for {key}: {e}")
+            try: os.remove(tmp_path)
+            except OSError: pass
+            return False
+
+    def _acquire_lock(self) -> Optional[str]:
+        """(Helper) Файловая блокировка вытеснения; None, если вытесняет другой процесс."""
+        lock_path = os.path.join(self.cache_dir, LOCK_FILENAME)
+        for _ in range(2):
+            try:
+                fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.write(fd, str(os.getpid()).encode()); os.close(fd)
+                return lock_path
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(lock_path) < STALE_LOCK_SECONDS: return None
+                    log.warning(f"Removing stale result cache lock: {lock_path}")
+                    os.remove(lock_path)
+                except OSError: return None
+            except OSError as e:
+                log.warning(f"Cannot create result cache lock {lock_path}: {e}")
+                return None
+        return None
+
+    def enforce_size_limit(self) -> Dict[str, int]:
+        """
+        Вытесняет самые давно использованные записи, пока размер кеша больше лимита.
+        Возвращает {'entries', 'total_bytes', 'evicted', 'freed_bytes'}.
+        """
+        stats = {'entries': 0, 'total_bytes': 0, 'evicted': 0, 'freed_bytes': 0}
+        if not os.path.isdir(self.cache_dir): return stats
+        lock_path = self._acquire_lock()
+        if not lock_path:
+            log.debug("Result cache eviction skipped: another process holds the lock.")
+            return stats
+        try:
+            entries = []
+            for shard in os.scandir(self.cache_dir):
+                if not shard.is_dir(): continue
+                for entry in os.scandir(shard.path):
+                    if entry.name.endswith('.tmp') or not entry.is_file(): continue
+                    try: st = entry.stat()
+                    except OSError: continue
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            stats['entries'] = len(entries)
+            if self.max_bytes > 0 and total > self.max_bytes:
+                entries.sort() # Сначала самые давно использованные
+                for _, size, path in entries:
+                    if total <= self.max_bytes: break
+                    try: os.remove(path)
+                    except FileNotFoundError: pass
+                    except OSError as e: log.warning(f"  Could not evict {path}: {e}"); continue
+                    total -= size; stats['evicted'] += 1; stats['freed_bytes'] += size
+                stats['entries'] -= stats['evicted']
+            stats['total_bytes'] = total
+            return stats
+        finally:
+            try: os.remove(lock_path)
+            except OSError: pass
@@ -0,0 +1,102 @@
+# run_control.py
+# Кооперативная отмена и ограничение времени запуска обработки.
+# Сценарии проверяют RunControl перед отправкой каждого следующего файла:
+# уже начатые файлы дорабатываются, новые не запускаются.
+
+import time
+import logging
+import threading
+from typing import Dict, Any, Optional
+
+log = logging.getLogger(__name__)
+
+
+class CancelToken:
+    """Флаг отмены, который можно установить из другого потока (например, из UI)."""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self.reason: Optional[str] = None
+
+    def cancel(self, reason: str = "cancelled by user"):
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+            log.warning(f"Cancellation requested: {reason}")
+
+    @property
+    def is_cancelled(self) -> bool:
+        return self._event.is_set()
+
+
+class RunControl:
+    """
+    Управление запуском: токен отмены и необязательный срок (deadline_seconds
+    от начала запуска). По истечении срока новые файлы не запускаются.
+    При fast_on_pressure, если прогноз по уже обработанным файлам не
+    укладывается в оставшееся время, оставшиеся файлы обрабатываются
+    быстрым профилем (ресайз BILINEAR, сохранение без optimize/progressive).
+    """
+
+    def __init__(self, token: Optional[CancelToken] = None, deadline_seconds: Optional[float] = None,
+                 fast_on_pressure: bool = True):
+        self.token = token or CancelToken()
+        self.deadline_seconds = deadline_seconds if deadline_seconds and deadline_seconds > 0 else None
+        self.fast_on_pressure = fast_on_pressure
+        self._started_at: Optional[float] = None
+        self._fast_mode = False
+
+    @classmethod
+    def from_settings(cls, perf_settings: Dict[str, Any], token: Optional[CancelToken] = None) -> 'RunControl':
+        """Создает RunControl по секции настроек performance (deadline_minutes, fast_on_deadline)."""
+        try: deadline_minutes = float(perf_settings.get('deadline_minutes', 0) or 0)
+        except (TypeError, ValueError): deadline_minutes = 0.0
+        return cls(token=token, deadline_seconds=deadline_minutes * 60.0,
+                   fast_on_pressure=bool(perf_settings.get('fast_on_deadline', True)))
+
+    def start(self):
+        """Отмечает начало запуска (повторные вызовы не сдвигают срок)."""
+        if self._started_at is None: self._started_at = time.monotonic()
+
+    def cancel(self, reason: str = "cancelled by user"):
+        self.token.cancel(reason)
+
+    def elapsed(self) -> float:
+        return 0.0 if self._started_at is None else time.monotonic() - self._started_at
+
+    def time_left(self) -> Optional[float]:
+        """Секунд до срока или None, если срок не задан."""
+        if self.deadline_seconds is None: return None
+        return self.deadline_seconds - self.elapsed()
+
+    def should_stop(self) -> bool:
+        """True, если запуск отменен или срок истек (тогда токен отменяется с причиной 'deadline')."""
+        if self.token.is_cancelled: return True
+        time_left = self.time_left()
+        if time_left is not None and time_left <= 0:
+            self.token.cancel(f"deadline of {self.deadline_seconds:g}s reached")
+            return True
+        return False
+
+    @property
+    def stop_reason(self) -> Optional[str]:
+        return self.token.reason
+
+    def use_fast_profile(self, done: int, remaining: int) -> bool:
+        """
+        Нужно ли обрабатывать следующий файл быстрым профилем.
+        Прогноз: оставшиеся файлы / наблюдаемая скорость (файлов в секунду).
+        Однажды включенный быстрый режим остается включенным до конца запуска.
+        """
+        if self._fast_mode: return True
+        time_left = self.time_left()
+        if not self.fast_on_pressure or time_left is None or done <= 0 or remaining <= 0: return False
+        projected = remaining * self.elapsed() / done
+        if projected > time_left:
+            self._fast_mode = True
+            log.warning(f"Deadline pressure: ~{projected:.1f}s needed for {remaining} file(s), {time_left:.1f}s left. Switching to fast profile.")
+        return self._fast_mode
+
+    @property
+    def fast_mode(self) -> bool:
+        return self._fast_mode
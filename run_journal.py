@@ -0,0 +1,170 @@
+# run_journal.py
+# Журнал запуска в папке результатов: дописываемый JSONL-файл, каждая запись
+# которого сбрасывается на диск (fsync) до продолжения работы. В журнал
+# попадают завершенные файлы, удаления оригиналов и переименования (запись о
+# переименовании делается ДО самого os.rename). Переименования одного прохода
+# заключены между rename_begin и rename_end. После сбоя (питание, перезапуск
+# Streamlit) по журналу можно откатить незавершенный проход переименования
+# (файлы __temp_...) и продолжить обработку с уже готовых файлов; завершенный
+# проход (в том числе в остановленном запуске) не откатывается.
+# После полностью завершенного запуска журнал удаляется: продолжать нечего.
+#
+# Записи:
+#   {'type': 'run_start', 'version', 'run_id', 'started', 'input', 'output_ext', 'settings_fingerprint'}
+#   {'type': 'file', 'file', 'status', 'output'}
+#   {'type': 'delete', 'file'}
+#   {'type': 'rename_begin'}
+#   {'type': 'rename', 'src', 'dst'}            (имена в папке результатов)
+#   {'type': 'rename_end'}
+#   {'type': 'run_end', 'complete', 'stop_reason'}
+
+import os
+import json
+import time
+import uuid
+import logging
+from typing import Dict, Any, Optional, List, Tuple, Iterable
+
+import durable_io
+
+log = logging.getLogger(__name__)
+
+JOURNAL_FILENAME = ".processing_journal.jsonl"
+JOURNAL_VERSION = 1
+
+
+class RunJournal:
+    """Журнал текущего запуска. Ошибки записи не прерывают обработку: журнал отключается."""
+
+    def __init__(self, output_dir: str):
+        self.output_dir = output_dir
+        self.path = os.path.join(output_dir, JOURNAL_FILENAME)
+        self._file = None
+
+    def start(self, header: Dict[str, Any], carried_records: Iterable[Dict[str, Any]] = ()) -> bool:
+        """
+        Начинает новый журнал (заменяя прежний атомарно). carried_records -
+        записи прерванного запуска, которые продолжаются в этом (готовые файлы).
+        """
+        header = dict(header, type='run_start', version=JOURNAL_VERSION,
+                      run_id=uuid.uuid4().hex, started=time.time())
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for record in [header, *carried_records]: f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                f.flush(); os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            durable_io.fsync_dir(self.output_dir)
+            self._file = open(self.path, 'a', encoding='utf-8')
+            log.debug(f"Run journal started: {self.path}")
+            return True
+        except OSError as e:
+            log.error(f"Could not start run journal {self.path}: {e}. Continuing without journal.")
+            try: os.remove(tmp_path)
+            except OSError: pass
+            return False
+
+    def _append(self, record: Dict[str, Any]):
+        if self._file is None: return
+        try:
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._file.flush(); os.fsync(self._file.fileno())
+        except OSError as e:
+            log.error(f"Run journal write failed ({e}). Journal disabled for the rest of the run.")
+            self.close()
+
+    def record_file(self, result: Dict[str, Any]):
+        """Фиксирует завершение файла (status - как в результате обработчика)."""
+        output_path = result.get('output_path')
+        self._append({'type': 'file', 'file': result['file'], 'status': result['status'],
+                      'output': os.path.basename(output_path) if output_path else None})
+
+    def record_delete(self, source_path: str):
+        self._append({'type': 'delete', 'file': os.path.basename(source_path)})
+
+    def record_rename(self, src_path: str, dst_path: str):
+        """Записывается перед переименованием: при сбое его можно откатить."""
+        self._append({'type': 'rename', 'src': os.path.basename(src_path), 'dst': os.path.basename(dst_path)})
+
+    def begin_renames(self):
+        """Начало прохода переименования (оба этапа)."""
+        self._append({'type': 'rename_begin'})
+
+    def end_renames(self):
+        """Проход переименования завершен: откатывать его при следующем запуске не нужно."""
+        self._append({'type': 'rename_end'})
+
+    def finish(self, complete: bool, stop_reason: Optional[str] = None):
+        """
+        Отмечает конец запуска. complete=False (остановка) оставляет запуск
+        продолжаемым; журнал завершенного запуска удаляется из папки результатов.
+        """
+        self._append({'type': 'run_end', 'complete': bool(complete), 'stop_reason': stop_reason})
+        writable = self._file is not None
+        self.close()
+        if complete and writable:
+            try: os.remove(self.path); log.debug(f"Run journal removed (run complete): {self.path}")
+            except OSError as e: log.warning(f"Could not remove run journal {self.path}: {e}")
+
+    def close(self):
+        if self._file is None: return
+        try: self._file.close()
+        except OSError: pass
+        self._file = None
+
+
+def read_journal(output_dir: str) -> Optional[Dict[str, Any]]:
+    """
+    Читает журнал прошлого запуска или None, если журнала нет или он нечитаем.
+    Оборванная последняя строка (сбой во время записи) пропускается.
+    Возвращает {'header', 'files': {file: запись}, 'deleted': [...], 'renames': [(src, dst), ...],
+    'renamed': {имя до переименования: итоговое имя}, 'end'}: renames - переименования
+    незавершенного прохода (для отката), renamed - итог завершенных проходов.
+    """
+    path = os.path.join(output_dir, JOURNAL_FILENAME)
+    if not os.path.isfile(path): return None
+    state = {'header': None, 'files': {}, 'deleted': [], 'renames': [], 'renamed': {}, 'end': None}
+    origins: Dict[str, str] = {} # {текущее имя: имя до всех переименований}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line_no, line in enumerate(f, 1):
+                try: record = json.loads(line)
+                except json.JSONDecodeError: log.warning(f"Run journal: skipping damaged line {line_no}."); continue
+                kind = record.get('type')
+                if kind == 'run_start': state['header'] = record
+                elif kind == 'file': state['files'][record['file']] = record
+                elif kind == 'delete': state['deleted'].append(record['file'])
+                elif kind == 'rename_begin': state['renames'] = []
+                elif kind == 'rename': state['renames'].append((record['src'], record['dst']))
+                elif kind == 'rename_end':
+                    for src, dst in state['renames']:
+                        origin = origins.pop(src, src); origins[dst] = origin; state['renamed'][origin] = dst
+                    state['renames'] = []
+                elif kind == 'run_end': state['end'] = record
+    except OSError as e:
+        log.warning(f"Could not read run journal {path}: {e}")
+        return None
+    if not state['header'] or state['header'].get('version') != JOURNAL_VERSION:
+        log.warning(f"Run journal {path} has unsupported format. Ignoring it.")
+        return None
+    return state
+
+
+def is_interrupted(state: Optional[Dict[str, Any]]) -> bool:
+    """True, если прошлый запуск не дошел до конца (сбой) или был остановлен."""
+    return bool(state) and not (state['end'] and state['end'].get('complete'))
+
+
+def rollback_renames(output_dir: str, renames: List[Tuple[str, str]]) -> Tuple[int, int]:
+    """
+    Возвращает файлы результатов к именам до переименования, проходя записи
+    в обратном порядке (итоговое имя -> __temp_ -> исходное). Повторный вызов
+    безопасен: выполненные откаты пропускаются. Возвращает (откачено, ошибок).
+    """
+    restored = 0; errors = 0
+    for src, dst in reversed(renames):
+        src_path = os.path.join(output_dir, src); dst_path = os.path.join(output_dir, dst)
+        if not os.path.exists(dst_path) or os.path.exists(src_path): continue
+        try: os.rename(dst_path, src_path); restored += 1; log.debug(f"  Rolled back: '{dst}' -> '{src}'")
+        except OSError as e: log.error(f"  ! Could not roll back '{dst}' -> '{src}': {e}"); errors += 1
+    return restored, errors
@@ -0,0 +1,83 @@
+# run_manifest.py
+# Манифест запуска в папке результатов: для каждого исходного файла хранится
+# его размер, mtime (и при желании хеш), имя результата и отпечаток настроек.
+# При повторном запуске неизмененные файлы с теми же настройками пропускаются.
+
+import os
+import json
+import logging
+from typing import Dict, Any, Optional
+
+import file_hashing
+
+log = logging.getLogger(__name__)
+
+MANIFEST_FILENAME = ".processing_manifest.json"
+MANIFEST_VERSION = 1
+
+
+def new_manifest(settings_fingerprint: Optional[str] = None) -> Dict[str, Any]:
+    """Пустой манифест для заданного отпечатка настроек."""
+    return {'version': MANIFEST_VERSION, 'settings_fingerprint': settings_fingerprint, 'entries': {}}
+
+
+def load_manifest(output_dir: str) -> Dict[str, Any]:
+    """Загружает манифест из папки результатов; при отсутствии или повреждении - пустой."""
+    path = os.path.join(output_dir, MANIFEST_FILENAME)
+    if not os.path.isfile(path): return new_manifest()
+    try:
+        with open(path, 'r', encoding='utf-8') as f: manifest = json.load(f)
+        if not isinstance(manifest, dict) or manifest.get('version') != MANIFEST_VERSION or not isinstance(manifest.get('entries'), dict):
+            log.warning(f"Manifest {path} has unsupported format. Ignoring it.")
+            return new_manifest()
+        return manifest
+    except (OSError, json.JSONDecodeError) as e:
+        log.warning(f"Could not read manifest {path}: {e}. Ignoring it.")
+        return new_manifest()
+
+
+def save_manifest(output_dir: str, manifest: Dict[str, Any]) -> bool:
+    """Атомарно сохраняет манифест (через временный файл и os.replace)."""
+    path = os.path.join(output_dir, MANIFEST_FILENAME)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f: json.dump(manifest, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, path)
+        log.debug(f"Manifest saved: {path} ({len(manifest.get('entries', {}))} entries)")
+        return True
+    except OSError as e:
+        log.error(f"Could not save manifest {path}: {e}")
+        try: os.remove(tmp_path)
+        except OSError: pass
+        return False
+
+
+def make_entry(source_path: str, use_hash: bool, fast: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    Запись манифеста для обработанного файла или None, если файл уже недоступен.
+    Имя результата ('output') заполняется после переименования.
+    """
+    try: st = os.stat(source_path)
+    except OSError: return None
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns,
+            'hash': file_hashing.hash_file(source_path) if use_hash else None,
+            'output': None, 'fast': bool(fast)}
+
+
+def is_unchanged(entry: Optional[Dict[str, Any]], source_path: str, output_dir: str, use_hash: bool) -> bool:
+    """
+    True, если файл не менялся с прошлого запуска и его результат на месте.
+    Сравниваются размер и mtime; при use_hash и совпадающем размере, но другом
+    mtime (копирование, touch) решает хеш содержимого - запись тогда обновляется.
+    Результаты быстрого профиля (нехватка времени) всегда переобрабатываются.
+    """
+    if not entry or entry.get('fast'): return False
+    if not entry.get('output') or not os.path.isfile(os.path.join(output_dir, entry['output'])): return False
+    try: st = os.stat(source_path)
+    except OSError: return False
+    if st.st_size != entry.get('size'): return False
+    if st.st_mtime_ns == entry.get('mtime_ns'): return True
+    if not use_hash or not entry.get('hash'): return False
+    if file_hashing.hash_file(source_path) != entry['hash']: return False
+    entry['mtime_ns'] = st.st_mtime_ns
+    return True
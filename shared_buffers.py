@@ -0,0 +1,126 @@
+# shared_buffers.py
+# Передача обработанных изображений между процессами без сериализации пикселей.
+# Обработчик записывает RGBA-пиксели в общий сегмент памяти (или в отображаемый
+# в память временный файл на Windows) и возвращает только небольшой дескриптор.
+# Родительский процесс открывает сегмент и создает изображение поверх него
+# через Image.frombuffer - без копирования.
+
+import os
+import mmap
+import uuid
+import logging
+from typing import Dict, Any, Optional, Tuple
+from multiprocessing import shared_memory, resource_tracker
+
+from PIL import Image
+
+log = logging.getLogger(__name__)
+
+# На Windows именованный сегмент живет, пока открыт хотя бы один дескриптор,
+# поэтому после завершения обработчика он бы исчез. Там используем файл + mmap.
+USE_SCRATCH_FILES = os.name == 'nt'
+
+
+def _create_untracked_shm(size: int) -> shared_memory.SharedMemory:
+    """
+    (Helper) Создает сегмент, не регистрируя его в resource_tracker обработчика.
+    Владельцем сегмента становится родительский процесс (он же делает unlink).
+    """
+    try:
+        return shared_memory.SharedMemory(create=True, size=size, track=False) # Python 3.13+
+    except TypeError:
+        shm = shared_memory.SharedMemory(create=True, size=size)
+        try: resource_tracker.unregister(shm._name, 'shared_memory')
+        except Exception: pass
+        return shm
+
+
+def _paste_into(buffer: Any, img_rgba: Image.Image):
+    """(Helper) Записывает пиксели прямо в буфер сегмента, без промежуточной копии tobytes()."""
+    target = Image.frombuffer('RGBA', img_rgba.size, buffer, 'raw', 'RGBA', 0, 1)
+    try:
+        target.readonly = 0 # Буфер доступен на запись: paste меняет его на месте, а не копию
+        target.paste(img_rgba, (0, 0))
+    finally:
+        target.close() # Отпускает буфер до закрытия сегмента
+
+
+def export_image(img: Image.Image, scratch_dir: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Копирует пиксели изображения (RGBA) в разделяемую память.
+    Возвращает дескриптор {'kind', 'name', 'size', 'mode', 'nbytes'},
+    который можно передать в другой процесс.
+    """
+    img_rgba = img if img.mode == 'RGBA' else img.convert('RGBA')
+    try:
+        width, height = img_rgba.size
+        nbytes = width * height * 4
+        if USE_SCRATCH_FILES:
+            name = os.path.join(scratch_dir or os.getcwd(), f"cell_{uuid.uuid4().hex}.rgba")
+            with open(name, 'w+b') as f:
+                f.truncate(max(1, nbytes))
+                with mmap.mmap(f.fileno(), max(1, nbytes)) as buffer:
+                    if nbytes: _paste_into(buffer, img_rgba)
+            kind = 'file'
+        else:
+            shm = _create_untracked_shm(max(1, nbytes))
+            try:
+                if nbytes: _paste_into(shm.buf, img_rgba)
+            except Exception:
+                shm.close(); shm.unlink()
+                raise
+            shm.close()
+            name = shm.name
+            kind = 'shm'
+        return {'kind': kind, 'name': name, 'size': (width, height), 'mode': 'RGBA', 'nbytes': nbytes}
+    finally:
+        if img_rgba is not img: img_rgba.close()
+
+
+def attach_image(descriptor: Dict[str, Any]) -> Tuple[Image.Image, Any]:
+    """
+    Открывает сегмент по дескриптору и возвращает (изображение, handle).
+    Изображение ссылается на разделяемую память напрямую (только чтение).
+    handle нужно передать в release() после закрытия изображения.
+    """
+    nbytes = descriptor['nbytes']
+    if descriptor['kind'] == 'file':
+        with open(descriptor['name'], 'r+b') as f:
+            buffer = mmap.mmap(f.fileno(), max(1, nbytes))
+        handle = ('file', buffer, descriptor['name'])
+    else:
+        shm = shared_memory.SharedMemory(name=descriptor['name'])
+        buffer = shm.buf
+        handle = ('shm', shm, descriptor['name'])
+    img = Image.frombuffer(descriptor['mode'], tuple(descriptor['size']), buffer, 'raw', descriptor['mode'], 0, 1)
+    return img, handle
+
+
+def release(handle: Any):
+    """Закрывает и удаляет сегмент. Изображение поверх него должно быть уже закрыто."""
+    if not handle: return
+    kind, obj, name = handle
+    try:
+        obj.close()
+    except BufferError:
+        # Изображение еще держит буфер - сегмент освободится при сборке мусора
+        log.debug(f"  Shared buffer {name} still referenced; deferring close.")
+    except Exception as e:
+        log.debug(f"  Error closing shared buffer {name}: {e}")
+    try:
+        if kind == 'shm': obj.unlink()
+        else: os.remove(name)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        log.warning(f"  Could not remove shared buffer {name}: {e}")
+
+
+def discard(descriptor: Dict[str, Any]):
+    """Удаляет сегмент, который так и не был открыт (например, при ошибке сборки)."""
+    try:
+        img, handle = attach_image(descriptor)
+    except Exception:
+        return
+    img.close()
+    release(handle)
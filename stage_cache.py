@@ -0,0 +1,128 @@
+# stage_cache.py
+# Кеш промежуточного результата конвейера: изображение после дорогих
+# начальных шагов (декодирование, пре-ресайз, отбеливание, удаление фона
+# и обрезка) вместе с данными, нужными следующим шагам (белый ли периметр,
+# размер до обрезки). При изменении только поздних настроек (поля, размер,
+# холст, формат, качество) повторно выполняется лишь хвост конвейера.
+#
+# Формат файла - несжатые пиксели, пригодные для отображения в память:
+#   MAGIC (8 байт) | длина заголовка (uint32 LE) | заголовок JSON |
+#   выравнивание до DATA_ALIGNMENT | пиксели (Image.tobytes())
+
+import os
+import json
+import mmap
+import uuid
+import struct
+import logging
+from typing import Dict, Any, Optional, Tuple
+
+from PIL import Image
+
+import result_cache
+
+log = logging.getLogger(__name__)
+
+MAGIC = b'PWSTAGE1'
+DATA_ALIGNMENT = 64
+STAGE_EXT = '.rawimg'
+# Режимы, которые сохраняются как есть (остальные не кешируются)
+RAW_MODES = ('L', 'LA', 'RGB', 'RGBA')
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'image_processor', 'stages')
+
+
+class StageCache(result_cache.ResultCache):
+    """Дисковый кеш промежуточных изображений (LRU-вытеснение - как у ResultCache)."""
+
+    def __init__(self, cache_dir: Optional[str] = None, max_bytes: int = 0):
+        super().__init__(cache_dir or DEFAULT_CACHE_DIR, max_bytes)
+
+    @classmethod
+    def from_settings(cls, cache_settings: Dict[str, Any]) -> 'StageCache':
+        """Создает кеш по секции настроек cache (stage_cache_dir, stage_cache_max_mb)."""
+        try: max_mb = float(cache_settings.get('stage_cache_max_mb', 0) or 0)
+        except (TypeError, ValueError): max_mb = 0.0
+        return cls(cache_settings.get('stage_cache_dir') or None, int(max_mb * 1024 * 1024))
+
+    def store_image(self, key: str, img: Image.Image, meta: Dict[str, Any]) -> bool:
+        """Атомарно записывает изображение и метаданные. False, если режим не поддерживается."""
+        return write_raw_image(self._entry_path(key, STAGE_EXT), img, meta)
+
+    def load_image(self, key: str) -> Optional[Tuple[Image.Image, Dict[str, Any], Any]]:
+        """
+        Открывает запись через mmap и возвращает (изображение, meta, handle) или None.
+        handle нужно передать в release() после закрытия изображения.
+        """
+        entry_path = self._entry_path(key, STAGE_EXT)
+        loaded = read_raw_image(entry_path)
+        if loaded:
+            try: os.utime(entry_path, None) # Отметка использования для LRU
+            except OSError: pass
+        return loaded
+
+
+def write_raw_image(path: str, img: Image.Image, meta: Dict[str, Any]) -> bool:
+    """Атомарно записывает изображение в формате кеша (заголовок + несжатые пиксели)."""
+    if img.mode not in RAW_MODES:
+        log.debug(f"  Stage cache: mode {img.mode} is not cached.")
+        return False
+    tmp_path = f"{path}.{os.getpid()}_{uuid.uuid4().hex}.tmp"
+    header = {'mode': img.mode, 'size': list(img.size), 'meta': meta}
+    header_bytes = json.dumps(header).encode('utf-8')
+    prefix_len = len(MAGIC) + 4 + len(header_bytes)
+    data_offset = -(-prefix_len // DATA_ALIGNMENT) * DATA_ALIGNMENT
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, 'wb') as f:
+            f.write(MAGIC); f.write(struct.pack('<I', len(header_bytes))); f.write(header_bytes)
+            f.write(b'\0' * (data_offset - prefix_len))
+            f.write(img.tobytes())
+        os.replace(tmp_path, path)
+        return True
+    except OSError as e:
+        log.warning(f"  ! Raw image write failed for {path}: {e}")
+        try: os.remove(tmp_path)
+        except OSError: pass
+        return False
+
+
+def read_raw_image(path: str) -> Optional[Tuple[Image.Image, Dict[str, Any], Any]]:
+    """
+    Открывает файл формата кеша через mmap: (изображение, meta, handle) или None.
+    Изображение ссылается на отображенный файл без копирования (только чтение).
+    """
+    try:
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC: log.warning(f"  ! Raw image {path} is corrupt."); return None
+            header_len = struct.unpack('<I', f.read(4))[0]
+            header = json.loads(f.read(header_len).decode('utf-8'))
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, struct.error) as e:
+        log.warning(f"  ! Raw image read failed for {path}: {e}")
+        return None
+    mode = header['mode']; size = tuple(header['size'])
+    prefix_len = len(MAGIC) + 4 + header_len
+    data_offset = -(-prefix_len // DATA_ALIGNMENT) * DATA_ALIGNMENT
+    view = memoryview(buffer)[data_offset:]
+    try:
+        img = Image.frombuffer(mode, size, view, 'raw', mode, 0, 1)
+    except Exception as e:
+        log.warning(f"  ! Raw image {path} cannot be mapped: {e}")
+        release((buffer, view))
+        return None
+    return img, header.get('meta', {}), (buffer, view)
+
+
+def release(handle: Any):
+    """Закрывает отображение записи. Изображение поверх него должно быть уже закрыто."""
+    if not handle: return
+    buffer, view = handle
+    try:
+        view.release()
+        buffer.close()
+    except BufferError:
+        # Изображение еще держит буфер - отображение закроется при сборке мусора
+        log.debug("  Stage cache mapping still referenced; deferring close.")
@@ -0,0 +1,74 @@
+import io
+import os
+import copy
+import tarfile
+import zipfile
+
+import pytest
+from PIL import Image
+
+import archive_input
+import config_manager
+import processing_workflows
+
+# Члены с опасными путями, служебные файлы macOS и повторная запись того же пути
+MEMBER_NAMES = ['../evil.jpg', '/abs/x.jpg', 'sub/./dir/a.jpg', '__MACOSX/sub/._a.jpg', 'notes.txt', 'sub/dir/a.jpg']
+
+
+def _jpeg_bytes(shade):
+    buffer = io.BytesIO()
+    Image.new('RGB', (90, 60), (shade, 90, 160)).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+def _make_archive(path, kind):
+    contents = [(name, _jpeg_bytes(i * 40)) for i, name in enumerate(MEMBER_NAMES)]
+    if kind == 'zip':
+        with zipfile.ZipFile(path, 'w') as zf:
+            for name, data in contents: zf.writestr(name, data)
+    else:
+        with tarfile.open(path, 'w:gz' if kind == 'tar-stream' else 'w') as tf:
+            for name, data in contents:
+                info = tarfile.TarInfo(name); info.size = len(data)
+                tf.addfile(info, io.BytesIO(data))
+    return contents
+
+
+@pytest.mark.parametrize('kind, filename', [('zip', 'in.zip'), ('tar', 'in.tar'), ('tar-stream', 'in.tar.gz')])
+def test_members_are_flattened_inside_the_archive(tmp_path, kind, filename):
+    archive_path = str(tmp_path / filename)
+    contents = dict(_make_archive(archive_path, kind))
+    assert archive_input.archive_kind(archive_path) == kind
+    members = archive_input.list_members(archive_path)
+    assert [m.rel_path for m in members] == ['abs' + os.sep + 'x.jpg', 'evil.jpg', os.sep.join(['sub', 'dir', 'a.jpg'])]
+    # Из двух членов с путем sub/dir/a.jpg читается первый
+    assert [archive_input.read_member(m) for m in members] == [contents['/abs/x.jpg'], contents['../evil.jpg'], contents['sub/./dir/a.jpg']]
+
+
+def test_include_and_exclude_masks_apply_to_member_paths(tmp_path):
+    archive_path = str(tmp_path / 'in.zip')
+    _make_archive(archive_path, 'zip')
+    assert [m.name for m in archive_input.list_members(archive_path, include=['sub/*'])] == ['sub/./dir/a.jpg']
+    assert [m.name for m in archive_input.list_members(archive_path, exclude=['sub/*', 'abs/*'])] == ['../evil.jpg']
+
+
+def test_damaged_archive_raises_oserror(tmp_path):
+    archive_path = tmp_path / 'in.zip'
+    _make_archive(str(archive_path), 'zip')
+    archive_path.write_bytes(archive_path.read_bytes()[:200])
+    with pytest.raises(OSError):
+        archive_input.list_members(str(archive_path), kind='zip')
+
+
+def test_run_writes_flat_names_only_into_output_folder(tmp_path):
+    archive_path = str(tmp_path / 'in.zip'); output_folder = tmp_path / 'work' / 'out'
+    _make_archive(archive_path, 'zip')
+    settings = copy.deepcopy(config_manager.DEFAULT_SETTINGS)
+    settings['paths'].update(input_folder_path=archive_path, output_folder_path=str(output_folder), backup_folder_path='')
+    settings['individual_mode'].update(article_name='', delete_originals=True)
+    settings['performance'].update(max_workers=1)
+    stats = processing_workflows.run_individual_processing(**settings)
+    assert stats['processed'] == 3 and stats['errors'] == 0
+    assert sorted(os.listdir(output_folder)) == ['abs__x.jpg', 'evil.jpg', 'sub__dir__a.jpg']
+    assert os.listdir(tmp_path / 'work') == ['out']
+    assert os.path.isfile(archive_path) # Исходный архив не удаляется
@@ -0,0 +1,55 @@
+import os
+import copy
+import zipfile
+
+from PIL import Image
+
+import archive_output
+import config_manager
+import processing_workflows
+
+
+def test_members_are_stored_or_deflated_by_extension(tmp_path):
+    archive_path = str(tmp_path / 'results.zip')
+    writer = archive_output.ArchiveWriter(archive_path, fsync=True)
+    assert writer.add('ART.jpg', b'\xff\xd8' + b'j' * 1000)
+    assert writer.add('ART_1.png', b'p' * 1000)
+    assert not writer.add('ART.jpg', b'other') # Имя уже занято
+    assert writer.close()
+    assert not writer.add('ART_2.jpg', b'late')
+    with zipfile.ZipFile(archive_path) as zf:
+        assert [(i.filename, i.compress_type) for i in zf.infolist()] == [('ART.jpg', zipfile.ZIP_STORED), ('ART_1.png', zipfile.ZIP_DEFLATED)]
+        assert zf.read('ART.jpg') == b'\xff\xd8' + b'j' * 1000
+    assert writer.stats() == {'path': archive_path, 'members': 2, 'data_bytes': 2002, 'archive_bytes': os.path.getsize(archive_path)}
+    assert os.listdir(tmp_path) == ['results.zip']
+
+
+def test_abort_and_empty_close_leave_no_partial_archive(tmp_path):
+    archive_path = tmp_path / 'results.zip'
+    archive_path.write_bytes(b'previous archive')
+    writer = archive_output.ArchiveWriter(str(archive_path))
+    assert writer.add('ART.jpg', b'data')
+    writer.abort()
+    assert archive_path.read_bytes() == b'previous archive'
+    assert os.listdir(tmp_path) == ['results.zip']
+    empty = archive_output.ArchiveWriter(str(tmp_path / 'empty.zip'))
+    assert not empty.close()
+    assert os.listdir(tmp_path) == ['results.zip']
+
+
+def test_run_writes_results_into_archive_only(tmp_path):
+    input_folder = tmp_path / 'in'; output_folder = tmp_path / 'out'
+    input_folder.mkdir()
+    for i, name in enumerate(['IMG_1.jpg', 'IMG_2.png', 'IMG_3.jpg']):
+        Image.new('RGB', (90, 60), (60 * i, 90, 160)).save(input_folder / name)
+    settings = copy.deepcopy(config_manager.DEFAULT_SETTINGS)
+    settings['paths'].update(input_folder_path=str(input_folder), output_folder_path=str(output_folder), backup_folder_path='')
+    settings['individual_mode'].update(article_name='ART', output_archive=True)
+    settings['performance'].update(max_workers=1)
+    stats = processing_workflows.run_individual_processing(**settings)
+    assert stats['processed'] == 3 and stats['output_archive']['members'] == 3
+    assert os.listdir(output_folder) == ['ART.zip']
+    with zipfile.ZipFile(output_folder / 'ART.zip') as zf:
+        assert zf.namelist() == ['ART.jpg', 'ART_1.jpg', 'ART_2.jpg']
+        assert all(i.compress_type == zipfile.ZIP_STORED for i in zf.infolist())
+        assert zf.testzip() is None
@@ -0,0 +1,71 @@
+import os
+import copy
+import contextlib
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+import async_workflows
+import config_manager
+import run_journal
+
+
+def _settings(tmp_path, count=4):
+    input_folder = tmp_path / 'in'; backup_folder = tmp_path / 'backup'
+    input_folder.mkdir(); backup_folder.mkdir()
+    for i in range(count): Image.new('RGB', (90 + i * 10, 60), (40 * i, 90, 160)).save(input_folder / f"IMG_{i}.jpg")
+    settings = copy.deepcopy(config_manager.DEFAULT_SETTINGS)
+    settings['paths'].update(input_folder_path=str(input_folder), output_folder_path=str(tmp_path / 'out'),
+                             backup_folder_path=str(backup_folder))
+    settings['individual_mode'].update(article_name='ART', delete_originals=True, enable_journal=True)
+    settings['performance'].update(max_workers=1)
+    return settings
+
+
+def test_async_run_processes_all_files(tmp_path):
+    summary = asyncio.run(async_workflows.run_individual_processing_async(**_settings(tmp_path)))
+    assert summary['processed'] == 4 and summary['cancelled'] == 0
+    assert summary['backup_stats']['done'] == 4
+    assert sorted(os.listdir(tmp_path / 'out')) == ['ART.jpg', 'ART_1.jpg', 'ART_2.jpg', 'ART_3.jpg']
+    assert os.listdir(tmp_path / 'in') == []
+
+
+def test_closing_iteration_early_finalizes_partial_run(tmp_path):
+    async def first_result_only():
+        run = async_workflows.IndividualRun(**_settings(tmp_path))
+        async for result in run:
+            assert result['status'] == 'processed'
+            break
+        return await run.aclose()
+
+    summary = asyncio.run(first_result_only())
+    assert summary['processed'] >= 1 and summary['processed'] + summary['cancelled'] == 4
+    assert summary['stop_reason'] == "iteration stopped"
+    # Все бекапы готовы до удаления оригиналов; удалены только исходники обработанных файлов
+    assert summary['backup_stats'] == {'done': 4, 'failed': 0, 'methods': summary['backup_stats']['methods']}
+    assert sorted(os.listdir(tmp_path / 'backup')) == ['IMG_0.jpg', 'IMG_1.jpg', 'IMG_2.jpg', 'IMG_3.jpg']
+    assert len(os.listdir(tmp_path / 'in')) == summary['cancelled']
+    outputs = sorted(os.listdir(tmp_path / 'out'))
+    assert outputs == sorted(['ART.jpg', *[f"ART_{i}.jpg" for i in range(1, summary['processed'])], run_journal.JOURNAL_FILENAME])
+    assert run_journal.is_interrupted(run_journal.read_journal(str(tmp_path / 'out')))
+
+
+def test_cancelling_task_with_shared_executor_finalizes_run(tmp_path):
+    async def cancel_after_first_result(executor):
+        run = async_workflows.IndividualRun(executor=executor, **_settings(tmp_path, count=6))
+        first = asyncio.Event()
+        async def consume():
+            async with contextlib.aclosing(run):
+                async for _ in run: first.set(); await asyncio.sleep(3600)
+        task = asyncio.create_task(consume())
+        await first.wait(); task.cancel()
+        try: await task
+        except asyncio.CancelledError: pass
+        return run.summary
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        summary = asyncio.run(cancel_after_first_result(executor))
+    assert summary['processed'] >= 1 and summary['processed'] + summary['cancelled'] == 6
+    assert summary['errors'] == 0 and summary['backup_stats']['done'] == 6
+    assert len(os.listdir(tmp_path / 'in')) == summary['cancelled']
@@ -0,0 +1,49 @@
+import pytest
+from PIL import Image
+
+import batch_scheduler
+
+
+def test_lpt_schedule_orders_by_cost_and_balances_workers():
+    schedule = batch_scheduler.build_lpt_schedule([2.0, 3.0, 2.0, 3.0, 2.0], 2)
+    # Сначала самые дорогие; при равной стоимости - исходный порядок
+    assert schedule['order'] == [1, 3, 0, 2, 4]
+    # Каждое задание - наименее загруженному обработчику (при равенстве - первому)
+    assert schedule['assignments'] == [[1, 0, 4], [3, 2]]
+    assert schedule['loads'] == [7.0, 5.0]
+    assert schedule['predicted_makespan'] == 7.0
+
+
+def test_lpt_schedule_beats_submission_order():
+    costs = [1.0, 1.0, 1.0, 1.0, 4.0]
+    schedule = batch_scheduler.build_lpt_schedule(costs, 2)
+    assert schedule['order'][0] == 4
+    assert schedule['assignments'] == [[4], [0, 1, 2, 3]]
+    assert schedule['predicted_makespan'] == 4.0 # В порядке отправки было бы 6.0
+
+
+def test_lpt_schedule_edge_cases():
+    assert batch_scheduler.build_lpt_schedule([], 4) == {'order': [], 'assignments': [[], [], [], []],
+                                                          'loads': [0.0] * 4, 'predicted_makespan': 0.0}
+    single = batch_scheduler.build_lpt_schedule([1.5, 0.5], 0) # Меньше одного обработчика - один
+    assert single['assignments'] == [[0, 1]] and single['predicted_makespan'] == 2.0
+    more_workers = batch_scheduler.build_lpt_schedule([1.0, 2.0], 3)
+    assert more_workers['assignments'] == [[1], [0], []] and more_workers['predicted_makespan'] == 2.0
+
+
+@pytest.mark.parametrize('name, size', [('wide.jpg', (2000, 1000)), ('small.png', (500, 300))])
+def test_probe_reads_header_size(tmp_path, name, size):
+    path = tmp_path / name
+    Image.new('RGB', size, (200, 40, 40)).save(path)
+    assert batch_scheduler.probe_megapixels(str(path)) == pytest.approx(size[0] * size[1] / 1_000_000)
+    # Заголовка достаточно: обрезанный файл оценивается так же
+    truncated = tmp_path / f"truncated_{name}"
+    truncated.write_bytes(path.read_bytes()[:1024])
+    assert batch_scheduler.probe_megapixels(str(truncated)) == pytest.approx(size[0] * size[1] / 1_000_000)
+
+
+def test_probe_unreadable_file_costs_zero(tmp_path):
+    garbage = tmp_path / 'broken.jpg'
+    garbage.write_bytes(b'not an image at all')
+    assert batch_scheduler.probe_megapixels(str(garbage)) == 0.0
+    assert batch_scheduler.probe_megapixels(str(tmp_path / 'missing.jpg')) == 0.0
@@ -0,0 +1,84 @@
+import os
+import copy
+
+import pytest
+from PIL import Image
+
+import config_manager
+import durable_io
+import processing_workflows
+
+
+def test_atomic_write_failure_keeps_previous_file(tmp_path):
+    target = tmp_path / 'result.jpg'
+    target.write_bytes(b'previous')
+    with pytest.raises(RuntimeError):
+        with durable_io.atomic_write(str(target), fsync=True) as f:
+            f.write(b'partial')
+            raise RuntimeError("encoder failed")
+    assert target.read_bytes() == b'previous'
+    assert os.listdir(tmp_path) == ['result.jpg']
+
+
+def test_atomic_write_replace_failure_removes_temp_file(tmp_path, monkeypatch):
+    target = tmp_path / 'result.jpg'
+    target.write_bytes(b'previous')
+    def fail_replace(src, dst): raise OSError("disk full")
+    monkeypatch.setattr(durable_io.os, 'replace', fail_replace)
+    with pytest.raises(OSError):
+        with durable_io.atomic_write(str(target)) as f: f.write(b'new')
+    assert target.read_bytes() == b'previous'
+    assert os.listdir(tmp_path) == ['result.jpg']
+
+
+def test_copy_file_failure_leaves_destination_untouched(tmp_path, monkeypatch):
+    source = tmp_path / 'cached.jpg'; target = tmp_path / 'result.jpg'
+    source.write_bytes(b'x' * 4096); target.write_bytes(b'previous')
+    with pytest.raises(OSError):
+        durable_io.copy_file(str(tmp_path / 'missing.jpg'), str(target))
+    def fail_midway(fsrc, fdst): fdst.write(fsrc.read(100)); raise OSError("read error")
+    monkeypatch.setattr(durable_io.shutil, 'copyfileobj', fail_midway)
+    with pytest.raises(OSError):
+        durable_io.copy_file(str(source), str(target), fsync=True)
+    assert target.read_bytes() == b'previous'
+    assert sorted(os.listdir(tmp_path)) == ['cached.jpg', 'result.jpg']
+    monkeypatch.undo()
+    durable_io.copy_file(str(source), str(target), fsync=True)
+    assert target.read_bytes() == b'x' * 4096
+
+
+def test_remove_stale_temp_files_only_removes_atomic_write_leftovers(tmp_path):
+    stale = durable_io.temp_path_for(str(tmp_path / 'ART_1.jpg'))
+    open(stale, 'wb').close()
+    for name in ('ART_1.jpg', '.hidden.tmp', '.notes.txt.tmp'): (tmp_path / name).write_bytes(b'keep')
+    (tmp_path / os.path.basename(durable_io.temp_path_for('folder'))).mkdir()
+    assert durable_io.remove_stale_temp_files(str(tmp_path)) == 1
+    assert not os.path.exists(stale)
+    assert len(os.listdir(tmp_path)) == 4
+    assert durable_io.remove_stale_temp_files(str(tmp_path / 'missing')) == 0
+
+
+def test_durability_batch_syncs_in_batches(tmp_path):
+    paths = []
+    for i in range(5):
+        path = tmp_path / f"{i}.jpg"; path.write_bytes(b'data'); paths.append(str(path))
+    batch = durable_io.DurabilityBatch(batch_size=2)
+    for path in paths: batch.add(path)
+    assert batch.synced == 4
+    batch.add(None); batch.flush()
+    assert batch.synced == 5
+
+
+def test_run_removes_stale_temp_files_and_writes_results_atomically(tmp_path):
+    input_folder = tmp_path / 'in'; output_folder = tmp_path / 'out'
+    input_folder.mkdir(); output_folder.mkdir()
+    for i in range(3): Image.new('RGB', (90, 60), (60 * i, 90, 160)).save(input_folder / f"IMG_{i}.jpg")
+    stale = durable_io.temp_path_for(str(output_folder / 'IMG_0.jpg'))
+    with open(stale, 'wb') as f: f.write(b'torn write')
+    settings = copy.deepcopy(config_manager.DEFAULT_SETTINGS)
+    settings['paths'].update(input_folder_path=str(input_folder), output_folder_path=str(output_folder), backup_folder_path='')
+    settings['individual_mode'].update(article_name='')
+    settings['performance'].update(max_workers=1, write_durability='fsync')
+    stats = processing_workflows.run_individual_processing(**settings)
+    assert stats['processed'] == 3
+    assert sorted(os.listdir(output_folder)) == ['IMG_0.jpg', 'IMG_1.jpg', 'IMG_2.jpg']
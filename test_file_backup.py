@@ -0,0 +1,84 @@
+import os
+import time
+
+import file_backup
+import file_hashing
+
+
+def _backup_run(backup_dir, input_dir, files, age_seconds=0):
+    """Записывает files {имя: содержимое} во входную папку и сохраняет их в хранилище отдельным запуском."""
+    os.makedirs(input_dir, exist_ok=True)
+    store = file_backup.BackupStore(str(backup_dir), str(input_dir))
+    store.created = time.time() - age_seconds
+    methods = {}
+    for name, data in files.items():
+        path = os.path.join(input_dir, name)
+        if data is not None:
+            with open(path, 'wb') as f: f.write(data)
+        methods[name] = store.put(path, name)
+    store.write_index()
+    return store, methods
+
+
+def _blob_files(backup_dir):
+    objects_dir = os.path.join(backup_dir, file_backup.OBJECTS_DIR)
+    return sorted(os.path.join(shard, name) for shard in os.listdir(objects_dir) for name in os.listdir(os.path.join(objects_dir, shard)))
+
+
+def _age_blobs(backup_dir, seconds):
+    stamp = time.time() - seconds
+    for blob in _blob_files(backup_dir): os.utime(os.path.join(backup_dir, file_backup.OBJECTS_DIR, blob), (stamp, stamp))
+
+
+def test_store_deduplicates_content_and_skips_unchanged_files(tmp_path, monkeypatch):
+    backup_dir = tmp_path / 'backup'; input_dir = tmp_path / 'in'
+    store, methods = _backup_run(backup_dir, input_dir, {'a.jpg': b'same', 'b.jpg': b'same', 'c.jpg': b'other'}, age_seconds=60)
+    assert methods['b.jpg'] == 'reused' and store.reused == 1
+    assert len(_blob_files(str(backup_dir))) == 2
+    assert store.entries['a.jpg']['blob'] == store.entries['b.jpg']['blob']
+    # Неизмененные с прошлого запуска файлы не читаются
+    monkeypatch.setattr(file_hashing, 'hash_file', lambda path: None)
+    store, methods = _backup_run(backup_dir, input_dir, {'a.jpg': None, 'c.jpg': None})
+    assert methods == {'a.jpg': 'reused', 'c.jpg': 'reused'} and store.stored_bytes == 0
+    assert len(file_backup.read_store_indexes(str(backup_dir))) == 2
+
+
+def test_writer_without_fast_copy_uses_copy2(tmp_path):
+    input_dir = tmp_path / 'in'; input_dir.mkdir()
+    (input_dir / 'a.jpg').write_bytes(b'data')
+    writer = file_backup.BackupWriter(str(tmp_path / 'backup'), file_backup.BackupStore(str(tmp_path / 'backup'), str(input_dir)), fast=False)
+    writer.submit(str(input_dir / 'a.jpg'), 'a.jpg')
+    assert writer.wait() == {'done': 1, 'failed': 0, 'methods': {'copy2': 1}}
+
+
+def test_prune_keeps_runs_per_input_folder(tmp_path):
+    backup_dir = tmp_path / 'backup'
+    for age, data in ((300, b'first'), (200, b'second run'), (100, b'third run!!')):
+        _backup_run(backup_dir, tmp_path / 'shop_a', {'a.jpg': data}, age_seconds=age)
+    _backup_run(backup_dir, tmp_path / 'shop_b', {'b.jpg': b'only run'}, age_seconds=400)
+    assert len(_blob_files(str(backup_dir))) == 4
+
+    dry = file_backup.prune(str(backup_dir), keep_runs=1, dry_run=True)
+    assert dry['runs_removed'] == 2 and len(file_backup.read_store_indexes(str(backup_dir))) == 4
+
+    stats = file_backup.prune(str(backup_dir), keep_runs=1)
+    assert stats == {'runs_removed': 2, 'runs_kept': 2, 'blobs_removed': 0, 'freed_bytes': 0} # Свежее содержимое не удаляется
+    kept = [index for _, index in file_backup.read_store_indexes(str(backup_dir))]
+    assert [list(index['files']) for index in kept] == [['b.jpg'], ['a.jpg']]
+    assert len(_blob_files(str(backup_dir))) == 4
+
+    _age_blobs(str(backup_dir), file_backup.PRUNE_GRACE_SECONDS + 60)
+    stats = file_backup.prune(str(backup_dir), keep_runs=1)
+    assert stats == {'runs_removed': 0, 'runs_kept': 2, 'blobs_removed': 2, 'freed_bytes': len(b'first') + len(b'second run')}
+    referenced = sorted(entry['blob'].split('/', 1)[1] for index in kept for entry in index['files'].values())
+    assert [blob.replace(os.sep, '/') for blob in _blob_files(str(backup_dir))] == referenced
+
+
+def test_prune_by_age(tmp_path):
+    backup_dir = tmp_path / 'backup'
+    _backup_run(backup_dir, tmp_path / 'in', {'old.jpg': b'old'}, age_seconds=3 * 86400)
+    _backup_run(backup_dir, tmp_path / 'in', {'new.jpg': b'new'})
+    _age_blobs(str(backup_dir), file_backup.PRUNE_GRACE_SECONDS + 60)
+    stats = file_backup.prune(str(backup_dir), keep_days=1)
+    assert stats == {'runs_removed': 1, 'runs_kept': 1, 'blobs_removed': 1, 'freed_bytes': 3}
+    assert [list(index['files']) for _, index in file_backup.read_store_indexes(str(backup_dir))] == [['new.jpg']]
@@ -0,0 +1,66 @@
+import os
+
+from PIL import Image
+
+import file_discovery
+
+
+def _tree(tmp_path):
+    root = tmp_path / 'in'
+    for rel in ('IMG_10.jpg', 'IMG_2.jpg', 'IMG_1.png', 'notes.txt', '.hidden.jpg', '__temp_0.jpg',
+                'A1/x_raw.jpg', 'A1/x.jpg', 'A1/deep/y.JPG', '.git/z.jpg', 'out/result.jpg'):
+        path = root / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if rel.endswith('.txt'): path.write_text('text')
+        else: Image.new('RGB', (8, 8), (200, 40, 40)).save(path, 'PNG' if rel.endswith('.png') else 'JPEG')
+    return root
+
+
+def _rel(found):
+    return [f.rel_path.replace(os.sep, '/') for f in found]
+
+
+def test_flat_discovery_skips_prefixes_and_sorts_naturally(tmp_path):
+    root = _tree(tmp_path)
+    found = file_discovery.discover_image_files(str(root))
+    # Скрытые и временные файлы пропускаются; IMG_2 идет раньше IMG_10
+    assert _rel(found) == ['IMG_1.png', 'IMG_2.jpg', 'IMG_10.jpg']
+    assert found[0].path == os.path.join(str(root), 'IMG_1.png')
+
+
+def test_recursive_discovery_and_excluded_paths(tmp_path):
+    root = _tree(tmp_path)
+    stats = {}
+    found = file_discovery.discover_image_files(str(root), recursive=True, exclude_paths=[str(root / 'out'), None])
+    assert _rel(found) == ['A1/deep/y.JPG', 'A1/x.jpg', 'A1/x_raw.jpg', 'IMG_1.png', 'IMG_2.jpg', 'IMG_10.jpg']
+    list(file_discovery.iter_image_files(str(root), recursive=True, stats=stats))
+    assert stats == {'found': 7, 'rejected_content': 0, 'unreadable_dirs': 0} # Скрытая папка .git не обходится
+
+
+def test_include_and_exclude_patterns(tmp_path):
+    root = _tree(tmp_path)
+    options = file_discovery.options_from_settings({'recursive': True, 'include_patterns': 'a1/*, img_1*',
+                                                    'exclude_patterns': ['*_RAW.*']})
+    # Маски fnmatch: '*' захватывает и вложенные папки
+    assert _rel(file_discovery.discover_image_files(str(root), **options)) == ['A1/deep/y.JPG', 'A1/x.jpg', 'IMG_1.png', 'IMG_10.jpg']
+
+    path_filter = file_discovery.make_path_filter(None, '*/deep/*')
+    assert path_filter('A1/deep/y.JPG') is False and path_filter('A1/x.jpg') is True
+    assert file_discovery.make_path_filter(None, ' , ') is None
+
+
+def test_sniffing_rejects_misnamed_files(tmp_path):
+    root = tmp_path / 'in'; root.mkdir()
+    Image.new('RGB', (8, 8)).save(root / 'real.jpg', 'JPEG')
+    Image.new('RGB', (8, 8)).save(root / 'png_named.jpg', 'PNG') # Другой формат - все равно изображение
+    (root / 'fake.jpg').write_bytes(b'<html>not an image</html>')
+    assert file_discovery.sniff_image_format(str(root / 'png_named.jpg')) == 'png'
+    assert file_discovery.sniff_image_format(str(root / 'fake.jpg')) is None
+    assert file_discovery.sniff_image_format(str(root / 'missing.jpg')) is None
+
+    stats = {}
+    found = sorted(_rel(file_discovery.iter_image_files(str(root), sniff=True, stats=stats)))
+    assert found == ['png_named.jpg', 'real.jpg']
+    assert stats['rejected_content'] == 1
+    # Без проверки содержимого файл принимается по расширению
+    assert len(list(file_discovery.iter_image_files(str(root)))) == 3
@@ -0,0 +1,61 @@
+import os
+import copy
+
+from PIL import Image
+
+import config_manager
+import file_hashing
+import processing_workflows
+
+
+def test_find_duplicates_groups_only_equal_content(tmp_path):
+    paths = {}
+    for name, data in (('a', b'x' * 100), ('b', b'y' * 100), ('c', b'x' * 100), ('d', b'x' * 50), ('e', b'x' * 100)):
+        path = tmp_path / name; path.write_bytes(data); paths[name] = str(path)
+    # b того же размера, но с другим содержимым; d совпадает началом, но короче
+    found = file_hashing.find_duplicates([paths[n] for n in 'abcde'])
+    assert found == {paths['a']: [paths['c'], paths['e']]}
+    # Первый путь группы - по порядку paths
+    assert file_hashing.find_duplicates([paths[n] for n in 'ecab']) == {paths['e']: [paths['c'], paths['a']]}
+    assert file_hashing.find_duplicates([paths['a'], paths['b'], paths['d']]) == {}
+
+
+def test_find_duplicates_skips_unreadable_files(tmp_path, monkeypatch):
+    paths = []
+    for name in 'abc':
+        path = tmp_path / name; path.write_bytes(b'same'); paths.append(str(path))
+    unreadable = paths[1]
+    original_hash = file_hashing.hash_file
+    monkeypatch.setattr(file_hashing, 'hash_file', lambda p: None if p == unreadable else original_hash(p))
+    missing = str(tmp_path / 'missing')
+    assert file_hashing.find_duplicates([missing] + paths) == {paths[0]: [paths[2]]}
+    assert file_hashing.hash_file(missing) is None
+    assert original_hash(str(tmp_path)) is None # Папка не читается как файл
+
+
+def test_each_duplicate_gets_its_own_output(tmp_path, monkeypatch):
+    input_folder = tmp_path / 'in'; input_folder.mkdir()
+    Image.new('RGB', (120, 80), (200, 40, 40)).save(input_folder / 'IMG_1.png')
+    Image.new('RGB', (120, 80), (40, 200, 40)).save(input_folder / 'IMG_2.png')
+    for copy_name in ('IMG_1_copy.png', 'IMG_1_copy2.png'):
+        (input_folder / copy_name).write_bytes((input_folder / 'IMG_1.png').read_bytes())
+    settings = copy.deepcopy(config_manager.DEFAULT_SETTINGS)
+    settings['paths'].update(input_folder_path=str(input_folder), output_folder_path=str(tmp_path / 'out'),
+                             backup_folder_path='')
+    settings['individual_mode'].update(detect_duplicates=True, enable_rename=False, delete_originals=False, output_format='png')
+    settings['performance'].update(max_workers=1)
+
+    calls = []
+    original_worker = processing_workflows._process_individual_file
+    def counting_worker(*args, **kwargs):
+        calls.append(args); return original_worker(*args, **kwargs)
+    monkeypatch.setattr(processing_workflows, '_process_individual_file', counting_worker)
+    summary = processing_workflows.run_individual_processing(**settings)
+
+    assert len(calls) == 2 # Дубликаты не обрабатываются повторно
+    assert summary['processed'] == 4 and summary['errors'] == 0
+    assert summary['duplicates'] == {'IMG_1_copy.png': 'IMG_1.png', 'IMG_1_copy2.png': 'IMG_1.png'}
+    out = tmp_path / 'out'
+    assert sorted(os.listdir(out)) == ['IMG_1.png', 'IMG_1_copy.png', 'IMG_1_copy2.png', 'IMG_2.png']
+    assert (out / 'IMG_1_copy.png').read_bytes() == (out / 'IMG_1.png').read_bytes() == (out / 'IMG_1_copy2.png').read_bytes()
+    assert (out / 'IMG_2.png').read_bytes() != (out / 'IMG_1.png').read_bytes()
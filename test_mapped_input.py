@@ -0,0 +1,59 @@
+import os
+import copy
+
+from PIL import Image
+
+import config_manager
+import mapped_input
+import processing_workflows
+
+
+def test_map_file_reads_content(tmp_path):
+    path = tmp_path / 'data.bin'; path.write_bytes(b'0123456789' * 10)
+    mapped = mapped_input.map_file(str(path))
+    assert mapped is not None and mapped[:] == b'0123456789' * 10
+    mapped_input.release(mapped)
+    assert mapped.closed
+    mapped_input.release(mapped) # Повторное закрытие - без ошибок
+
+
+def test_map_file_empty_or_missing_returns_none(tmp_path):
+    empty = tmp_path / 'empty.jpg'; empty.write_bytes(b'')
+    # mmap файла нулевой длины вызывает ValueError - вместо этого None
+    assert mapped_input.map_file(str(empty)) is None
+    assert mapped_input.map_file(str(tmp_path / 'missing.jpg')) is None
+    assert mapped_input.map_file(str(tmp_path)) is None # Папка
+    mapped_input.release(None)
+
+
+def test_readahead_hints_each_file_once(tmp_path, monkeypatch):
+    paths = []
+    for name in 'abc':
+        path = tmp_path / name; path.write_bytes(b'x'); paths.append(str(path))
+    hinted = []
+    monkeypatch.setattr(mapped_input, 'READAHEAD_SUPPORTED', True)
+    monkeypatch.setattr(mapped_input, 'prefetch', lambda p: hinted.append(p) or p != paths[2])
+    readahead = mapped_input.ReadAhead(2)
+    readahead.hint(paths[:2]); readahead.hint(paths)
+    assert hinted == paths and readahead.hinted == 2 # Неудачная подсказка не учитывается
+    disabled = mapped_input.ReadAhead(0); disabled.hint(paths)
+    assert disabled.hinted == 0 and len(hinted) == 3
+    assert mapped_input.ReadAhead(-1).depth == 0
+
+
+def test_prefetch_missing_file_returns_false(tmp_path):
+    assert mapped_input.prefetch(str(tmp_path / 'missing.jpg')) is False
+
+
+def test_mapped_run_handles_empty_input(tmp_path):
+    input_folder = tmp_path / 'in'; input_folder.mkdir()
+    for i in range(2): Image.new('RGB', (90, 60), (40 * i, 90, 160)).save(input_folder / f"IMG_{i}.jpg")
+    (input_folder / 'IMG_2.jpg').write_bytes(b'')
+    settings = copy.deepcopy(config_manager.DEFAULT_SETTINGS)
+    settings['paths'].update(input_folder_path=str(input_folder), output_folder_path=str(tmp_path / 'out'), backup_folder_path='')
+    settings['individual_mode'].update(enable_rename=False, delete_originals=False)
+    settings['performance'].update(max_workers=1, mmap_input=True, readahead_files=2)
+    summary = processing_workflows.run_individual_processing(**settings)
+    # Пустой файл читается обычным способом и не открывается как изображение
+    assert summary['processed'] == 2 and summary['processed'] + summary['skipped'] + summary['errors'] == 3
+    assert sorted(os.listdir(tmp_path / 'out')) == ['IMG_0.jpg', 'IMG_1.jpg']
@@ -0,0 +1,55 @@
+import os
+import copy
+
+from PIL import Image
+
+import config_manager
+import processing_workflows
+
+
+def _make_inputs(folder, names):
+    os.makedirs(folder)
+    for i, name in enumerate(names):
+        Image.new('RGB', (100 + i * 10, 80), (30 * i, 90, 160)).save(os.path.join(folder, name))
+
+
+def _run(input_folder, output_folder, allocate_names_upfront):
+    settings = copy.deepcopy(config_manager.DEFAULT_SETTINGS)
+    settings['paths'].update(input_folder_path=input_folder, output_folder_path=output_folder, backup_folder_path='')
+    settings['individual_mode'].update(article_name='ART', allocate_names_upfront=allocate_names_upfront)
+    settings['performance'].update(max_workers=1)
+    return processing_workflows.run_individual_processing(**settings)
+
+
+def _contents(folder):
+    return {name: open(os.path.join(folder, name), 'rb').read() for name in sorted(os.listdir(folder))}
+
+
+def test_allocate_output_names_exact_match_natural_order_and_occupied():
+    basenames = {'IMG_10.jpg': 'IMG_10', 'IMG_2.jpg': 'IMG_2', 'art.png': 'art', 'IMG_1.jpg': 'IMG_1'}
+    names = processing_workflows.allocate_output_names(basenames, 'ART', '.jpg')
+    assert names == {'art.png': 'ART.jpg', 'IMG_1.jpg': 'ART_1.jpg', 'IMG_2.jpg': 'ART_2.jpg', 'IMG_10.jpg': 'ART_3.jpg'}
+    # Без точного совпадения базовое имя получает первый файл; занятые имена пропускаются
+    names = processing_workflows.allocate_output_names({'b': 'b', 'a': 'a', 'c': 'c'}, 'ART', '.jpg', {os.path.normcase('ART.jpg'), os.path.normcase('ART_2.jpg')})
+    assert names == {'a': 'ART_1.jpg', 'b': 'ART_3.jpg', 'c': 'ART_4.jpg'}
+
+
+def test_upfront_names_match_legacy_renaming(tmp_path):
+    input_folder = str(tmp_path / 'in')
+    _make_inputs(input_folder, ['IMG_1.jpg', 'IMG_2.jpg', 'art.jpg', 'IMG_3.png'])
+    legacy = _run(input_folder, str(tmp_path / 'legacy'), False)
+    upfront = _run(input_folder, str(tmp_path / 'upfront'), True)
+    assert legacy['processed'] == upfront['processed'] == 4
+    assert _contents(str(tmp_path / 'upfront')) == _contents(str(tmp_path / 'legacy'))
+    assert sorted(os.listdir(tmp_path / 'upfront')) == ['ART.jpg', 'ART_1.jpg', 'ART_2.jpg', 'ART_3.jpg']
+
+
+def test_upfront_names_skip_existing_outputs_without_temp_files(tmp_path):
+    input_folder = str(tmp_path / 'in'); output_folder = tmp_path / 'out'
+    _make_inputs(input_folder, ['IMG_1.jpg', 'IMG_2.jpg'])
+    output_folder.mkdir(); (output_folder / 'ART.jpg').write_bytes(b'older result')
+    stats = _run(input_folder, str(output_folder), True)
+    assert stats['processed'] == 2
+    assert sorted(os.listdir(output_folder)) == ['ART.jpg', 'ART_1.jpg', 'ART_2.jpg']
+    assert (output_folder / 'ART.jpg').read_bytes() == b'older result'
+    assert not any(name.startswith('__temp_') for name in os.listdir(output_folder))
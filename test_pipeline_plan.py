@@ -0,0 +1,112 @@
+import copy
+import pickle
+
+import pytest
+from PIL import Image, ImageDraw
+
+import config_manager
+import image_utils
+import pipeline_plan
+
+
+def _source_image(white_perimeter):
+    img = Image.new('RGB', (900, 600), (255, 255, 255) if white_perimeter else (236, 236, 236))
+    draw = ImageDraw.Draw(img)
+    draw.rectangle([200, 150, 640, 470], fill=(40, 90, 160))
+    draw.ellipse([300, 200, 520, 420], fill=(200, 60, 40))
+    return img
+
+
+def _settings(**sections):
+    settings = copy.deepcopy(config_manager.DEFAULT_SETTINGS)
+    settings['whitening'].update(enable_whitening=True)
+    settings['background_crop'].update(enable_bg_crop=True, white_tolerance=10)
+    settings['padding'].update(enable_padding=True, padding_percent=5.0, perimeter_margin=3, allow_expansion=True)
+    settings['brightness_contrast'].update(enable_bc=True, brightness_factor=1.1, contrast_factor=0.9)
+    settings['individual_mode'].update(enable_force_aspect_ratio=True, force_aspect_ratio=[1, 1],
+                                       enable_max_dimensions=True, max_output_width=300, max_output_height=300,
+                                       enable_exact_canvas=True, final_exact_width=400, final_exact_height=400)
+    for section, values in sections.items(): settings[section].update(values)
+    return settings
+
+
+def _baseline_chain(img, settings, resample):
+    """Цепочка шагов отдельного файла в прежнем виде: вызовы image_utils и функций шагов по настройкам."""
+    prep = settings['preprocessing']; white = settings['whitening']; bgc = settings['background_crop']
+    pad = settings['padding']; bc = settings['brightness_contrast']; ind = settings['individual_mode']
+    if prep['enable_preresize']: img = pipeline_plan.apply_preresize(img, prep['preresize_width'], prep['preresize_height'], resample)
+    if white['enable_whitening']: img = image_utils.whiten_image_by_darkest_perimeter(img, int(white.get('whitening_cancel_threshold', 550)))
+    tolerance = bgc['white_tolerance'] if bgc['enable_bg_crop'] else 0
+    perimeter_is_white = False
+    if pad['enable_padding'] and pad['perimeter_margin'] > 0:
+        perimeter_is_white = image_utils.check_perimeter_is_white(img, tolerance, pad['perimeter_margin'])
+    pre_crop_w, pre_crop_h = img.size
+    if bgc['enable_bg_crop']:
+        img = image_utils.remove_white_background(img, tolerance)
+        img = image_utils.crop_image(img, bgc['crop_symmetric_axes'], bgc['crop_symmetric_absolute'])
+    if pad['enable_padding'] and pad['perimeter_margin'] > 0 and not perimeter_is_white and pad['padding_percent'] > 0:
+        w, h = img.size
+        padding_pixels = int(round(max(w, h) * (pad['padding_percent'] / 100.0)))
+        if padding_pixels > 0 and (pad['allow_expansion'] or (w + 2 * padding_pixels <= pre_crop_w and h + 2 * padding_pixels <= pre_crop_h)):
+            img = image_utils.add_padding(img, pad['padding_percent'])
+    if bc['enable_bc']:
+        img = image_utils.apply_brightness_contrast(img, brightness_factor=bc['brightness_factor'], contrast_factor=bc['contrast_factor'])
+    if ind['enable_force_aspect_ratio']: img = pipeline_plan.apply_force_aspect_ratio(img, ind['force_aspect_ratio'])
+    if ind['enable_max_dimensions']: img = pipeline_plan.apply_max_dimensions(img, ind['max_output_width'], ind['max_output_height'], resample)
+    output_format = ind['output_format']; background = tuple(ind['jpg_background_color'])
+    if ind['enable_exact_canvas'] and ind['final_exact_width'] > 0 and ind['final_exact_height'] > 0:
+        return pipeline_plan.apply_final_canvas_or_prepare(img, ind['final_exact_width'], ind['final_exact_height'], output_format, background, resample)
+    return pipeline_plan.apply_final_canvas_or_prepare(img, 0, 0, output_format, background)
+
+
+def _run_plan(img, settings, resample):
+    plan = pickle.loads(pickle.dumps(pipeline_plan.compile_plan(settings))) # План передается обработчикам через pickle
+    state = pipeline_plan.StageState(resample)
+    return plan.run_finish(plan.run_tail(plan.run_prefix(img, state), state), state)
+
+
+def _assert_same_image(actual, expected):
+    assert (actual.mode, actual.size) == (expected.mode, expected.size)
+    assert actual.tobytes() == expected.tobytes()
+
+
+SETTINGS_SETS = {
+    'full_jpg': _settings(),
+    'white_perimeter_png': _settings(individual_mode={'output_format': 'png', 'enable_exact_canvas': False}),
+    'preresize_no_expansion': _settings(preprocessing={'enable_preresize': True, 'preresize_width': 500, 'preresize_height': 500},
+                                        padding={'allow_expansion': False, 'padding_percent': 30.0},
+                                        individual_mode={'enable_force_aspect_ratio': False}),
+}
+
+
+@pytest.mark.parametrize('name', list(SETTINGS_SETS))
+@pytest.mark.parametrize('white_perimeter', [False, True])
+@pytest.mark.parametrize('resample', [pipeline_plan.RESAMPLE_QUALITY, pipeline_plan.RESAMPLE_FAST])
+def test_compiled_plan_matches_baseline_chain(name, white_perimeter, resample):
+    settings = SETTINGS_SETS[name]
+    expected = _baseline_chain(_source_image(white_perimeter), settings, resample)
+    _assert_same_image(_run_plan(_source_image(white_perimeter), settings, resample), expected)
+
+
+def test_fast_profile_changes_only_resampling():
+    settings = SETTINGS_SETS['full_jpg']
+    quality = _run_plan(_source_image(False), settings, pipeline_plan.RESAMPLE_QUALITY)
+    fast = _run_plan(_source_image(False), settings, pipeline_plan.RESAMPLE_FAST)
+    assert (fast.mode, fast.size) == (quality.mode, quality.size)
+    assert fast.tobytes() != quality.tobytes()
+    img = _source_image(False)
+    for resample in (pipeline_plan.RESAMPLE_QUALITY, pipeline_plan.RESAMPLE_FAST):
+        _assert_same_image(pipeline_plan.apply_max_dimensions(img.copy(), 300, 300, resample), img.resize((300, 200), resample))
+        _assert_same_image(pipeline_plan.apply_preresize(img.copy(), 450, 0, resample), img.resize((450, 300), resample))
+
+
+def test_no_op_stages_are_not_compiled():
+    settings = _settings(brightness_contrast={'brightness_factor': 1.0, 'contrast_factor': 1.0},
+                         padding={'perimeter_margin': 0},
+                         individual_mode={'enable_force_aspect_ratio': False, 'max_output_width': 0, 'max_output_height': 0,
+                                          'enable_exact_canvas': False})
+    plan = pipeline_plan.compile_plan(settings)
+    assert plan.describe() == "Whiten -> BackgroundCrop -> FinalCanvas"
+    assert plan == pipeline_plan.compile_plan(copy.deepcopy(settings))
+    with pytest.raises(AttributeError):
+        plan.prefix = ()
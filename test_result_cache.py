@@ -0,0 +1,57 @@
+import os
+import time
+
+import result_cache
+
+
+def _store_entries(cache, count, size=1000):
+    """Помещает count записей по size байт; mtime записи i - на count-i минут раньше текущего."""
+    keys = [cache.make_key(f"source{i}", "settings", ".jpg") for i in range(count)]
+    now = time.time()
+    for i, key in enumerate(keys):
+        assert cache.store_bytes(key, ".jpg", bytes([i]) * size)
+        stamp = now - (count - i) * 60
+        os.utime(cache._entry_path(key, ".jpg"), (stamp, stamp))
+    return keys
+
+
+def test_eviction_removes_least_recently_used(tmp_path):
+    cache = result_cache.ResultCache(str(tmp_path), max_bytes=2500)
+    keys = _store_entries(cache, 4)
+    # Попадание обновляет отметку использования: самая старая запись становится самой свежей
+    assert cache.fetch(keys[0], ".jpg", str(tmp_path / "out.jpg"))
+    stats = cache.enforce_size_limit()
+    assert stats == {'entries': 2, 'total_bytes': 2000, 'evicted': 2, 'freed_bytes': 2000}
+    assert cache.fetch_bytes(keys[0], ".jpg") == bytes([0]) * 1000
+    assert cache.fetch_bytes(keys[3], ".jpg") == bytes([3]) * 1000
+    assert cache.fetch_bytes(keys[1], ".jpg") is None
+    assert cache.fetch_bytes(keys[2], ".jpg") is None
+
+
+def test_no_eviction_without_limit_or_under_limit(tmp_path):
+    keys = _store_entries(result_cache.ResultCache(str(tmp_path)), 3)
+    assert result_cache.ResultCache(str(tmp_path), max_bytes=0).enforce_size_limit()['evicted'] == 0
+    assert result_cache.ResultCache(str(tmp_path), max_bytes=3000).enforce_size_limit()['evicted'] == 0
+    cache = result_cache.ResultCache(str(tmp_path))
+    assert all(cache.fetch_bytes(key, ".jpg") is not None for key in keys)
+
+
+def test_eviction_skipped_while_another_process_holds_the_lock(tmp_path):
+    cache = result_cache.ResultCache(str(tmp_path), max_bytes=1000)
+    _store_entries(cache, 3)
+    (tmp_path / result_cache.LOCK_FILENAME).write_text("12345")
+    assert cache.enforce_size_limit()['evicted'] == 0
+    # Блокировка прерванного процесса устаревает и снимается
+    stale = time.time() - result_cache.STALE_LOCK_SECONDS - 1
+    os.utime(tmp_path / result_cache.LOCK_FILENAME, (stale, stale))
+    assert cache.enforce_size_limit()['evicted'] == 2
+    assert not (tmp_path / result_cache.LOCK_FILENAME).exists()
+
+
+def test_fetch_miss_leaves_destination_untouched(tmp_path):
+    cache = result_cache.ResultCache(str(tmp_path / "cache"))
+    dest = tmp_path / "out.jpg"
+    dest.write_bytes(b"previous")
+    assert not cache.fetch(cache.make_key("missing", "settings", ".jpg"), ".jpg", str(dest))
+    assert dest.read_bytes() == b"previous"
+    assert sorted(os.listdir(tmp_path)) == ["out.jpg"]
@@ -0,0 +1,124 @@
+import os
+import copy
+
+import pytest
+from PIL import Image
+
+import config_manager
+import processing_workflows
+import run_control
+import run_journal
+
+
+def _make_inputs(folder, count=4):
+    os.makedirs(folder)
+    for i in range(count):
+        Image.new('RGB', (120 + i * 10, 80), (40 * i, 90, 160)).save(os.path.join(folder, f"IMG_{i}.jpg"))
+
+
+def _journal_settings(input_folder, output_folder):
+    settings = copy.deepcopy(config_manager.DEFAULT_SETTINGS)
+    settings['paths'].update(input_folder_path=input_folder, output_folder_path=output_folder, backup_folder_path='')
+    settings['individual_mode'].update(article_name='ART', enable_journal=True, resume_interrupted=True)
+    settings['performance'].update(max_workers=1)
+    return settings
+
+
+def test_read_journal_skips_damaged_tail_and_reports_interrupted(tmp_path):
+    journal = run_journal.RunJournal(str(tmp_path))
+    assert journal.start({'input': 'in', 'output_ext': '.jpg', 'settings_fingerprint': 'abc'})
+    journal.record_file({'file': 'a.jpg', 'status': 'processed', 'output_path': str(tmp_path / 'a.jpg')})
+    journal.record_rename(str(tmp_path / 'a.jpg'), str(tmp_path / 'ART.jpg'))
+    journal.close()
+    with open(tmp_path / run_journal.JOURNAL_FILENAME, 'a', encoding='utf-8') as f: f.write('{"type": "fi') # Сбой во время записи
+    state = run_journal.read_journal(str(tmp_path))
+    assert state['files']['a.jpg']['output'] == 'a.jpg'
+    assert state['renames'] == [('a.jpg', 'ART.jpg')]
+    assert state['end'] is None and run_journal.is_interrupted(state)
+
+
+def test_only_unfinished_rename_pass_is_pending(tmp_path):
+    journal = run_journal.RunJournal(str(tmp_path))
+    journal.start({'input': 'in'})
+    journal.begin_renames()
+    for src, dst in (('a.jpg', '__temp_1_0_a.jpg'), ('__temp_1_0_a.jpg', 'ART.jpg')): journal.record_rename(src, dst)
+    journal.end_renames()
+    journal.begin_renames(); journal.record_rename('b.jpg', '__temp_2_0_b.jpg')
+    journal.close()
+    state = run_journal.read_journal(str(tmp_path))
+    assert state['renamed'] == {'a.jpg': 'ART.jpg'}
+    assert state['renames'] == [('b.jpg', '__temp_2_0_b.jpg')]
+
+
+def test_finish_removes_journal_only_after_complete_run(tmp_path):
+    stopped = run_journal.RunJournal(str(tmp_path))
+    stopped.start({'input': 'in'}); stopped.finish(complete=False, stop_reason="deadline")
+    state = run_journal.read_journal(str(tmp_path))
+    assert state['end'] == {'type': 'run_end', 'complete': False, 'stop_reason': "deadline"}
+    assert run_journal.is_interrupted(state)
+    complete = run_journal.RunJournal(str(tmp_path))
+    complete.start({'input': 'in'}); complete.finish(complete=True)
+    assert run_journal.read_journal(str(tmp_path)) is None
+    assert os.listdir(tmp_path) == []
+
+
+def test_rollback_renames_restores_names_and_is_repeatable(tmp_path):
+    # Сбой между этапами переименования: первый файл уже под итоговым именем, второй - под временным
+    (tmp_path / 'ART.jpg').write_bytes(b'first')
+    (tmp_path / '__temp_1_1_b.jpg').write_bytes(b'second')
+    renames = [('a.jpg', '__temp_1_0_a.jpg'), ('b.jpg', '__temp_1_1_b.jpg'), ('__temp_1_0_a.jpg', 'ART.jpg')]
+    assert run_journal.rollback_renames(str(tmp_path), renames) == (3, 0)
+    assert sorted(os.listdir(tmp_path)) == ['a.jpg', 'b.jpg']
+    assert (tmp_path / 'a.jpg').read_bytes() == b'first' and (tmp_path / 'b.jpg').read_bytes() == b'second'
+    assert run_journal.rollback_renames(str(tmp_path), renames) == (0, 0)
+
+
+def test_interrupted_run_is_rolled_back_and_resumed(tmp_path, monkeypatch):
+    input_folder = str(tmp_path / 'in'); output_folder = str(tmp_path / 'out')
+    _make_inputs(input_folder)
+    settings = _journal_settings(input_folder, output_folder)
+    # Сбой после переименования: запись run_end не дописана, результаты уже под итоговыми именами
+    with monkeypatch.context() as patch:
+        patch.setattr(run_journal.RunJournal, 'finish', lambda self, complete, stop_reason=None: self.close())
+        first = processing_workflows.run_individual_processing(**copy.deepcopy(settings))
+    assert first['processed'] == 4
+    interrupted = sorted(os.listdir(output_folder))
+    assert interrupted == sorted(['ART.jpg', 'ART_1.jpg', 'ART_2.jpg', 'ART_3.jpg', run_journal.JOURNAL_FILENAME])
+    contents = {name: open(os.path.join(output_folder, name), 'rb').read() for name in interrupted if name.startswith('ART')}
+
+    calls = []
+    process_file = processing_workflows._process_individual_file
+    monkeypatch.setattr(processing_workflows, '_process_individual_file', lambda *args, **kwargs: calls.append(args) or process_file(*args, **kwargs))
+    second = processing_workflows.run_individual_processing(**copy.deepcopy(settings))
+    assert calls == [] # Готовые до сбоя файлы не обрабатываются повторно
+    assert second['resumed'] == 4 and second['processed'] == 4 and second['errors'] == 0
+    names = sorted(os.listdir(output_folder))
+    assert names == ['ART.jpg', 'ART_1.jpg', 'ART_2.jpg', 'ART_3.jpg']
+    assert {name: open(os.path.join(output_folder, name), 'rb').read() for name in names} == contents
+
+
+@pytest.mark.parametrize('resume', [False, True])
+def test_stopped_run_keeps_finished_renames_on_rerun(tmp_path, monkeypatch, resume):
+    input_folder = str(tmp_path / 'in'); output_folder = str(tmp_path / 'out')
+    _make_inputs(input_folder)
+    settings = _journal_settings(input_folder, output_folder)
+    settings['individual_mode'].update(delete_originals=True, resume_interrupted=resume)
+    # Остановка после двух файлов: удаление и оба этапа переименования выполняются, run_end - complete=False
+    control = run_control.RunControl()
+    process_file = processing_workflows._process_individual_file
+    def stop_after_two(job, *args, **kwargs):
+        if job['index'] == 1: control.cancel("stopped by user")
+        return process_file(job, *args, **kwargs)
+    with monkeypatch.context() as patch:
+        patch.setattr(processing_workflows, '_process_individual_file', stop_after_two)
+        first = processing_workflows.run_individual_processing(control=control, **copy.deepcopy(settings))
+    assert first['processed'] == 2 and first['cancelled'] == 2
+    assert sorted(os.listdir(input_folder)) == ['IMG_2.jpg', 'IMG_3.jpg']
+    assert sorted(os.listdir(output_folder)) == sorted(['ART.jpg', 'ART_1.jpg', run_journal.JOURNAL_FILENAME])
+    contents = {name: open(os.path.join(output_folder, name), 'rb').read() for name in ('ART.jpg', 'ART_1.jpg')}
+
+    second = processing_workflows.run_individual_processing(**copy.deepcopy(settings))
+    assert second['resumed'] == (2 if resume else 0) and second['cancelled'] == 0
+    assert sorted(os.listdir(output_folder)) == ['ART.jpg', 'ART_1.jpg', 'ART_2.jpg', 'ART_3.jpg']
+    assert {name: open(os.path.join(output_folder, name), 'rb').read() for name in contents} == contents
+    assert os.listdir(input_folder) == []
@@ -0,0 +1,87 @@
+import os
+import copy
+
+import pytest
+from PIL import Image
+
+import config_manager
+import processing_workflows
+import run_manifest
+
+
+def _entry(tmp_path, use_hash=False, data=b'source bytes'):
+    source = tmp_path / 'src.jpg'; source.write_bytes(data)
+    out = tmp_path / 'out'; out.mkdir(exist_ok=True); (out / 'ART.jpg').write_bytes(b'result')
+    entry = run_manifest.make_entry(str(source), use_hash)
+    entry['output'] = 'ART.jpg'
+    return entry, source, out
+
+
+def _touch(path, delta_ns=5_000_000_000):
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + delta_ns))
+
+
+def test_unchanged_file_is_detected(tmp_path):
+    entry, source, out = _entry(tmp_path)
+    assert run_manifest.is_unchanged(entry, str(source), str(out), use_hash=False)
+    assert not run_manifest.is_unchanged(None, str(source), str(out), use_hash=False)
+    assert not run_manifest.is_unchanged(dict(entry, fast=True), str(source), str(out), use_hash=False)
+
+
+def test_mtime_or_size_change_marks_file_changed(tmp_path):
+    entry, source, out = _entry(tmp_path)
+    _touch(source)
+    assert not run_manifest.is_unchanged(entry, str(source), str(out), use_hash=False)
+    entry, source, out = _entry(tmp_path)
+    source.write_bytes(b'source bytes, edited')
+    os.utime(source, ns=(entry['mtime_ns'], entry['mtime_ns'])) # Тот же mtime, другой размер
+    assert not run_manifest.is_unchanged(entry, str(source), str(out), use_hash=False)
+
+
+def test_hash_mode_accepts_touched_file_with_same_content(tmp_path):
+    entry, source, out = _entry(tmp_path, use_hash=True)
+    _touch(source)
+    assert run_manifest.is_unchanged(entry, str(source), str(out), use_hash=True)
+    assert entry['mtime_ns'] == os.stat(source).st_mtime_ns # Запись обновлена новым mtime
+    # Тот же размер, другое содержимое
+    source.write_bytes(b'SOURCE BYTES'); _touch(source)
+    assert not run_manifest.is_unchanged(entry, str(source), str(out), use_hash=True)
+
+
+def test_missing_output_or_source_marks_file_changed(tmp_path):
+    entry, source, out = _entry(tmp_path)
+    assert not run_manifest.is_unchanged(dict(entry, output=None), str(source), str(out), use_hash=False)
+    os.remove(out / 'ART.jpg')
+    assert not run_manifest.is_unchanged(entry, str(source), str(out), use_hash=False)
+    entry, source, out = _entry(tmp_path)
+    os.remove(source)
+    assert not run_manifest.is_unchanged(entry, str(source), str(out), use_hash=False)
+
+
+@pytest.mark.parametrize('manifest_hash', [False, True])
+def test_rerun_skips_unchanged_files_until_settings_change(tmp_path, manifest_hash):
+    input_folder = tmp_path / 'in'; input_folder.mkdir()
+    for i in range(3): Image.new('RGB', (90 + i * 10, 60), (40 * i, 90, 160)).save(input_folder / f"IMG_{i}.jpg")
+    settings = copy.deepcopy(config_manager.DEFAULT_SETTINGS)
+    settings['paths'].update(input_folder_path=str(input_folder), output_folder_path=str(tmp_path / 'out'), backup_folder_path='')
+    settings['individual_mode'].update(enable_rename=False, delete_originals=False, skip_unchanged=True, manifest_hash=manifest_hash)
+    settings['performance'].update(max_workers=1)
+
+    assert processing_workflows.run_individual_processing(**settings)['skipped_unchanged'] == 0
+    manifest = run_manifest.load_manifest(str(tmp_path / 'out'))
+    assert sorted(manifest['entries']) == ['IMG_0.jpg', 'IMG_1.jpg', 'IMG_2.jpg']
+    assert all((entry['hash'] is not None) == manifest_hash for entry in manifest['entries'].values())
+
+    _touch(input_folder / 'IMG_1.jpg')
+    summary = processing_workflows.run_individual_processing(**settings)
+    # Тронутый файл: без хеша - переобработка, с хешем - пропуск
+    assert summary['skipped_unchanged'] == (3 if manifest_hash else 2)
+
+    # Изменение настроек меняет отпечаток - обрабатываются все файлы
+    settings['individual_mode'].update(jpeg_quality=settings['individual_mode']['jpeg_quality'] - 10)
+    summary = processing_workflows.run_individual_processing(**settings)
+    assert summary['skipped_unchanged'] == 0 and summary['processed'] == 3
+    assert run_manifest.load_manifest(str(tmp_path / 'out'))['settings_fingerprint'] != manifest['settings_fingerprint']
+    # Тот же запуск повторно - снова все пропускаются
+    assert processing_workflows.run_individual_processing(**settings)['skipped_unchanged'] == 3
@@ -0,0 +1,56 @@
+import os
+from multiprocessing import shared_memory
+
+import pytest
+from PIL import Image, ImageDraw
+
+import shared_buffers
+
+
+def _image(mode):
+    img = Image.new('RGBA', (41, 27), (250, 250, 250, 255))
+    ImageDraw.Draw(img).rectangle([4, 3, 30, 20], fill=(30, 120, 200, 180))
+    return img if mode == 'RGBA' else img.convert(mode)
+
+
+def _no_tobytes(self, *args, **kwargs):
+    raise AssertionError("export_image must not build an intermediate copy of the pixels")
+
+
+@pytest.fixture(params=['shm', 'file'])
+def kind(request, monkeypatch):
+    monkeypatch.setattr(shared_buffers, 'USE_SCRATCH_FILES', request.param == 'file')
+    return request.param
+
+
+@pytest.mark.parametrize('mode', ['RGBA', 'RGB', 'L'])
+def test_export_attach_release_round_trip(tmp_path, monkeypatch, kind, mode):
+    img = _image(mode)
+    expected = img.convert('RGBA').tobytes()
+    with monkeypatch.context() as patch:
+        patch.setattr(Image.Image, 'tobytes', _no_tobytes)
+        descriptor = shared_buffers.export_image(img, str(tmp_path))
+    assert descriptor['kind'] == kind
+    assert (tuple(descriptor['size']), descriptor['mode'], descriptor['nbytes']) == (img.size, 'RGBA', len(expected))
+    assert img.mode == mode # Исходное изображение не меняется
+    if kind == 'file': assert os.path.dirname(descriptor['name']) == str(tmp_path)
+
+    attached, handle = shared_buffers.attach_image(descriptor)
+    assert (attached.mode, attached.size) == ('RGBA', img.size)
+    assert attached.tobytes() == expected
+    attached.close(); del attached
+    shared_buffers.release(handle)
+    # Сегмент удален: повторно открыть его нельзя
+    if kind == 'file': assert not os.path.exists(descriptor['name'])
+    else:
+        with pytest.raises(FileNotFoundError): shared_memory.SharedMemory(name=descriptor['name'])
+    shared_buffers.release(None)
+
+
+def test_discard_removes_unopened_segment(tmp_path, kind):
+    descriptor = shared_buffers.export_image(_image('RGB'), str(tmp_path))
+    shared_buffers.discard(descriptor)
+    if kind == 'file': assert os.listdir(tmp_path) == []
+    else:
+        with pytest.raises(FileNotFoundError): shared_memory.SharedMemory(name=descriptor['name'])
+    shared_buffers.discard(descriptor) # Повторно - без ошибок
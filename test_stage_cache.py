@@ -0,0 +1,61 @@
+import struct
+
+import pytest
+from PIL import Image, ImageDraw
+
+import stage_cache
+
+
+def _image(mode):
+    img = Image.new('RGB', (37, 23), (250, 250, 250))
+    ImageDraw.Draw(img).rectangle([5, 4, 30, 18], fill=(30, 120, 200))
+    return img.convert(mode)
+
+
+@pytest.mark.parametrize('mode', stage_cache.RAW_MODES)
+def test_raw_image_round_trip(tmp_path, mode):
+    path = str(tmp_path / 'sub' / f"entry{stage_cache.STAGE_EXT}")
+    img = _image(mode); meta = {'perimeter_is_white': True, 'pre_crop_size': [900, 600]}
+    assert stage_cache.write_raw_image(path, img, meta)
+    with open(path, 'rb') as f: data = f.read()
+    # Заголовок: MAGIC, длина JSON; пиксели начинаются с выровненного смещения
+    assert data[:len(stage_cache.MAGIC)] == stage_cache.MAGIC
+    header_len = struct.unpack('<I', data[len(stage_cache.MAGIC):len(stage_cache.MAGIC) + 4])[0]
+    pixels = img.tobytes()
+    data_offset = len(data) - len(pixels)
+    assert data_offset % stage_cache.DATA_ALIGNMENT == 0
+    assert len(stage_cache.MAGIC) + 4 + header_len <= data_offset < len(stage_cache.MAGIC) + 4 + header_len + stage_cache.DATA_ALIGNMENT
+    assert data[data_offset:] == pixels
+
+    loaded, loaded_meta, handle = stage_cache.read_raw_image(path)
+    assert (loaded.mode, loaded.size) == (mode, img.size)
+    assert loaded.tobytes() == pixels
+    assert loaded_meta == meta
+    loaded.close(); del loaded
+    stage_cache.release(handle)
+    stage_cache.release(None)
+
+
+def test_unsupported_mode_is_not_written(tmp_path):
+    path = tmp_path / f"entry{stage_cache.STAGE_EXT}"
+    assert not stage_cache.write_raw_image(str(path), _image('P'), {})
+    assert not path.exists()
+
+
+@pytest.mark.parametrize('cut', ['empty', 'magic', 'header', 'pixels'])
+def test_truncated_file_is_rejected(tmp_path, cut):
+    path = tmp_path / f"entry{stage_cache.STAGE_EXT}"
+    assert stage_cache.write_raw_image(str(path), _image('RGB'), {'a': 1})
+    data = path.read_bytes()
+    lengths = {'empty': 0, 'magic': len(stage_cache.MAGIC) + 2, 'header': len(stage_cache.MAGIC) + 10, 'pixels': len(data) - 7}
+    path.write_bytes(data[:lengths[cut]])
+    assert stage_cache.read_raw_image(str(path)) is None
+
+
+def test_wrong_magic_or_missing_file_is_rejected(tmp_path):
+    path = tmp_path / f"entry{stage_cache.STAGE_EXT}"
+    assert stage_cache.write_raw_image(str(path), _image('RGB'), {})
+    data = path.read_bytes()
+    path.write_bytes(b'PWSTAGE0' + data[len(stage_cache.MAGIC):])
+    assert stage_cache.read_raw_image(str(path)) is None
+    assert stage_cache.read_raw_image(str(tmp_path / 'missing.rawimg')) is None
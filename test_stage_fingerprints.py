@@ -0,0 +1,87 @@
+import copy
+
+import pytest
+
+import config_manager
+
+STAGES = list(config_manager.PIPELINE_STAGES)
+
+
+def _settings(**sections):
+    settings = copy.deepcopy(config_manager.DEFAULT_SETTINGS)
+    settings['whitening'].update(enable_whitening=True)
+    settings['background_crop'].update(enable_bg_crop=True, white_tolerance=10)
+    settings['padding'].update(enable_padding=True, padding_percent=5.0, perimeter_margin=3)
+    settings['individual_mode'].update(enable_max_dimensions=True, max_output_width=800, max_output_height=800)
+    for section, values in sections.items(): settings[section].update(values)
+    return settings
+
+
+def _changed(old, new):
+    return [stage for stage in STAGES if old[stage] != new[stage]]
+
+
+def test_fingerprints_are_stable_and_cover_every_stage():
+    fingerprints = config_manager.get_stage_fingerprints(_settings())
+    assert list(fingerprints) == STAGES
+    assert fingerprints == config_manager.get_stage_fingerprints(_settings())
+    assert len(set(fingerprints.values())) == len(STAGES)
+    assert config_manager.first_changed_stage(fingerprints, dict(fingerprints)) is None
+    assert config_manager.first_changed_stage(None, fingerprints) == STAGES[0]
+
+
+@pytest.mark.parametrize('section, values, first_stage', [
+    ('individual_mode', {'jpeg_quality': 80}, 'encode'),
+    ('individual_mode', {'max_output_width': 600}, 'geometry'),
+    ('brightness_contrast', {'enable_bc': True, 'brightness_factor': 1.2}, 'brightness_contrast'),
+    ('padding', {'padding_percent': 8.0}, 'padding'),
+])
+def test_tail_stage_change_keeps_prefix_fingerprints(section, values, first_stage):
+    old = config_manager.get_stage_fingerprints(_settings())
+    new = config_manager.get_stage_fingerprints(_settings(**{section: values}))
+    assert config_manager.first_changed_stage(old, new) == first_stage
+    # Отпечаток шага накопительный: меняются этот шаг и все следующие
+    assert _changed(old, new) == STAGES[STAGES.index(first_stage):]
+    if STAGES.index(first_stage) > STAGES.index(config_manager.STAGE_PREFIX_END):
+        assert old[config_manager.STAGE_PREFIX_END] == new[config_manager.STAGE_PREFIX_END]
+
+
+@pytest.mark.parametrize('section, values, first_stage', [
+    ('preprocessing', {'enable_preresize': True, 'preresize_width': 1500, 'preresize_height': 1500}, 'preresize'),
+    ('whitening', {'whitening_cancel_threshold': 400}, 'whitening'),
+    ('background_crop', {'white_tolerance': 20}, 'bg_crop'),
+    ('padding', {'perimeter_margin': 5}, 'bg_crop'), # Проверка периметра выполняется до обрезки
+])
+def test_prefix_change_changes_every_later_stage(section, values, first_stage):
+    old = config_manager.get_stage_fingerprints(_settings())
+    new = config_manager.get_stage_fingerprints(_settings(**{section: values}))
+    assert _changed(old, new) == STAGES[STAGES.index(first_stage):]
+
+
+def test_disabled_stage_ignores_its_values():
+    base = _settings(brightness_contrast={'enable_bc': False})
+    changed = _settings(brightness_contrast={'enable_bc': False, 'brightness_factor': 1.5, 'contrast_factor': 0.5})
+    assert config_manager.get_stage_fingerprints(base) == config_manager.get_stage_fingerprints(changed)
+
+
+def test_workflow_only_keys_do_not_affect_fingerprints():
+    values = {'enable_rename': True, 'article_name': 'ART', 'delete_originals': True, 'skip_unchanged': True,
+              'manifest_hash': True, 'enable_journal': True, 'resume_interrupted': True, 'multi_presets': ['a', 'b'],
+              'detect_duplicates': True, 'allocate_names_upfront': True, 'output_archive': True}
+    assert set(values) == config_manager.WORKFLOW_ONLY_KEYS['individual_mode']
+    base = _settings()
+    assert config_manager.get_stage_fingerprints(_settings(individual_mode=values)) == config_manager.get_stage_fingerprints(base)
+    # Пути, производительность и кеши тоже не входят в отпечатки
+    other = _settings(paths={'input_folder_path': '/elsewhere'}, performance={'max_workers': 8},
+                      cache={'enable_result_cache': True})
+    assert config_manager.get_stage_fingerprints(other) == config_manager.get_stage_fingerprints(base)
+
+
+def test_collage_fingerprints_use_collage_sections():
+    base = config_manager.get_stage_fingerprints(_settings(), 'collage')
+    assert base[config_manager.COLLAGE_CELL_END] != config_manager.get_stage_fingerprints(_settings())[config_manager.COLLAGE_CELL_END]
+    # Настройки отдельных файлов на ячейки коллажа не влияют; колонки коллажа меняют только сборку
+    assert config_manager.get_stage_fingerprints(_settings(individual_mode={'max_output_width': 300}), 'collage') == base
+    cols = config_manager.get_stage_fingerprints(_settings(collage_mode={'forced_cols': 5}), 'collage')
+    assert config_manager.first_changed_stage(base, cols) == 'geometry'
+    assert cols[config_manager.COLLAGE_CELL_END] == base[config_manager.COLLAGE_CELL_END]
@@ -0,0 +1,137 @@
+# worker_pool.py
+# Долгоживущий ("теплый") пул обработчиков, переиспользуемый между запусками.
+# В app.py он хранится в st.cache_resource, поэтому повторные нажатия
+# "Запустить" не платят за старт процессов и импорт модулей.
+
+import os
+import atexit
+import logging
+import threading
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, Any, Optional, Iterator
+
+log = logging.getLogger(__name__)
+
+WORKER_KINDS = ('process', 'thread')
+THREAD_NAME_PREFIX = "photo_worker" # Имена потоков-обработчиков (по ним app.py отбирает записи для лога UI)
+# Модули, загружаемые в forkserver один раз: дочерние процессы получают их готовыми
+PRELOAD_MODULES = ['PIL.Image', 'image_utils', 'processing_workflows']
+
+
+def _warm_up_worker():
+    """(Initializer) Импортирует модули обработки и регистрирует плагины Pillow."""
+    import image_utils # noqa: F401
+    from PIL import Image
+    Image.init()
+
+
+def _ping() -> int:
+    """(Worker) Проверка работоспособности: возвращает PID обработчика."""
+    return os.getpid()
+
+
+def _get_mp_context():
+    """(Helper) forkserver (с предзагрузкой модулей), если доступен, иначе spawn."""
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        ctx = multiprocessing.get_context('forkserver')
+        ctx.set_forkserver_preload(PRELOAD_MODULES)
+        return ctx
+    return multiprocessing.get_context('spawn')
+
+
+def get_executor_workers(executor: Executor, default: int = 1) -> int:
+    """Число обработчиков у готового пула (для планирования заданий)."""
+    return int(getattr(executor, '_max_workers', default) or default)
+
+
+@contextmanager
+def borrow_executor(executor: Optional[Executor], num_workers: int) -> Iterator[Executor]:
+    """
+    Возвращает переданный пул без закрытия после использования или, если пул
+    не передан, создает временный пул процессов на время блока with.
+    """
+    if executor is not None:
+        yield executor
+        return
+    with ProcessPoolExecutor(max_workers=num_workers) as own_executor:
+        yield own_executor
+
+
+class WorkerPool:
+    """
+    Владелец пула обработчиков, общий для всех перезапусков скрипта и сессий.
+    Пул создается лениво, пересоздается при смене размера/типа,
+    проверяется на работоспособность и может быть перезапущен вручную.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor: Optional[Executor] = None
+        self._max_workers = 0
+        self._kind = 'process'
+        self._restarts = 0
+        atexit.register(self.shutdown)
+
+    def get_executor(self, max_workers: int, kind: str = 'process') -> Executor:
+        """Возвращает пул нужного размера и типа, создавая/пересоздавая его при необходимости."""
+        kind = kind if kind in WORKER_KINDS else 'process'
+        max_workers = max(1, int(max_workers))
+        with self._lock:
+            if self._executor is not None and (self._max_workers != max_workers or self._kind != kind):
+                log.info(f"Worker pool settings changed ({self._kind} x{self._max_workers} -> {kind} x{max_workers}). Recreating pool.")
+                self._shutdown_locked()
+            if self._executor is None:
+                self._executor = self._create(max_workers, kind)
+                self._max_workers = max_workers; self._kind = kind
+            return self._executor
+
+    def is_healthy(self, timeout: float = 10.0) -> bool:
+        """Отправляет пробное задание; False, если пул сломан или не отвечает."""
+        executor = self._executor
+        if executor is None: return False
+        try:
+            executor.submit(_ping).result(timeout=timeout)
+            return True
+        except Exception as e:
+            log.warning(f"Worker pool health check failed: {e}")
+            return False
+
+    def ensure_healthy(self, max_workers: int, kind: str = 'process') -> Executor:
+        """Как get_executor(), но перезапускает пул, если проверка не прошла."""
+        executor = self.get_executor(max_workers, kind)
+        if not self.is_healthy():
+            self.restart()
+            executor = self.get_executor(max_workers, kind)
+        return executor
+
+    def restart(self):
+        """Останавливает текущий пул; новый будет создан при следующем запросе."""
+        with self._lock:
+            self._shutdown_locked()
+            self._restarts += 1
+        log.info("Worker pool restarted.")
+
+    def shutdown(self):
+        with self._lock:
+            self._shutdown_locked()
+
+    def status(self) -> Dict[str, Any]:
+        return {'running': self._executor is not None, 'kind': self._kind,
+                'max_workers': self._max_workers, 'restarts': self._restarts}
+
+    def _create(self, max_workers: int, kind: str) -> Executor:
+        log.info(f"Starting warm worker pool: {kind} x{max_workers}")
+        if kind == 'thread':
+            return ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=THREAD_NAME_PREFIX)
+        return ProcessPoolExecutor(max_workers=max_workers, mp_context=_get_mp_context(), initializer=_warm_up_worker)
+
+    def _shutdown_locked(self):
+        if self._executor is None: return
+        try:
+            # Уже выполняющиеся задания (например, другой сессии) дорабатывают сами
+            self._executor.shutdown(wait=False)
+        except Exception as e:
+            log.error(f"Error shutting down worker pool: {e}")
+        self._executor = None